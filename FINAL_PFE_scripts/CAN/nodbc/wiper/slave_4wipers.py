@@ -6,6 +6,7 @@ import time
 import threading
 import logging
 import re
+from async_logging import setup_logging
 
 # LED Positions (1-based indexing converted to 0-based)
 FRONT_LEDS = [27,26,25]  # LEDs 12, 13, 14 -> indices 11, 12, 13 (Right to left)
@@ -22,14 +23,10 @@ SHIFT_REGISTER_PINS = {
 }
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('wiper_slave.log'),
-        logging.StreamHandler()
-    ]
-)
+log = setup_logging('wiper_slave', 'wiper_slave.log')
+can_log = logging.getLogger('wiper_slave.can')
+gpio_log = logging.getLogger('wiper_slave.gpio')
+file_log = logging.getLogger('wiper_slave.file')
 
 class CANWiperSlave:
     def __init__(self):
@@ -39,7 +36,7 @@ class CANWiperSlave:
             time.sleep(0.1)
             self.can_bus = can.interface.Bus(channel='can0', bustype='socketcan')
         except Exception as e:
-            logging.error(f"CAN initialization failed: {e}")
+            can_log.error("CAN initialization failed: %s", e)
             raise
         
         # Shift register setup
@@ -71,7 +68,7 @@ class CANWiperSlave:
         # Start response file monitoring thread
         self.start_response_monitor()
         
-        logging.info("Wiper slave initialized with shift register control")
+        log.info("Wiper slave initialized with shift register control")
 
     def setup_shift_register(self):
         """Initialize GPIO pins for 74HC595 shift register control."""
@@ -84,7 +81,7 @@ class CANWiperSlave:
         
         # Initialize shift register (clear all outputs)
         self.clear_shift_register()
-        logging.info("Shift register initialized")
+        gpio_log.info("Shift register initialized")
 
     def clear_shift_register(self):
         """Clear all shift register outputs - matches slave1 logic"""
@@ -147,10 +144,10 @@ class CANWiperSlave:
                         signals[key] = value
                 return signals
         except FileNotFoundError:
-            logging.warning("response.txt not found, using defaults")
+            file_log.warning("response.txt not found, using defaults")
             return defaults
         except Exception as e:
-            logging.error(f"Error reading response.txt: {e}")
+            file_log.error("Error reading response.txt: %s", e)
             return defaults
 
     def response_file_changed(self):
@@ -166,19 +163,17 @@ class CANWiperSlave:
 
     def monitor_response_file(self):
         """Monitor response.txt for changes and send updates"""
-        logging.info("Monitoring response.txt...")
+        file_log.info("Monitoring response.txt...")
         try:
             while self.running:
                 if self.response_file_changed():
-                    logging.info("response.txt changed, updating signals")
+                    file_log.debug("response.txt changed, updating signals")
                     self.response_signals = self.read_response_file()
-                    print("\nUpdated Response Signals from response.txt:")
-                    for key, value in self.response_signals.items():
-                        print(f"{key}: {value}")
+                    file_log.info("Updated response signals from response.txt: %s", self.response_signals, extra=self.response_signals)
                     self.send_response()
                 time.sleep(0.3)  # Fast polling
         except Exception as e:
-            logging.error(f"Response file monitoring error: {e}")
+            file_log.error("Response file monitoring error: %s", e)
 
     def start_response_monitor(self):
         """Start a thread to monitor response.txt"""
@@ -255,7 +250,7 @@ class CANWiperSlave:
             self.active_threads = []
             self.back_wiper_active = False
             self.wiper_position = 0
-            logging.info("Wipers fully stopped")
+            gpio_log.info("Wipers fully stopped")
             self.send_response()
 
     def create_response_frame(self):
@@ -286,8 +281,6 @@ class CANWiperSlave:
                 is_extended_id=False
             )
             self.can_bus.send(msg)
-            logging.info(f"Sent response CAN: {data.hex()}")
-            # Display sent signals
             signals = {
                 'WiperStatus': data[0],
                 'wiperCurrentSpeed': data[1],
@@ -298,15 +291,13 @@ class CANWiperSlave:
                 'blockageReason': data[6],
                 'hwError': data[7]
             }
-            print("\nSent Response Signals:")
-            for key, value in signals.items():
-                print(f"{key}: {value}")
+            can_log.info("Sent response CAN: %s %s", data.hex(), signals, extra=dict(signals, can_id=0x101))
         except Exception as e:
-            logging.error(f"CAN response send error: {e}")
+            can_log.error("CAN response send error: %s", e)
 
     def process_can_signals(self, signals):
         """Process received CAN signals and control wipers accordingly"""
-        logging.info(f"Processing signals: {signals}")
+        log.info("Processing signals: %s", signals)
         
         self._stop_wipers()
         
@@ -327,7 +318,7 @@ class CANWiperSlave:
             )
             self.active_threads = [thread]
             thread.start()
-            logging.info("Started touch mode (single wipe)")
+            gpio_log.info("Started touch mode (single wipe)")
         
         elif self.wiper_mode in [2, 4]:
             front_thread = threading.Thread(
@@ -349,12 +340,12 @@ class CANWiperSlave:
                 )
                 self.active_threads.append(back_thread)
                 back_thread.start()
-                logging.info("Started intermittent rear wiper")
+                gpio_log.info("Started intermittent rear wiper")
             else:
                 self.set_multiple_leds(BACK_LEDS + BACK_LEDS2, 0)
-                logging.debug("Ensured rear wipers are off")
+                gpio_log.debug("Ensured rear wipers are off")
             
-            logging.info(f"Started continuous front wiper (speed={'fast' if self.wiper_speed == 2 else 'normal'})")
+            gpio_log.info("Started continuous front wiper (speed=%s)", 'fast' if self.wiper_speed == 2 else 'normal')
         
         self.send_response()
 
@@ -376,7 +367,7 @@ class CANWiperSlave:
 
     def monitor_can(self):
         """Monitor CAN bus for messages"""
-        logging.info("Listening for CAN messages...")
+        can_log.info("Listening for CAN messages...")
         try:
             while self.running:
                 msg = self.can_bus.recv(timeout=1.0)
@@ -384,11 +375,11 @@ class CANWiperSlave:
                     signals = self.parse_can_frame(msg.data)
                     self.process_can_signals(signals)
         except Exception as e:
-            logging.error(f"CAN monitoring error: {e}")
+            can_log.error("CAN monitoring error: %s", e)
 
     def shutdown(self):
         """Clean up resources"""
-        logging.info("Shutting down...")
+        log.info("Shutting down...")
         self.running = False
         self._stop_wipers()
         
@@ -402,7 +393,7 @@ class CANWiperSlave:
         os.system('sudo /sbin/ip link set can0 down')
         self.clear_shift_register()
         GPIO.cleanup()
-        logging.info("Shutdown complete")
+        log.info("Shutdown complete")
 
 if __name__ == "__main__":
     try:
@@ -410,6 +401,6 @@ if __name__ == "__main__":
         while slave.running:
             time.sleep(1)
     except KeyboardInterrupt:
-        logging.info("Received keyboard interrupt")
+        log.info("Received keyboard interrupt")
     finally:
         slave.shutdown()
\ No newline at end of file
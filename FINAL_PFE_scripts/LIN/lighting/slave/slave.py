@@ -1,8 +1,13 @@
 import serial
 import RPi.GPIO as GPIO
+import os
 import time
 import threading
 import logging
+from collections import deque
+from lin_transport import (Reassembler, segment, negative_response, LINTransportError, BROADCAST_NAD,
+                           MASTER_REQUEST_ID, SLAVE_RESPONSE_ID, MAX_FRAME_DATA_LENGTH,
+                           SERVICE_NOT_SUPPORTED, REQUEST_OUT_OF_RANGE)
 
 # LIN Frame IDs for each light type
 LIGHT_IDS = {
@@ -68,12 +73,18 @@ MODE_LEDS = {
 }
 
 # LIN Constants
-SERIAL_PORT = '/dev/serial0'
+SERIAL_PORT = os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
 BAUD_RATE = 19200
 WAKEUP_PIN = 4
 SYNC_BYTE = 0x55
 BREAK_BYTE = 0x00
 
+# Status snapshot, read by the master over the LIN transport layer
+LIGHT_NAD = 0x0A
+READ_DATA_SID = 0x22  # ReadDataByIdentifier
+POSITIVE_RESPONSE_OFFSET = 0x40
+LIGHT_STATUS_DID = 0x0100
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -85,7 +96,7 @@ logging.basicConfig(
 )
 
 class LINLightSlave:
-    def __init__(self):
+    def __init__(self, serial_port=SERIAL_PORT):
         self.running = True
         self.light_status = {
             "Low Beam": {"status": 0, "mode": "Stand"},
@@ -104,11 +115,16 @@ class LINLightSlave:
         self.left_turn_running = False
         self.right_turn_running = False
         self.current_mode = "Stand"
+        self.status_snapshot = bytes(14)  # returned by the next status read
+        self.request_receiver = Reassembler(LIGHT_NAD)
+        self.response_frames = deque()  # transport frames sent on the master's 0x3D headers
+        self.slot_lock = threading.Lock()
         
         self.setup_gpio()
-        self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=0.1)
+        self.ser = serial.Serial(serial_port, baudrate=BAUD_RATE, timeout=0.1)
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(WAKEUP_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self.publish_status()
     
     def setup_gpio(self):
         """Initialize all GPIO pins for LEDs."""
@@ -171,24 +187,55 @@ class LINLightSlave:
             return None
         return frame_id
     
-    def send_break(self):
-        self.ser.baudrate = BAUD_RATE // 4
-        self.ser.write(bytes([BREAK_BYTE]))
-        self.ser.flush()
-        time.sleep(13 * (1.0 / (BAUD_RATE // 4)))
-        self.ser.baudrate = BAUD_RATE
+    def queue_response(self, frames):
+        """Replace any unsent response with these transport frames"""
+        with self.slot_lock:
+            self.response_frames = deque(frames)
     
-    def send_lin_response(self, frame_id, data):
-        """Send a complete LIN response frame (with break and sync)"""
-        self.send_break()
-        self.ser.write(bytes([SYNC_BYTE]))
-        pid = self.calculate_pid(frame_id)
-        self.ser.write(bytes([pid]))
-        self.ser.write(data)
-        checksum = self.calculate_checksum(pid, data)
-        self.ser.write(bytes([checksum]))
+    def send_slot_response(self, pid_byte):
+        """Answer a slave response header with the next queued transport frame.
+        
+        Only data and checksum are written (the master owns break, sync and
+        PID); with nothing queued the header stays unanswered.
+        """
+        with self.slot_lock:
+            if not self.response_frames:
+                return False
+            data = self.response_frames.popleft()
+        self.ser.write(data + bytes([self.calculate_checksum(pid_byte, data)]))
         self.ser.flush()
-        time.sleep(0.005)
+        return True
+    
+    def handle_master_request(self, frame):
+        """Process one master request frame addressed to this node"""
+        nad = frame[0]
+        if nad == 0x00:
+            return  # go-to-sleep command
+        if nad not in (LIGHT_NAD, BROADCAST_NAD):
+            return
+        
+        # A new request cancels whatever response was still queued
+        self.queue_response([])
+        try:
+            request = self.request_receiver.feed(frame)
+        except LINTransportError as e:
+            logging.warning(f"Dropped transport request: {e}")
+            return
+        if request is None:
+            return  # more frames of a segmented request to come
+        
+        sid = request[0]
+        status_request = bytes([READ_DATA_SID, LIGHT_STATUS_DID >> 8, LIGHT_STATUS_DID & 0xFF])
+        if request == status_request:
+            with self.slot_lock:
+                snapshot = self.status_snapshot
+            response = bytes([READ_DATA_SID + POSITIVE_RESPONSE_OFFSET]) + status_request[1:] + snapshot
+            self.queue_response(segment(LIGHT_NAD, response))
+            logging.info(f"Status read requested, answering in {len(self.response_frames)} transport frames")
+        elif sid == READ_DATA_SID:
+            self.queue_response(negative_response(LIGHT_NAD, sid, REQUEST_OUT_OF_RANGE))
+        else:
+            self.queue_response(negative_response(LIGHT_NAD, sid, SERVICE_NOT_SUPPORTED))
     
     def control_light_status(self, light, status_code):
         """Control the light based only on status code (ON/OFF/FAILED/INVALID)."""
@@ -411,19 +458,19 @@ class LINLightSlave:
             self.control_light_status(light, status_code)
             self.control_mode(mode_code)
             
-            # Send status response after processing command
-            time.sleep(0.01)
-            self.send_status_response()
+            # Publish the new status for the master's next poll
+            self.publish_status()
         else:
             logging.warning(f"Unknown frame ID received: {hex(frame_id)}")
     
-    def send_status_response(self):
-        """Send current status of all lights to master"""
+    def publish_status(self):
+        """Publish current status of all lights for the master's next status read"""
         try:
             data = self.create_status_response()
-            self.send_lin_response(0x18, data)  # 0x18 is our status response ID
+            with self.slot_lock:
+                self.status_snapshot = bytes(data)
             
-            logging.info("Sent status response:")
+            logging.info("Published status response:")
             for i, light in enumerate([
                 "Low Beam", "High Beam", "Parking Left", "Parking Right",
                 "Hazard Lights", "Right Turn", "Left Turn"
@@ -433,7 +480,7 @@ class LINLightSlave:
                 logging.info(f"  {light}: {status} | {mode}")
                 
         except Exception as e:
-            logging.error(f"Error sending status response: {e}")
+            logging.error(f"Error publishing status response: {e}")
     
     def receive_messages(self):
         """Main loop to receive and process LIN messages"""
@@ -442,48 +489,54 @@ class LINLightSlave:
         
         try:
             while self.running:
-                if self.ser.in_waiting:
-                    byte = self.ser.read(1)
-                    buffer += byte
+                # Blocks in select() until a byte arrives or the port timeout
+                # expires, so an idle bus costs no CPU
+                byte = self.ser.read(1)
+                if not byte:
+                    continue
+                buffer += byte
+                
+                # Check for break character (start of LIN frame)
+                if byte == bytes([BREAK_BYTE]):
+                    buffer = bytes([BREAK_BYTE])  # Start fresh frame
+                    continue
                     
-                    # Check for break character (start of LIN frame)
-                    if byte == bytes([BREAK_BYTE]):
-                        buffer = bytes([BREAK_BYTE])  # Start fresh frame
-                        continue
+                # Only proceed if we have break + sync
+                if len(buffer) >= 2 and buffer[0] == BREAK_BYTE and buffer[1] == SYNC_BYTE:
+                    if len(buffer) >= 3:
+                        pid_byte = buffer[2]
+                        frame_id = self.parse_pid(pid_byte)
                         
-                    # Only proceed if we have break + sync
-                    if len(buffer) >= 2 and buffer[0] == BREAK_BYTE and buffer[1] == SYNC_BYTE:
-                        if len(buffer) >= 3:
-                            pid_byte = buffer[2]
-                            frame_id = self.parse_pid(pid_byte)
+                        if frame_id is not None:
+                            # Slave response header: send the next transport frame
+                            if frame_id == SLAVE_RESPONSE_ID:
+                                self.send_slot_response(pid_byte)
+                                buffer = bytes()
                             
-                            if frame_id is not None:
-                                # Check if this is a status request (ID 0x17)
-                                if frame_id == 0x17:
-                                    checksum = ord(self.ser.read(1)) if self.ser.in_waiting else None
-                                    if checksum is not None:
-                                        calc_checksum = self.calculate_checksum(pid_byte, bytes())
-                                        if checksum == calc_checksum:
-                                            logging.info("Received status request")
-                                            self.send_status_response()
-                                        else:
-                                            logging.warning(f"Checksum mismatch in status request: received {hex(checksum)}, calculated {hex(calc_checksum)}")
-                                    buffer = bytes()
-                                
-                                # Check if this is a light control command
-                                elif frame_id in LIGHT_IDS:
-                                    data = self.ser.read(2) if self.ser.in_waiting else None
-                                    if data and len(data) == 2:
-                                        checksum = ord(self.ser.read(1)) if self.ser.in_waiting else None
-                                        if checksum is not None:
-                                            calc_checksum = self.calculate_checksum(pid_byte, data)
-                                            if checksum == calc_checksum:
-                                                self.process_light_command(frame_id, data)
-                                            else:
-                                                logging.warning(f"Checksum mismatch in light command: received {hex(checksum)}, calculated {hex(calc_checksum)}")
-                                        buffer = bytes()
-                
-                time.sleep(0.001)
+                            # Master request: a transport frame for this node (or go-to-sleep)
+                            elif frame_id == MASTER_REQUEST_ID:
+                                data = self.ser.read(MAX_FRAME_DATA_LENGTH + 1)
+                                if len(data) == MAX_FRAME_DATA_LENGTH + 1:
+                                    frame, checksum = data[:MAX_FRAME_DATA_LENGTH], data[MAX_FRAME_DATA_LENGTH]
+                                    if checksum == self.calculate_checksum(pid_byte, frame):
+                                        self.handle_master_request(frame)
+                                    else:
+                                        logging.warning(f"Checksum mismatch in master request: received {hex(checksum)}")
+                                buffer = bytes()
+                            
+                            # Check if this is a light control command
+                            elif frame_id in LIGHT_IDS:
+                                # Data + checksum follow the header; wait for them
+                                # instead of dropping a command still on the wire
+                                data = self.ser.read(3)
+                                if len(data) == 3:
+                                    checksum = data[2]
+                                    calc_checksum = self.calculate_checksum(pid_byte, data[:2])
+                                    if checksum == calc_checksum:
+                                        self.process_light_command(frame_id, data[:2])
+                                    else:
+                                        logging.warning(f"Checksum mismatch in light command: received {hex(checksum)}, calculated {hex(calc_checksum)}")
+                                buffer = bytes()
                 
         except KeyboardInterrupt:
             logging.info("Received keyboard interrupt")
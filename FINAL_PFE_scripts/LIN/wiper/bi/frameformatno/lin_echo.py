@@ -0,0 +1,177 @@
+"""
+Echo-checked LIN transmission with bounded retransmission.
+
+A LIN transceiver drives and listens on the same wire, so every byte a node
+sends comes back on its own RX line. Comparing that echo with what was
+written shows bit errors and collisions: another node pulling a recessive
+bit dominant changes the byte that comes back. The header's echo is checked
+before the response field goes out, so a frame that lost the bus is
+abandoned there, and a failed frame is sent again after a random backoff
+whose ceiling doubles per attempt (BACKOFF_BASE, capped at BACKOFF_MAX) so
+two nodes that collided do not retry in lockstep. After MAX_RETRIES
+retransmissions the frame is dropped. Errors are counted per frame ID.
+
+Without a transceiver (a bare UART, or the pty simulator without --echo)
+nothing comes back and every frame is dropped after its retries (a warning
+is logged for the first one); set LIN_ECHO_CHECK=0 to write frames
+unchecked.
+
+Scripts whose receive thread owns the port pass every chunk it reads
+through feed(), which hands the echo to the waiting sender and returns the
+rest. Otherwise the sender reads the echo from the port itself, waiting no
+longer than the echo can take, whatever the port's own timeout.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from collections import Counter
+
+BREAK_BYTE = 0x00
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.002  # first retry waits up to 2 ms, then up to 4, 8 ...
+BACKOFF_MAX = 0.02
+ECHO_MARGIN = 0.005   # UART FIFO and driver delay before an echoed byte is readable
+ECHO_CHECK = os.environ.get('LIN_ECHO_CHECK', '1') != '0'
+
+log = logging.getLogger('lin_echo')
+
+class EchoCheckedWriter:
+    def __init__(self, ser, baud_rate, write=None, send_break=None, fed=False,
+                 max_retries=MAX_RETRIES, enabled=ECHO_CHECK, on_error=None):
+        """
+        Args:
+            ser: open serial port
+            baud_rate: data rate, used to size the echo timeout
+            write: callable writing bytes (default: ser.write + flush)
+            send_break: callable sending the break, or None when the break is
+                part of the header bytes
+            fed: the caller's receive thread delivers RX bytes through feed()
+            max_retries: retransmissions before a frame is dropped
+            enabled: compare echoes; when False frames are written once, unchecked
+            on_error: called with the frame ID on every echo mismatch
+        """
+        self.ser = ser
+        self.baud_rate = baud_rate
+        self.write = write or self._write
+        self.send_break = send_break
+        self.fed = fed
+        self.max_retries = max_retries
+        self.enabled = enabled
+        self.on_error = on_error
+        self.lock = threading.Lock()  # one frame on the wire at a time
+        # fed mode: RX bytes are held as echo only while a frame is checked,
+        # and never more than the sender is still waiting for
+        self.echo = bytearray()
+        self.listening = False
+        self.capacity = 0
+        self.echo_ready = threading.Condition()
+        self.delivered = Counter()
+        self.bus_errors = Counter()
+        self.retransmissions = Counter()
+        self.dropped = Counter()
+        self.silent = False  # nothing at all came back in the last attempt
+        self.silence_reported = False
+
+    def _write(self, data):
+        self.ser.write(data)
+        self.ser.flush()
+
+    def send(self, frame_id, header, response=b''):
+        """Send one frame, retrying on echo mismatch.
+
+        header holds the bytes after the break (sync, PID) or, when no
+        send_break is configured, the whole header including the break byte.
+        Returns True once the frame went out with a clean echo.
+        """
+        with self.lock:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self.retransmissions[frame_id] += 1
+                    time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))))
+                if self._attempt(header, response):
+                    self.delivered[frame_id] += 1
+                    return True
+                self.bus_errors[frame_id] += 1
+                if self.on_error:
+                    self.on_error(frame_id)
+            self.dropped[frame_id] += 1
+            if self.silent and not self.silence_reported:
+                self.silence_reported = True
+                log.warning("LIN frame %s dropped: no echo came back. Without a transceiver echoing "
+                            "the bus, set LIN_ECHO_CHECK=0", hex(frame_id))
+            return False
+
+    def _attempt(self, header, response):
+        self.silent = False
+        if not self.enabled:
+            if self.send_break:
+                self.send_break()
+            self.write(header + response)
+            return True
+        self._listen(True)
+        try:
+            if self.send_break:
+                self.send_break()
+            # The break itself may come back as one 0x00 (framing error) byte
+            if self._exchange(header, break_echo=self.send_break is not None) != header:
+                return False  # lost the bus in the header: do not send the response
+            return not response or self._exchange(response) == response
+        finally:
+            self._listen(False)
+
+    def _listen(self, on):
+        if self.fed:
+            with self.echo_ready:
+                self.listening = on
+                self.echo.clear()
+        elif on:
+            self.ser.reset_input_buffer()
+
+    def _exchange(self, data, break_echo=False):
+        """Write `data` and return what came back for it."""
+        extra = 1 if break_echo else 0
+        if self.fed:
+            with self.echo_ready:
+                self.capacity = len(data) + extra
+        self.write(data)
+        echo = self._read_echo(len(data))
+        if break_echo and echo[:1] == bytes([BREAK_BYTE]):
+            echo = echo[1:] + self._read_echo(1)
+        self.silent = not echo
+        return echo
+
+    def _read_echo(self, count):
+        # Allow the 1.4x LIN byte-time tolerance for the bytes still to come
+        timeout = 1.4 * 10 * count / self.baud_rate + ECHO_MARGIN
+        if not self.fed:
+            # The port's own timeout (often 1 s) would stall every frame on a bus without echo
+            previous = self.ser.timeout
+            self.ser.timeout = timeout
+            try:
+                return self.ser.read(count)
+            finally:
+                self.ser.timeout = previous
+        deadline = time.monotonic() + timeout
+        with self.echo_ready:
+            while len(self.echo) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.echo_ready.wait(remaining)
+            echo = bytes(self.echo[:count])
+            del self.echo[:count]
+            self.capacity -= len(echo)
+        return echo
+
+    def feed(self, data):
+        """Pass received bytes through; returns those that are not our echo."""
+        with self.echo_ready:
+            if not self.listening:
+                return data
+            take = max(0, self.capacity - len(self.echo))
+            if take:
+                self.echo.extend(data[:take])
+                self.echo_ready.notify()
+            return data[take:]
@@ -5,11 +5,12 @@ import re
 import threading
 import serial
 from req import WiperSystem
+from lin_echo import EchoCheckedWriter
 from datetime import datetime
 
 class LINWiperMaster:
-    def __init__(self):
-        self.serial_port = '/dev/serial0'
+    def __init__(self, serial_port=None):
+        self.serial_port = serial_port or os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
         self.baudrate = 9600
         self.ser = None
         self.wiper = WiperSystem("input.txt", "wiper_output.txt")
@@ -47,6 +48,8 @@ class LINWiperMaster:
             )
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
+            # The receive thread owns the port and hands echoes to the writer
+            self.writer = EchoCheckedWriter(self.ser, self.baudrate, write=self.send_bytes, fed=True)
             print(f"LIN interface initialized on {self.serial_port}")
         except Exception as e:
             print(f"LIN init failed: {e}")
@@ -82,6 +85,12 @@ class LINWiperMaster:
         
         return frame
     
+    def send_bytes(self, data):
+        """Write bytes with small delays between them"""
+        for byte in data:
+            self.ser.write(bytes([byte]))
+            time.sleep(0.001)
+    
     def send_lin_frame(self, pid, data):
         """Send a LIN frame with proper timing"""
         frame = self.create_lin_frame(pid, data)
@@ -90,10 +99,11 @@ class LINWiperMaster:
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
             
-            # Send with small delays between bytes
-            for byte in frame:
-                self.ser.write(bytes([byte]))
-                time.sleep(0.001)
+            # Break, sync and PID first; the data goes out only if their echo matched
+            if not self.writer.send(pid, bytes(frame[:3]), bytes(frame[3:])):
+                print(f"LIN bus error: frame {hex(pid)} dropped, echo mismatched on every retry "
+                      f"({self.writer.bus_errors[pid]} mismatches on this ID)")
+                return
             
             print(f"Sent LIN frame: PID={hex(pid)}, Data={bytes(data).hex()}, Checksum={hex(frame[-1])}")
         except Exception as e:
@@ -176,7 +186,7 @@ class LINWiperMaster:
         try:
             while self.running:
                 # Read available data
-                data = self.ser.read(self.ser.in_waiting or 1)
+                data = self.writer.feed(self.ser.read(self.ser.in_waiting or 1))
                 if data:
                     buffer.extend(data)
                     
@@ -215,8 +225,6 @@ class LINWiperMaster:
                                 buffer = buffer[sync_pos+1:]
                         else:
                             break
-                
-                time.sleep(0.01)
         except Exception as e:
             print(f"Response monitoring error: {e}")
     
@@ -6,6 +6,7 @@ import time
 import threading
 import logging
 import re
+from lin_echo import EchoCheckedWriter
 
 # GPIO setup
 FRONT_LEDS = [23, 24, 26]  # Right to left
@@ -22,9 +23,9 @@ logging.basicConfig(
 )
 
 class LINWiperSlave:
-    def __init__(self):
+    def __init__(self, serial_port=None):
         # Initialize LIN interface
-        self.serial_port = '/dev/serial0'
+        self.serial_port = serial_port or os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
         self.baudrate = 9600
         self.ser = None
         
@@ -94,6 +95,8 @@ class LINWiperSlave:
             )
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
+            # The receive thread owns the port and hands echoes to the writer
+            self.writer = EchoCheckedWriter(self.ser, self.baudrate, write=self.send_bytes, fed=True)
             logging.info(f"LIN interface initialized on {self.serial_port}")
         except Exception as e:
             logging.error(f"LIN init failed: {e}")
@@ -188,6 +191,12 @@ class LINWiperSlave:
         
         return frame
 
+    def send_bytes(self, data):
+        """Write bytes with small delays between them"""
+        for byte in data:
+            self.ser.write(bytes([byte]))
+            time.sleep(0.001)
+
     def send_lin_frame(self, pid, data):
         """Send a LIN frame with proper timing"""
         frame = self.create_lin_frame(pid, data)
@@ -196,10 +205,11 @@ class LINWiperSlave:
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
             
-            # Send with small delays between bytes
-            for byte in frame:
-                self.ser.write(bytes([byte]))
-                time.sleep(0.001)
+            # Break, sync and PID first; the data goes out only if their echo matched
+            if not self.writer.send(pid, bytes(frame[:3]), bytes(frame[3:])):
+                logging.error(f"LIN bus error: frame {hex(pid)} dropped, echo mismatched on every retry "
+                              f"({self.writer.bus_errors[pid]} mismatches on this ID)")
+                return
             
             logging.info(f"Sent LIN frame: PID={hex(pid)}, Data={bytes(data).hex()}, Checksum={hex(frame[-1])}")
         except Exception as e:
@@ -398,7 +408,7 @@ class LINWiperSlave:
         try:
             while self.running:
                 # Read available data
-                data = self.ser.read(self.ser.in_waiting or 1)
+                data = self.writer.feed(self.ser.read(self.ser.in_waiting or 1))
                 if data:
                     buffer.extend(data)
                     logging.debug(f"Raw data received: {bytes(data).hex()}")
@@ -435,8 +445,6 @@ class LINWiperSlave:
                                 buffer = buffer[sync_pos+1:]
                         else:
                             break
-                
-                time.sleep(0.01)
         except Exception as e:
             logging.error(f"LIN monitoring error: {e}")
 
@@ -3,13 +3,20 @@ import time
 import os
 import re
 import threading
+import logging
 import serial
 from req import WiperSystem
+from lin_echo import EchoCheckedWriter
 from datetime import datetime
+from async_logging import setup_logging
+
+log = logging.getLogger('lin_wiper_master')
+lin_log = logging.getLogger('lin_wiper_master.lin')
+file_log = logging.getLogger('lin_wiper_master.file')
 
 class LINWiperMaster:
-    def __init__(self):
-        self.serial_port = '/dev/serial0'
+    def __init__(self, serial_port=None):
+        self.serial_port = serial_port or os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
         self.baudrate = 9600
         self.ser = None
         self.wiper = WiperSystem("input.txt", "wiper_output.txt")
@@ -47,9 +54,12 @@ class LINWiperMaster:
             )
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
-            print(f"LIN interface initialized on {self.serial_port}")
+            # The receive thread owns the port and hands echoes to the writer
+            self.writer = EchoCheckedWriter(self.ser, self.baudrate, write=self.send_data,
+                                            send_break=self.send_break_field, fed=True)
+            lin_log.info("LIN interface initialized on %s", self.serial_port)
         except Exception as e:
-            print(f"LIN init failed: {e}")
+            lin_log.error("LIN init failed: %s", e)
             raise
     
     def send_break_field(self):
@@ -61,7 +71,7 @@ class LINWiperMaster:
             self.ser.break_condition = False
             time.sleep(0.0005)  # Break delimiter
         except Exception as e:
-            print(f"Break field error: {e}")
+            lin_log.error("Break field error: %s", e)
     
     def send_sync_byte(self):
         """Send LIN sync byte (0x55)"""
@@ -69,7 +79,7 @@ class LINWiperMaster:
             self.ser.write(bytes([0x55]))
             time.sleep(0.001)
         except Exception as e:
-            print(f"Sync byte error: {e}")
+            lin_log.error("Sync byte error: %s", e)
     
     def send_pid(self, pid):
         """Send Protected Identifier"""
@@ -77,7 +87,7 @@ class LINWiperMaster:
             self.ser.write(bytes([pid]))
             time.sleep(0.001)
         except Exception as e:
-            print(f"PID error: {e}")
+            lin_log.error("PID error: %s", e)
     
     def send_data(self, data):
         """Send data bytes with proper timing"""
@@ -86,7 +96,7 @@ class LINWiperMaster:
                 self.ser.write(bytes([byte]))
                 time.sleep(0.001)
         except Exception as e:
-            print(f"Data send error: {e}")
+            lin_log.error("Data send error: %s", e)
     
     def calculate_checksum(self, pid, data):
         """Calculate LIN classic checksum (for LIN 1.x)"""
@@ -105,27 +115,17 @@ class LINWiperMaster:
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
             
-            # Send frame fields sequentially
-            print("\nSending LIN frame:")
-            print(f"Break field (13+ dominant bits)")
-            self.send_break_field()
-            
-            print(f"Sync byte: 0x55")
-            self.send_sync_byte()
-            
-            print(f"PID: {hex(pid)}")
-            self.send_pid(pid)
-            
-            print(f"Data: {bytes(data).hex()}")
-            self.send_data(data)
-            
+            # Send frame fields sequentially; the data goes out only if the header's echo matched
             checksum = self.calculate_checksum(pid, data)
-            print(f"Checksum: {hex(checksum)}")
-            self.ser.write(bytes([checksum]))
+            if not self.writer.send(pid, bytes([0x55, pid]), bytes(data) + bytes([checksum])):
+                lin_log.error("LIN bus error: frame %s dropped, echo mismatched on every retry", hex(pid),
+                              extra={'pid': pid, 'bus_errors': self.writer.bus_errors[pid]})
+                return
             
-            print("Frame sent completely")
+            lin_log.debug("Sent LIN frame: PID %s, data %s, checksum %s", hex(pid), bytes(data).hex(), hex(checksum),
+                          extra={'pid': pid, 'data': list(data), 'checksum': checksum})
         except Exception as e:
-            print(f"Frame send error: {e}")
+            lin_log.error("Frame send error: %s", e)
     
     def extract_signals(self, content):
         """Extract signals from wiper_output.txt"""
@@ -158,17 +158,16 @@ class LINWiperMaster:
             self.wiper.process_operation()
             with open("wiper_output.txt", 'r') as f:
                 content = f.read()
-                print("\nGenerated Output:")
-                print(content.strip())
+                file_log.debug("Generated output: %s", content.strip())
                 
                 signals = self.extract_signals(content)
-                print("\nSignals to transmit:", signals)
+                log.info("Signals to transmit: %s", signals)
                 
                 lin_data = self.create_request_data(signals)
                 self.send_lin_frame(self.MASTER_REQUEST_PID, lin_data)
                 
         except Exception as e:
-            print(f"Error: {e}")
+            log.error("Error: %s", e)
     
     def parse_response_data(self, data):
         """Parse response LIN data into signals"""
@@ -192,19 +191,19 @@ class LINWiperMaster:
                 for key, value in signals.items():
                     f.write(f"{key} = {value}\n")
                 f.write("\n")
-            print(f"Response signals written to response_signals.txt at {timestamp}")
+            file_log.debug("Response signals written to response_signals.txt at %s", timestamp)
         except Exception as e:
-            print(f"Error writing to response_signals.txt: {e}")
+            file_log.error("Error writing to response_signals.txt: %s", e)
     
     def monitor_responses(self):
         """Monitor LIN bus for responses"""
-        print("Listening for LIN response messages...")
+        lin_log.info("Listening for LIN response messages...")
         buffer = bytearray()
         
         try:
             while self.running:
                 # Read available data
-                data = self.ser.read(self.ser.in_waiting or 1)
+                data = self.writer.feed(self.ser.read(self.ser.in_waiting or 1))
                 if data:
                     buffer.extend(data)
                     
@@ -233,20 +232,16 @@ class LINWiperMaster:
                             if checksum == calculated:
                                 if pid == self.SLAVE_RESPONSE_PID:
                                     signals = self.parse_response_data(data)
-                                    print("\nReceived Response Signals:")
-                                    for key, value in signals.items():
-                                        print(f"{key}: {value}")
+                                    lin_log.info("Received response signals: %s", signals, extra=signals)
                                     self.write_response_to_file(signals)
                                 buffer = buffer[sync_pos+11:]
                             else:
-                                print(f"Checksum error: expected {hex(calculated)}, got {hex(checksum)}")
+                                lin_log.warning("Checksum error: expected %s, got %s", hex(calculated), hex(checksum))
                                 buffer = buffer[sync_pos+1:]
                         else:
                             break
-                
-                time.sleep(0.01)
         except Exception as e:
-            print(f"Response monitoring error: {e}")
+            lin_log.error("Response monitoring error: %s", e)
     
     def start_response_monitor(self):
         """Start response monitoring thread"""
@@ -264,11 +259,11 @@ class LINWiperMaster:
             return False
     
     def monitor(self):
-        print("Monitoring input.txt...")
+        file_log.info("Monitoring input.txt...")
         try:
             while self.running:
                 if self.file_changed():
-                    print("\n=== Input Changed ===")
+                    file_log.info("Input changed")
                     self.send_signals()
                 time.sleep(0.3)
         except KeyboardInterrupt:
@@ -280,9 +275,10 @@ class LINWiperMaster:
             self.response_thread.join(timeout=0.5)
         if self.ser and self.ser.is_open:
             self.ser.close()
-        print("Shutdown complete")
+        log.info("Shutdown complete")
 
 if __name__ == "__main__":
+    setup_logging('lin_wiper_master', 'lin_wiper_master.log')
     master = LINWiperMaster()
     try:
         master.monitor()
@@ -6,6 +6,7 @@ import time
 import threading
 import logging
 import re
+from lin_echo import EchoCheckedWriter
 
 # GPIO setup
 FRONT_LEDS = [23, 24, 26]  # Right to left
@@ -22,9 +23,9 @@ logging.basicConfig(
 )
 
 class LINWiperSlave:
-    def __init__(self):
+    def __init__(self, serial_port=None):
         # Initialize LIN interface
-        self.serial_port = '/dev/serial0'
+        self.serial_port = serial_port or os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
         self.baudrate = 9600
         self.ser = None
         
@@ -94,6 +95,9 @@ class LINWiperSlave:
             )
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
+            # The receive thread owns the port and hands echoes to the writer
+            self.writer = EchoCheckedWriter(self.ser, self.baudrate, write=self.send_data,
+                                            send_break=self.send_break_field, fed=True)
             logging.info(f"LIN interface initialized on {self.serial_port}")
         except Exception as e:
             logging.error(f"LIN init failed: {e}")
@@ -151,23 +155,18 @@ class LINWiperSlave:
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
             
-            # Send frame fields sequentially
+            # Send frame fields sequentially; the data goes out only if the header's echo matched
             logging.info("\nSending LIN frame:")
             logging.info(f"Break field (13+ dominant bits)")
-            self.send_break_field()
-            
             logging.info(f"Sync byte: 0x55")
-            self.send_sync_byte()
-            
             logging.info(f"PID: {hex(pid)}")
-            self.send_pid(pid)
-            
             logging.info(f"Data: {bytes(data).hex()}")
-            self.send_data(data)
-            
             checksum = self.calculate_checksum(pid, data)
             logging.info(f"Checksum: {hex(checksum)}")
-            self.ser.write(bytes([checksum]))
+            if not self.writer.send(pid, bytes([0x55, pid]), bytes(data) + bytes([checksum])):
+                logging.error(f"LIN bus error: frame {hex(pid)} dropped, echo mismatched on every retry "
+                              f"({self.writer.bus_errors[pid]} mismatches on this ID)")
+                return
             
             logging.info("Frame sent completely")
         except Exception as e:
@@ -425,7 +424,7 @@ class LINWiperSlave:
         try:
             while self.running:
                 # Read available data
-                data = self.ser.read(self.ser.in_waiting or 1)
+                data = self.writer.feed(self.ser.read(self.ser.in_waiting or 1))
                 if data:
                     buffer.extend(data)
                     logging.debug(f"Raw data received: {bytes(data).hex()}")
@@ -462,8 +461,6 @@ class LINWiperSlave:
                                 buffer = buffer[sync_pos+1:]
                         else:
                             break
-                
-                time.sleep(0.01)
         except Exception as e:
             logging.error(f"LIN monitoring error: {e}")
 
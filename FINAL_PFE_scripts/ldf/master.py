@@ -1,15 +1,13 @@
 import serial
 import time
 import RPi.GPIO as GPIO
-import threading
 import ldfparser
 import os
+from lin_network import LINNetworkManager, GO_TO_SLEEP_ID, GO_TO_SLEEP_DATA
 
 class LINMaster:
-    def __init__(self, ldf_path):
+    def __init__(self, ldf_path, serial_port=None):
         self.running = True
-        self.response_received = threading.Event()
-        self.lock = threading.Lock()
         
         # Parse LDF file
         self.ldf = ldfparser.parse_ldf(ldf_path)
@@ -27,11 +25,11 @@ class LINMaster:
         GPIO.setup(self.wakeup_pin, GPIO.OUT)
         GPIO.output(self.wakeup_pin, GPIO.HIGH)
         
-        self.ser = serial.Serial('/dev/serial0', baudrate=self.baud_rate, timeout=0.1)
-        
-        # Start response monitoring thread
-        self.response_thread = threading.Thread(target=self.monitor_responses, daemon=True)
-        self.response_thread.start()
+        # Header plus the maximum LIN response space (1.4x nominal) for the
+        # slave frame, and a few ms for the slave script to react
+        response_timeout = (34 + 1.4 * 10 * (self.slave_frame['length'] + 1)) / self.baud_rate + 0.005
+        self.ser = serial.Serial(serial_port or os.environ.get('LIN_SERIAL_PORT', '/dev/serial0'), baudrate=self.baud_rate, timeout=response_timeout)
+        self.network = LINNetworkManager(self.wakeup_slave, self.send_go_to_sleep)
     
     def calculate_pid(self, frame_id):
         """Calculate LIN Protected Identifier from LDF frame"""
@@ -64,6 +62,30 @@ class LINMaster:
         time.sleep(0.01)
         GPIO.output(self.wakeup_pin, GPIO.HIGH)
     
+    def write_frame(self, frame_id, data):
+        """Write break, sync, PID, data and checksum; returns the PID and checksum"""
+        self.send_break()
+        
+        # Send sync byte
+        self.ser.write(bytes([0x55]))
+        
+        pid = self.calculate_pid(frame_id)
+        self.ser.write(bytes([pid]))
+        
+        # Send data
+        self.ser.write(data)
+        
+        # Calculate and send checksum
+        checksum = self.calculate_checksum(pid, data)
+        self.ser.write(bytes([checksum]))
+        self.ser.flush()
+        return pid, checksum
+    
+    def send_go_to_sleep(self):
+        """Broadcast the go-to-sleep command once the bus has been idle"""
+        self.write_frame(GO_TO_SLEEP_ID, GO_TO_SLEEP_DATA)
+        print("Bus idle, sent go-to-sleep frame")
+    
     def send_message(self, data=None):
         """Send data to slave using information from LDF"""
         try:
@@ -71,24 +93,10 @@ class LINMaster:
                 # Default data from LDF frame size (4 bytes in our case)
                 data = bytes([0xDE, 0xAD, 0xBE, 0xEF])
             
-            self.wakeup_slave()
-            self.send_break()
-            
-            # Send sync byte
-            self.ser.write(bytes([0x55]))
-            
-            # Send PID (from LDF frame ID)
-            frame_id = self.master_frame['frame_id']
-            pid = self.calculate_pid(frame_id)
-            self.ser.write(bytes([pid]))
-            
-            # Send data
-            self.ser.write(data)
-            
-            # Calculate and send checksum
-            checksum = self.calculate_checksum(pid, data)
-            self.ser.write(bytes([checksum]))
-            self.ser.flush()
+            # Wake the slave only if the bus went to sleep, then send with
+            # the PID from the LDF frame ID
+            with self.network.transmit():
+                pid, checksum = self.write_frame(self.master_frame['frame_id'], data)
             
             # Display in hex format
             data_hex = ' '.join(f'{x:02X}' for x in data)
@@ -97,66 +105,44 @@ class LINMaster:
         except Exception as e:
             print(f"Error sending LIN message: {e}")
     
-    def monitor_responses(self):
-        """Thread to monitor for responses from slave"""
-        buffer = bytearray()
-        slave_frame_id = self.slave_frame['frame_id']
+    def poll_response(self):
+        """Send the slave frame header from the LDF and read the slave's response"""
+        length = self.slave_frame['length']
+        pid = self.calculate_pid(self.slave_frame['frame_id'])
         
-        while self.running:
-            if self.ser.in_waiting:
-                byte = self.ser.read(1)
-                if byte:
-                    buffer += byte
-                
-                # Check for complete frame (break + sync + pid + data + checksum)
-                expected_length = 3 + self.slave_frame['length'] + 1  # break(1) + sync(1) + pid(1) + data + checksum(1)
-                if len(buffer) >= expected_length:
-                    # Verify break and sync
-                    if buffer[0] != 0x00 or buffer[1] != 0x55:
-                        print("Invalid frame start")
-                        buffer = buffer[1:]
-                        continue
-                    
-                    pid = buffer[2]
-                    frame_id = pid & 0x3F
-                    
-                    if frame_id != slave_frame_id:
-                        print(f"Unexpected response frame ID: {frame_id:02X}")
-                        buffer = buffer[3:]
-                        continue
-                    
-                    # Get data bytes
-                    data_start = 3
-                    data_end = data_start + self.slave_frame['length']
-                    data = buffer[data_start:data_end]
-                    received_checksum = buffer[data_end]
-                    
-                    # Verify checksum
-                    calc_checksum = self.calculate_checksum(pid, data)
-                    if received_checksum != calc_checksum:
-                        print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
-                        buffer = buffer[expected_length:]
-                        continue
-                    
-                    # Display the response
-                    data_hex = ' '.join(f'{x:02X}' for x in data)
-                    print(f"Received response: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
-                    self.response_received.set()
-                    
-                    # Clear processed frame from buffer
-                    buffer = buffer[expected_length:]
+        with self.network.transmit():
+            self.ser.reset_input_buffer()
+            self.send_break()
+            self.ser.write(bytes([0x55, pid]))
+            self.ser.flush()
             
-            time.sleep(0.001)
+            response = self.ser.read(length + 1)
+            if response[:3] == bytes([0x00, 0x55, pid]):
+                # Transceiver echo of our own header
+                response = response[3:] + self.ser.read(3)
+        
+        if len(response) < length + 1:
+            return None
+        
+        data, received_checksum = response[:length], response[length]
+        calc_checksum = self.calculate_checksum(pid, data)
+        if received_checksum != calc_checksum:
+            print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
+            return None
+        
+        # Display the response
+        data_hex = ' '.join(f'{x:02X}' for x in data)
+        print(f"Received response: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
+        return data
     
     def run(self):
         """Main loop to send messages"""
         try:
             while self.running:
-                self.response_received.clear()
                 self.send_message()
                 
-                # Wait for response with timeout
-                if self.response_received.wait(timeout=1.0):
+                # Poll the slave's response in its slot
+                if self.poll_response() is not None:
                     print("Successful communication cycle")
                 else:
                     print("Timeout waiting for response")
@@ -169,8 +155,7 @@ class LINMaster:
     def shutdown(self):
         """Cleanup resources"""
         self.running = False
-        if hasattr(self, 'response_thread') and self.response_thread.is_alive():
-            self.response_thread.join(timeout=0.5)
+        self.network.stop()
         if self.ser and self.ser.is_open:
             self.ser.close()
         GPIO.cleanup()
@@ -6,9 +6,9 @@ import ldfparser
 import os
 
 class LINSlave:
-    def __init__(self, ldf_path):
+    def __init__(self, ldf_path, serial_port=None):
         self.running = True
-        self.response_queue = []
+        self.response_slots = {}  # frame ID -> data sent when the master polls it
         self.lock = threading.Lock()
         
         # Parse LDF file
@@ -27,11 +27,7 @@ class LINSlave:
         GPIO.setup(self.wakeup_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
         
         # Initialize serial
-        self.ser = serial.Serial('/dev/serial0', baudrate=self.baud_rate, timeout=0.1)
-        
-        # Start response sending thread
-        self.response_thread = threading.Thread(target=self.send_responses, daemon=True)
-        self.response_thread.start()
+        self.ser = serial.Serial(serial_port or os.environ.get('LIN_SERIAL_PORT', '/dev/serial0'), baudrate=self.baud_rate, timeout=0.1)
     
     def calculate_pid(self, frame_id):
         """Calculate LIN Protected Identifier"""
@@ -50,60 +46,32 @@ class LINSlave:
                 checksum -= 0xFF
         return (0xFF - checksum) & 0xFF
     
-    def send_break(self):
-        """Send LIN break signal (13 bits of 0)"""
-        self.ser.baudrate = self.baud_rate // 4
-        self.ser.write(bytes([0x00]))
-        self.ser.flush()
-        time.sleep(0.001)
-        self.ser.baudrate = self.baud_rate
-    
-    def queue_response(self, data=None):
-        """Queue a response to be sent by the response thread"""
+    def publish_response(self, data=None):
+        """Publish the data sent when the master polls the slave frame"""
         with self.lock:
             if data is None:
                 # Default response data (4 bytes in our case)
                 data = bytes([0xCA, 0xFE, 0xBA, 0xBE])
-            self.response_queue.append(data)
+            self.response_slots[self.slave_frame['frame_id']] = bytes(data)
     
-    def send_responses(self):
-        """Thread to send responses from the queue"""
-        slave_frame_id = self.slave_frame['frame_id']
+    def send_slot_response(self, frame_id, pid):
+        """Answer a master header with data and checksum only (the master owns break, sync and PID)"""
+        with self.lock:
+            response_data = self.response_slots.get(frame_id)
+        if response_data is None:
+            return
         
-        while self.running:
-            with self.lock:
-                if self.response_queue:
-                    response_data = self.response_queue.pop(0)
-                else:
-                    response_data = None
-            
-            if response_data:
-                try:
-                    self.send_break()
-                    
-                    # Send sync byte
-                    self.ser.write(bytes([0x55]))
-                    
-                    # Send PID
-                    pid = self.calculate_pid(slave_frame_id)
-                    self.ser.write(bytes([pid]))
-                    
-                    # Send response data
-                    self.ser.write(response_data)
-                    
-                    # Calculate and send checksum
-                    checksum = self.calculate_checksum(pid, response_data)
-                    self.ser.write(bytes([checksum]))
-                    self.ser.flush()
-                    
-                    # Display in hex format
-                    data_hex = ' '.join(f'{x:02X}' for x in response_data)
-                    print(f"Sent response frame: PID={pid:02X}, Data=[{data_hex}], Checksum={checksum:02X}")
-                
-                except Exception as e:
-                    print(f"Error sending LIN response: {e}")
+        try:
+            checksum = self.calculate_checksum(pid, response_data)
+            self.ser.write(response_data + bytes([checksum]))
+            self.ser.flush()
             
-            time.sleep(0.001)
+            # Display in hex format
+            data_hex = ' '.join(f'{x:02X}' for x in response_data)
+            print(f"Sent response: PID={pid:02X}, Data=[{data_hex}], Checksum={checksum:02X}")
+        
+        except Exception as e:
+            print(f"Error sending LIN response: {e}")
     
     def receive_messages(self):
         """Main thread to receive and process LIN messages"""
@@ -115,51 +83,57 @@ class LINSlave:
         
         try:
             while self.running:
-                if self.ser.in_waiting:
-                    byte = self.ser.read(1)
-                    if byte:
-                        buffer += byte
+                # Wait for the next byte inside read(); it returns empty after the port timeout
+                byte = self.ser.read(1)
+                if not byte:
+                    continue
+                buffer += byte
+                
+                # Header for a frame this slave publishes: answer in its slot
+                if len(buffer) == 3 and buffer[0] == 0x00 and buffer[1] == 0x55 \
+                        and (buffer[2] & 0x3F) == self.slave_frame['frame_id']:
+                    self.send_slot_response(buffer[2] & 0x3F, buffer[2])
+                    buffer = bytearray()
+                    continue
+                
+                # Check for complete frame
+                if len(buffer) >= expected_length:
+                    # Verify break and sync
+                    if buffer[0] != 0x00 or buffer[1] != 0x55:
+                        print("Invalid frame start (missing break or sync)")
+                        buffer = buffer[1:]
+                        continue
+                    
+                    pid = buffer[2]
+                    frame_id = pid & 0x3F
+                    
+                    if frame_id != master_frame_id:
+                        print(f"Received frame for unexpected ID: {frame_id:02X}")
+                        buffer = buffer[3:]
+                        continue
                     
-                    # Check for complete frame
-                    if len(buffer) >= expected_length:
-                        # Verify break and sync
-                        if buffer[0] != 0x00 or buffer[1] != 0x55:
-                            print("Invalid frame start (missing break or sync)")
-                            buffer = buffer[1:]
-                            continue
-                        
-                        pid = buffer[2]
-                        frame_id = pid & 0x3F
-                        
-                        if frame_id != master_frame_id:
-                            print(f"Received frame for unexpected ID: {frame_id:02X}")
-                            buffer = buffer[3:]
-                            continue
-                        
-                        # Get data bytes
-                        data_start = 3
-                        data_end = data_start + self.master_frame['length']
-                        data = buffer[data_start:data_end]
-                        received_checksum = buffer[data_end]
-                        
-                        # Verify checksum
-                        calc_checksum = self.calculate_checksum(pid, data)
-                        if received_checksum != calc_checksum:
-                            print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
-                            buffer = buffer[expected_length:]
-                            continue
-                        
-                        # Display the message
-                        data_hex = ' '.join(f'{x:02X}' for x in data)
-                        print(f"Received message: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
-                        
-                        # Queue response
-                        self.queue_response()
-                        
-                        # Clear processed frame from buffer
+                    # Get data bytes
+                    data_start = 3
+                    data_end = data_start + self.master_frame['length']
+                    data = buffer[data_start:data_end]
+                    received_checksum = buffer[data_end]
+                    
+                    # Verify checksum
+                    calc_checksum = self.calculate_checksum(pid, data)
+                    if received_checksum != calc_checksum:
+                        print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
                         buffer = buffer[expected_length:]
-                
-                time.sleep(0.001)
+                        continue
+                    
+                    # Display the message
+                    data_hex = ' '.join(f'{x:02X}' for x in data)
+                    print(f"Received message: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
+                    
+                    # Publish the response for the master's poll
+                    self.publish_response()
+                    
+                    # Clear processed frame from buffer
+                    buffer = buffer[expected_length:]
                 
         except KeyboardInterrupt:
             print("Received keyboard interrupt")
@@ -171,8 +145,6 @@ class LINSlave:
     def shutdown(self):
         """Cleanup resources"""
         self.running = False
-        if hasattr(self, 'response_thread') and self.response_thread.is_alive():
-            self.response_thread.join(timeout=0.5)
         if self.ser:
             self.ser.close()
         GPIO.cleanup()
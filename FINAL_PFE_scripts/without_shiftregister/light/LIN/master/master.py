@@ -1,11 +1,14 @@
 import serial
 import time
 import os
-import threading
 from datetime import datetime
 import mysql.connector
 from mysql.connector import Error
 import RPi.GPIO as GPIO
+from lin_network import LINNetworkManager, GO_TO_SLEEP_ID, GO_TO_SLEEP_DATA
+from lin_echo import EchoCheckedWriter
+from lin_transport import (Reassembler, segment, MASTER_REQUEST_ID, SLAVE_RESPONSE_ID,
+                           MAX_FRAME_DATA_LENGTH)
 
 # LIN Frame IDs for each light type
 LIGHT_IDS = {
@@ -18,16 +21,12 @@ LIGHT_IDS = {
     "Left Turn": 0x16
 }
 
-# Response IDs (same as light IDs for two-way communication)
-RESPONSE_IDS = {
-    "Low Beam": 0x10,
-    "High Beam": 0x11,
-    "Parking Left": 0x12,
-    "Parking Right": 0x13,
-    "Hazard Lights": 0x14,
-    "Right Turn": 0x15,
-    "Left Turn": 0x16
-}
+# Status snapshot, read from the slave over the LIN transport layer
+LIGHT_NAD = 0x0A
+READ_DATA_SID = 0x22  # ReadDataByIdentifier
+POSITIVE_RESPONSE_OFFSET = 0x40
+LIGHT_STATUS_DID = 0x0100
+STATUS_RESPONSE_LENGTH = 14  # 7 lights * 2 bytes each
 
 # Status codes for LIN communication
 STATUS_CODES = {
@@ -77,6 +76,9 @@ BAUD_RATE = 19200
 WAKEUP_PIN = 4
 SYNC_BYTE = 0x55
 BREAK_BYTE = 0x00
+SLAVE_TURNAROUND = 0.005  # time a slave script takes to react to a header
+# Header plus the maximum LIN response space (1.4x nominal) for a transport frame
+RESPONSE_TIMEOUT = (34 + 1.4 * 10 * (MAX_FRAME_DATA_LENGTH + 1)) / BAUD_RATE + SLAVE_TURNAROUND
 
 class LINLightMaster:
     def __init__(self, filename):
@@ -94,9 +96,10 @@ class LINLightMaster:
         GPIO.setup(WAKEUP_PIN, GPIO.OUT)
         GPIO.output(WAKEUP_PIN, GPIO.HIGH)
         
-        self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=0)
+        self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=RESPONSE_TIMEOUT)
+        self.writer = EchoCheckedWriter(self.ser, BAUD_RATE, send_break=self.send_break)
+        self.network = LINNetworkManager(self.wakeup_slave, self.send_go_to_sleep)
         self.init_db_connection()
-        self.start_response_monitor()
     
     def init_db_connection(self):
         try:
@@ -168,22 +171,84 @@ class LINLightMaster:
         time.sleep(0.01)
         GPIO.output(WAKEUP_PIN, GPIO.HIGH)
     
+    def write_frame(self, frame_id, data):
+        """Write break, sync, PID, data and checksum for one frame.
+        
+        Returns False if the echo still did not match after the retries.
+        """
+        pid = self.calculate_pid(frame_id)
+        response = bytes(data) + bytes([self.calculate_checksum(pid, data)])
+        return self.writer.send(frame_id, bytes([SYNC_BYTE, pid]), response)
+    
+    def poll_response(self, frame_id, length):
+        """Send the header for a slave-published frame and read its response.
+        
+        Returns the data bytes, or None if the slave did not answer within
+        the response slot or the checksum is wrong.
+        """
+        pid = self.calculate_pid(frame_id)
+        self.ser.reset_input_buffer()
+        self.send_break()
+        self.ser.write(bytes([SYNC_BYTE, pid]))
+        self.ser.flush()
+        
+        response = self.ser.read(length + 1)
+        if response[:3] == bytes([BREAK_BYTE, SYNC_BYTE, pid]):
+            # Transceiver echo of our own header
+            response = response[3:] + self.ser.read(3)
+        if len(response) < length + 1:
+            return None
+        
+        data, checksum = response[:length], response[length]
+        calc_checksum = self.calculate_checksum(pid, data)
+        if checksum != calc_checksum:
+            print(f"Checksum mismatch: received {hex(checksum)}, calculated {hex(calc_checksum)}")
+            return None
+        return data
+    
+    def read_status_snapshot(self):
+        """Read the status of all lights from the slave in one transport layer transfer.
+        
+        Sends a ReadDataByIdentifier request on the master request frame and
+        polls the slave response frame until the segmented answer is complete.
+        Returns the status bytes, or None if the request or the answer failed.
+        """
+        request = bytes([READ_DATA_SID, LIGHT_STATUS_DID >> 8, LIGHT_STATUS_DID & 0xFF])
+        for frame in segment(LIGHT_NAD, request):
+            if not self.write_frame(MASTER_REQUEST_ID, frame):
+                print("LIN bus error: status request dropped, echo mismatched on every retry")
+                return None
+        
+        receiver = Reassembler(LIGHT_NAD)
+        message = None
+        while message is None:
+            frame = self.poll_response(SLAVE_RESPONSE_ID, MAX_FRAME_DATA_LENGTH)
+            if frame is None:
+                print("No status response from slave" +
+                      (" (transfer stopped after the first frame)" if receiver.in_progress else ""))
+                return None
+            message = receiver.feed(frame)
+        
+        if message[:3] != bytes([READ_DATA_SID + POSITIVE_RESPONSE_OFFSET]) + request[1:]:
+            print(f"Status request rejected by slave: {message.hex()}")
+            return None
+        return message[3:]
+    
+    def send_go_to_sleep(self):
+        """Broadcast the go-to-sleep command (called by the network manager)"""
+        self.write_frame(GO_TO_SLEEP_ID, GO_TO_SLEEP_DATA)
+        print("Bus idle, sent go-to-sleep frame")
+    
     def send_light_command(self, light, status, mode):
         """Send a LIN frame to control a specific light with status and mode"""
         try:
-            self.wakeup_slave()
-            self.send_break()
-            
-            self.ser.write(bytes([SYNC_BYTE]))
-            pid = self.calculate_pid(LIGHT_IDS[light])
-            self.ser.write(bytes([pid]))
-            
             data = bytes([STATUS_CODES[status], MODE_CODES[mode]])
-            self.ser.write(data)
-            
-            checksum = self.calculate_checksum(pid, data)
-            self.ser.write(bytes([checksum]))
-            self.ser.flush()
+            with self.network.transmit():
+                delivered = self.write_frame(LIGHT_IDS[light], data)
+            if not delivered:
+                print(f"LIN bus error: {light} command dropped, echo mismatched on every retry "
+                      f"({self.writer.bus_errors[LIGHT_IDS[light]]} mismatches on ID {hex(LIGHT_IDS[light])})")
+                return
             
             print(f"Sent LIN frame: {light} - {status} - {mode} (ID: {hex(LIGHT_IDS[light])}, Data: {[hex(STATUS_CODES[status]), hex(MODE_CODES[mode])]})")
             self.last_modified_light = (light, LIGHT_IDS[light])
@@ -193,7 +258,7 @@ class LINLightMaster:
     
     def parse_response_frame(self, data):
         """Parse the response frame from slave (2 bytes per light - status and mode)"""
-        if len(data) != 14:  # 7 lights * 2 bytes each
+        if len(data) != STATUS_RESPONSE_LENGTH:
             print(f"Invalid response frame length: {len(data)} bytes")
             return None
         
@@ -266,84 +331,25 @@ class LINLightMaster:
             if not self.db_connection.is_connected():
                 print("Database connection lost; will attempt to reconnect on next update")
     
-    def monitor_responses(self):
-        """Monitor for response frames from slave"""
-        print("Listening for response LIN messages...")
-        buffer = bytes()
-        
-        try:
-            while self.running:
-                if self.ser.in_waiting:
-                    byte = self.ser.read(1)
-                    buffer += byte
-                    
-                    # Check for break character (start of LIN frame)
-                    if byte == bytes([BREAK_BYTE]):
-                        buffer = bytes([BREAK_BYTE])  # Start fresh frame
-                        continue
-                        
-                    # Only proceed if we have break + sync
-                    if len(buffer) >= 2 and buffer[0] == BREAK_BYTE and buffer[1] == SYNC_BYTE:
-                        if len(buffer) >= 3:
-                            pid_byte = buffer[2]
-                            frame_id = pid_byte & 0x3F
-                            
-                            # Check if this is a status response (ID 0x18)
-                            if frame_id == 0x18:
-                                data_length = 14  # 7 lights * 2 bytes each
-                                total_length = 3 + data_length + 1  # Break+Sync+PID + data + checksum
-                                
-                                # Read remaining bytes if needed
-                                while len(buffer) < total_length and self.running:
-                                    if self.ser.in_waiting:
-                                        buffer += self.ser.read(1)
-                                    time.sleep(0.001)
-                                
-                                if len(buffer) >= total_length:
-                                    data = buffer[3:3+data_length]
-                                    checksum = buffer[3+data_length]
-                                    
-                                    # Verify checksum
-                                    calc_checksum = self.calculate_checksum(pid_byte, data)
-                                    if checksum == calc_checksum:
-                                        signals = self.parse_response_frame(data)
-                                        if signals:
-                                            print("\nReceived Response Signals:")
-                                            for light, data in signals.items():
-                                                print(f"{light}: {data['status']} | {data['mode']}")
-                                            self.write_response_to_file(signals)
-                                            self.update_database(signals)
-                                    else:
-                                        print(f"Checksum mismatch: received {hex(checksum)}, calculated {hex(calc_checksum)}")
-                                    
-                                    buffer = bytes()  # Clear buffer after processing
-                time.sleep(0.001)
-                
-        except Exception as e:
-            print(f"Response monitoring error: {e}")
-    
-    def start_response_monitor(self):
-        self.response_thread = threading.Thread(target=self.monitor_responses, daemon=True)
-        self.response_thread.start()
-    
     def request_status_report(self):
-        """Send a LIN frame to request status report from slave"""
+        """Read the slave's status snapshot and record what it reports"""
         try:
-            self.wakeup_slave()
-            self.send_break()
-            
-            self.ser.write(bytes([SYNC_BYTE]))
-            pid = self.calculate_pid(0x17)  # Special ID for status request
-            self.ser.write(bytes([pid]))
+            with self.network.transmit():
+                data = self.read_status_snapshot()
             
-            checksum = self.calculate_checksum(pid, bytes())
-            self.ser.write(bytes([checksum]))
-            self.ser.flush()
+            if data is None:
+                return
             
-            print("Sent status request frame")
+            signals = self.parse_response_frame(data)
+            if signals:
+                print("\nReceived Response Signals:")
+                for light, signal in signals.items():
+                    print(f"{light}: {signal['status']} | {signal['mode']}")
+                self.write_response_to_file(signals)
+                self.update_database(signals)
             
         except Exception as e:
-            print(f"Error sending status request: {e}")
+            print(f"Error requesting status report: {e}")
     
     def monitor_file(self):
         print(f"Monitoring {self.filename} for new light status updates...")
@@ -400,8 +406,10 @@ class LINLightMaster:
     
     def shutdown(self):
         self.running = False
-        if hasattr(self, 'response_thread') and self.response_thread.is_alive():
-            self.response_thread.join(timeout=0.5)
+        self.network.stop()
+        if self.writer.bus_errors:
+            print("LIN bus errors per frame ID: " +
+                  ", ".join(f"{hex(frame_id)}: {count}" for frame_id, count in sorted(self.writer.bus_errors.items())))
         if self.ser:
             self.ser.close()
         if self.db_connection and self.db_connection.is_connected():
@@ -6,62 +6,79 @@ import os
 import watchdog.observers
 import watchdog.events
 
+LIGHT_FILE = "light_analysis.txt"
+WINDOW_FILE = "windows_analysis.txt"
+
 class FileChangeHandler(watchdog.events.FileSystemEventHandler):
     def __init__(self, light_event, window_event):
         super().__init__()
-        self.light_event = light_event
-        self.window_event = window_event
+        self.events = {LIGHT_FILE: light_event, WINDOW_FILE: window_event}
+
+    def notify(self, path):
+        event = self.events.get(os.path.basename(path))
+        if event:
+            event.set()
 
     def on_modified(self, event):
         if not event.is_directory:
-            if "light_analysis.txt" in event.src_path:
-                self.light_event.set()
-            elif "windows_analysis.txt" in event.src_path:
-                self.window_event.set()
+            self.notify(event.src_path)
 
-def run_light_master(light_event):
-    light_master = CANLightMaster("light_analysis.txt")
+    def on_created(self, event):
+        if not event.is_directory:
+            self.notify(event.src_path)
+
+    def on_moved(self, event):
+        # Editors save by writing a temp file and renaming it over the original
+        if not event.is_directory:
+            self.notify(event.dest_path)
+
+def run_master(master, change_event):
+    """Block until the file changed, then handle what was appended.
+
+    The event is cleared before reading, so a change that lands while lines
+    are being processed sets it again and is picked up on the next pass.
+    """
+    master.process_available()  # lines appended while the observer was starting
     while True:
-        light_event.wait()  # Wait for the event to be set
-        light_master.monitor_file()
-        light_event.clear()  # Reset the event for next time
+        change_event.wait()
+        change_event.clear()
+        master.process_available()
+
+def run_light_master(light_event):
+    run_master(CANLightMaster(LIGHT_FILE), light_event)
 
 def run_window_master(window_event):
-    window_master = CANWindowMaster("windows_analysis.txt")
-    while True:
-        window_event.wait()  # Wait for the event to be set
-        window_master.monitor_file()
-        window_event.clear()  # Reset the event for next time
+    run_master(CANWindowMaster(WINDOW_FILE), window_event)
 
 if __name__ == "__main__":
     print("Starting master controller with event-driven processes...")
-    
+
     # Create events for inter-process communication
     light_event = multiprocessing.Event()
     window_event = multiprocessing.Event()
-    
+
     # Create processes for each master
     light_process = multiprocessing.Process(
-        target=run_light_master, 
+        target=run_light_master,
         args=(light_event,),
         daemon=True
     )
     window_process = multiprocessing.Process(
-        target=run_window_master, 
+        target=run_window_master,
         args=(window_event,),
         daemon=True
     )
-    
+
     # Start the processes
     light_process.start()
     window_process.start()
-    
+
     # Set up file system observer
     event_handler = FileChangeHandler(light_event, window_event)
     observer = watchdog.observers.Observer()
     observer.schedule(event_handler, path='.', recursive=False)
     observer.start()
-    
+
     try:
         # Keep the main process alive while the others run
         while True:
@@ -70,4 +87,4 @@ if __name__ == "__main__":
         print("\nShutting down master controller...")
         observer.stop()
         observer.join()
-        print("Shutdown complete")
\ No newline at end of file
+        print("Shutdown complete")
@@ -1,10 +1,11 @@
+import os
 import serial
 import time
 import RPi.GPIO as GPIO
 import threading
 
 # LIN Constants
-SERIAL_PORT = '/dev/serial0'
+SERIAL_PORT = os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
 BAUD_RATE = 19200
 WAKEUP_PIN = 4
 SYNC_BYTE = 0x55
@@ -97,54 +98,53 @@ class LINMaster:
         print("Response monitor thread started")
         
         while self.running:
-            if self.ser.in_waiting:
-                byte = self.ser.read(1)
-                if byte:
-                    buffer += byte
-                
-                # Check for complete frame (break + sync + pid + data + checksum)
-                # Minimum frame is 5 bytes (header + 1 byte data + checksum)
-                if len(buffer) >= 5:
-                    # Verify break and sync
-                    if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
-                        print("Invalid frame start")
-                        buffer = buffer[1:]  # Skip first byte and try again
-                        continue
-                    
-                    pid = buffer[2]
-                    frame_id = pid & 0x3F
-                    
-                    if frame_id != SLAVE_RESPONSE_ID:
-                        print(f"Unexpected response frame ID: {hex(frame_id)}")
-                        buffer = buffer[3:]  # Skip this frame
-                        continue
-                    
-                    # Get data (could be 1-8 bytes)
-                    data_length = len(buffer) - 4  # Total length minus header and checksum
-                    if data_length < 1 or data_length > 8:
-                        print(f"Invalid data length: {data_length}")
-                        buffer = buffer[3:]  # Skip this frame
-                        continue
-                    
-                    data = buffer[3:3+data_length]
-                    received_checksum = buffer[3+data_length]
-                    
-                    # Verify checksum
-                    calc_checksum = self.calculate_checksum(pid, data)
-                    if received_checksum != calc_checksum:
-                        print(f"Checksum mismatch: received {hex(received_checksum)}, calculated {hex(calc_checksum)}")
-                        buffer = buffer[4+data_length:]  # Skip this frame
-                        continue
-                    
-                    # Print the response
-                    response = data.decode('ascii', errors='ignore')
-                    print(f"Received response: {response}")
-                    self.response_received.set()
-                    
-                    # Clear processed frame from buffer
-                    buffer = buffer[4+data_length:]
+            # Blocking read, woken by the next byte or the 0.1 s port timeout
+            byte = self.ser.read(1)
+            if not byte:
+                continue
+            buffer += byte
             
-            time.sleep(0.001)
+            # Check for complete frame (break + sync + pid + data + checksum)
+            # Minimum frame is 5 bytes (header + 1 byte data + checksum)
+            if len(buffer) >= 5:
+                # Verify break and sync
+                if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
+                    print("Invalid frame start")
+                    buffer = buffer[1:]  # Skip first byte and try again
+                    continue
+                
+                pid = buffer[2]
+                frame_id = pid & 0x3F
+                
+                if frame_id != SLAVE_RESPONSE_ID:
+                    print(f"Unexpected response frame ID: {hex(frame_id)}")
+                    buffer = buffer[3:]  # Skip this frame
+                    continue
+                
+                # Get data (could be 1-8 bytes)
+                data_length = len(buffer) - 4  # Total length minus header and checksum
+                if data_length < 1 or data_length > 8:
+                    print(f"Invalid data length: {data_length}")
+                    buffer = buffer[3:]  # Skip this frame
+                    continue
+                
+                data = buffer[3:3+data_length]
+                received_checksum = buffer[3+data_length]
+                
+                # Verify checksum
+                calc_checksum = self.calculate_checksum(pid, data)
+                if received_checksum != calc_checksum:
+                    print(f"Checksum mismatch: received {hex(received_checksum)}, calculated {hex(calc_checksum)}")
+                    buffer = buffer[4+data_length:]  # Skip this frame
+                    continue
+                
+                # Print the response
+                response = data.decode('ascii', errors='ignore')
+                print(f"Received response: {response}")
+                self.response_received.set()
+                
+                # Clear processed frame from buffer
+                buffer = buffer[4+data_length:]
     
     def run(self):
         """Main loop to send messages"""
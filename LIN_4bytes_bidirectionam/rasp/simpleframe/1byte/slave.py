@@ -1,10 +1,12 @@
+import os
 import serial
 import RPi.GPIO as GPIO
 import time
+import queue
 import threading
 
 # LIN Constants
-SERIAL_PORT = '/dev/serial0'
+SERIAL_PORT = os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
 BAUD_RATE = 19200
 WAKEUP_PIN = 4
 SYNC_BYTE = 0x55
@@ -17,8 +19,7 @@ SLAVE_RESPONSE_ID = 0x21
 class LINSlave:
     def __init__(self):
         self.running = True
-        self.response_queue = []
-        self.lock = threading.Lock()
+        self.response_queue = queue.Queue()
         
         # Initialize GPIO
         GPIO.setmode(GPIO.BCM)
@@ -58,19 +59,19 @@ class LINSlave:
     
     def queue_response(self):
         """Queue a response to be sent by the response thread"""
-        with self.lock:
-            self.response_queue.append("R")  # 1 byte response
+        self.response_queue.put("R")  # 1 byte response
     
     def send_responses(self):
         """Thread to send responses from the queue"""
         print("Response sender thread started")
         
         while self.running:
-            with self.lock:
-                if self.response_queue:
-                    response_msg = self.response_queue.pop(0)
-                else:
-                    response_msg = None
+            # Sleep on the queue until a response is queued; the timeout only
+            # lets the thread notice shutdown
+            try:
+                response_msg = self.response_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
             
             if response_msg:
                 try:
@@ -98,8 +99,6 @@ class LINSlave:
                 
                 except Exception as e:
                     print(f"Error sending LIN response: {e}")
-            
-            time.sleep(0.001)
     
     def receive_messages(self):
         """Main thread to receive and process LIN messages"""
@@ -108,55 +107,54 @@ class LINSlave:
         
         try:
             while self.running:
-                if self.ser.in_waiting:
-                    byte = self.ser.read(1)
-                    if byte:
-                        buffer += byte
-                    
-                    # Check if we have a complete frame (minimum 5 bytes)
-                    if len(buffer) >= 5:
-                        # Verify break and sync
-                        if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
-                            print("Invalid frame start (missing break or sync)")
-                            buffer = buffer[1:]  # Skip first byte and try again
-                            continue
-                        
-                        pid = buffer[2]
-                        frame_id = pid & 0x3F
-                        
-                        if frame_id != MASTER_FRAME_ID:
-                            print(f"Received frame for unexpected ID: {hex(frame_id)}")
-                            buffer = buffer[3:]  # Skip this frame
-                            continue
-                        
-                        # Get data (could be 1-8 bytes)
-                        data_length = len(buffer) - 4  # Total length minus header and checksum
-                        if data_length < 1 or data_length > 8:
-                            print(f"Invalid data length: {data_length}")
-                            buffer = buffer[3:]  # Skip this frame
-                            continue
-                        
-                        data = buffer[3:3+data_length]
-                        received_checksum = buffer[3+data_length]
-                        
-                        # Verify checksum
-                        calc_checksum = self.calculate_checksum(pid, data)
-                        if received_checksum != calc_checksum:
-                            print(f"Checksum mismatch: received {hex(received_checksum)}, calculated {hex(calc_checksum)}")
-                            buffer = buffer[4+data_length:]  # Skip this frame
-                            continue
-                        
-                        # Print the message
-                        message = data.decode('ascii', errors='ignore')
-                        print(f"Received message: {message}")
-                        
-                        # Queue response
-                        self.queue_response()
-                        
-                        # Clear processed frame from buffer
-                        buffer = buffer[4+data_length:]
+                # Blocking read, woken by the next byte or the 0.1 s port timeout
+                byte = self.ser.read(1)
+                if not byte:
+                    continue
+                buffer += byte
                 
-                time.sleep(0.001)
+                # Check if we have a complete frame (minimum 5 bytes)
+                if len(buffer) >= 5:
+                    # Verify break and sync
+                    if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
+                        print("Invalid frame start (missing break or sync)")
+                        buffer = buffer[1:]  # Skip first byte and try again
+                        continue
+                    
+                    pid = buffer[2]
+                    frame_id = pid & 0x3F
+                    
+                    if frame_id != MASTER_FRAME_ID:
+                        print(f"Received frame for unexpected ID: {hex(frame_id)}")
+                        buffer = buffer[3:]  # Skip this frame
+                        continue
+                    
+                    # Get data (could be 1-8 bytes)
+                    data_length = len(buffer) - 4  # Total length minus header and checksum
+                    if data_length < 1 or data_length > 8:
+                        print(f"Invalid data length: {data_length}")
+                        buffer = buffer[3:]  # Skip this frame
+                        continue
+                    
+                    data = buffer[3:3+data_length]
+                    received_checksum = buffer[3+data_length]
+                    
+                    # Verify checksum
+                    calc_checksum = self.calculate_checksum(pid, data)
+                    if received_checksum != calc_checksum:
+                        print(f"Checksum mismatch: received {hex(received_checksum)}, calculated {hex(calc_checksum)}")
+                        buffer = buffer[4+data_length:]  # Skip this frame
+                        continue
+                    
+                    # Print the message
+                    message = data.decode('ascii', errors='ignore')
+                    print(f"Received message: {message}")
+                    
+                    # Queue response
+                    self.queue_response()
+                    
+                    # Clear processed frame from buffer
+                    buffer = buffer[4+data_length:]
                 
         except KeyboardInterrupt:
             print("Received keyboard interrupt")
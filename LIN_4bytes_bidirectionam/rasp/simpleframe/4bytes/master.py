@@ -1,10 +1,10 @@
+import os
 import serial
 import time
 import RPi.GPIO as GPIO
-import threading
 
 # LIN Constants
-SERIAL_PORT = '/dev/serial0'
+SERIAL_PORT = os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
 BAUD_RATE = 19200
 WAKEUP_PIN = 4
 SYNC_BYTE = 0x55
@@ -14,22 +14,20 @@ BREAK_BYTE = 0x00
 MASTER_FRAME_ID = 0x20
 SLAVE_RESPONSE_ID = 0x21
 
+# Header plus the maximum LIN response space (1.4x nominal) for 4 data
+# bytes, and a few ms for the slave script to react
+RESPONSE_TIMEOUT = (34 + 1.4 * 10 * (4 + 1)) / BAUD_RATE + 0.005
+
 class LINMaster:
     def __init__(self):
         self.running = True
-        self.response_received = threading.Event()
-        self.lock = threading.Lock()
         
         # Initialize GPIO and serial
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(WAKEUP_PIN, GPIO.OUT)
         GPIO.output(WAKEUP_PIN, GPIO.HIGH)
         
-        self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=0.1)
-        
-        # Start response monitoring thread
-        self.response_thread = threading.Thread(target=self.monitor_responses, daemon=True)
-        self.response_thread.start()
+        self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=RESPONSE_TIMEOUT)
     
     def calculate_pid(self, frame_id):
         """Calculate LIN Protected Identifier"""
@@ -93,63 +91,40 @@ class LINMaster:
         except Exception as e:
             print(f"Error sending LIN message: {e}")
     
-    def monitor_responses(self):
-        """Thread to monitor for responses from slave"""
-        buffer = bytearray()
-        print("Response monitor thread started")
+    def poll_response(self):
+        """Send the header for the slave's response frame and read its 4-byte answer"""
+        pid = self.calculate_pid(SLAVE_RESPONSE_ID)
+        self.ser.reset_input_buffer()
+        self.send_break()
+        self.ser.write(bytes([SYNC_BYTE, pid]))
+        self.ser.flush()
         
-        while self.running:
-            if self.ser.in_waiting:
-                byte = self.ser.read(1)
-                if byte:
-                    buffer += byte
-                
-                # Check for complete frame (break + sync + pid + 4 data + checksum = 8 bytes)
-                if len(buffer) >= 8:
-                    # Verify break and sync
-                    if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
-                        print("Invalid frame start")
-                        buffer = buffer[1:]  # Skip first byte and try again
-                        continue
-                    
-                    pid = buffer[2]
-                    frame_id = pid & 0x3F
-                    
-                    if frame_id != SLAVE_RESPONSE_ID:
-                        print(f"Unexpected response frame ID: {frame_id:02X}")
-                        buffer = buffer[3:]  # Skip this frame
-                        continue
-                    
-                    # Get 4 bytes of data
-                    data = buffer[3:7]
-                    received_checksum = buffer[7]
-                    
-                    # Verify checksum
-                    calc_checksum = self.calculate_checksum(pid, data)
-                    if received_checksum != calc_checksum:
-                        print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
-                        buffer = buffer[8:]  # Skip this frame
-                        continue
-                    
-                    # Display the response in hex
-                    data_hex = ' '.join(f'{x:02X}' for x in data)
-                    print(f"Received response: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
-                    self.response_received.set()
-                    
-                    # Clear processed frame from buffer
-                    buffer = buffer[8:]
-            
-            time.sleep(0.001)
+        response = self.ser.read(5)
+        if response[:3] == bytes([BREAK_BYTE, SYNC_BYTE, pid]):
+            # Transceiver echo of our own header
+            response = response[3:] + self.ser.read(3)
+        if len(response) < 5:
+            return None
+        
+        data, received_checksum = response[:4], response[4]
+        calc_checksum = self.calculate_checksum(pid, data)
+        if received_checksum != calc_checksum:
+            print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
+            return None
+        
+        # Display the response in hex
+        data_hex = ' '.join(f'{x:02X}' for x in data)
+        print(f"Received response: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
+        return data
     
     def run(self):
         """Main loop to send messages"""
         try:
             while self.running:
-                self.response_received.clear()
                 self.send_message()
                 
-                # Wait for response with timeout
-                if self.response_received.wait(timeout=1.0):
+                # Poll the slave's response in its slot
+                if self.poll_response() is not None:
                     print("Successful communication cycle")
                 else:
                     print("Timeout waiting for response")
@@ -162,8 +137,6 @@ class LINMaster:
     def shutdown(self):
         """Cleanup resources"""
         self.running = False
-        if hasattr(self, 'response_thread') and self.response_thread.is_alive():
-            self.response_thread.join(timeout=0.5)
         if self.ser and self.ser.is_open:
             self.ser.close()
         GPIO.cleanup()
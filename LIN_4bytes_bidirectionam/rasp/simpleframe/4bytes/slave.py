@@ -1,10 +1,11 @@
+import os
 import serial
 import RPi.GPIO as GPIO
 import time
 import threading
 
 # LIN Constants
-SERIAL_PORT = '/dev/serial0'
+SERIAL_PORT = os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
 BAUD_RATE = 19200
 WAKEUP_PIN = 4
 SYNC_BYTE = 0x55
@@ -17,7 +18,7 @@ SLAVE_RESPONSE_ID = 0x21
 class LINSlave:
     def __init__(self):
         self.running = True
-        self.response_queue = []
+        self.response_slots = {}  # frame ID -> data sent when the master polls it
         self.lock = threading.Lock()
         
         # Initialize GPIO
@@ -26,10 +27,6 @@ class LINSlave:
         
         # Initialize serial
         self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=0.1)
-        
-        # Start response sending thread
-        self.response_thread = threading.Thread(target=self.send_responses, daemon=True)
-        self.response_thread.start()
     
     def calculate_pid(self, frame_id):
         """Calculate LIN Protected Identifier"""
@@ -48,58 +45,30 @@ class LINSlave:
                 checksum -= 0xFF
         return (0xFF - checksum) & 0xFF
     
-    def send_break(self):
-        """Send LIN break signal (13 bits of 0)"""
-        self.ser.baudrate = BAUD_RATE // 4
-        self.ser.write(bytes([BREAK_BYTE]))
-        self.ser.flush()
-        time.sleep(0.001)  # Short delay for break
-        self.ser.baudrate = BAUD_RATE
-    
-    def queue_response(self):
-        """Queue a response to be sent by the response thread"""
+    def publish_response(self):
+        """Publish the data sent when the master polls the response frame"""
         with self.lock:
             # Example 4-byte response: 0xCA, 0xFE, 0xBA, 0xBE
-            self.response_queue.append(bytes([0xCA, 0xFE, 0xBA, 0xBE]))
+            self.response_slots[SLAVE_RESPONSE_ID] = bytes([0xCA, 0xFE, 0xBA, 0xBE])
     
-    def send_responses(self):
-        """Thread to send responses from the queue"""
-        print("Response sender thread started")
+    def send_slot_response(self, frame_id, pid):
+        """Answer a master header with data and checksum only (the master owns break, sync and PID)"""
+        with self.lock:
+            response_data = self.response_slots.get(frame_id)
+        if response_data is None:
+            return
         
-        while self.running:
-            with self.lock:
-                if self.response_queue:
-                    response_data = self.response_queue.pop(0)
-                else:
-                    response_data = None
-            
-            if response_data:
-                try:
-                    self.send_break()
-                    
-                    # Send sync byte
-                    self.ser.write(bytes([SYNC_BYTE]))
-                    
-                    # Send PID
-                    pid = self.calculate_pid(SLAVE_RESPONSE_ID)
-                    self.ser.write(bytes([pid]))
-                    
-                    # Send 4-byte response data
-                    self.ser.write(response_data)
-                    
-                    # Calculate and send checksum
-                    checksum = self.calculate_checksum(pid, response_data)
-                    self.ser.write(bytes([checksum]))
-                    self.ser.flush()
-                    
-                    # Display in hex format
-                    data_hex = ' '.join(f'{x:02X}' for x in response_data)
-                    print(f"Sent response frame: PID={pid:02X}, Data=[{data_hex}], Checksum={checksum:02X}")
-                
-                except Exception as e:
-                    print(f"Error sending LIN response: {e}")
+        try:
+            checksum = self.calculate_checksum(pid, response_data)
+            self.ser.write(response_data + bytes([checksum]))
+            self.ser.flush()
             
-            time.sleep(0.001)
+            # Display in hex format
+            data_hex = ' '.join(f'{x:02X}' for x in response_data)
+            print(f"Sent response: PID={pid:02X}, Data=[{data_hex}], Checksum={checksum:02X}")
+        
+        except Exception as e:
+            print(f"Error sending LIN response: {e}")
     
     def receive_messages(self):
         """Main thread to receive and process LIN messages"""
@@ -108,49 +77,55 @@ class LINSlave:
         
         try:
             while self.running:
-                if self.ser.in_waiting:
-                    byte = self.ser.read(1)
-                    if byte:
-                        buffer += byte
-                    
-                    # Check for complete frame (break + sync + pid + 4 data + checksum = 8 bytes)
-                    if len(buffer) >= 8:
-                        # Verify break and sync
-                        if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
-                            print("Invalid frame start (missing break or sync)")
-                            buffer = buffer[1:]  # Skip first byte and try again
-                            continue
-                        
-                        pid = buffer[2]
-                        frame_id = pid & 0x3F
-                        
-                        if frame_id != MASTER_FRAME_ID:
-                            print(f"Received frame for unexpected ID: {frame_id:02X}")
-                            buffer = buffer[3:]  # Skip this frame
-                            continue
-                        
-                        # Get 4 bytes of data
-                        data = buffer[3:7]
-                        received_checksum = buffer[7]
-                        
-                        # Verify checksum
-                        calc_checksum = self.calculate_checksum(pid, data)
-                        if received_checksum != calc_checksum:
-                            print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
-                            buffer = buffer[8:]  # Skip this frame
-                            continue
-                        
-                        # Display the message in hex
-                        data_hex = ' '.join(f'{x:02X}' for x in data)
-                        print(f"Received message: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
-                        
-                        # Queue response
-                        self.queue_response()
-                        
-                        # Clear processed frame from buffer
-                        buffer = buffer[8:]
+                # Blocking read, woken by the next byte or the 0.1 s port timeout
+                byte = self.ser.read(1)
+                if not byte:
+                    continue
+                buffer += byte
                 
-                time.sleep(0.001)
+                # Header for the response frame: answer in its slot
+                if len(buffer) == 3 and buffer[0] == BREAK_BYTE and buffer[1] == SYNC_BYTE \
+                        and (buffer[2] & 0x3F) == SLAVE_RESPONSE_ID:
+                    self.send_slot_response(SLAVE_RESPONSE_ID, buffer[2])
+                    buffer = bytearray()
+                    continue
+                
+                # Check for complete frame (break + sync + pid + 4 data + checksum = 8 bytes)
+                if len(buffer) >= 8:
+                    # Verify break and sync
+                    if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
+                        print("Invalid frame start (missing break or sync)")
+                        buffer = buffer[1:]  # Skip first byte and try again
+                        continue
+                    
+                    pid = buffer[2]
+                    frame_id = pid & 0x3F
+                    
+                    if frame_id != MASTER_FRAME_ID:
+                        print(f"Received frame for unexpected ID: {frame_id:02X}")
+                        buffer = buffer[3:]  # Skip this frame
+                        continue
+                    
+                    # Get 4 bytes of data
+                    data = buffer[3:7]
+                    received_checksum = buffer[7]
+                    
+                    # Verify checksum
+                    calc_checksum = self.calculate_checksum(pid, data)
+                    if received_checksum != calc_checksum:
+                        print(f"Checksum mismatch: received {received_checksum:02X}, calculated {calc_checksum:02X}")
+                        buffer = buffer[8:]  # Skip this frame
+                        continue
+                    
+                    # Display the message in hex
+                    data_hex = ' '.join(f'{x:02X}' for x in data)
+                    print(f"Received message: PID={pid:02X}, Data=[{data_hex}], Checksum={received_checksum:02X}")
+                    
+                    # Publish the response for the master's poll
+                    self.publish_response()
+                    
+                    # Clear processed frame from buffer
+                    buffer = buffer[8:]
                 
         except KeyboardInterrupt:
             print("Received keyboard interrupt")
@@ -162,8 +137,6 @@ class LINSlave:
     def shutdown(self):
         """Cleanup resources"""
         self.running = False
-        if hasattr(self, 'response_thread') and self.response_thread.is_alive():
-            self.response_thread.join(timeout=0.5)
         if self.ser:
             self.ser.close()
         GPIO.cleanup()
@@ -0,0 +1,420 @@
+"""
+Bus trace recorder and time-accurate replay for the CAN and LIN rigs.
+
+Traces are a compact binary file: a header, then one record per CAN
+message or LIN frame with a nanosecond timestamp. They can be exported to
+candump (-L log), Vector ASC or BLF for the usual viewers, and candump /
+ASC / BLF captures can be imported back for replay.
+
+    python bench/bus_trace.py record -o run.pfetrace --can-channel can0 --lin-port /dev/serial0
+    python bench/bus_trace.py info run.pfetrace
+    python bench/bus_trace.py export run.pfetrace -o run.asc
+    python bench/bus_trace.py import candump-2025-05-01.log -o run.pfetrace
+    python bench/bus_trace.py replay run.pfetrace --speed 10 --can-channel vcan0
+    python bench/bus_trace.py replay run.pfetrace --max --lin-port /dev/pts/4
+
+LIN is recorded from a listen-only serial tap: a third pty of the LIN
+simulator (bench/lin_sim.py serve --nodes 3) or a second transceiver on the
+rig. A frame is break, sync, PID and every byte up to the next break; the
+record keeps the raw PID and the bytes after it (data and checksum) so
+replay puts the exact frame back on the wire. As 0x00 0x55 may also be data,
+a break is only taken after an idle gap, or after the frame length the LDF
+gives the ID:
+
+    python bench/bus_trace.py record -o run.pfetrace --lin-port /dev/pts/5 \
+        --lin-ldf "vehicle systems/HMI/door/final/door_system.ldf"
+"""
+import os
+import time
+import struct
+import argparse
+import threading
+from collections import namedtuple
+
+import can
+
+from fakes import format_latencies
+from can_harness import load_module
+
+TRACE_MAGIC = b'PFETRACE'
+TRACE_VERSION = 1
+HEADER = struct.Struct('<8sHq')  # magic, version, start time (ns since epoch)
+RECORD = struct.Struct('<qBBIB')  # timestamp ns, bus, flags, id, length
+
+BUS_CAN = 0
+BUS_LIN = 1
+
+# CAN record flags
+FLAG_EXTENDED = 0x01
+FLAG_REMOTE = 0x02
+FLAG_ERROR = 0x04
+FLAG_FD = 0x08
+FLAG_RX = 0x10
+FLAG_BRS = 0x20  # FD frame sent with the data phase bitrate
+FLAG_ESI = 0x40  # FD frame sent by an error-passive node
+
+LIN_BREAK_BYTE = 0x00
+LIN_SYNC_BYTE = 0x55
+LIN_BAUD_RATE = 19200
+
+def load_frame_table(ldf_path):
+    """{frame ID: data length} from an LDF, parsed as the door slaves do"""
+    return load_module('vehicle systems/HMI/door/final', 'lin_deframer').load_frame_table(ldf_path)
+
+EXPORT_FORMATS = {
+    '.log': can.CanutilsLogWriter,  # candump -L
+    '.asc': can.ASCWriter,
+    '.blf': can.BLFWriter
+}
+
+TraceRecord = namedtuple('TraceRecord', ['timestamp_ns', 'bus', 'flags', 'arbitration_id', 'data'])
+
+# ---------------------------------------------------------------------------
+# Trace file
+# ---------------------------------------------------------------------------
+
+class TraceWriter:
+    """Append-only binary trace; safe to share between recorder threads."""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, time.time_ns()))
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, timestamp_ns, bus, flags, arbitration_id, data):
+        record = RECORD.pack(timestamp_ns, bus, flags, arbitration_id, len(data)) + bytes(data)
+        with self.lock:
+            self.file.write(record)
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_trace(path):
+    """Yield the TraceRecords of a trace file in file order."""
+    with open(path, 'rb') as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} bus trace")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            timestamp_ns, bus, flags, arbitration_id, length = RECORD.unpack(head)
+            yield TraceRecord(timestamp_ns, bus, flags, arbitration_id, f.read(length))
+
+def message_to_record(msg):
+    flags = ((FLAG_EXTENDED if msg.is_extended_id else 0) |
+             (FLAG_REMOTE if msg.is_remote_frame else 0) |
+             (FLAG_ERROR if msg.is_error_frame else 0) |
+             (FLAG_FD if msg.is_fd else 0) |
+             (FLAG_RX if msg.is_rx else 0) |
+             (FLAG_BRS if msg.bitrate_switch else 0) |
+             (FLAG_ESI if msg.error_state_indicator else 0))
+    return TraceRecord(int(round(msg.timestamp * 1e9)), BUS_CAN, flags, msg.arbitration_id, bytes(msg.data))
+
+def record_to_message(record, channel=None):
+    return can.Message(
+        timestamp=record.timestamp_ns / 1e9,
+        arbitration_id=record.arbitration_id,
+        is_extended_id=bool(record.flags & FLAG_EXTENDED),
+        is_remote_frame=bool(record.flags & FLAG_REMOTE),
+        is_error_frame=bool(record.flags & FLAG_ERROR),
+        is_fd=bool(record.flags & FLAG_FD),
+        is_rx=bool(record.flags & FLAG_RX),
+        bitrate_switch=bool(record.flags & FLAG_BRS),
+        error_state_indicator=bool(record.flags & FLAG_ESI),
+        dlc=len(record.data),
+        data=record.data,
+        channel=channel
+    )
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+class CANRecorder(can.Listener):
+    """python-can listener that writes every received message to the trace."""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def on_message_received(self, msg):
+        self.writer.write(*message_to_record(msg))
+
+class LINRecorder(threading.Thread):
+    """Listen-only LIN tap: splits the serial byte stream into frames.
+
+    0x00 0x55 is also a valid pair of data bytes, so it only counts as break
+    and sync after an idle gap, or once the frame in progress has the length
+    `frame_lengths` ({frame ID: data length}, e.g. from the LDF) gives its ID.
+    Without a length table, frames must be separated by an idle gap.
+    """
+
+    def __init__(self, writer, port, baud_rate=LIN_BAUD_RATE, frame_lengths=None):
+        super().__init__(daemon=True)
+        import serial
+
+        self.writer = writer
+        self.frame_lengths = frame_lengths or {}
+        # An idle gap of two byte times ends a frame that had no successor
+        self.ser = serial.Serial(port, baudrate=baud_rate, timeout=20 / baud_rate)
+        self.running = True
+        self.frame_start = None
+        self.frame = bytearray()
+        self.idle = True
+        self.break_seen = False
+
+    def run(self):
+        while self.running:
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+            now = time.time_ns()
+            if not chunk:
+                self._flush()
+                self.idle = True
+                continue
+            for byte in chunk:
+                if self.break_seen and byte == LIN_SYNC_BYTE:
+                    self._flush()
+                    self.frame_start = now
+                    self.break_seen = False
+                elif byte == LIN_BREAK_BYTE and (self.idle or self._frame_complete()):
+                    # Break candidate; a gap may separate it from the sync byte
+                    self.break_seen = True
+                else:
+                    if self.frame_start is not None:
+                        self.frame.append(byte)
+                    self.break_seen = False
+                self.idle = False
+        self._flush()
+        self.ser.close()
+
+    def _frame_complete(self):
+        """True once the frame has its PID, data and checksum bytes"""
+        if not self.frame:
+            return False
+        length = self.frame_lengths.get(self.frame[0] & 0x3F)
+        return length is not None and len(self.frame) >= length + 2
+
+    def _flush(self):
+        if self.frame_start is not None and self.frame:
+            # frame = PID, data..., checksum
+            self.writer.write(self.frame_start, BUS_LIN, 0, self.frame[0], self.frame[1:])
+        self.frame_start = None
+        self.frame = bytearray()
+
+    def stop(self):
+        self.running = False
+        self.join(timeout=1.0)
+
+def record(output, can_channel, can_interface, lin_port, lin_baud_rate, duration, lin_frame_lengths=None):
+    writer = TraceWriter(output)
+    bus = notifier = lin = None
+    if can_channel:
+        bus = can.Bus(channel=can_channel, interface=can_interface)
+        notifier = can.Notifier(bus, [CANRecorder(writer)])
+    if lin_port:
+        lin = LINRecorder(writer, lin_port, lin_baud_rate, lin_frame_lengths)
+        lin.start()
+
+    print(f"Recording to {output} (Ctrl-C to stop)")
+    try:
+        deadline = time.monotonic() + duration if duration else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if notifier:
+            notifier.stop()
+            bus.shutdown()
+        if lin:
+            lin.stop()
+        writer.close()
+    print(f"Recorded {writer.count} records")
+
+# ---------------------------------------------------------------------------
+# Export / import
+# ---------------------------------------------------------------------------
+
+def export_trace(path, output):
+    """Write the CAN records to candump/ASC/BLF, chosen by the output suffix."""
+    suffix = os.path.splitext(output)[1].lower()
+    if suffix not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {suffix!r}; use one of {', '.join(EXPORT_FORMATS)}")
+    writer = EXPORT_FORMATS[suffix](output)
+    exported = skipped = 0
+    for record in read_trace(path):
+        if record.bus != BUS_CAN:
+            # candump/ASC/BLF writers in python-can only carry CAN
+            skipped += 1
+            continue
+        writer.on_message_received(record_to_message(record, channel=0))
+        exported += 1
+    writer.stop()
+    return exported, skipped
+
+def import_log(path, output):
+    """Convert any log python-can can read (candump, ASC, BLF, ...) to a trace."""
+    writer = TraceWriter(output)
+    for msg in can.LogReader(path):
+        writer.write(*message_to_record(msg))
+    writer.close()
+    return writer.count
+
+def trace_info(path):
+    records = list(read_trace(path))
+    if not records:
+        print(f"{path}: empty")
+        return
+    span = (records[-1].timestamp_ns - records[0].timestamp_ns) / 1e9
+    can_count = sum(1 for r in records if r.bus == BUS_CAN)
+    ids = sorted({(r.bus, r.arbitration_id) for r in records})
+    print(f"{path}: {len(records)} records ({can_count} CAN, {len(records) - can_count} LIN) over {span:.3f} s")
+    print("IDs: " + ', '.join(f"{'CAN' if bus == BUS_CAN else 'LIN'} {hex(i)}" for bus, i in ids))
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def sleep_until(deadline_ns):
+    """Sleep most of the way, then spin: time.sleep alone overshoots by ~0.1 ms."""
+    while True:
+        remaining = deadline_ns - time.perf_counter_ns()
+        if remaining <= 0:
+            return
+        if remaining > 2_000_000:
+            time.sleep((remaining - 1_000_000) / 1e9)
+
+def write_lin_frame(ser, baud_rate, pid, payload):
+    """Break (0x00 at a quarter of the baud rate), sync, PID, recorded bytes."""
+    ser.baudrate = baud_rate // 4
+    ser.write(bytes([LIN_BREAK_BYTE]))
+    ser.flush()
+    time.sleep(13 / (baud_rate // 4))
+    ser.baudrate = baud_rate
+    ser.write(bytes([LIN_SYNC_BYTE, pid]) + payload)
+
+class Replayer:
+    """Re-inject a trace, keeping the recorded spacing divided by `speed`.
+
+    speed=None replays as fast as the buses accept frames.
+    """
+
+    def __init__(self, records, can_bus=None, lin_serial=None, lin_baud_rate=LIN_BAUD_RATE, speed=1.0):
+        self.records = records
+        self.can_bus = can_bus
+        self.lin_serial = lin_serial
+        self.lin_baud_rate = lin_baud_rate
+        self.speed = speed
+        self.lateness = []
+        self.sent = 0
+        self.skipped = 0
+
+    def run(self):
+        if not self.records:
+            return 0.0
+        first = self.records[0].timestamp_ns
+        start = time.perf_counter_ns()
+        for record in self.records:
+            if self.speed:
+                target = start + int((record.timestamp_ns - first) / self.speed)
+                sleep_until(target)
+            if record.bus == BUS_CAN and self.can_bus:
+                self.can_bus.send(record_to_message(record))
+            elif record.bus == BUS_LIN and self.lin_serial:
+                write_lin_frame(self.lin_serial, self.lin_baud_rate, record.arbitration_id, record.data)
+            else:
+                self.skipped += 1
+                continue
+            if self.speed:
+                self.lateness.append((time.perf_counter_ns() - target) / 1e9)
+            self.sent += 1
+        return (time.perf_counter_ns() - start) / 1e9
+
+def replay(path, speed, can_channel, can_interface, lin_port, lin_baud_rate):
+    records = list(read_trace(path))
+    # A classic socket rejects FD frames, so open it FD-capable when the trace has any
+    fd = any(r.bus == BUS_CAN and r.flags & FLAG_FD for r in records)
+    can_bus = can.Bus(channel=can_channel, interface=can_interface, fd=fd) if can_channel else None
+    lin_serial = None
+    if lin_port:
+        import serial
+        lin_serial = serial.Serial(lin_port, baudrate=lin_baud_rate, timeout=0)
+
+    replayer = Replayer(records, can_bus, lin_serial, lin_baud_rate, speed)
+    try:
+        elapsed = replayer.run()
+    finally:
+        if can_bus:
+            can_bus.shutdown()
+        if lin_serial:
+            lin_serial.flush()
+            lin_serial.close()
+
+    span = (records[-1].timestamp_ns - records[0].timestamp_ns) / 1e9 if records else 0.0
+    print(f"Replayed {replayer.sent} records ({replayer.skipped} without a target bus) in {elapsed:.3f} s "
+          f"-> {replayer.sent / elapsed if elapsed else 0:.1f} records/s, "
+          f"{span / elapsed if elapsed else 0:.1f}x the recorded {span:.3f} s")
+    if speed:
+        print(format_latencies("Send lateness", replayer.lateness))
+
+def main():
+    parser = argparse.ArgumentParser(description="Record, convert and replay CAN/LIN bus traces")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def bus_options(p):
+        p.add_argument('--can-channel', help="e.g. can0 or vcan0")
+        p.add_argument('--can-interface', default='socketcan')
+        p.add_argument('--lin-port', help="serial port of the LIN tap / simulator node")
+        p.add_argument('--lin-baud-rate', type=int, default=LIN_BAUD_RATE)
+
+    record_parser = sub.add_parser('record', help="record CAN and/or LIN traffic")
+    record_parser.add_argument('-o', '--output', required=True)
+    record_parser.add_argument('--duration', type=float, default=None, help="seconds (default: until Ctrl-C)")
+    record_parser.add_argument('--lin-ldf', help="LDF whose frame lengths split back-to-back LIN frames "
+                                                 "(default: frames end at an idle gap)")
+    bus_options(record_parser)
+
+    replay_parser = sub.add_parser('replay', help="re-inject a trace")
+    replay_parser.add_argument('trace')
+    speed = replay_parser.add_mutually_exclusive_group()
+    speed.add_argument('--speed', type=float, default=1.0, help="time scale, e.g. 10 for 10x real time")
+    speed.add_argument('--max', action='store_true', help="ignore timestamps and send back to back")
+    bus_options(replay_parser)
+
+    export_parser = sub.add_parser('export', help="write CAN records as candump (.log), ASC or BLF")
+    export_parser.add_argument('trace')
+    export_parser.add_argument('-o', '--output', required=True)
+
+    import_parser = sub.add_parser('import', help="convert a candump/ASC/BLF log to a trace")
+    import_parser.add_argument('log')
+    import_parser.add_argument('-o', '--output', required=True)
+
+    info_parser = sub.add_parser('info', help="summarise a trace")
+    info_parser.add_argument('trace')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        if not (args.can_channel or args.lin_port):
+            parser.error("record needs --can-channel and/or --lin-port")
+        frame_lengths = load_frame_table(args.lin_ldf) if args.lin_ldf else None
+        record(args.output, args.can_channel, args.can_interface, args.lin_port, args.lin_baud_rate, args.duration,
+               frame_lengths)
+    elif args.command == 'replay':
+        if not (args.can_channel or args.lin_port):
+            parser.error("replay needs --can-channel and/or --lin-port")
+        replay(args.trace, None if args.max else args.speed, args.can_channel, args.can_interface,
+               args.lin_port, args.lin_baud_rate)
+    elif args.command == 'export':
+        exported, skipped = export_trace(args.trace, args.output)
+        print(f"Exported {exported} CAN records to {args.output} ({skipped} LIN records skipped)")
+    elif args.command == 'import':
+        print(f"Imported {import_log(args.log, args.output)} messages to {args.output}")
+    else:
+        trace_info(args.trace)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,780 @@
+"""
+End-to-end harness for the CAN master/slave pairs.
+
+Runs a master and a slave against each other without a Raspberry Pi:
+RPi.GPIO is replaced by a recording stub, MySQL by an in-memory SQLite
+database, and the hardcoded can0/socketcan bus by python-can's virtual
+interface (or a real vcan0 with --interface socketcan --channel vcan0).
+
+    python bench/can_harness.py light --commands 500
+    python bench/can_harness.py window --interface socketcan --channel vcan0 --two-process
+    python bench/can_harness.py light --light-frames aggregated --mode-changes 50
+    python bench/can_harness.py snapshot --fd --interface socketcan --channel vcan0 --setup-vcan
+    python bench/can_harness.py service --fd --dumps 50
+    python bench/can_harness.py refresh --refresh-period 0.2 --restarts 10
+    python bench/can_harness.py txqueue --replay-lines 20000 --txqueuelen 10
+
+Reports throughput (commands/s) for a burst of analysis lines and latency
+percentiles for one-at-a-time commands, measured both from the analysis
+file write and from the CAN send. --mode-changes writes all seven lights
+with a new mode at once and reports the frames and bus time each change
+costs, for the per-light or aggregated lighting frames (light_frames.py).
+`snapshot` runs the light, window and wiper slaves with the light and window
+masters and times vehicle snapshots (snapshot.py), classic or with --fd.
+`service` runs the light and window slaves and times state dumps and an
+LED table write over their ISO-TP channels (slave_service.py).
+`refresh` restarts the light and window slaves after a round of commands and
+times how long the masters' cyclic refresh frames (cyclic.py) take to bring
+them back to the commanded state, with the jitter of the refresh period.
+Refresh frames are off (--refresh-period 0) in the other runs so they do not
+show up in the measured frame counts.
+`txqueue` replays a large lighting analysis file into the light master through
+a socket that, like can0, holds only --txqueuelen frames and answers ENOBUFS
+beyond that, with a bus-off halfway through, and checks that the transmit
+queue (can_tx.py) delivers every frame in order; the same frames sent straight
+with bus.send() show what used to be lost.
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import errno
+import tempfile
+import threading
+import subprocess
+import contextlib
+import importlib.util
+from collections import defaultdict, deque
+
+import can
+
+from fakes import install_hardware_fakes, format_latencies
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def install_fakes(interface, channel):
+    """Patch GPIO, MySQL, `ip link` calls and can.interface.Bus for this process."""
+    gpio, connector = install_hardware_fakes(skip_commands=('ip link',))
+
+    def bus_factory(channel_arg=None, bustype=None, **kwargs):
+        kwargs.pop('channel', None)
+        kwargs.pop('interface', None)
+        return can.Bus(interface=interface, channel=channel, **kwargs)
+
+    can.interface.Bus = bus_factory
+    return gpio, connector
+
+def ensure_vcan(channel, fd=False):
+    """Create and bring up a vcan interface (needs root and the vcan module);
+    with fd, give it the CAN FD MTU so it carries 64-byte frames."""
+    if not os.path.exists(f'/sys/class/net/{channel}'):
+        subprocess.run(['ip', 'link', 'add', 'dev', channel, 'type', 'vcan'], check=True)
+    # vcan only changes its MTU while down
+    subprocess.run(['ip', 'link', 'set', 'down', channel], check=False)
+    subprocess.run(['ip', 'link', 'set', channel, 'mtu', '72' if fd else '16'], check=True)
+    subprocess.run(['ip', 'link', 'set', 'up', channel], check=True)
+
+# ---------------------------------------------------------------------------
+# Master / slave pairs
+# ---------------------------------------------------------------------------
+
+LIGHTS = ["Low Beam", "High Beam", "Parking Left", "Parking Right"]
+ALL_LIGHTS = LIGHTS + ["Hazard Lights", "Right Turn", "Left Turn"]
+LIGHT_MODES = ["Fahren", "Stand", "Parking", "Wohnen"]
+WINDOWS = ["DR", "PS", "DRS", "PRS"]
+
+def light_line(i):
+    # Alternate each light so the master never skips an unchanged status
+    light = LIGHTS[i % len(LIGHTS)]
+    result = "activated" if (i // len(LIGHTS)) % 2 == 0 else "deactivated"
+    return light, f"Light: {light} | Result: {result} | Mode: {LIGHT_MODES[i % len(LIGHT_MODES)]}"
+
+def mode_change_lines(i):
+    # Only the mode changes; blinking lights stay off so the slave answers at once
+    mode = LIGHT_MODES[i % len(LIGHT_MODES)]
+    return [(light, f"Light: {light} | Result: {'activated' if light == 'Low Beam' else 'deactivated'} | Mode: {mode}")
+            for light in ALL_LIGHTS]
+
+def window_line(i):
+    # FAILED results are answered at once (no 1 s LED animation on the slave)
+    window = WINDOWS[i % len(WINDOWS)]
+    level = (i * 25) % 125
+    return window, (f"Window: {window} | Result: FAILED | Level: {level}% | "
+                    f"Level_type: AUTO | mode: Whonen | safety: OFF")
+
+# master/slave: (directory, module, class); files: copied into the run directory
+PAIRS = {
+    'light': {
+        'master': ('finalPFE_2', 'master_light', 'CANLightMaster'),
+        'slave': ('finalPFE_2', 'slave_light', 'CANLightSlave'),
+        'files': [],
+        'make_line': light_line
+    },
+    'window': {
+        'master': ('finalPFE_2', 'master_window', 'CANWindowMaster'),
+        'slave': ('finalPFE_2', 'slave_window', 'CANWindowSlave'),
+        'files': [],
+        'make_line': window_line
+    },
+    'dbc-window': {
+        'master': ('FINAL_PFE_scripts/CAN/dbc/Window/master', 'master_window', 'CANWindowMaster'),
+        'slave': ('FINAL_PFE_scripts/CAN/dbc/Window/slave', 'slave_window', 'CANWindowSlave'),
+        'files': ['FINAL_PFE_scripts/CAN/dbc/Window/master/window_system.dbc'],
+        'make_line': window_line
+    }
+}
+
+# Snapshot run: every ECU that answers a vehicle snapshot, and the masters reading them
+SNAPSHOT_SLAVES = [
+    ('finalPFE_2', 'slave_light', 'CANLightSlave'),
+    ('finalPFE_2', 'slave_window', 'CANWindowSlave'),
+    ('vehicle systems/HMI/wiper/CAN/finalVersion/send2event_id', 'slave', 'CANWiperSlave')
+]
+SNAPSHOT_MASTERS = [
+    ('finalPFE_2', 'master_light', 'CANLightMaster'),
+    ('finalPFE_2', 'master_window', 'CANWindowMaster')
+]
+WIPER_RESPONSE_ID = 0x101
+
+def prepare_workdir(pair, workdir):
+    for path in pair['files']:
+        shutil.copy(os.path.join(REPO_ROOT, path), workdir)
+
+def load_module(directory, module_name):
+    path = os.path.join(REPO_ROOT, directory, f'{module_name}.py')
+    # The scripts import sibling helpers (e.g. stage_trace) as top-level modules
+    if os.path.dirname(path) not in sys.path:
+        sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(f'harness_{module_name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def start_slave(pair):
+    directory, module_name, class_name = pair['slave']
+    module = load_module(directory, module_name)
+    slave = getattr(module, class_name)()
+    thread = threading.Thread(target=slave.receive_messages, daemon=True)
+    thread.start()
+    return slave, thread
+
+class LatencyProbe:
+    """Matches master sends and slave responses per frame name (FIFO)."""
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.written = defaultdict(deque)
+        self.sent = defaultdict(deque)
+        self.file_latencies = []
+        self.bus_latencies = []
+        self.responses = 0
+
+    def on_write(self, name):
+        with self.lock:
+            self.written[name].append(time.perf_counter())
+
+    def on_send(self, name):
+        with self.lock:
+            self.sent[name].append(time.perf_counter())
+
+    def on_response(self, status):
+        now = time.perf_counter()
+        with self.lock:
+            for name in status:
+                if self.written[name]:
+                    self.file_latencies.append(now - self.written[name].popleft())
+                if self.sent[name]:
+                    self.bus_latencies.append(now - self.sent[name].popleft())
+                self.responses += 1
+            self.lock.notify_all()
+
+    def wait_for(self, count, timeout):
+        with self.lock:
+            return self.lock.wait_for(lambda: self.responses >= count, timeout)
+
+def attach_probe(master, probe):
+    send = master.send_can_message
+    write_response = master.write_response_to_file
+
+    def send_can_message(name, *args):
+        probe.on_send(name)
+        return send(name, *args)
+
+    def write_response_to_file(status):
+        write_response(status)
+        probe.on_response(status)
+
+    master.send_can_message = send_can_message
+    master.write_response_to_file = write_response_to_file
+
+def frame_time(msg, bitrate=500000, data_bitrate=2000000):
+    """Seconds a standard-ID data frame occupies the bus, worst-case bit
+    stuffing and interframe space included."""
+    length = len(msg.data)
+    if not msg.is_fd:
+        return (47 + 8 * length + (34 + 8 * length - 1) // 4) / bitrate
+    # FD: arbitration and the ACK/EOF tail at the nominal rate, the rest at
+    # the data rate when the bit-rate switch is set
+    crc = 17 if length <= 16 else 21
+    data_bits = 5 + 8 * length + (5 + 8 * length - 1) // 4 + 4 + crc + -(-(4 + crc) // 4)
+    return 34 / bitrate + data_bits / (data_bitrate if msg.bitrate_switch else bitrate)
+
+class BusMonitor:
+    """Counts every frame on the bus, and its bus time, from its own socket."""
+
+    def __init__(self, interface, channel, watch=()):
+        self.bus = can.Bus(interface=interface, channel=channel, fd=True)
+        self.watch = {can_id: [] for can_id in watch}  # CAN ID -> timestamps of its frames
+        self.frames = 0
+        self.busy = 0.0
+        self.last_seen = {}  # CAN ID -> perf_counter of its latest frame
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            msg = self.bus.recv(timeout=0.1)
+            if msg:
+                self.frames += 1
+                self.busy += frame_time(msg)
+                self.last_seen[msg.arbitration_id] = time.perf_counter()
+                if msg.arbitration_id in self.watch:
+                    self.watch[msg.arbitration_id].append(msg.timestamp)
+
+    def counts(self):
+        return self.frames, self.busy
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.bus.shutdown()
+
+def append_lines(path, lines):
+    with open(path, 'a') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+def run_benchmark(pair_name, commands, latency_samples, interface, channel, two_process, verbose,
+                  mode_changes=0):
+    pair = PAIRS[pair_name]
+    workdir = tempfile.mkdtemp(prefix=f'can_harness_{pair_name}_')
+    os.chdir(workdir)
+    analysis_file = os.path.join(workdir, 'analysis.txt')
+    open(analysis_file, 'w').close()
+    prepare_workdir(pair, workdir)
+
+    install_fakes(interface, channel)
+    if not verbose:
+        # The slaves log every frame at INFO through a FileHandler + console
+        logging.disable(logging.INFO)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    slave_process = None
+    slave = None
+    monitor = BusMonitor(interface, channel)
+
+    with output:
+        if two_process:
+            slave_process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), pair_name, '--role', 'slave',
+                 '--interface', interface, '--channel', channel],
+                stdout=None if verbose else subprocess.DEVNULL,
+                stderr=None if verbose else subprocess.DEVNULL
+            )
+            time.sleep(1.0)
+        else:
+            slave, _ = start_slave(pair)
+
+        directory, module_name, class_name = pair['master']
+        master_module = load_module(directory, module_name)
+        master = getattr(master_module, class_name)(analysis_file)
+        probe = LatencyProbe()
+        attach_probe(master, probe)
+        threading.Thread(target=master.monitor_file, daemon=True).start()
+        time.sleep(0.2)
+
+        # Throughput: one burst of analysis lines
+        burst = [pair['make_line'](i) for i in range(commands)]
+        for name, _ in burst:
+            probe.on_write(name)
+        start = time.perf_counter()
+        append_lines(analysis_file, [line for _, line in burst])
+        completed = probe.wait_for(commands, timeout=max(10.0, commands * 0.05))
+        elapsed = time.perf_counter() - start
+        throughput_responses = probe.responses
+        burst_bus_latencies = list(probe.bus_latencies)
+
+        # Latency: one command at a time
+        probe.file_latencies.clear()
+        probe.bus_latencies.clear()
+        for i in range(latency_samples):
+            name, line = pair['make_line'](commands + i)
+            probe.on_write(name)
+            append_lines(analysis_file, [line])
+            probe.wait_for(throughput_responses + i + 1, timeout=5.0)
+        file_latencies = list(probe.file_latencies)
+        bus_latencies = list(probe.bus_latencies)
+
+        # Bus cost of a mode change touching every light. The master skips a
+        # light whose status and mode did not change, so an unmeasured first
+        # change brings all seven to a known state
+        changes = []
+        if mode_changes:
+            lines = mode_change_lines(0)
+            for name, _ in lines:
+                probe.on_write(name)
+            append_lines(analysis_file, [line for _, line in lines])
+            probe.wait_for(probe.responses + len(lines), timeout=1.0)
+            with probe.lock:
+                probe.written.clear()
+                probe.sent.clear()
+        for i in range(mode_changes):
+            lines = mode_change_lines(i + 1)
+            expected = probe.responses + len(lines)
+            frames, busy = monitor.counts()
+            start = time.perf_counter()
+            for name, _ in lines:
+                probe.on_write(name)
+            append_lines(analysis_file, [line for _, line in lines])
+            answered = probe.wait_for(expected, timeout=5.0)
+            elapsed_change = time.perf_counter() - start
+            time.sleep(0.05)  # let the monitor catch the last response
+            changes.append((monitor.frames - frames, monitor.busy - busy, elapsed_change, answered))
+
+        master.shutdown()
+        if slave:
+            slave.running = False
+        if slave_process:
+            slave_process.terminate()
+            slave_process.wait(timeout=5)
+
+    print(f"Pair: {pair_name} ({interface}:{channel}, {'two processes' if two_process else 'one process'})")
+    print(f"Burst: {throughput_responses}/{commands} responses in {elapsed:.3f} s "
+          f"-> {throughput_responses / elapsed:.1f} commands/s{'' if completed else ' (timed out)'}")
+    print(format_latencies("Burst send->response", burst_bus_latencies))
+    print(format_latencies("File write->response", file_latencies))
+    print(format_latencies("CAN send->response", bus_latencies))
+    monitor.stop()
+    if changes:
+        frames = sum(c[0] for c in changes) / len(changes)
+        busy = sum(c[1] for c in changes) / len(changes)
+        print(f"Mode change: {sum(c[3] for c in changes)}/{len(changes)} answered, "
+              f"{frames:.1f} frames and {busy * 1000:.3f} ms of bus time each at 500 kbit/s")
+        print(format_latencies("Mode change->answered", [c[2] for c in changes]))
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def run_snapshot_benchmark(requests, interface, channel, fd, verbose):
+    """Time vehicle snapshots: one request, answered by the light, window and wiper slaves"""
+    workdir = tempfile.mkdtemp(prefix='can_harness_snapshot_')
+    os.chdir(workdir)
+    install_fakes(interface, channel)
+    if not verbose:
+        logging.disable(logging.INFO)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    monitor = BusMonitor(interface, channel)
+    rounds = []
+
+    with output:
+        slaves = []
+        for directory, module_name, class_name in SNAPSHOT_SLAVES:
+            slave = getattr(load_module(directory, module_name), class_name)()
+            if hasattr(slave, 'receive_messages'):
+                threading.Thread(target=slave.receive_messages, daemon=True).start()
+            slaves.append(slave)  # the wiper slave starts its own CAN thread
+
+        seen = set()
+        seen_lock = threading.Condition()
+        masters = []
+        for directory, module_name, class_name in SNAPSHOT_MASTERS:
+            analysis_file = os.path.join(workdir, f'{module_name}.txt')
+            open(analysis_file, 'w').close()
+            master = getattr(load_module(directory, module_name), class_name)(analysis_file)
+
+            def write_response_to_file(status, write=master.write_response_to_file):
+                write(status)
+                with seen_lock:
+                    seen.update(status)
+                    seen_lock.notify_all()
+
+            master.write_response_to_file = write_response_to_file
+            masters.append(master)
+        units = set(load_module('finalPFE_2', 'master_light').LIGHT_IDS) | \
+            set(load_module('finalPFE_2', 'master_window').WINDOW_IDS)
+        snapshot = load_module('finalPFE_2', 'snapshot')
+        fd_active = masters[0].fd
+        requester = can.Bus(interface=interface, channel=channel)
+        time.sleep(0.5)
+
+        for _ in range(requests):
+            with seen_lock:
+                seen.clear()
+            frames, busy = monitor.counts()
+            start = time.perf_counter()
+            requester.send(can.Message(arbitration_id=snapshot.SNAPSHOT_REQUEST_ID,
+                                       data=snapshot.encode_request(snapshot.SNAPSHOT_ALL, fd_active),
+                                       is_extended_id=False))
+            with seen_lock:
+                complete = seen_lock.wait_for(lambda: units <= seen, timeout=2.0)
+            while monitor.last_seen.get(WIPER_RESPONSE_ID, 0) < start and time.perf_counter() - start < 2.0:
+                time.sleep(0.001)
+            done = max(time.perf_counter() if complete else start, monitor.last_seen.get(WIPER_RESPONSE_ID, start))
+            time.sleep(0.05)  # let the monitor catch every answer
+            rounds.append((monitor.frames - frames, monitor.busy - busy, done - start,
+                           complete and monitor.last_seen.get(WIPER_RESPONSE_ID, 0) >= start))
+
+        requester.shutdown()
+        for master in masters:
+            master.shutdown()
+        for slave in slaves:
+            slave.running = False
+
+    monitor.stop()
+    complete = [r for r in rounds if r[3]]
+    print(f"Snapshot: {interface}:{channel}, {'CAN FD' if fd_active else 'classic CAN'}")
+    print(f"Complete: {len(complete)}/{len(rounds)} snapshots (7 lights, 4 windows, wiper)")
+    if complete:
+        print(f"Per snapshot: {sum(r[0] for r in complete) / len(complete):.1f} frames, request included, "
+              f"{sum(r[1] for r in complete) / len(complete) * 1000:.3f} ms of bus time")
+        print(format_latencies("Request->all answered", [r[2] for r in complete]))
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def run_service_benchmark(dumps, interface, channel, fd, verbose):
+    """Time state dumps and an LED table round trip over the slaves' ISO-TP channels"""
+    workdir = tempfile.mkdtemp(prefix='can_harness_service_')
+    os.chdir(workdir)
+    install_fakes(interface, channel)
+    if not verbose:
+        logging.disable(logging.INFO)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    monitor = BusMonitor(interface, channel)
+    results = {}
+
+    with output:
+        slaves = []
+        for directory, module_name, class_name in SNAPSHOT_SLAVES[:2]:
+            slave = getattr(load_module(directory, module_name), class_name)()
+            threading.Thread(target=slave.receive_messages, daemon=True).start()
+            slaves.append(slave)
+        service = load_module('finalPFE_2', 'slave_service')
+        isotp = load_module('finalPFE_2', 'isotp_channel')
+        fd_active = slaves[0].fd
+        client_bus = can.Bus(interface=interface, channel=channel, fd=fd_active)
+        time.sleep(0.5)
+
+        for name in ('light', 'window'):
+            request_id, response_id = service.SERVICE_IDS[name]
+            client = isotp.IsoTpChannel(client_bus, request_id, response_id, fd=fd_active, kernel=False)
+            client.start_reader()
+            rounds = []
+            for _ in range(dumps):
+                frames, busy = monitor.counts()
+                start = time.perf_counter()
+                client.send(bytes([service.READ_DATA_SID]) + service.STATE_DUMP_DID.to_bytes(2, 'big'))
+                response = client.recv(timeout=2.0)
+                elapsed = time.perf_counter() - start
+                time.sleep(0.05)  # let the monitor catch every frame
+                rounds.append((monitor.frames - frames, monitor.busy - busy, elapsed,
+                               len(response) if response and response[0] == 0x62 else None))
+            table = service.read_data(client, service.LED_TABLE_DID)
+            service.write_data(client, service.LED_TABLE_DID, table)
+            table_ok = service.read_data(client, service.LED_TABLE_DID) == table
+            client.close()
+            results[name] = (rounds, table_ok)
+
+        client_bus.shutdown()
+        for slave in slaves:
+            slave.running = False
+
+    monitor.stop()
+    print(f"ISO-TP service: {interface}:{channel}, {'CAN FD' if fd_active else 'classic CAN'}")
+    for name, (rounds, table_ok) in results.items():
+        complete = [r for r in rounds if r[3]]
+        print(f"{name}: {len(complete)}/{len(rounds)} dumps, LED table read/write/read "
+              f"{'matches' if table_ok else 'DIFFERS'}")
+        if complete:
+            size = sum(r[3] for r in complete) / len(complete)
+            frames = sum(r[0] for r in complete) / len(complete)
+            busy = sum(r[1] for r in complete) / len(complete)
+            print(f"  {size:.0f} bytes per dump: {frames:.1f} frames, request and flow control included, "
+                  f"{busy * 1000:.3f} ms of bus time ({size / busy / 1000:.1f} kB/s while on the bus)")
+            print(format_latencies("  Request->dump received", [r[2] for r in complete]))
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def run_refresh_benchmark(restarts, period, interface, channel, verbose):
+    """Restart the light and window slaves and time their recovery from the refresh frames alone"""
+    workdir = tempfile.mkdtemp(prefix='can_harness_refresh_')
+    os.chdir(workdir)
+    install_fakes(interface, channel)
+    if not verbose:
+        logging.disable(logging.INFO)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    cyclic = load_module('finalPFE_2', 'cyclic')
+    monitor = BusMonitor(interface, channel, watch=(cyclic.LIGHTS_REFRESH_ID, cyclic.WINDOW_REFRESH_ID))
+    recoveries = defaultdict(list)
+
+    with output:
+        slave_classes = [getattr(load_module(directory, module_name), class_name)
+                         for directory, module_name, class_name in SNAPSHOT_SLAVES[:2]]
+        slaves = []
+        for cls in slave_classes:
+            slave = cls()
+            slaves.append((slave, threading.Thread(target=slave.receive_messages, daemon=True)))
+            slaves[-1][1].start()
+        masters = []
+        for directory, module_name, class_name in SNAPSHOT_MASTERS:
+            analysis_file = os.path.join(workdir, f'{module_name}.txt')
+            open(analysis_file, 'w').close()
+            masters.append(getattr(load_module(directory, module_name), class_name)(analysis_file))
+        time.sleep(0.2)
+        masters[0].on_new_lines([f"Light: {light} | Result: activated | Mode: Fahren" for light in LIGHTS])
+        masters[1].on_new_lines([window_line(i)[1] for i in range(len(WINDOWS))])
+        time.sleep(0.5)
+        # What a slave holds once it has every command: the light LED buffer, the window commands
+        expected = [list(slaves[0][0].leds_status), dict(slaves[1][0].commanded)]
+        state = [lambda slave: slave.leds_status, lambda slave: slave.commanded]
+
+        for _ in range(restarts):
+            for i, cls in enumerate(slave_classes):
+                old, thread = slaves[i]
+                old.running = False
+                thread.join(timeout=2.0)  # its receive loop shuts it down
+                start = time.perf_counter()
+                slave = cls()
+                thread = threading.Thread(target=slave.receive_messages, daemon=True)
+                thread.start()
+                slaves[i] = (slave, thread)
+                while state[i](slave) != expected[i] and time.perf_counter() - start < 3 * period + 1.0:
+                    time.sleep(0.001)
+                if state[i](slave) == expected[i]:
+                    recoveries[cls.__name__].append(time.perf_counter() - start)
+
+        # Frames per refresh task; the BCM spreads them evenly over the period
+        task_frames = {master.refresh.arbitration_id: master.refresh.count for master in masters}
+        for master in masters:
+            master.shutdown()
+        for slave, _ in slaves:
+            slave.running = False
+
+    monitor.stop()
+    print(f"Refresh: {interface}:{channel}, period {period} s "
+          f"({'kernel BCM' if interface == 'socketcan' else 'python-can timer thread'})")
+    for cls in slave_classes:
+        print(f"{cls.__name__}: {len(recoveries[cls.__name__])}/{restarts} restarts recovered without a new command")
+        print(format_latencies("  Slave start->state restored", recoveries[cls.__name__]))
+    for can_id, stamps in monitor.watch.items():
+        intervals = [b - a for a, b in zip(stamps, stamps[1:])]
+        if intervals:
+            jitter = [abs(interval - period / task_frames[can_id]) for interval in intervals]
+            print(format_latencies(f"{hex(can_id)} interval error", jitter))
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+class LimitedTxQueue:
+    """A bus whose socket holds `txqueuelen` frames, drained at 500 kbit/s, and
+    raises ENOBUFS like SocketCAN when full; bus_off() stops the draining until
+    `ip link set ... type can restart`."""
+
+    def __init__(self, bus, txqueuelen, bus_off_at=None, injector=None):
+        self.bus = bus
+        self.txqueuelen = txqueuelen
+        self.bus_off_at = bus_off_at  # frames accepted before the bus-off
+        self.injector = injector      # puts the bus-off error frame on the bus
+        self.departures = deque()
+        self.sent = []
+        self.off = False
+        self.off_since = None
+        self.restart_times = []
+        self.enobufs = 0
+        self.transmitter = None
+        self.high_water = 0
+
+    def send(self, msg, timeout=None):
+        now = time.perf_counter()
+        while not self.off and self.departures and self.departures[0] <= now:
+            self.departures.popleft()
+        if self.transmitter is not None:
+            self.high_water = max(self.high_water, len(self.transmitter.pending))
+        if len(self.departures) >= self.txqueuelen:
+            self.enobufs += 1
+            raise can.CanOperationError("Failed to transmit: No buffer space available", errno.ENOBUFS)
+        self.departures.append(max(now, self.departures[-1] if self.departures else now) + frame_time(msg))
+        self.bus.send(msg)
+        self.sent.append(msg)
+        if len(self.sent) == self.bus_off_at:
+            self.off = True
+            self.off_since = time.perf_counter()
+            self.injector.send(can.Message(arbitration_id=0x40, is_error_frame=True, data=bytes(8),
+                                           is_extended_id=False))
+
+    def link_state(self, channel):
+        return 'BUS-OFF' if self.off else 'ERROR-ACTIVE'
+
+    def restart(self):
+        self.off = False
+        self.departures.clear()  # a restarted controller starts with an empty FIFO
+        self.restart_times.append(time.perf_counter() - self.off_since)
+
+    def __getattr__(self, name):
+        return getattr(self.bus, name)
+
+def run_txqueue_benchmark(lines, txqueuelen, interface, channel, verbose):
+    """Replay a large analysis file through a txqueue that fills up and a controller that goes bus-off"""
+    workdir = tempfile.mkdtemp(prefix='can_harness_txqueue_')
+    os.chdir(workdir)
+    install_fakes(interface, channel)
+    if not verbose:
+        logging.disable(logging.INFO)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    replay = [light_line(i) for i in range(lines)]
+    light_ids = load_module('finalPFE_2', 'master_light').LIGHT_IDS
+
+    # What the masters did before: bus.send() straight from the file reader
+    direct = LimitedTxQueue(can.Bus(interface=interface, channel=channel), txqueuelen)
+    direct_lost = 0
+    for name, _ in replay:
+        try:
+            direct.send(can.Message(arbitration_id=light_ids[name], data=[1, 1], is_extended_id=False))
+        except can.CanError:
+            direct_lost += 1
+    direct.bus.shutdown()
+
+    with output:
+        analysis_file = os.path.join(workdir, 'analysis.txt')
+        open(analysis_file, 'w').close()
+        master_module = load_module('finalPFE_2', 'master_light')
+        can_tx = sys.modules['can_tx']
+        injector = can.Bus(interface=interface, channel=channel)
+        master = master_module.CANLightMaster(analysis_file)
+        limited = LimitedTxQueue(master.transmitter.bus, txqueuelen, bus_off_at=lines // 2, injector=injector)
+        limited.transmitter = master.transmitter
+        master.transmitter.bus = limited
+        can_tx.link_state = limited.link_state
+        system = os.system
+
+        def restart_aware_system(command):
+            if 'type can restart' in command:
+                limited.restart()
+                return 0
+            return system(command)
+
+        os.system = restart_aware_system
+        threading.Thread(target=master.monitor_file, daemon=True).start()
+        time.sleep(0.2)
+
+        start = time.perf_counter()
+        append_lines(analysis_file, [line for _, line in replay])
+        while len(limited.sent) < lines and time.perf_counter() - start < max(10.0, lines * 0.002):
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        retries = {values[1]: child.get() for values, child in can_tx.TX_RETRIES.children.items()
+                   if values[0] == 'light_master'}
+        dropped = sum(child.get() for values, child in can_tx.TX_DROPPED.children.items()
+                      if values[0] == 'light_master')
+        master.shutdown()
+        injector.shutdown()
+        os.system = system
+
+    # Each light's frames must come out in the order its lines were written
+    expected = defaultdict(list)
+    for i, (name, _) in enumerate(replay):
+        expected[light_ids[name]].append(light_line(i)[1].split(' | ')[1:])
+    delivered = defaultdict(list)
+    for msg in limited.sent:
+        delivered[msg.arbitration_id].append(list(msg.data[:2]))
+    in_order = all(len(delivered[can_id]) == len(statuses) for can_id, statuses in expected.items()) and \
+        all(delivered[can_id] == [[1 if result == 'Result: activated' else 0,
+                                   master_module.MODE_CODES[mode.split(': ')[1].upper()]]
+                                  for result, mode in statuses]
+            for can_id, statuses in expected.items())
+
+    print(f"Transmit queue: {interface}:{channel}, txqueuelen {txqueuelen}, bus-off after {lines // 2} frames")
+    print(f"Direct bus.send: {direct_lost}/{lines} frames lost to ENOBUFS")
+    print(f"Transmit queue: {len(limited.sent)}/{lines} frames delivered in {elapsed:.3f} s "
+          f"({len(limited.sent) / elapsed:.0f} frames/s), per-light order {'kept' if in_order else 'BROKEN'}, "
+          f"{dropped:.0f} dropped")
+    print(f"  {limited.enobufs} ENOBUFS answers retried ({', '.join(f'{k}: {v:.0f}' for k, v in sorted(retries.items()))}), "
+          f"queue high water {limited.high_water} frames")
+    print(format_latencies("  Bus-off->restarted", limited.restart_times))
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def run_slave_process(pair_name, interface, channel):
+    """Entry point for --role slave: run only the slave until terminated."""
+    workdir = tempfile.mkdtemp(prefix=f'can_harness_{pair_name}_slave_')
+    os.chdir(workdir)
+    prepare_workdir(PAIRS[pair_name], workdir)
+    install_fakes(interface, channel)
+    slave, thread = start_slave(PAIRS[pair_name])
+    thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a CAN master/slave pair against a virtual bus")
+    parser.add_argument('pair', choices=sorted(PAIRS) + ['snapshot', 'service', 'refresh', 'txqueue'])
+    parser.add_argument('--commands', type=int, default=200, help="lines in the throughput burst")
+    parser.add_argument('--latency-samples', type=int, default=20, help="one-at-a-time commands")
+    parser.add_argument('--interface', default='virtual', help="python-can interface (virtual, socketcan)")
+    parser.add_argument('--channel', default='harness', help="bus channel (e.g. vcan0 for socketcan)")
+    parser.add_argument('--setup-vcan', action='store_true', help="create/bring up the vcan channel first")
+    parser.add_argument('--two-process', action='store_true', help="run the slave in a separate process")
+    parser.add_argument('--role', choices=['harness', 'slave'], default='harness', help=argparse.SUPPRESS)
+    parser.add_argument('--verbose', action='store_true', help="keep the scripts' own console output")
+    parser.add_argument('--light-frames', choices=['per-light', 'aggregated'],
+                        help="lighting frame layout for the light master (LIGHT_FRAMES)")
+    parser.add_argument('--mode-changes', type=int, default=0,
+                        help="mode changes touching all seven lights, with frames and bus time per change")
+    parser.add_argument('--fd', action='store_true', help="open the buses with CAN FD (CAN_FD=1)")
+    parser.add_argument('--snapshots', type=int, default=50, help="snapshot requests for the snapshot run")
+    parser.add_argument('--dumps', type=int, default=20, help="state dumps per slave for the service run")
+    parser.add_argument('--refresh-period', type=float, default=None,
+                        help="CAN_REFRESH_PERIOD in seconds (default: 0.2 for the refresh run, 0 otherwise)")
+    parser.add_argument('--restarts', type=int, default=5, help="slave restarts for the refresh run")
+    parser.add_argument('--replay-lines', type=int, default=5000, help="analysis lines replayed by the txqueue run")
+    parser.add_argument('--txqueuelen', type=int, default=10, help="frames the txqueue run's socket holds (can0: 10)")
+    args = parser.parse_args()
+
+    if args.two_process and args.interface == 'virtual':
+        parser.error("--two-process needs a bus shared between processes, e.g. --interface socketcan --channel vcan0")
+    if args.setup_vcan:
+        ensure_vcan(args.channel, args.fd)
+    if args.fd:
+        os.environ['CAN_FD'] = '1'
+    if args.light_frames:
+        os.environ['LIGHT_FRAMES'] = args.light_frames
+    if args.refresh_period is None:
+        args.refresh_period = 0.2 if args.pair == 'refresh' else 0
+    os.environ['CAN_REFRESH_PERIOD'] = str(args.refresh_period)
+    if args.mode_changes and args.pair != 'light':
+        parser.error("--mode-changes is only defined for the light pair")
+    if args.pair == 'snapshot':
+        if args.two_process:
+            parser.error("the snapshot run is single-process")
+        run_snapshot_benchmark(args.snapshots, args.interface, args.channel, args.fd, args.verbose)
+        return
+    if args.pair == 'service':
+        if args.two_process:
+            parser.error("the service run is single-process")
+        run_service_benchmark(args.dumps, args.interface, args.channel, args.fd, args.verbose)
+        return
+    if args.pair == 'refresh':
+        if args.two_process or not args.refresh_period:
+            parser.error("the refresh run is single-process and needs a refresh period")
+        run_refresh_benchmark(args.restarts, args.refresh_period, args.interface, args.channel, args.verbose)
+        return
+    if args.pair == 'txqueue':
+        if args.two_process:
+            parser.error("the txqueue run is single-process")
+        run_txqueue_benchmark(args.replay_lines, args.txqueuelen, args.interface, args.channel, args.verbose)
+        return
+
+    if args.role == 'slave':
+        run_slave_process(args.pair, args.interface, args.channel)
+    else:
+        run_benchmark(args.pair, args.commands, args.latency_samples, args.interface,
+                      args.channel, args.two_process, args.verbose, args.mode_changes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Burst test for the door slaves' LIN receive loop.
+
+Runs the real receive_and_process_frames() / control_leds() of
+vehicle systems/HMI/door/final/slave.py and slave_siftregister.py against a
+simulated UART: bytes arrive at LIN byte timing (10 bits at 19200 baud) into
+a receive buffer of fixed size, like the kernel tty buffer, and bytes that
+arrive while it is full are lost and counted. The stream is back-to-back
+FlashLight (0x23) frames alternating with door frames (0x01), longer than the
+buffer by default, and the slave has GRACE seconds after its last byte to
+handle what is left.
+
+    python bench/door_burst.py --frames 2000
+    python bench/door_burst.py --blocking-flash     the old sleep-in-the-loop flash, for comparison
+
+Fails (exit status 1) when the buffer overflowed or a frame was not handled.
+"""
+import os
+import sys
+import time
+import types
+import argparse
+import contextlib
+
+from fakes import install_hardware_fakes
+from can_harness import load_module
+
+DOOR_DIR = 'vehicle systems/HMI/door/final'
+SLAVES = ('slave', 'slave_siftregister')
+N_TTY_BUF_SIZE = 4096
+GRACE = 1.0  # seconds after the last byte before the receive loop is stopped
+
+class BufferedUART:
+    """Receives `stream` at line rate into a `size`-byte buffer; bytes arriving
+    at a full buffer are dropped. Reading once the stream is over and read,
+    or after the deadline (GRACE seconds after its last byte), raises
+    KeyboardInterrupt, which ends the slave's receive loop as Ctrl-C would."""
+
+    def __init__(self, stream, baudrate=19200, size=N_TTY_BUF_SIZE):
+        self.stream = stream
+        self.byte_time = 10 / baudrate
+        self.size = size
+        self.buffer = bytearray()
+        self.arrived = 0
+        self.overflows = 0
+        self.start = None  # the line starts with the slave's first read
+
+    def receive(self):
+        if self.start is None:
+            self.start = time.monotonic()
+        due = min(len(self.stream), int((time.monotonic() - self.start) / self.byte_time))
+        new = self.stream[self.arrived:due]
+        self.arrived = due
+        room = self.size - len(self.buffer)
+        self.buffer.extend(new[:room])
+        self.overflows += max(0, len(new) - room)
+
+    @property
+    def in_waiting(self):
+        self.receive()
+        return len(self.buffer)
+
+    def expired(self):
+        return self.start is not None and \
+            time.monotonic() - self.start > len(self.stream) * self.byte_time + GRACE
+
+    def read(self, size=1):
+        self.receive()
+        if self.expired():
+            raise KeyboardInterrupt
+        while not self.buffer:
+            if self.arrived >= len(self.stream):
+                raise KeyboardInterrupt
+            time.sleep(self.byte_time)
+            self.receive()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        pass
+
+def make_fake_serial(uarts):
+    """pyserial stand-in whose Serial() hands out the next prepared UART"""
+    serial = types.ModuleType('serial')
+    serial.PARITY_NONE, serial.STOPBITS_ONE, serial.EIGHTBITS = 'N', 1, 8
+    serial.Serial = lambda *args, **kwargs: uarts.pop(0)
+    return serial
+
+def burst_stream(frame_count, calculate_checksum):
+    def lin_frame(identifier, data_bytes):
+        return bytes([0x00, 0x55, identifier] + data_bytes + [calculate_checksum(identifier, data_bytes)])
+
+    return b''.join(
+        lin_frame(0x23, [i & 1]) if i % 2 == 0 else lin_frame(0x01, [i & 1, 0, 1])
+        for i in range(frame_count)
+    )
+
+def blocking_flash(module):
+    """The flash as it was before the effect scheduler: 3 x 400 ms in the receive loop"""
+    def flash(channel, pins):
+        for _ in range(3):
+            module.effects.set_outputs(pins, True)
+            time.sleep(0.2)
+            module.effects.set_outputs(pins, False)
+            time.sleep(0.2)
+    return flash
+
+def run_slave(module_name, frame_count, buffer_size, blocking):
+    lin_deframer = load_module(DOOR_DIR, 'lin_deframer')
+    uart = BufferedUART(burst_stream(frame_count, lin_deframer.calculate_checksum), size=buffer_size)
+    sys.modules['serial'] = make_fake_serial([uart])
+    module = load_module(DOOR_DIR, module_name)
+    if blocking:
+        module.effects.flash = blocking_flash(module)
+
+    handled = [0]
+    control_leds = module.control_leds
+
+    def counting_control_leds(frame):
+        # Frames of one large read still waiting at the deadline count as not handled
+        if uart.expired():
+            raise KeyboardInterrupt
+        handled[0] += 1
+        control_leds(frame)
+
+    module.control_leds = counting_control_leds
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        module.receive_and_process_frames()
+    uart.receive()  # what arrived while the loop was blocked counts too
+    return handled[0], uart.overflows, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Burst of FlashLight/door frames through the door slaves")
+    parser.add_argument('--frames', type=int, default=2000, help="frames in the burst, half of them FlashLight")
+    parser.add_argument('--buffer', type=int, default=N_TTY_BUF_SIZE, help="UART receive buffer in bytes")
+    parser.add_argument('--blocking-flash', action='store_true',
+                        help="flash with time.sleep() in the receive loop, as before the effect scheduler")
+    args = parser.parse_args()
+
+    install_hardware_fakes()
+    os.environ['METRICS_PORT'] = '0'
+    failed = False
+    for module_name in SLAVES:
+        handled, overflows, elapsed = run_slave(module_name, args.frames, args.buffer, args.blocking_flash)
+        ok = overflows == 0 and handled == args.frames
+        failed |= not ok
+        print(f"{module_name}: {handled}/{args.frames} frames handled, {overflows} bytes lost to "
+              f"receive buffer overflow ({args.buffer} bytes), {elapsed:.2f} s {'OK' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Stand-ins for the Raspberry Pi hardware and the MySQL server, shared by the
+bench harnesses so the scripts can run unmodified on a dev box.
+"""
+import os
+import re
+import sys
+import types
+import sqlite3
+import threading
+
+def make_fake_gpio():
+    """Return RPi / RPi.GPIO modules that accept every call and count outputs."""
+    gpio = types.ModuleType('RPi.GPIO')
+    for name in ('BCM', 'BOARD', 'OUT', 'IN', 'PUD_UP', 'PUD_DOWN', 'RISING', 'FALLING', 'BOTH'):
+        setattr(gpio, name, name)
+    gpio.HIGH = 1
+    gpio.LOW = 0
+    gpio.output_count = 0
+    gpio.pins = {}
+
+    def output(pin, value):
+        gpio.output_count += 1
+        gpio.pins[pin] = value
+
+    gpio.output = output
+    gpio.input = lambda pin: gpio.pins.get(pin, 0)
+    for name in ('setmode', 'setwarnings', 'setup', 'cleanup', 'add_event_detect', 'remove_event_detect'):
+        setattr(gpio, name, lambda *args, **kwargs: None)
+
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = gpio
+    return rpi, gpio
+
+class MemoryCursor:
+    """mysql.connector cursor API on top of sqlite3 (%s placeholders -> ?)."""
+
+    def __init__(self, connection):
+        self.cursor = connection.cursor()
+
+    @staticmethod
+    def _translate(query):
+        query = query.replace('%s', '?')
+        # MySQL-only column options that sqlite does not understand
+        query = re.sub(r'ON UPDATE CURRENT_TIMESTAMP', '', query, flags=re.IGNORECASE)
+        query = re.sub(r'AUTO_INCREMENT', 'AUTOINCREMENT', query, flags=re.IGNORECASE)
+        query = re.sub(r'INT AUTOINCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT', query, flags=re.IGNORECASE)
+        query = re.sub(r',\s*UNIQUE KEY \w+ \((\w+)\)', r', UNIQUE (\1)', query, flags=re.IGNORECASE)
+        return query
+
+    def execute(self, query, params=()):
+        self.cursor.execute(self._translate(query), params)
+
+    def executemany(self, query, params):
+        self.cursor.executemany(self._translate(query), params)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def close(self):
+        self.cursor.close()
+
+class MemoryConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self, *args, **kwargs):
+        return MemoryCursor(self.database)
+
+    def commit(self):
+        self.database.commit()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+def make_memory_mysql():
+    """Return mysql / mysql.connector modules backed by one shared in-memory DB."""
+    database = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+    lock = threading.Lock()
+
+    class LockedDatabase:
+        # The masters share one connection between their file and response threads
+        def cursor(self):
+            return LockedCursor(database.cursor())
+
+        def commit(self):
+            pass
+
+    class LockedCursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+
+        def execute(self, *args):
+            with lock:
+                return self._cursor.execute(*args)
+
+        def executemany(self, *args):
+            with lock:
+                return self._cursor.executemany(*args)
+
+        def __getattr__(self, name):
+            return getattr(self._cursor, name)
+
+    connector = types.ModuleType('mysql.connector')
+    connector.Error = sqlite3.Error
+    connector.connect = lambda **kwargs: MemoryConnection(LockedDatabase())
+    connector.database = database
+    mysql = types.ModuleType('mysql')
+    mysql.connector = connector
+    return mysql, connector
+
+def install_hardware_fakes(skip_commands=()):
+    """Patch RPi.GPIO, mysql.connector and os.system for this process.
+
+    Shell commands containing any of `skip_commands` (interface bring-up,
+    sudo raspi-config, ...) are reported as successful without running.
+    """
+    rpi, gpio = make_fake_gpio()
+    mysql, connector = make_memory_mysql()
+    sys.modules.update({'RPi': rpi, 'RPi.GPIO': gpio, 'mysql': mysql, 'mysql.connector': connector})
+
+    real_system = os.system
+
+    def system(command):
+        # The scripts configure their own interfaces; the harness owns them
+        if any(skip in command for skip in skip_commands):
+            return 0
+        return real_system(command)
+
+    os.system = system
+    return gpio, connector
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def format_latencies(label, values):
+    ms = [v * 1000 for v in values]
+    return (f"{label:<22} n={len(ms):<5} p50={percentile(ms, 0.50):7.2f} ms  "
+            f"p90={percentile(ms, 0.90):7.2f} ms  p99={percentile(ms, 0.99):7.2f} ms  "
+            f"max={max(ms) if ms else float('nan'):7.2f} ms")
@@ -0,0 +1,642 @@
+"""
+Pseudo-terminal LIN bus simulator for the serial-only LIN scripts.
+
+Every node gets its own pty. Bytes written by one node go onto a shared
+bus and reach the other nodes only after the time it takes to shift them
+out (10 bits per byte at the node's baud rate). A 0x00 written while the
+node's tty is set below its data rate (the scripts' send_break) is timed
+at that rate and counted as a break. Bytes from two nodes waiting for the
+same byte slot collide and are delivered as their wired-AND (dominant 0),
+and --noise flips a random bit in that fraction of bytes.
+
+The LIN scripts take their port from LIN_SERIAL_PORT (or their serial_port
+constructor argument):
+
+    python bench/lin_sim.py serve --nodes 2
+    LIN_SERIAL_PORT=/dev/pts/3 python FINAL_PFE_scripts/LIN/lighting/master/master.py
+    LIN_SERIAL_PORT=/dev/pts/4 python FINAL_PFE_scripts/LIN/lighting/slave/slave.py
+
+    python bench/lin_sim.py bench lighting --commands 20
+    python bench/lin_sim.py bench synthetic --commands 500 --noise 0.001
+    python bench/lin_sim.py bench synthetic --commands 500 --echo --jam 20
+    python bench/lin_sim.py idle FINAL_PFE_scripts/LIN/lighting/slave/slave.py
+
+Frames are tracked on the bus, not per node: a frame starts at a break
+and a response written by another node (a slave answering the master's
+header) belongs to the same frame. The benchmark reports frames per second
+on the bus, the response latency (header start -> end of the slave's
+response) and the headers nobody answered.
+
+With --echo every byte also comes back to its sender, as on a real
+transceiver, and the scripts check their echoes (lin_echo); without it they
+run with LIN_ECHO_CHECK=0. --jam adds a node that writes random bytes at
+that average rate, so frames collide with foreign traffic. The synthetic
+master then sends through EchoCheckedWriter and the benchmark reports the
+frames it delivered, retransmitted and dropped.
+
+Limits of a pty: flush() returns as soon as the bytes are handed over, so
+a script's own post-frame sleeps start earlier than on a real UART, and
+break_condition (the wiper scripts) is not visible, so those frames are
+only counted as bytes.
+"""
+import os
+import sys
+import tty
+import time
+import runpy
+import random
+import shutil
+import logging
+import termios
+import argparse
+import tempfile
+import selectors
+import threading
+import subprocess
+from collections import deque
+
+from fakes import install_hardware_fakes, format_latencies
+from can_harness import light_line, window_line
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BREAK_BYTE = 0x00
+SYNC_BYTE = 0x55
+BITS_PER_BYTE = 10  # start + 8 data + stop
+DEFAULT_BAUD_RATE = 19200
+
+TERMIOS_SPEEDS = {
+    getattr(termios, f'B{rate}'): rate
+    for rate in (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200)
+    if hasattr(termios, f'B{rate}')
+}
+
+# ---------------------------------------------------------------------------
+# Bus model
+# ---------------------------------------------------------------------------
+
+class BusNode:
+    """One pty endpoint on the simulated bus."""
+
+    def __init__(self, index):
+        self.index = index
+        self.master_fd, self.slave_fd = os.openpty()
+        # Keep our copy of the slave side open so the pty survives the
+        # script closing and reopening its port
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.port = os.ttyname(self.slave_fd)
+        self.pending = deque()  # (queued_at, byte, break_speed or None)
+        self.data_speed = 0
+        self.bytes_sent = 0
+
+    def tty_speed(self, fallback):
+        """Output speed the script last configured on its end of the pty."""
+        try:
+            return TERMIOS_SPEEDS.get(termios.tcgetattr(self.slave_fd)[5], fallback)
+        except termios.error:
+            return fallback
+
+    def close(self):
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+class LINBusSimulator(threading.Thread):
+    """Shared LIN bus between `nodes` pseudo-terminals.
+
+    baud_rate: data rate to time bytes at; None follows each node's tty.
+    noise: probability that a byte on the bus gets one bit flipped.
+    echo: also deliver each byte back to its sender, as a LIN transceiver does.
+    """
+
+    def __init__(self, nodes=2, baud_rate=None, noise=0.0, echo=False, seed=None, frame_history=100000):
+        super().__init__(daemon=True)
+        self.nodes = [BusNode(i) for i in range(nodes)]
+        self.baud_rate = baud_rate
+        self.noise = noise
+        self.echo = echo
+        self.random = random.Random(seed)
+        self.running = True
+        self.lock = threading.Lock()
+        # (start, end, header node, frame_id, data length, errors, responding node or None)
+        self.frames = deque(maxlen=frame_history)
+        self.frame = None
+        self.stats = {
+            'bytes': 0, 'breaks': 0, 'collisions': 0,
+            'noise_errors': 0, 'overruns': 0, 'busy_time': 0.0,
+            'updates': 0  # frames whose content differs from the last one with that ID
+        }
+        self.last_data = {}
+        self.bus_free_at = 0.0
+        self.in_flight = None
+
+        self.selector = selectors.DefaultSelector()
+        for node in self.nodes:
+            self.selector.register(node.master_fd, selectors.EVENT_READ, node)
+
+    @property
+    def ports(self):
+        return [node.port for node in self.nodes]
+
+    def run(self):
+        while self.running:
+            now = time.perf_counter()
+            if self.in_flight:
+                timeout = max(0.0, self.bus_free_at - now)
+            else:
+                timeout = 0.0 if self._has_pending() else 0.1
+            events = self.selector.select(timeout)
+            for key, _ in events:
+                self._read_node(key.data)
+            if not events and not self.in_flight:
+                # Idle: pick up the data rate each script configured on open
+                for node in self.nodes:
+                    node.data_speed = node.tty_speed(node.data_speed)
+
+            now = time.perf_counter()
+            if self.in_flight and now >= self.bus_free_at:
+                self._deliver(*self.in_flight)
+                self.in_flight = None
+            if not self.in_flight and self._has_pending():
+                self._start_slot(now)
+
+    def _has_pending(self):
+        return any(node.pending for node in self.nodes)
+
+    def _read_node(self, node):
+        try:
+            data = os.read(node.master_fd, 4096)
+        except (BlockingIOError, OSError):
+            return
+        queued_at = time.perf_counter()
+        speed = node.tty_speed(0)
+        # The scripts write the break byte on its own, flush, and sleep before
+        # restoring the data rate, so only a trailing 0x00 read while the tty
+        # is below the data rate is a break. The speed is sampled after the
+        # read, so earlier bytes of the chunk may have gone out at the data rate.
+        break_at = len(data) - 1 if data[-1:] == bytes([BREAK_BYTE]) and 0 < speed < node.data_speed else -1
+        if break_at < 0:
+            node.data_speed = max(node.data_speed, speed)
+        for i, byte in enumerate(data):
+            node.pending.append((queued_at, byte, speed if i == break_at else None))
+
+    def _byte_time(self, node, break_speed):
+        """Seconds one byte from `node` occupies the bus."""
+        data_speed = node.data_speed or self.baud_rate or DEFAULT_BAUD_RATE
+        bit_time = 1.0 / (self.baud_rate or data_speed)
+        if break_speed is None:
+            return BITS_PER_BYTE * bit_time
+        # --baud-rate changes the data rate but keeps the break/data length
+        # ratio the script chose
+        return BITS_PER_BYTE * bit_time * data_speed / break_speed
+
+    def _start_slot(self, now):
+        # Back-to-back bytes start where the previous one ended, not when
+        # the loop happened to wake up
+        slot_start = max(self.bus_free_at, min(node.pending[0][0] for node in self.nodes if node.pending))
+        slot_start = min(slot_start, now)
+        # Anyone who started shifting within the first bit of the slot is on
+        # the wire at the same time
+        bit_time = 1.0 / (self.baud_rate or DEFAULT_BAUD_RATE)
+        senders = [node for node in self.nodes if node.pending and node.pending[0][0] <= slot_start + bit_time]
+
+        value = 0xFF
+        duration = 0.0
+        is_break = False
+        for node in senders:
+            _, byte, break_speed = node.pending.popleft()
+            value &= byte  # dominant 0 wins on the wire
+            duration = max(duration, self._byte_time(node, break_speed))
+            is_break = is_break or break_speed is not None
+            node.bytes_sent += 1
+
+        collided = len(senders) > 1
+        if collided:
+            self.stats['collisions'] += 1
+        if self.noise and self.random.random() < self.noise:
+            value ^= 1 << self.random.randrange(8)
+            self.stats['noise_errors'] += 1
+
+        self.bus_free_at = slot_start + duration
+        self.stats['busy_time'] += duration
+        self.in_flight = (value, senders, slot_start, self.bus_free_at, is_break, collided)
+
+    def _deliver(self, value, senders, start, end, is_break, collided):
+        payload = bytes([value])
+        for node in self.nodes:
+            if node in senders and not self.echo:
+                continue
+            try:
+                os.write(node.master_fd, payload)
+            except (BlockingIOError, OSError):
+                # Nobody is reading this port and its input queue is full
+                self.stats['overruns'] += 1
+
+        with self.lock:
+            self.stats['bytes'] += 1
+            if is_break:
+                self.stats['breaks'] += 1
+            self._track_frame(senders, value, start, end, is_break, collided)
+
+    def _track_frame(self, senders, value, start, end, is_break, collided):
+        if is_break:
+            self._close_frame()
+            self.frame = {'start': start, 'end': end, 'node': senders[0].index, 'id': None,
+                          'length': 0, 'errors': 0, 'responder': None, 'data': bytearray()}
+            return
+        frame = self.frame
+        if frame is None:
+            return
+        frame['end'] = end
+        frame['length'] += 1
+        frame['errors'] += collided
+        others = [node.index for node in senders if node.index != frame['node']]
+        if others and frame['responder'] is None and frame['length'] > 2:
+            frame['responder'] = others[0]
+        if frame['length'] == 1 and value != SYNC_BYTE:
+            self.frame = None  # a 0x00 data byte, not a break
+        elif frame['length'] == 2:  # sync, then PID
+            frame['id'] = value & 0x3F
+        elif frame['length'] > 2:
+            frame['data'].append(value)
+
+    def _close_frame(self):
+        frame = self.frame
+        if frame is not None and frame['id'] is not None:
+            # length counts sync, PID and checksum as well as the data; a
+            # header nobody answered comes out at -1
+            self.frames.append((frame['start'], frame['end'], frame['node'], frame['id'],
+                                frame['length'] - 3, frame['errors'], frame['responder']))
+            # A schedule polling unchanged status frames keeps the bus busy
+            # without anything happening
+            if self.last_data.get(frame['id']) != frame['data']:
+                self.last_data[frame['id']] = bytes(frame['data'])
+                self.stats['updates'] += 1
+        self.frame = None
+
+    def snapshot_frames(self):
+        """Close open frames and return every frame seen so far, oldest first."""
+        with self.lock:
+            self._close_frame()
+            return sorted(self.frames, key=lambda frame: frame[0])
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join(timeout=1.0)
+        self.selector.close()
+        for node in self.nodes:
+            node.close()
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+# Node 0 is always the master. input: file the master watches (created empty
+# before it starts); make_line: same analysis lines as the CAN harness
+PAIRS = {
+    'lighting': {
+        'master': 'FINAL_PFE_scripts/LIN/lighting/master/master.py',
+        'slave': 'FINAL_PFE_scripts/LIN/lighting/slave/slave.py',
+        'input': 'analysis_results.txt',
+        'make_line': light_line
+    },
+    'window': {
+        'master': 'FINAL_PFE_scripts/LIN/window/master/master_window.py',
+        'slave': 'FINAL_PFE_scripts/LIN/window/slave/slave.py',
+        'input': 'windows_analysis.txt',
+        'make_line': window_line
+    },
+    'synthetic': None  # in-process master/slave with no script-side sleeps
+}
+
+def calculate_pid(frame_id):
+    p0 = (frame_id ^ (frame_id >> 1) ^ (frame_id >> 2) ^ (frame_id >> 4)) & 0x01
+    p1 = ~((frame_id >> 1) ^ (frame_id >> 3) ^ (frame_id >> 4) ^ (frame_id >> 5)) & 0x01
+    return (frame_id & 0x3F) | (p0 << 6) | (p1 << 7)
+
+def calculate_checksum(pid, data):
+    checksum = pid
+    for byte in data:
+        checksum += byte
+        if checksum > 0xFF:
+            checksum -= 0xFF
+    return (0xFF - checksum) & 0xFF
+
+def write_break(ser, baud_rate):
+    """0x00 at a quarter of the baud rate."""
+    ser.baudrate = baud_rate // 4
+    ser.write(bytes([BREAK_BYTE]))
+    ser.flush()
+    time.sleep(13 / (baud_rate // 4))
+    ser.baudrate = baud_rate
+
+def write_header(ser, baud_rate, frame_id):
+    """Break, sync, PID; returns the PID."""
+    write_break(ser, baud_rate)
+    pid = calculate_pid(frame_id)
+    ser.write(bytes([SYNC_BYTE, pid]))
+    return pid
+
+def write_frame(ser, baud_rate, frame_id, data=b''):
+    """Header followed by the master's own data and checksum."""
+    pid = write_header(ser, baud_rate, frame_id)
+    ser.write(bytes(data) + bytes([calculate_checksum(pid, data)]))
+    ser.flush()
+
+def read_frame(ser, lengths, published=None):
+    """Block until a header whose ID is in `lengths` arrives; None on timeout.
+
+    Headers for IDs in `published` are answered with that data and checksum
+    (the slave side of a master-polled frame) and are not returned.
+    """
+    published = published or {}
+    while True:
+        byte = ser.read(1)
+        if not byte:
+            return None
+        if byte[0] != BREAK_BYTE or ser.read(1) != bytes([SYNC_BYTE]):
+            continue
+        pid = ser.read(1)
+        if not pid or calculate_pid(pid[0] & 0x3F) != pid[0]:
+            continue
+        frame_id = pid[0] & 0x3F
+        if frame_id in published:
+            data = published[frame_id]
+            ser.write(data + bytes([calculate_checksum(pid[0], data)]))
+            ser.flush()
+            continue
+        if frame_id not in lengths:
+            continue
+        rest = ser.read(lengths[frame_id] + 1)
+        if len(rest) == lengths[frame_id] + 1 and rest[-1] == calculate_checksum(pid[0], rest[:-1]):
+            return frame_id, rest[:-1]
+
+def poll_frame(ser, baud_rate, frame_id, length, echo=False):
+    """Send the header for a slave-published frame; its data, or None."""
+    pid = write_header(ser, baud_rate, frame_id)
+    ser.flush()
+    if echo:
+        ser.read(3)  # our own break, sync and PID
+    response = ser.read(length + 1)
+    if len(response) == length + 1 and response[-1] == calculate_checksum(pid, response[:-1]):
+        return response[:-1]
+    return None
+
+def run_synthetic(sim, commands, baud_rate, echo=False):
+    """Lighting-style exchange without the scripts' polling and sleeps:
+    command frame 0x10, then the master polls the 14-byte status frame 0x18.
+
+    Returns the number of polls that timed out, the number of distinct
+    commands the slave received and, with echo, the EchoCheckedWriter the
+    command frames went through."""
+    import serial
+
+    master = serial.Serial(sim.ports[0], baudrate=baud_rate, timeout=0.05)
+    slave = serial.Serial(sim.ports[1], baudrate=baud_rate, timeout=0.05)
+    slave_running = True
+    time.sleep(0.2)  # let the simulator see both ports' data rate
+    writer = None
+    if echo:
+        sys.path.insert(0, os.path.join(REPO_ROOT, 'FINAL_PFE_scripts', 'LIN', 'lighting', 'master'))
+        from lin_echo import EchoCheckedWriter
+        writer = EchoCheckedWriter(master, baud_rate, send_break=lambda: write_break(master, baud_rate),
+                                   enabled=True)
+
+    received = set()
+
+    def serve():
+        while slave_running:
+            frame = read_frame(slave, {0x10: 2}, published={0x18: bytes(14)})
+            if frame:
+                received.add(frame[1])
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    timeouts = 0
+    for i in range(commands):
+        data = bytes([i & 0xFF, i >> 8 & 0xFF])  # unique per command, so the slave can count them
+        if writer:
+            pid = calculate_pid(0x10)
+            writer.send(0x10, bytes([SYNC_BYTE, pid]), data + bytes([calculate_checksum(pid, data)]))
+        else:
+            write_frame(master, baud_rate, 0x10, data)
+        if poll_frame(master, baud_rate, 0x18, 14, echo) is None:
+            timeouts += 1
+    slave_running = False
+    server.join(timeout=1.0)  # foreign traffic can keep read_frame going past one timeout
+    master.close()
+    slave.close()
+    return timeouts, len(received), writer
+
+def jam(port, baud_rate, rate, seed, stop):
+    """Write random bytes onto the bus at `rate` bytes/s on average."""
+    import serial
+
+    jammer = serial.Serial(port, baudrate=baud_rate, timeout=0)
+    rng = random.Random(seed)
+    sent = 0
+    while not stop.wait(rng.expovariate(rate)):
+        jammer.write(bytes([rng.randrange(256)]))
+        sent += 1
+    jammer.close()
+    return sent
+
+def run_node(script, port, verbose):
+    """Entry point for `node`: run one LIN script against a simulator port."""
+    install_hardware_fakes(skip_commands=('sudo', 'raspi-config', 'dtoverlay', 'systemctl'))
+    os.environ['LIN_SERIAL_PORT'] = port
+    if not verbose:
+        logging.disable(logging.INFO)
+    sys.path.insert(0, os.path.dirname(script))
+    sys.argv = [script]
+    runpy.run_path(script, run_name='__main__')
+
+def spawn_node(script, port, workdir, verbose, echo=False):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'node', os.path.join(REPO_ROOT, script),
+         '--port', port] + (['--verbose'] if verbose else []),
+        cwd=workdir,
+        env=dict(os.environ, LIN_ECHO_CHECK='1' if echo else '0'),
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL
+    )
+
+def wait_until_quiet(sim, quiet_time, timeout):
+    """Wait until no new or changed frame has been seen for `quiet_time` seconds."""
+    deadline = time.perf_counter() + timeout
+    seen = -1
+    while time.perf_counter() < deadline:
+        time.sleep(quiet_time)
+        count = sim.stats['updates']
+        if count == seen:
+            return True
+        seen = count
+    return False
+
+def response_latencies(frames):
+    """Header start -> end of response for every answered slave frame, and
+    the number of headers that got no response at all."""
+    latencies = [end - start for start, end, _, _, _, _, responder in frames if responder is not None]
+    unanswered = sum(1 for frame in frames if frame[6] is None and frame[4] < 0)
+    return latencies, unanswered
+
+def run_benchmark(pair_name, commands, baud_rate, noise, seed, verbose, echo=False, jam_rate=0.0):
+    sim = LINBusSimulator(nodes=3 if jam_rate else 2, baud_rate=baud_rate, noise=noise, echo=echo, seed=seed)
+    sim.start()
+    pair = PAIRS[pair_name]
+    workdir = tempfile.mkdtemp(prefix=f'lin_sim_{pair_name}_')
+    processes = []
+    timeouts = received = writer = None
+    jam_stop = threading.Event()
+    jam_result = []
+    start = time.perf_counter()
+
+    try:
+        if jam_rate:
+            threading.Thread(target=lambda: jam_result.append(
+                jam(sim.ports[2], baud_rate or DEFAULT_BAUD_RATE, jam_rate, seed, jam_stop)), daemon=True).start()
+        if pair is None:
+            timeouts, received, writer = run_synthetic(sim, commands, baud_rate or DEFAULT_BAUD_RATE, echo)
+        else:
+            input_file = os.path.join(workdir, pair['input'])
+            open(input_file, 'w').close()
+            processes.append(spawn_node(pair['slave'], sim.ports[1], workdir, verbose, echo))
+            time.sleep(1.0)
+            processes.append(spawn_node(pair['master'], sim.ports[0], workdir, verbose, echo))
+            time.sleep(1.0)
+            start = time.perf_counter()
+            with open(input_file, 'a') as f:
+                f.write(''.join(pair['make_line'](i)[1] + '\n' for i in range(commands)))
+            wait_until_quiet(sim, quiet_time=1.5, timeout=max(30.0, commands * 2.0))
+    finally:
+        jam_stop.set()
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=5)
+        frames = sim.snapshot_frames()
+        sim.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    frames = [f for f in frames if f[0] >= start]
+    stats = sim.stats
+    latencies, unanswered = response_latencies(frames)
+    window = (frames[-1][1] - frames[0][0]) if frames else 0.0
+    slave_count = sum(1 for f in frames if f[6] is not None or f[2] != 0)
+    print(f"Pair: {pair_name} ({baud_rate or 'script'} baud, noise={noise})")
+    print(f"Frames: {len(frames)} ({len(frames) - slave_count} master, {slave_count} slave) "
+          f"in {window:.3f} s -> {len(frames) / window if window else 0:.1f} frames/s, "
+          f"bus load {stats['busy_time'] / window * 100 if window else 0:.1f}%")
+    print(f"Bus: {stats['bytes']} bytes, {stats['breaks']} breaks, {stats['collisions']} collisions, "
+          f"{stats['noise_errors']} noise errors, {stats['overruns']} overruns")
+    print(format_latencies("Response latency", latencies))
+    print(f"Unanswered headers: {unanswered}" +
+          (f", master timeouts: {timeouts}" if timeouts is not None else ""))
+    if jam_rate:
+        print(f"Jammer: {jam_result[0] if jam_result else 0} bytes at {jam_rate:g} bytes/s")
+    if received is not None:
+        print(f"Commands received by the slave: {received}/{commands} "
+              f"({received / window if window else 0:.1f}/s)")
+    if writer:
+        print(f"Echo check: {sum(writer.delivered.values())} confirmed, {sum(writer.bus_errors.values())} mismatches, "
+              f"{sum(writer.retransmissions.values())} retransmissions, {sum(writer.dropped.values())} dropped")
+
+def process_cpu_time(pid):
+    """User + system CPU seconds used so far by `pid` (Linux /proc)."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def process_wakeups(pid):
+    """Context switches so far, summed over all threads of `pid`."""
+    total = 0
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/status') as f:
+            total += sum(int(line.split()[1]) for line in f if 'ctxt_switches:' in line)
+    return total
+
+def run_idle(script, seconds, verbose):
+    """Run one script on a quiet bus and report the CPU it burns waiting."""
+    sim = LINBusSimulator(nodes=2)
+    sim.start()
+    workdir = tempfile.mkdtemp(prefix='lin_sim_idle_')
+    process = spawn_node(script, sim.ports[1], workdir, verbose)
+    try:
+        time.sleep(2.0)  # imports and start-up work are not idle time
+        if process.poll() is not None:
+            print(f"{script} exited with {process.returncode}")
+            return
+        cpu_start, wakeups_start = process_cpu_time(process.pid), process_wakeups(process.pid)
+        start = time.perf_counter()
+        time.sleep(seconds)
+        cpu = process_cpu_time(process.pid) - cpu_start
+        wakeups = process_wakeups(process.pid) - wakeups_start
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=5)
+        sim.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{script}: {cpu:.2f} s CPU in {elapsed:.1f} s idle -> {cpu / elapsed * 100:.1f}% of one core, "
+          f"{wakeups / elapsed:.0f} wakeups/s")
+
+def serve(nodes, baud_rate, noise, echo, seed):
+    sim = LINBusSimulator(nodes=nodes, baud_rate=baud_rate, noise=noise, echo=echo, seed=seed)
+    sim.start()
+    for node in sim.nodes:
+        print(f"node {node.index}: LIN_SERIAL_PORT={node.port}")
+    print("Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"bytes={sim.stats['bytes']} breaks={sim.stats['breaks']} "
+                  f"collisions={sim.stats['collisions']} noise_errors={sim.stats['noise_errors']}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="pty-based LIN bus simulator")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def bus_options(p):
+        p.add_argument('--baud-rate', type=int, default=None, help="time data bytes at this rate (default: each tty's)")
+        p.add_argument('--noise', type=float, default=0.0, help="probability of a bit error per byte")
+        p.add_argument('--seed', type=int, default=None)
+        p.add_argument('--echo', action='store_true', help="deliver each byte back to its sender")
+
+    serve_parser = sub.add_parser('serve', help="create the ptys and run until Ctrl-C")
+    serve_parser.add_argument('--nodes', type=int, default=2)
+    bus_options(serve_parser)
+
+    bench_parser = sub.add_parser('bench', help="run a master/slave pair and report frames/s and latency")
+    bench_parser.add_argument('pair', choices=sorted(PAIRS))
+    bench_parser.add_argument('--commands', type=int, default=20, help="analysis lines / exchanges to send")
+    bench_parser.add_argument('--verbose', action='store_true', help="keep the scripts' own console output")
+    bench_parser.add_argument('--jam', type=float, default=0.0, help="random foreign bytes/s from a third node")
+    bus_options(bench_parser)
+
+    idle_parser = sub.add_parser('idle', help="measure the CPU one script uses on a silent bus")
+    idle_parser.add_argument('script')
+    idle_parser.add_argument('--seconds', type=float, default=10.0)
+    idle_parser.add_argument('--verbose', action='store_true')
+
+    node_parser = sub.add_parser('node', help="run one script on a port (used by bench)")
+    node_parser.add_argument('script')
+    node_parser.add_argument('--port', required=True)
+    node_parser.add_argument('--verbose', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.nodes, args.baud_rate, args.noise, args.echo, args.seed)
+    elif args.command == 'bench':
+        run_benchmark(args.pair, args.commands, args.baud_rate, args.noise, args.seed, args.verbose,
+                      args.echo, args.jam)
+    elif args.command == 'idle':
+        run_idle(args.script, args.seconds, args.verbose)
+    else:
+        run_node(args.script, args.port, args.verbose)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Asynchronous, structured logging for the frame paths.
+
+setup_logging() routes every logger of the process through one QueueHandler:
+the calling thread only filters and enqueues the LogRecord, and a
+QueueListener thread does the formatting and the console/file I/O. The log
+file gets one JSON object per line; the console gets the usual text line.
+
+Levels are set per subsystem, i.e. per logger below the service name:
+
+    LOG_LEVEL=INFO                     default level
+    LOG_LEVELS="can=WARNING,db=DEBUG"  -> light_master.can, light_master.db
+
+Repeated messages (same logger, level and format string) pass at most
+RATE_LIMIT_BURST times per RATE_LIMIT_INTERVAL seconds. The next one that
+passes carries the number dropped in between as `suppressed`.
+
+Use %-style arguments, not f-strings: formatting then happens on the
+listener thread, and the format string is what identifies a repeat.
+Keyword fields passed as `extra={...}` end up as JSON keys.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from collections.abc import Mapping
+
+RATE_LIMIT_INTERVAL = 1.0
+RATE_LIMIT_BURST = 10
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# Attributes every LogRecord has; anything else came in through `extra`
+STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'suppressed'}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRS:
+                entry[key] = value
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f" ({record.suppressed} similar suppressed)"
+        return text
+
+class RateLimitFilter(logging.Filter):
+    """Drop repeats of a message beyond `burst` per `interval` seconds."""
+
+    def __init__(self, interval=RATE_LIMIT_INTERVAL, burst=RATE_LIMIT_BURST, max_keys=1024):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_keys = max_keys
+        self.windows = {}  # (logger, level, format) -> [window start, passed, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None:
+                if len(self.windows) >= self.max_keys:
+                    self.windows.clear()  # f-string callers would grow this forever
+                self.windows[key] = [record.created, 1, 0]
+                return True
+            if record.created - window[0] >= self.interval:
+                record.suppressed = window[2]
+                window[:] = [record.created, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+# Log arguments that can be formatted later and still give the same text
+IMMUTABLE_ARG_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+def message_args(args):
+    """The values of a record's args, whether a tuple or a single mapping"""
+    return args.values() if isinstance(args, Mapping) else args
+
+class AsyncQueueHandler(QueueHandler):
+    """Enqueue the record as is; formatting is left to the listener thread.
+
+    The stock QueueHandler formats on the calling thread so records can be
+    pickled; this queue never leaves the process, so only what may change
+    before the listener gets to it is rendered early: the traceback (it
+    references live frames) and the message when an argument is mutable
+    (a dict or list the caller keeps updating would be logged as it is later).
+    """
+
+    def prepare(self, record):
+        if record.args and not all(isinstance(arg, IMMUTABLE_ARG_TYPES) for arg in message_args(record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def parse_levels(spec):
+    """'can=WARNING,db=DEBUG' -> {'can': 'WARNING', 'db': 'DEBUG'}"""
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging(service, log_file=None, level=None, levels=None, console=True):
+    """Send all logging through a background listener; return the service logger.
+
+    The first call in a process installs the queue and the listener, later
+    calls (other services in the same process) only set their levels.
+    """
+    global _listener
+    root = logging.getLogger()
+    with _setup_lock:
+        if _listener is None:
+            handlers = []
+            if console:
+                console_handler = logging.StreamHandler(sys.stdout)
+                console_handler.setFormatter(ConsoleFormatter(CONSOLE_FORMAT))
+                handlers.append(console_handler)
+            if log_file:
+                file_handler = logging.FileHandler(log_file)
+                file_handler.setFormatter(JsonFormatter())
+                handlers.append(file_handler)
+
+            log_queue = queue.SimpleQueue()
+            queue_handler = AsyncQueueHandler(log_queue)
+            queue_handler.addFilter(RateLimitFilter())
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            root.addHandler(queue_handler)
+            root.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO'))
+
+            _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+    levels = dict(levels or {}, **parse_levels(os.environ.get('LOG_LEVELS')))
+    for subsystem, subsystem_level in levels.items():
+        logging.getLogger(f"{service}.{subsystem}").setLevel(subsystem_level)
+    return logging.getLogger(service)
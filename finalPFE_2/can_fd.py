@@ -0,0 +1,96 @@
+"""
+CAN FD for the shared CAN layer, falling back to classic CAN.
+
+With CAN_FD=1 the interface is brought up with a data phase at
+CAN_FD_DBITRATE (bit-rate switch) and the socket is opened with fd=True, so
+frames of up to 64 bytes can be sent and received. When the controller (or a
+vcan without `mtu 72`) cannot do FD, the bus is opened as classic CAN and
+the callers send their classic frame layouts instead:
+
+    fd_active = open_bus(...)[1]
+    if fd_active: one FD frame
+    else:         the same content in classic 8-byte frames
+
+A classic node on an FD bus still receives every classic frame; it never
+sees FD frames, which the kernel does not deliver to classic sockets.
+
+    CAN_FD=1                  try CAN FD (default: classic)
+    CAN_FD_DBITRATE=2000000   data phase bit rate
+"""
+import os
+import time
+import logging
+import can
+
+CAN_FD = os.environ.get('CAN_FD', '0') == '1'
+NOMINAL_BITRATE = 500000
+DATA_BITRATE = int(os.environ.get('CAN_FD_DBITRATE', 2000000))
+
+CAN_MTU = 16
+CANFD_MTU = 72
+CLASSIC_MAX_LENGTH = 8
+FD_LENGTHS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+log = logging.getLogger('can_fd')
+
+def fd_length(length):
+    """Smallest CAN FD payload length that holds `length` bytes"""
+    for fd_len in FD_LENGTHS:
+        if fd_len >= length:
+            return fd_len
+    raise ValueError(f"CAN FD frames carry at most {FD_LENGTHS[-1]} bytes, got {length}")
+
+def interface_mtu(channel):
+    """MTU of a SocketCAN interface (16 classic, 72 FD), None if unknown"""
+    try:
+        with open(f'/sys/class/net/{channel}/mtu') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+def link_up(channel, fd=False):
+    """Bring a SocketCAN interface up, with a switched data phase for FD"""
+    if fd:
+        os.system(f'sudo /sbin/ip link set {channel} up type can bitrate {NOMINAL_BITRATE} '
+                  f'dbitrate {DATA_BITRATE} fd on')
+    else:
+        os.system(f'sudo /sbin/ip link set {channel} up type can bitrate {NOMINAL_BITRATE}')
+    time.sleep(0.1)
+
+def open_bus(channel, interface='socketcan', fd=None, bring_up=True):
+    """
+    Open a python-can bus, with CAN FD when asked for and available
+
+    Args:
+        channel: interface name, e.g. can0 or vcan0
+        interface: python-can interface
+        fd: try CAN FD (None: the CAN_FD environment variable)
+        bring_up: run `ip link set ... up` first (socketcan only)
+
+    Returns:
+        tuple: (bus, True if the bus carries FD frames)
+    """
+    fd = CAN_FD if fd is None else fd
+    if interface == 'socketcan':
+        if bring_up:
+            link_up(channel, fd)
+        mtu = interface_mtu(channel)
+        if fd and mtu is not None and mtu != CANFD_MTU:
+            log.warning("%s is not CAN FD capable (MTU %s), falling back to classic CAN", channel, mtu)
+            fd = False
+            if bring_up:
+                link_up(channel, False)
+    try:
+        return can.interface.Bus(channel=channel, interface=interface, fd=fd), fd
+    except (can.CanError, OSError, ValueError) as e:
+        if not fd:
+            raise
+        log.warning("Opening %s with CAN FD failed (%s), falling back to classic CAN", channel, e)
+        return can.interface.Bus(channel=channel, interface=interface), False
+
+def fd_message(arbitration_id, data):
+    """FD frame with bit-rate switch, payload padded to a valid FD length"""
+    data = bytes(data)
+    data += bytes(fd_length(len(data)) - len(data))
+    return can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=False,
+                       is_fd=True, bitrate_switch=True)
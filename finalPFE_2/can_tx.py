@@ -0,0 +1,242 @@
+"""
+Transmit queue between the CAN masters and their socket.
+
+The file-monitor threads used to call bus.send() themselves, so a full
+socket txqueue (ENOBUFS) or a controller gone bus-off raised in the middle
+of a file read: the frame was logged as an error and lost, and only a
+restart of the script brought the link back. CANTransmitter takes the frames
+instead and owns the socket's send side:
+
+    - a bounded queue, sent lowest arbitration ID first (the order the bus
+      itself arbitrates them in), first in first out within an ID
+    - send() blocks while the queue is full, so a burst (a large analysis
+      file replayed) slows the file reader down instead of dropping frames
+    - ENOBUFS and a full socket buffer are retried with a growing pause
+    - a bus-off error frame, or a frame stuck for BUS_OFF_CHECK_AFTER, makes
+      the transmitter read the controller state over netlink (iproute2's
+      `ip -details -json link show`). A BUS-OFF controller is restarted with
+      `ip link set ... type can restart`, a stopped link is brought up again,
+      and the frame is sent again
+
+Frames are only given up on when send() times out on a full queue, when the
+socket refuses the frame itself (e.g. an FD frame on a classic socket) or
+when they are still queued at stop(). pfe_can_tx_dropped counts them by
+reason; pfe_queue_depth{queue="can_tx"} is the queue depth.
+
+    CAN_TX_QUEUE=256    frames waiting before send() blocks
+"""
+import os
+import json
+import time
+import errno
+import heapq
+import logging
+import threading
+import subprocess
+import can
+import metrics
+from can_fd import link_up
+
+TX_QUEUE_SIZE = int(os.environ.get('CAN_TX_QUEUE', 256))
+SEND_TIMEOUT = 0.05          # seconds one bus.send() waits for room in the socket buffer
+RETRY_DELAYS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05)  # pause before the 1st, 2nd, ... retry
+BUS_OFF_CHECK_AFTER = 0.2    # seconds a frame may be stuck before the controller state is read
+BUS_OFF_CHECK_INTERVAL = 1.0  # seconds between two state reads while it stays stuck
+STOP_TIMEOUT = 2.0           # seconds stop() waits for the queue to drain
+
+CAN_ERR_BUSOFF = 0x40  # error class bit of a bus-off error frame (linux/can/error.h)
+
+# errno -> retry reason; anything else is a frame the socket will never take
+RETRY_ERRNOS = {
+    errno.ENOBUFS: 'enobufs',
+    errno.EAGAIN: 'buffer_full',
+    errno.ENETDOWN: 'link_down',
+    errno.ENETUNREACH: 'link_down',
+}
+
+QUEUE_DEPTH = metrics.gauge('pfe_queue_depth', 'Items waiting in a background queue', ('service', 'queue'))
+TX_DROPPED = metrics.counter('pfe_can_tx_dropped', 'Frames the CAN transmit queue gave up on', ('service', 'reason'))
+TX_RETRIES = metrics.counter('pfe_can_tx_retries', 'CAN sends repeated after a full buffer or link error',
+                             ('service', 'reason'))
+LINK_RESTARTS = metrics.counter('pfe_can_link_restarts', 'CAN controller restarts by the state found',
+                                ('service', 'state'))
+TX_WAIT_SECONDS = metrics.histogram('pfe_can_tx_wait_seconds', 'Time from send() to the frame leaving the socket',
+                                    ('service',))
+
+log = logging.getLogger('can_tx')
+
+def link_state(channel):
+    """CAN state of a SocketCAN interface (ERROR-ACTIVE, BUS-OFF, STOPPED, ...), None if unknown"""
+    try:
+        result = subprocess.run(['ip', '-details', '-json', 'link', 'show', 'dev', channel],
+                                capture_output=True, text=True, timeout=2)
+        links = json.loads(result.stdout) if result.returncode == 0 else []
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+    for link in links:
+        state = link.get('linkinfo', {}).get('info_data', {}).get('state')
+        if state:
+            return state
+        if 'UP' not in link.get('flags', ()):
+            return 'STOPPED'
+    return None
+
+def retry_reason(error):
+    """Why a failed send is worth repeating, None when it is not"""
+    code = getattr(error, 'error_code', None) or getattr(error, 'errno', None)
+    if code in RETRY_ERRNOS:
+        return RETRY_ERRNOS[code]
+    if isinstance(error, can.CanTimeoutError) or 'buffer full' in str(error).lower():
+        return 'buffer_full'
+    return None
+
+class CANTransmitter(threading.Thread):
+    def __init__(self, bus, service, channel=None, fd=False, maxsize=TX_QUEUE_SIZE):
+        """
+        Sends the frames queued by send() on its own thread
+
+        Args:
+            bus: python-can bus; only this thread calls its send()
+            service: label for metrics and logs, e.g. light_master
+            channel: SocketCAN interface whose controller state is watched (None: not watched)
+            fd: the interface is brought up with CAN FD after a restart
+            maxsize: frames waiting before send() blocks
+        """
+        super().__init__(name=f'{service}-can-tx', daemon=True)
+        self.bus = bus
+        self.service = service
+        self.channel = channel
+        self.fd = fd
+        self.maxsize = maxsize
+        self.pending = []  # heap of (arbitration ID, sequence, message, queued at)
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.busy = False
+        self.running = True
+        self.bus_off_reported = False
+        self.dropped = {reason: TX_DROPPED.labels(service, reason) for reason in ('queue_full', 'rejected', 'stopped')}
+        self.waits = TX_WAIT_SECONDS.labels(service)
+        QUEUE_DEPTH.labels(service, 'can_tx').set_function(lambda: len(self.pending))
+
+    def send(self, msg, timeout=None):
+        """
+        Queue one frame, blocking while the queue is full
+
+        Raises can.CanOperationError when the frame was not queued: still
+        full after `timeout` seconds (None: wait as long as it takes), or the
+        transmitter is stopped.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.pending) < self.maxsize or not self.running, timeout):
+                self.dropped['queue_full'].inc()
+                raise can.CanOperationError(f"CAN transmit queue full ({self.maxsize} frames)")
+            if not self.running:
+                self.dropped['stopped'].inc()
+                raise can.CanOperationError("CAN transmitter stopped")
+            self.sequence += 1
+            heapq.heappush(self.pending, (msg.arbitration_id, self.sequence, msg, time.perf_counter()))
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every queued frame has left the socket"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+    def on_error_frame(self, msg):
+        """Feed error frames from whoever reads the bus; bus-off triggers a restart"""
+        if msg.is_error_frame and msg.arbitration_id & CAN_ERR_BUSOFF:
+            log.warning("%s: bus-off error frame received", self.service)
+            with self.condition:
+                self.bus_off_reported = True
+                self.condition.notify_all()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Send what is queued (for up to `timeout` seconds), then stop"""
+        if self.is_alive():
+            self.flush(timeout)
+        with self.condition:
+            self.running = False
+            if self.pending:
+                log.warning("%s: %d queued frame(s) not sent at stop", self.service, len(self.pending))
+                self.dropped['stopped'].inc(len(self.pending))
+                self.pending.clear()
+            self.condition.notify_all()
+        if self.is_alive():
+            self.join(timeout=1.0)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.bus_off_reported or not self.running)
+                if not self.running:
+                    return
+                if self.bus_off_reported:
+                    self.bus_off_reported = False
+                    recover = True
+                else:
+                    recover = False
+                    _, _, msg, queued = heapq.heappop(self.pending)
+                    self.busy = True
+                    # Room for the next frame: wake a blocked send()
+                    self.condition.notify_all()
+            if recover:
+                self.recover_link()
+                continue
+            try:
+                if self._transmit(msg):
+                    self.waits.observe(time.perf_counter() - queued)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def _transmit(self, msg):
+        """Send one frame, retrying until it is out; False when it was dropped"""
+        attempt = 0
+        stuck_since = None
+        next_check = 0.0
+        while True:
+            try:
+                self.bus.send(msg, SEND_TIMEOUT)
+                return True
+            except (can.CanError, OSError, ValueError) as e:
+                reason = retry_reason(e)
+                if reason is None:
+                    self.dropped['rejected'].inc()
+                    log.error("%s: frame %s rejected by the socket: %s", self.service, hex(msg.arbitration_id), e)
+                    return False
+                if not self.running:
+                    self.dropped['stopped'].inc()
+                    return False
+            TX_RETRIES.labels(self.service, reason).inc()
+            now = time.monotonic()
+            if stuck_since is None:
+                # A full txqueue during a burst is normal backpressure
+                stuck_since = now
+                log.debug("%s: frame %s not sent (%s), retrying", self.service, hex(msg.arbitration_id), reason)
+            if self.bus_off_reported or (now - stuck_since >= BUS_OFF_CHECK_AFTER and now >= next_check):
+                if not self.bus_off_reported:
+                    log.warning("%s: frame %s stuck for %.1f s (%s), checking the controller",
+                                self.service, hex(msg.arbitration_id), now - stuck_since, reason)
+                self.bus_off_reported = False
+                self.recover_link()
+                next_check = time.monotonic() + BUS_OFF_CHECK_INTERVAL
+            time.sleep(RETRY_DELAYS[min(attempt, len(RETRY_DELAYS) - 1)])
+            attempt += 1
+
+    def recover_link(self):
+        """Restart a bus-off controller, or bring a stopped link up; True when it did either"""
+        if not self.channel:
+            return False
+        state = link_state(self.channel)
+        if state not in ('BUS-OFF', 'STOPPED'):
+            return False
+        log.warning("%s: %s is %s, restarting it", self.service, self.channel, state)
+        LINK_RESTARTS.labels(self.service, state.lower().replace('-', '_')).inc()
+        # `type can restart` only works on a bus-off controller without restart-ms set;
+        # a link that is down, or refuses the restart, is set down and up again
+        if state != 'BUS-OFF' or os.system(f'sudo /sbin/ip link set {self.channel} type can restart') != 0:
+            os.system(f'sudo /sbin/ip link set {self.channel} down')
+            link_up(self.channel, self.fd)
+        log.info("%s: %s is %s after the restart", self.service, self.channel, link_state(self.channel))
+        return True
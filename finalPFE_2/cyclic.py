@@ -0,0 +1,120 @@
+"""
+Cyclic refresh frames sent by the kernel's broadcast manager (BCM).
+
+Commands go out once, when the analysis file changes, so a slave that
+restarts afterwards stays dark until the next edit. Each master therefore
+also keeps everything it has commanded so far in a refresh frame that is
+repeated every REFRESH_PERIOD:
+
+    LIGHTS_REFRESH (0x112)   light_frames.encode_lights of every light commanded
+                             so far, all with the mode of the latest command
+    WINDOW_REFRESH (0x212)   one frame per window commanded so far, in the
+                             classic snapshot layout (index + entry)
+
+Refresh frames are classic CAN on an FD bus too, so every slave hears them
+whatever its CAN_FD setting.
+
+The frame is registered once with bus.send_periodic(), a BCM TX_SETUP on
+socketcan: the kernel times it and Python is not woken per cycle. A state
+change replaces the payload in place (modify_data) without resetting the
+timer. Other python-can interfaces fall back to python-can's timer thread.
+
+Slaves apply the parts of a refresh that differ from the last command they
+received, without answering, and RefreshMonitor reports a master whose
+refresh frames have stopped.
+
+    CAN_REFRESH_PERIOD=1.0   seconds between refreshes of the whole state (0: off)
+"""
+import os
+import time
+import logging
+import threading
+import can
+
+REFRESH_PERIOD = float(os.environ.get('CAN_REFRESH_PERIOD', 1.0))
+REFRESH_TIMEOUT = 3 * REFRESH_PERIOD  # slave side: master silent after three missed refreshes
+
+LIGHTS_REFRESH_ID = 0x112
+WINDOW_REFRESH_ID = 0x212
+
+log = logging.getLogger('cyclic')
+
+class CyclicFrame:
+    def __init__(self, bus, arbitration_id, period=REFRESH_PERIOD):
+        """
+        Frames on one ID that the bus repeats until stopped
+
+        Args:
+            bus: python-can bus (or the supervisor's shared bus)
+            arbitration_id: CAN ID of the frames
+            period: seconds between two rounds of all the frames (0: never sent)
+        """
+        self.bus = bus
+        self.arbitration_id = arbitration_id
+        self.period = period
+        self.task = None
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def update(self, payloads):
+        """
+        Set the payloads sent from now on
+
+        The BCM sends a task's frames one per interval, so with several frames
+        the interval is period / count and each frame still repeats every period.
+        A new frame count re-registers the task, which restarts its timer.
+        """
+        if not self.period or not payloads:
+            return
+        msgs = [can.Message(arbitration_id=self.arbitration_id, data=data, is_extended_id=False)
+                for data in payloads]
+        with self.lock:
+            if self.task is not None and len(msgs) == self.count:
+                self.task.modify_data(msgs)
+                return
+            if self.task is not None:
+                self.task.stop()
+            self.task = self.bus.send_periodic(msgs, self.period / len(msgs))
+            self.count = len(msgs)
+            log.info("Cyclic %s: %d frame(s) every %.3f s", hex(self.arbitration_id), len(msgs), self.period)
+
+    def stop(self):
+        with self.lock:
+            if self.task is not None:
+                self.task.stop()
+                self.task = None
+                self.count = 0
+
+class RefreshMonitor:
+    def __init__(self, name, timeout=REFRESH_TIMEOUT, on_timeout=None):
+        """
+        Slave side: notices when a master's refresh frames stop
+
+        Armed by the first refresh, so a master without refresh frames is not
+        reported. seen() on every refresh frame, check() from the receive loop.
+
+        Args:
+            name: what the refreshes come from, for the log
+            timeout: seconds without a refresh before the master counts as lost
+            on_timeout: called once per loss
+        """
+        self.name = name
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.last_seen = None
+        self.lost = False
+
+    def seen(self):
+        if self.lost:
+            log.info("Refresh frames from %s are back", self.name)
+        self.last_seen = time.monotonic()
+        self.lost = False
+
+    def check(self):
+        if not self.timeout or self.last_seen is None or self.lost:
+            return
+        if time.monotonic() - self.last_seen > self.timeout:
+            self.lost = True
+            log.warning("No refresh from %s for %.1f s", self.name, self.timeout)
+            if self.on_timeout:
+                self.on_timeout()
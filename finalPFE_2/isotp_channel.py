@@ -0,0 +1,283 @@
+"""
+ISO-TP (ISO 15765-2) channel for bulk transfers over CAN.
+
+Carries messages of up to 4095 bytes between two CAN IDs, with the
+receiver pacing the sender through flow control frames:
+
+    single frame       PCI 0x0L          L = 1..7 bytes (CAN FD: 0x00, length, up to 62)
+    first frame        PCI 0x1H, LEN     12-bit message length H:LEN, then the first bytes
+    consecutive frame  PCI 0x2N          N = sequence number mod 16
+    flow control       PCI 0x3S, BS, ST  S: 0 continue, 1 wait, 2 overflow
+
+After a first frame the sender waits for flow control, then sends BS
+consecutive frames (0: all the rest) at least STmin apart and waits for the
+next flow control. With CAN FD the frames carry up to 64 bytes.
+
+Where the kernel has can-isotp (socket.CAN_ISOTP and the can-isotp module),
+the channel binds an ISO-TP socket and the kernel does the segmentation,
+flow control and timing; both ends then need the same CAN_FD setting.
+Otherwise the frames go through the python-can bus: whoever reads the bus
+passes the frames on rx_id to on_frame(), or start_reader() does it when
+the channel has the bus to itself. The fallback answers in CAN FD only when
+the peer's last message came in CAN FD.
+"""
+import time
+import queue
+import socket
+import struct
+import logging
+import threading
+import can
+from can_fd import fd_message
+
+MAX_MESSAGE_LENGTH = 4095
+CLASSIC_FRAME = 8
+FD_FRAME = 64
+
+SINGLE_FRAME = 0x00
+FIRST_FRAME = 0x10
+CONSECUTIVE_FRAME = 0x20
+FLOW_CONTROL = 0x30
+CONTINUE_TO_SEND = 0
+WAIT = 1
+OVERFLOW = 2
+
+BLOCK_SIZE = 0   # consecutive frames between flow controls we send (0: no limit)
+ST_MIN = 0       # ms between consecutive frames we ask for
+N_BS = 1.0       # seconds the sender waits for flow control
+N_CR = 1.0       # seconds the receiver waits for the next consecutive frame
+MAX_WAIT_FRAMES = 10
+
+# Kernel can-isotp socket options (linux/can/isotp.h)
+SOL_CAN_ISOTP = 106
+CAN_ISOTP_RECV_FC = 2
+CAN_ISOTP_LL_OPTS = 5
+CANFD_BRS = 0x01
+
+log = logging.getLogger('isotp')
+
+class IsoTpError(Exception):
+    pass
+
+def kernel_isotp_available():
+    """True when a kernel ISO-TP socket can be opened"""
+    if not hasattr(socket, 'CAN_ISOTP'):
+        return False
+    try:
+        socket.socket(socket.AF_CAN, socket.SOCK_DGRAM, socket.CAN_ISOTP).close()
+        return True
+    except OSError:
+        return False
+
+def st_min_seconds(st_min):
+    """STmin byte -> seconds: 0x00-0x7F ms, 0xF1-0xF9 100-900 us, reserved values as 127 ms"""
+    if st_min <= 0x7F:
+        return st_min / 1000
+    if 0xF1 <= st_min <= 0xF9:
+        return (st_min - 0xF0) / 10000
+    return 0.127
+
+class IsoTpChannel:
+    def __init__(self, bus, tx_id, rx_id, channel=None, interface=None, fd=False,
+                 block_size=BLOCK_SIZE, st_min=ST_MIN, kernel=None):
+        """
+        One ISO-TP link between two CAN IDs
+
+        Args:
+            bus: python-can bus the fallback sends on
+            tx_id: CAN ID this end sends on
+            rx_id: CAN ID this end listens on
+            channel: SocketCAN interface for a kernel socket
+            interface: python-can interface of `bus`; the kernel socket needs socketcan
+            fd: send CAN FD frames of up to 64 bytes
+            block_size: consecutive frames the peer may send per flow control
+            st_min: STmin byte asked of the peer
+            kernel: True/False to force/forbid the kernel socket, None when available
+        """
+        self.bus = bus
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.fd = fd
+        self.peer_fd = fd
+        self.block_size = block_size
+        self.st_min = st_min
+        self.received = queue.SimpleQueue()
+        self.flow_control = queue.SimpleQueue()
+        self.send_lock = threading.Lock()
+        self.reader = None
+        self.running = True
+        self._reset_rx()
+
+        if kernel is None:
+            kernel = channel is not None and interface == 'socketcan' and kernel_isotp_available()
+        self.kernel = kernel
+        self.sock = None
+        if kernel:
+            self.sock = socket.socket(socket.AF_CAN, socket.SOCK_DGRAM, socket.CAN_ISOTP)
+            self.sock.setsockopt(SOL_CAN_ISOTP, CAN_ISOTP_RECV_FC, struct.pack('=BBB', block_size, st_min, 0))
+            if fd:
+                self.sock.setsockopt(SOL_CAN_ISOTP, CAN_ISOTP_LL_OPTS, struct.pack('=BBB', 72, FD_FRAME, CANFD_BRS))
+            self.sock.bind((channel, rx_id, tx_id))
+        log.info("ISO-TP %s -> %s (%s, %s)", hex(tx_id), hex(rx_id), "kernel" if kernel else "python",
+                 "CAN FD" if fd else "classic")
+
+    # ------------------------------------------------------------------
+    # Public API
+
+    def send(self, message, timeout=N_BS):
+        """Send one message; raises IsoTpError when the peer does not take it"""
+        message = bytes(message)
+        if not 0 < len(message) <= MAX_MESSAGE_LENGTH:
+            raise IsoTpError(f"Message length must be 1..{MAX_MESSAGE_LENGTH} bytes, got {len(message)}")
+        if self.kernel:
+            self.sock.settimeout(timeout)
+            try:
+                self.sock.send(message)
+            except OSError as e:
+                raise IsoTpError(f"Kernel ISO-TP send failed: {e}")
+            return
+        with self.send_lock:
+            self._send(message, timeout)
+
+    def recv(self, timeout=None):
+        """Next complete message, or None after `timeout` seconds"""
+        if self.kernel:
+            self.sock.settimeout(timeout)
+            try:
+                return self.sock.recv(MAX_MESSAGE_LENGTH)
+            except socket.timeout:
+                return None
+        try:
+            return self.received.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def on_frame(self, msg):
+        """Feed one frame received on rx_id (python fallback; ignored with the kernel socket)"""
+        if self.kernel or msg.arbitration_id != self.rx_id or not msg.data:
+            return
+        data = bytes(msg.data)
+        kind = data[0] & 0xF0
+        if kind == FLOW_CONTROL:
+            if len(data) >= 3:
+                self.flow_control.put((data[0] & 0x0F, data[1], data[2]))
+        elif kind == SINGLE_FRAME:
+            self._reset_rx()
+            length = data[0] & 0x0F
+            start = 1
+            if length == 0 and len(data) > 1:  # CAN FD escape: length in the second byte
+                length, start = data[1], 2
+            if 0 < length <= len(data) - start:
+                self.peer_fd = msg.is_fd
+                self.received.put(data[start:start + length])
+        elif kind == FIRST_FRAME:
+            self._reset_rx()
+            if len(data) < 2:
+                return
+            length = ((data[0] & 0x0F) << 8) | data[1]
+            if length <= len(data) - 2:
+                log.warning("First frame for a %d-byte message ignored", length)
+                return
+            self.peer_fd = msg.is_fd
+            self.rx_length = length
+            self.rx_data = bytearray(data[2:])
+            self.rx_sequence = 1
+            self.rx_last = time.monotonic()
+            self._send_flow_control()
+        elif kind == CONSECUTIVE_FRAME:
+            if not self.rx_length:
+                return
+            if time.monotonic() - self.rx_last > N_CR or data[0] & 0x0F != self.rx_sequence & 0x0F:
+                log.warning("Consecutive frame late or out of sequence, message dropped")
+                self._reset_rx()
+                return
+            self.rx_data.extend(data[1:1 + self.rx_length - len(self.rx_data)])
+            self.rx_sequence += 1
+            self.rx_last = time.monotonic()
+            if len(self.rx_data) >= self.rx_length:
+                self.received.put(bytes(self.rx_data))
+                self._reset_rx()
+            elif self.block_size and (self.rx_sequence - 1) % self.block_size == 0:
+                self._send_flow_control()
+
+    def start_reader(self):
+        """Read the bus on a thread of our own (when nothing else reads it)"""
+        if self.kernel or self.reader:
+            return
+        self.reader = threading.Thread(target=self._read_loop, name=f'isotp-{hex(self.rx_id)}', daemon=True)
+        self.reader.start()
+
+    def close(self):
+        self.running = False
+        if self.reader:
+            self.reader.join(timeout=1.5)
+        if self.sock:
+            self.sock.close()
+
+    # ------------------------------------------------------------------
+    # Python fallback
+
+    def _reset_rx(self):
+        self.rx_length = 0
+        self.rx_data = bytearray()
+        self.rx_sequence = 0
+        self.rx_last = 0.0
+
+    def _read_loop(self):
+        while self.running:
+            msg = self.bus.recv(timeout=0.5)
+            if msg:
+                self.on_frame(msg)
+
+    def _frame(self, data, fd):
+        if fd:
+            return fd_message(self.tx_id, data)
+        return can.Message(arbitration_id=self.tx_id, data=data, is_extended_id=False)
+
+    def _send_flow_control(self):
+        data = bytes([FLOW_CONTROL | CONTINUE_TO_SEND, self.block_size, self.st_min])
+        self.bus.send(self._frame(data, self.fd and self.peer_fd))
+
+    def _send(self, message, timeout):
+        fd = self.fd and self.peer_fd
+        frame_size = FD_FRAME if fd else CLASSIC_FRAME
+        while not self.flow_control.empty():  # stale answers to an earlier transfer
+            self.flow_control.get_nowait()
+
+        if len(message) <= CLASSIC_FRAME - 1:
+            self.bus.send(self._frame(bytes([SINGLE_FRAME | len(message)]) + message, fd))
+            return
+        if fd and len(message) <= FD_FRAME - 2:
+            self.bus.send(self._frame(bytes([SINGLE_FRAME, len(message)]) + message, fd))
+            return
+
+        first = frame_size - 2
+        self.bus.send(self._frame(bytes([FIRST_FRAME | (len(message) >> 8), len(message) & 0xFF]) +
+                                  message[:first], fd))
+        offset = first
+        sequence = 1
+        chunk = frame_size - 1
+        while offset < len(message):
+            block_size, st_min = self._wait_flow_control(timeout)
+            sent = 0
+            while offset < len(message) and (block_size == 0 or sent < block_size):
+                if sent and st_min:
+                    time.sleep(st_min)
+                self.bus.send(self._frame(bytes([CONSECUTIVE_FRAME | (sequence & 0x0F)]) +
+                                          message[offset:offset + chunk], fd))
+                offset += chunk
+                sequence += 1
+                sent += 1
+
+    def _wait_flow_control(self, timeout):
+        """(block size, STmin seconds) of the next continue-to-send flow control"""
+        for _ in range(MAX_WAIT_FRAMES + 1):
+            try:
+                status, block_size, st_min = self.flow_control.get(timeout=timeout)
+            except queue.Empty:
+                raise IsoTpError(f"No flow control on {hex(self.rx_id)} within {timeout} s")
+            if status == CONTINUE_TO_SEND:
+                return block_size, st_min_seconds(st_min)
+            if status == OVERFLOW:
+                raise IsoTpError("Receiver overflow: message too long for the peer")
+        raise IsoTpError(f"Peer sent more than {MAX_WAIT_FRAMES} wait frames")
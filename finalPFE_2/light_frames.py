@@ -0,0 +1,67 @@
+"""
+Aggregated lighting frames: all seven lights in one 8-byte CAN frame.
+
+The legacy layout spends one frame per light on IDs 0x101-0x107 and the
+slave answers each on the same ID. The aggregated layout packs every light
+into LIGHTS_CTRL (0x110, master -> slave) and LIGHTS_STATUS (0x111,
+slave -> master). light_system.dbc describes both layouts.
+
+    bits  0-6    LIGHTS_MASK     lights carried by this frame, bit i = LIGHT_ORDER[i]
+    bits  8-21   <light>_STATUS  2 bits per light: 0 off, 1 on, 2 failed, 3 invalid
+    bits 24-44   <light>_MODE    3 bits per light: the 1..4 mode codes
+
+Fields of lights outside the mask are zero and must be ignored. The slave
+accepts both layouts and answers in the one a command arrived in.
+"""
+
+LIGHTS_CTRL_ID = 0x110  # 0x100 is the wiper command
+LIGHTS_STATUS_ID = 0x111
+FRAME_LENGTH = 8
+
+# Bit i of the mask, and the field order, follow the legacy IDs 0x101-0x107
+LIGHT_ORDER = ("Low Beam", "High Beam", "Parking Left", "Parking Right",
+               "Hazard Lights", "Right Turn", "Left Turn")
+
+STATUS_START, STATUS_BITS = 8, 2
+MODE_START, MODE_BITS = 24, 3
+
+# Legacy status bytes <-> 2-bit status fields
+STATUS_FIELDS = {0x00: 0, 0x01: 1, 0xFF: 2, 0xFE: 3}
+STATUS_BYTES = {field: code for code, field in STATUS_FIELDS.items()}
+
+def encode_lights(lights):
+    """
+    Pack light commands or states into one frame
+
+    Args:
+        lights: {light name: (status byte, mode code)} for the lights to carry
+
+    Returns:
+        bytes: the 8 data bytes
+    """
+    value = 0
+    for light, (status, mode) in lights.items():
+        i = LIGHT_ORDER.index(light)
+        value |= 1 << i
+        value |= STATUS_FIELDS[status] << (STATUS_START + STATUS_BITS * i)
+        value |= (mode & ((1 << MODE_BITS) - 1)) << (MODE_START + MODE_BITS * i)
+    return value.to_bytes(FRAME_LENGTH, 'little')
+
+def decode_lights(data):
+    """
+    Unpack a frame built by encode_lights
+
+    Returns:
+        dict: {light name: (status byte, mode code)} for the lights in the
+        mask, in LIGHT_ORDER; empty for a frame shorter than 8 bytes
+    """
+    if len(data) < FRAME_LENGTH:
+        return {}
+    value = int.from_bytes(bytes(data[:FRAME_LENGTH]), 'little')
+    lights = {}
+    for i, light in enumerate(LIGHT_ORDER):
+        if value & (1 << i):
+            status = (value >> (STATUS_START + STATUS_BITS * i)) & ((1 << STATUS_BITS) - 1)
+            mode = (value >> (MODE_START + MODE_BITS * i)) & ((1 << MODE_BITS) - 1)
+            lights[light] = (STATUS_BYTES[status], mode)
+    return lights
@@ -2,9 +2,18 @@ import can
 import time
 import os
 import threading
+import logging
 from datetime import datetime
 import mysql.connector
 from mysql.connector import Error
+import metrics
+from async_logging import setup_logging
+from stage_trace import StageTracer, split_trace_field
+from light_frames import LIGHTS_CTRL_ID, LIGHTS_STATUS_ID, encode_lights, decode_lights
+from can_fd import open_bus
+from snapshot import SNAPSHOT_REQUEST_ID, LIGHT_SNAPSHOT_ID, SNAPSHOT_LIGHTS, encode_request
+from can_tx import CANTransmitter
+from cyclic import CyclicFrame, LIGHTS_REFRESH_ID
 
 # CAN IDs for each light type
 LIGHT_IDS = {
@@ -70,12 +79,40 @@ EVENT_IDS = {
     0x107: 14   # Left Turn
 }
 
+log = logging.getLogger('light_master')
+can_log = logging.getLogger('light_master.can')
+db_log = logging.getLogger('light_master.db')
+file_log = logging.getLogger('light_master.file')
+
+METRICS_PORT = 9101
+RESPONSE_TIMEOUT = 2.0  # seconds the slave has to answer a command
+# LIGHT_FRAMES=aggregated packs the lights of one file read into LIGHTS_CTRL
+# frames (see light_frames.py); the default keeps one frame per light
+AGGREGATED_FRAMES = os.environ.get('LIGHT_FRAMES', 'per-light') == 'aggregated'
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+RESPONSE_TIMEOUTS = metrics.counter('pfe_response_timeouts', 'Commands not answered in time', ('service', 'id'))
+DB_WRITE_SECONDS = metrics.histogram('pfe_db_write_seconds', 'Duration of protocol_data updates', ('service',))
+
+FRAMES_SENT = {can_id: FRAMES.labels('light_master', 'tx', hex(can_id))
+               for can_id in (*LIGHT_IDS.values(), LIGHTS_CTRL_ID, SNAPSHOT_REQUEST_ID)}
+FRAMES_RECEIVED = {can_id: FRAMES.labels('light_master', 'rx', hex(can_id))
+                   for can_id in (*RESPONSE_IDS.values(), LIGHTS_STATUS_ID, LIGHT_SNAPSHOT_ID)}
+SEND_ERRORS = ERRORS.labels('light_master', 'send')
+MALFORMED_LINES = ERRORS.labels('light_master', 'malformed_line')
+DB_WRITES = DB_WRITE_SECONDS.labels('light_master')
+
 class CANLightMaster:
-    def __init__(self, filename):
+    def __init__(self, filename, bus=None, db_pool=None, aggregated=None):
         self.filename = filename
         self.channel = 'can0'
         self.bustype = 'socketcan'
-        self.bus = None
+        self.bus = bus
+        self.owns_bus = bus is None  # False when hosted by the supervisor
+        self.transmitter = bus  # the supervisor's shared bus queues its sends itself
+        self.fd = getattr(bus, 'fd', False)
+        self.db_pool = db_pool
         self.last_size = os.path.getsize(filename)
         self.running = True
         self.db_connection = None
@@ -83,32 +120,45 @@ class CANLightMaster:
         self.last_processed_status = {light: None for light in LIGHT_IDS}
         self.last_processed_mode = {light: None for light in LIGHT_IDS}
         self.current_db_states = {event_id: None for event_id in EVENT_IDS.values()}
+        self.tracer = StageTracer('light_master')
+        self.awaiting_response = {}  # CAN ID -> monotonic send time
+        self.aggregated = AGGREGATED_FRAMES if aggregated is None else aggregated
+        self.pending_lights = {}  # light -> (status, mode, trace) for the next LIGHTS_CTRL frame
+        self.latest_mode = None  # mode of the latest command, carried by the refresh frame
         
-        self.init_can_bus()
+        metrics.start_http_server(METRICS_PORT)
+        if self.owns_bus:
+            self.init_can_bus()
+        self.refresh = CyclicFrame(self.bus, LIGHTS_REFRESH_ID)
         self.init_db_connection()
         self.load_current_db_states()
-        self.start_response_monitor()
+        if self.owns_bus:
+            self.start_response_monitor()
     
     def init_can_bus(self):
         try:
-            os.system(f'sudo /sbin/ip link set {self.channel} up type can bitrate 500000')
-            time.sleep(0.1)
-            self.bus = can.interface.Bus(channel=self.channel, bustype=self.bustype)
-            print("CAN initialized")
+            self.bus, self.fd = open_bus(self.channel, self.bustype)
+            self.transmitter = CANTransmitter(self.bus, 'light_master',
+                                              self.channel if self.bustype == 'socketcan' else None, self.fd)
+            self.transmitter.start()
+            can_log.info("CAN initialized (%s)", "CAN FD" if self.fd else "classic")
         except Exception as e:
-            print(f"CAN init failed: {e}")
+            can_log.error("CAN init failed: %s", e)
             raise
     
     def init_db_connection(self):
         try:
-            self.db_connection = mysql.connector.connect(
-                host="10.20.0.23",
-                user="myuser1",
-                password="root",
-                database="khalil"
-            )
+            if self.db_pool:
+                self.db_connection = self.db_pool.get_connection()
+            else:
+                self.db_connection = mysql.connector.connect(
+                    host="10.20.0.23",
+                    user="myuser1",
+                    password="root",
+                    database="khalil"
+                )
             self.db_cursor = self.db_connection.cursor()
-            print("MySQL database connection established")
+            db_log.info("MySQL database connection established")
             
             create_table_query = """
             CREATE TABLE IF NOT EXISTS protocol_data (
@@ -133,13 +183,15 @@ class CANLightMaster:
                 for event_id in missing_ids:
                     self.db_cursor.execute(insert_query, (event_id, 0, timestamp))
                 self.db_connection.commit()
-                print(f"Initialized {len(missing_ids)} missing rows in protocol_data")
+                db_log.info("Initialized %d missing rows in protocol_data", len(missing_ids))
             
-            self.db_cursor.execute("DELETE FROM protocol_data WHERE event_id NOT IN (11, 12, 17, 18, 13, 15, 14)")
-            self.db_connection.commit()
+            if not self.db_pool:
+                # A shared database also holds the other plugins' rows
+                self.db_cursor.execute("DELETE FROM protocol_data WHERE event_id NOT IN (11, 12, 17, 18, 13, 15, 14)")
+                self.db_connection.commit()
             
         except Error as e:
-            print(f"Error connecting to MySQL: {e}")
+            db_log.error("Error connecting to MySQL: %s", e)
             raise
     
     def load_current_db_states(self):
@@ -151,26 +203,101 @@ class CANLightMaster:
             self.db_cursor.execute("SELECT event_id, message FROM protocol_data")
             for event_id, message in self.db_cursor.fetchall():
                 self.current_db_states[event_id] = message
-            print("Loaded current database states")
+            db_log.info("Loaded current database states")
         except Error as e:
-            print(f"Error loading current database states: {e}")
+            db_log.error("Error loading current database states: %s", e)
     
-    def send_can_message(self, light, status, mode):
+    def send_can_message(self, light, status, mode, trace=None):
+        if self.aggregated:
+            self.queue_light_command(light, status, mode, trace)
+            return
         try:
+            data = [STATUS_CODES[status], MODE_CODES[mode]]
+            # Traced commands carry a sequence byte the slave echoes back
+            sequence = self.tracer.expect_response(trace, LIGHT_IDS[light])
+            if sequence is not None:
+                data.append(sequence)
             msg = can.Message(
                 arbitration_id=LIGHT_IDS[light],
-                data=[STATUS_CODES[status], MODE_CODES[mode]],
+                data=data,
                 is_extended_id=False
             )
-            self.bus.send(msg)
-            print(f"Sent: {light} - {status} - {mode} (ID: {hex(LIGHT_IDS[light])}, Data: {[hex(STATUS_CODES[status]), hex(MODE_CODES[mode])]})")
+            self.transmitter.send(msg)
+            self.tracer.stamp(trace, 'master_send')
+            FRAMES_SENT[LIGHT_IDS[light]].inc()
+            self.awaiting_response[LIGHT_IDS[light]] = time.monotonic()
+            can_log.info("Sent: %s - %s - %s (ID: %s)", light, status, mode, hex(LIGHT_IDS[light]),
+                         extra={'can_id': LIGHT_IDS[light], 'data': data})
             self.last_processed_status[light] = status
             self.last_processed_mode[light] = mode
         except Exception as e:
-            print(f"Error sending CAN message: {e}")
+            SEND_ERRORS.inc()
+            can_log.error("Error sending CAN message: %s", e)
+    
+    def queue_light_command(self, light, status, mode, trace=None):
+        """Add a command to the next LIGHTS_CTRL frame.
+
+        A frame carries one command per light and a single mode, so a repeated
+        light or a mode change sends the commands queued so far first.
+        """
+        if light in self.pending_lights or any(m != mode for _, m, _ in self.pending_lights.values()):
+            self.flush_light_commands()
+        self.pending_lights[light] = (status, mode, trace)
+        self.last_processed_status[light] = status
+        self.last_processed_mode[light] = mode
+    
+    def flush_light_commands(self):
+        """Send the queued commands as one LIGHTS_CTRL frame"""
+        if not self.pending_lights:
+            return
+        pending, self.pending_lights = self.pending_lights, {}
+        try:
+            data = encode_lights({light: (STATUS_CODES[status], MODE_CODES[mode])
+                                  for light, (status, mode, _) in pending.items()})
+            for _, _, trace in pending.values():
+                # Answered lights are matched in command order, not by sequence byte
+                self.tracer.expect_response(trace, LIGHTS_STATUS_ID)
+            self.transmitter.send(can.Message(arbitration_id=LIGHTS_CTRL_ID, data=data, is_extended_id=False))
+            for _, _, trace in pending.values():
+                self.tracer.stamp(trace, 'master_send')
+            FRAMES_SENT[LIGHTS_CTRL_ID].inc()
+            self.awaiting_response[LIGHTS_STATUS_ID] = time.monotonic()
+            can_log.info("Sent: %s (ID: %s)", ', '.join(f"{light} - {status} - {mode}"
+                                                        for light, (status, mode, _) in pending.items()),
+                         hex(LIGHTS_CTRL_ID), extra={'can_id': LIGHTS_CTRL_ID, 'data': list(data)})
+        except Exception as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error sending CAN message: %s", e)
+    
+    def update_refresh(self):
+        """Put every light commanded so far into the cyclic LIGHTS_REFRESH frame (see cyclic.py)"""
+        lights = {light: (STATUS_CODES[status], MODE_CODES[self.latest_mode])
+                  for light, status in self.last_processed_status.items() if status is not None}
+        if not lights:
+            return
+        try:
+            self.refresh.update([encode_lights(lights)])
+        except (can.CanError, OSError, ValueError) as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error updating the refresh frame: %s", e)
+    
+    def request_snapshot(self):
+        """Ask the light slave for the state of every light in one frame"""
+        try:
+            data = encode_request(SNAPSHOT_LIGHTS, self.fd)
+            self.transmitter.send(can.Message(arbitration_id=SNAPSHOT_REQUEST_ID, data=data, is_extended_id=False))
+            FRAMES_SENT[SNAPSHOT_REQUEST_ID].inc()
+            can_log.info("Sent snapshot request (ID: %s)", hex(SNAPSHOT_REQUEST_ID), extra={'can_id': SNAPSHOT_REQUEST_ID})
+        except Exception as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error sending snapshot request: %s", e)
     
     def parse_response_frame(self, msg):
         """Parse response CAN message from slave"""
+        if msg.arbitration_id in (LIGHTS_STATUS_ID, LIGHT_SNAPSHOT_ID):
+            return {light: {"status": STATUS_NAMES.get(status_code, f"Unknown: {hex(status_code)}"),
+                            "mode": MODE_NAMES.get(mode_code, f"Unknown: {hex(mode_code)}")}
+                    for light, (status_code, mode_code) in decode_lights(msg.data).items()} or None
         try:
             light = next((name for name, can_id in RESPONSE_IDS.items() if can_id == msg.arbitration_id), None)
             if light and len(msg.data) >= 2:
@@ -184,7 +311,7 @@ class CANLightMaster:
                     }
                 }
         except (IndexError, ValueError) as e:
-            print(f"Error parsing response: {e}")
+            can_log.warning("Error parsing response: %s", e)
         return None
     
     def write_response_to_file(self, status):
@@ -193,12 +320,16 @@ class CANLightMaster:
             with open("lighting_response.txt", 'a') as f:
                 for light, data in status.items():
                     f.write(f"{light} | {data['status']} | {data['mode']}\n")
-            print("Response status written to lighting_response.txt")
+            file_log.debug("Response status written to lighting_response.txt")
         except Exception as e:
-            print(f"Error writing to lighting_response.txt: {e}")
+            file_log.error("Error writing to lighting_response.txt: %s", e)
     
     def update_database(self, status):
         """Update the database only when light status changes"""
+        with DB_WRITES.time():
+            self._update_database(status)
+    
+    def _update_database(self, status):
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         updates = []
         
@@ -228,34 +359,67 @@ class CANLightMaster:
                 # Execute all updates in a single transaction
                 self.db_cursor.executemany(update_query, [(val, ts, eid) for eid, val, ts in updates])
                 self.db_connection.commit()
-                print(f"Updated {len(updates)} records in database")
-                for eid, val, ts in updates:
-                    light_name = next((k for k, v in EVENT_IDS.items() if v == eid), "Unknown")
-                    print(f"  - {light_name} (ID: {eid}): {val} at {ts}")
+                db_log.info("Updated %d records in database", len(updates),
+                            extra={'updates': [(eid, val) for eid, val, ts in updates]})
             else:
-                print("No database updates needed - all states are current")
+                db_log.debug("No database updates needed - all states are current")
                 
         except Error as e:
-            print(f"Error updating MySQL database: {e}")
+            db_log.error("Error updating MySQL database: %s", e)
             if not self.db_connection.is_connected():
-                print("Database connection lost; will attempt to reconnect on next update")
+                db_log.warning("Database connection lost; will attempt to reconnect on next update")
     
     def monitor_responses(self):
         """Monitor CAN bus for response messages from slave"""
-        print("Listening for response CAN messages...")
+        can_log.info("Listening for response CAN messages...")
         try:
             while self.running:
                 msg = self.bus.recv(timeout=1.0)
-                if msg and msg.arbitration_id in RESPONSE_IDS.values():
-                    status = self.parse_response_frame(msg)
-                    if status:
-                        print("\nReceived Light Status:")
-                        for light, data in status.items():
-                            print(f"{light}: {data['status']} | {data['mode']}")
-                        self.write_response_to_file(status)
-                        self.update_database(status)
+                self.check_response_timeouts()
+                if msg and msg.is_error_frame:
+                    # Error classes share the ID space (0x101: restarted + TX timeout)
+                    self.transmitter.on_error_frame(msg)
+                elif msg:
+                    self.handle_response(msg)
         except Exception as e:
-            print(f"Response monitoring error: {e}")
+            can_log.error("Response monitoring error: %s", e)
+    
+    def handle_response(self, msg):
+        """Process one frame from the bus; frames of other IDs are ignored"""
+        if msg.arbitration_id not in FRAMES_RECEIVED:
+            return
+        # 0x101 is also the wiper response, which is 8 bytes long
+        if msg.arbitration_id in RESPONSE_IDS.values() and len(msg.data) > 3:
+            return
+        FRAMES_RECEIVED[msg.arbitration_id].inc()
+        self.awaiting_response.pop(msg.arbitration_id, None)
+        status = self.parse_response_frame(msg)
+        if msg.arbitration_id == LIGHT_SNAPSHOT_ID:
+            traces = []  # snapshots answer no command
+        elif msg.arbitration_id == LIGHTS_STATUS_ID:
+            traces = [self.tracer.match_response(LIGHTS_STATUS_ID) for _ in status or ()]
+        else:
+            traces = [self.tracer.match_response(msg.arbitration_id, msg.data[2] if len(msg.data) > 2 else None)]
+        for trace in traces:
+            self.tracer.stamp(trace, 'bus_round_trip')
+        if status:
+            for light, data in status.items():
+                can_log.info("Received: %s | %s | %s", light, data['status'], data['mode'],
+                             extra={'can_id': msg.arbitration_id})
+            self.write_response_to_file(status)
+            for trace in traces:
+                self.tracer.stamp(trace, 'response_file')
+            self.update_database(status)
+            for trace in traces:
+                self.tracer.finish(trace, 'db_update')
+    
+    def check_response_timeouts(self):
+        """Count commands the slave has not answered within RESPONSE_TIMEOUT"""
+        now = time.monotonic()
+        for can_id, sent_at in list(self.awaiting_response.items()):
+            if now - sent_at > RESPONSE_TIMEOUT and self.awaiting_response.pop(can_id, None):
+                RESPONSE_TIMEOUTS.labels('light_master', hex(can_id)).inc()
+                can_log.warning("No response for ID %s within %s s", hex(can_id), RESPONSE_TIMEOUT)
     
     def start_response_monitor(self):
         """Start a thread to monitor response messages"""
@@ -263,67 +427,101 @@ class CANLightMaster:
         self.response_thread.start()
     
     def monitor_file(self):
-        print(f"Monitoring {self.filename} for new light status updates...")
-        print("Add new lines to the file to send CAN messages")
+        file_log.info("Monitoring %s for new light status updates...", self.filename)
         
         try:
             while self.running:
-                current_size = os.path.getsize(self.filename)
-                
-                if current_size > self.last_size:
-                    with open(self.filename, 'r') as f:
-                        f.seek(self.last_size)
-                        new_content = f.read()
-                        self.last_size = current_size
-                        
-                        for line in new_content.split('\n'):
-                            if line.strip() and line.startswith("Light:"):
-                                try:
-                                    parts = [p.strip() for p in line.split('|')]
-                                    if len(parts) < 3:
-                                        print(f"Skipping incomplete line: {line}")
-                                        continue
-                                        
-                                    light = parts[0].split(':')[1].strip()
-                                    status = parts[1].split(':')[1].strip().upper()
-                                    mode = parts[2].split(':')[1].strip().upper()
-                                    
-                                    if (light in LIGHT_IDS and 
-                                        status in STATUS_CODES and 
-                                        mode in MODE_CODES):
-                                        
-                                        if (self.last_processed_status[light] != status or 
-                                            self.last_processed_mode[light] != mode):
-                                            
-                                            self.send_can_message(light, status, mode)
-                                            self.last_processed_status[light] = status
-                                            self.last_processed_mode[light] = mode
-                                            print(f"Processed status/mode change for {light}: {status}/{mode}")
-                                        else:
-                                            print(f"No change in {light} status/mode, skipping")
-                                    else:
-                                        print(f"Ignoring unknown light/status/mode: {line}")
-                                except (IndexError, ValueError) as e:
-                                    print(f"Malformed line: {line} - Error: {e}")
-                
+                self.process_available()
                 time.sleep(0.1)
                 
         except KeyboardInterrupt:
             self.shutdown()
     
+    def process_available(self):
+        """Handle the complete lines appended to the file since the last call.
+
+        Safe to call on every file event: a line still being written is left
+        for the next call, and a truncated file is read again from the start.
+        """
+        current_size = os.path.getsize(self.filename)
+        if current_size < self.last_size:
+            self.last_size = 0
+        if current_size == self.last_size:
+            return 0
+        
+        with open(self.filename, 'rb') as f:
+            f.seek(self.last_size)
+            new_content = f.read(current_size - self.last_size)
+        read_ns = time.monotonic_ns()
+        complete = new_content[:new_content.rfind(b'\n') + 1]
+        self.last_size += len(complete)
+        
+        lines = complete.decode(errors='replace').splitlines()
+        if lines:
+            self.on_new_lines(lines, read_ns)
+        return len(lines)
+    
+    def on_new_lines(self, lines, read_ns=None):
+        """Send the CAN commands for new analysis lines"""
+        read_ns = read_ns or time.monotonic_ns()
+        changed = False
+        for line in lines:
+            line, trace_tag = split_trace_field(line)
+            if line.strip() and line.startswith("Light:"):
+                try:
+                    parts = [p.strip() for p in line.split('|')]
+                    if len(parts) < 3:
+                        MALFORMED_LINES.inc()
+                        file_log.warning("Skipping incomplete line: %s", line)
+                        continue
+
+                    light = parts[0].split(':')[1].strip()
+                    status = parts[1].split(':')[1].strip().upper()
+                    mode = parts[2].split(':')[1].strip().upper()
+
+                    if (light in LIGHT_IDS and 
+                        status in STATUS_CODES and 
+                        mode in MODE_CODES):
+
+                        if (self.last_processed_status[light] != status or 
+                            self.last_processed_mode[light] != mode):
+
+                            trace = self.tracer.begin(trace_tag, read_ns, 'master_poll')
+                            self.send_can_message(light, status, mode, trace)
+                            self.last_processed_status[light] = status
+                            self.last_processed_mode[light] = mode
+                            self.latest_mode = mode
+                            changed = True
+                            file_log.debug("Processed status/mode change for %s: %s/%s", light, status, mode)
+                        else:
+                            file_log.debug("No change in %s status/mode, skipping", light)
+                    else:
+                        file_log.warning("Ignoring unknown light/status/mode: %s", line)
+                except (IndexError, ValueError) as e:
+                    MALFORMED_LINES.inc()
+                    file_log.warning("Malformed line: %s - Error: %s", line, e)
+        self.flush_light_commands()
+        if changed:
+            self.update_refresh()
+    
     def shutdown(self):
         self.running = False
         if hasattr(self, 'response_thread') and self.response_thread.is_alive():
             self.response_thread.join(timeout=0.5)
-        if self.bus:
+        if self.owns_bus and self.transmitter:
+            self.transmitter.stop()
+        self.refresh.stop()
+        if self.bus and self.owns_bus:
             self.bus.shutdown()
         if self.db_connection and self.db_connection.is_connected():
             self.db_cursor.close()
             self.db_connection.close()
-            print("MySQL connection closed")
-        os.system(f'sudo /sbin/ip link set {self.channel} down')
-        print("Shutdown complete")
+            db_log.info("MySQL connection closed")
+        if self.owns_bus:
+            os.system(f'sudo /sbin/ip link set {self.channel} down')
+        log.info("Shutdown complete")
 
 if __name__ == "__main__":
+    setup_logging('light_master', 'light_master.log')
     master = CANLightMaster("Lights_analysis.txt")
     master.monitor_file()
\ No newline at end of file
@@ -2,9 +2,18 @@ import can
 import time
 import os
 import threading
+import logging
 from datetime import datetime
 import mysql.connector
 from mysql.connector import Error
+import metrics
+from async_logging import setup_logging
+from stage_trace import StageTracer, split_trace_field
+from can_fd import open_bus
+from snapshot import (SNAPSHOT_REQUEST_ID, WINDOW_SNAPSHOT_ID, WINDOW_SNAPSHOT_CLASSIC_ID, SNAPSHOT_WINDOWS,
+                      encode_request, decode_window_snapshot, encode_window_snapshot)
+from can_tx import CANTransmitter
+from cyclic import CyclicFrame, WINDOW_REFRESH_ID
 
 # CAN IDs for each window type
 WINDOW_IDS = {
@@ -38,42 +47,80 @@ EVENT_IDS = {
 LEVEL_TYPES = ["AUTO", "MANUAL"]
 MODES = ["WHONEN", "FAHREN"]
 
+log = logging.getLogger('window_master')
+can_log = logging.getLogger('window_master.can')
+db_log = logging.getLogger('window_master.db')
+file_log = logging.getLogger('window_master.file')
+
+METRICS_PORT = 9102
+RESPONSE_TIMEOUT = 6.0  # seconds; the slave animates up to 4 LEDs at 1 s each
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+RESPONSE_TIMEOUTS = metrics.counter('pfe_response_timeouts', 'Commands not answered in time', ('service', 'id'))
+DB_WRITE_SECONDS = metrics.histogram('pfe_db_write_seconds', 'Duration of protocol_data updates', ('service',))
+
+SNAPSHOT_IDS = (WINDOW_SNAPSHOT_ID, WINDOW_SNAPSHOT_CLASSIC_ID)
+
+FRAMES_SENT = {can_id: FRAMES.labels('window_master', 'tx', hex(can_id))
+               for can_id in (*WINDOW_IDS.values(), SNAPSHOT_REQUEST_ID)}
+FRAMES_RECEIVED = {can_id: FRAMES.labels('window_master', 'rx', hex(can_id))
+                   for can_id in (*RESPONSE_IDS.values(), *SNAPSHOT_IDS)}
+SEND_ERRORS = ERRORS.labels('window_master', 'send')
+MALFORMED_LINES = ERRORS.labels('window_master', 'malformed_line')
+DB_WRITES = DB_WRITE_SECONDS.labels('window_master')
+
 class CANWindowMaster:
-    def __init__(self, filename):
+    def __init__(self, filename, bus=None, db_pool=None):
         self.filename = filename
         self.channel = 'can0'
         self.bustype = 'socketcan'
-        self.bus = None
+        self.bus = bus
+        self.owns_bus = bus is None  # False when hosted by the supervisor
+        self.transmitter = bus  # the supervisor's shared bus queues its sends itself
+        self.fd = getattr(bus, 'fd', False)
+        self.db_pool = db_pool
         self.last_size = os.path.getsize(filename)
         self.running = True
         self.db_connection = None
         self.db_cursor = None
         self.last_processed_status = {window: None for window in WINDOW_IDS}
+        self.tracer = StageTracer('window_master')
+        self.awaiting_response = {}  # CAN ID -> monotonic send time
+        self.commanded = {}  # window -> entry bytes of its latest command, for the refresh frames
         
-        self.init_can_bus()
+        metrics.start_http_server(METRICS_PORT)
+        if self.owns_bus:
+            self.init_can_bus()
+        self.refresh = CyclicFrame(self.bus, WINDOW_REFRESH_ID)
         self.init_db_connection()
-        self.start_response_monitor()
+        if self.owns_bus:
+            self.start_response_monitor()
     
     def init_can_bus(self):
         try:
-            os.system(f'sudo /sbin/ip link set {self.channel} up type can bitrate 500000')
-            time.sleep(0.1)
-            self.bus = can.interface.Bus(channel=self.channel, bustype=self.bustype)
-            print("CAN initialized")
+            self.bus, self.fd = open_bus(self.channel, self.bustype)
+            self.transmitter = CANTransmitter(self.bus, 'window_master',
+                                              self.channel if self.bustype == 'socketcan' else None, self.fd)
+            self.transmitter.start()
+            can_log.info("CAN initialized (%s)", "CAN FD" if self.fd else "classic")
         except Exception as e:
-            print(f"CAN init failed: {e}")
+            can_log.error("CAN init failed: %s", e)
             raise
     
     def init_db_connection(self):
         try:
-            self.db_connection = mysql.connector.connect(
-                host="10.20.0.23",
-                user="myuser1",
-                password="root",
-                database="khalil"
-            )
+            if self.db_pool:
+                self.db_connection = self.db_pool.get_connection()
+            else:
+                self.db_connection = mysql.connector.connect(
+                    host="10.20.0.23",
+                    user="myuser1",
+                    password="root",
+                    database="khalil"
+                )
             self.db_cursor = self.db_connection.cursor()
-            print("MySQL database connection established")
+            db_log.info("MySQL database connection established")
             
             create_table_query = """
             CREATE TABLE IF NOT EXISTS protocol_data (
@@ -98,13 +145,13 @@ class CANWindowMaster:
                 for event_id in missing_ids:
                     self.db_cursor.execute(insert_query, (event_id, 0, timestamp))
                 self.db_connection.commit()
-                print(f"Initialized {len(missing_ids)} missing window rows in protocol_data")
+                db_log.info("Initialized %d missing window rows in protocol_data", len(missing_ids))
             
         except Error as e:
-            print(f"Error connecting to MySQL: {e}")
+            db_log.error("Error connecting to MySQL: %s", e)
             raise
     
-    def send_can_message(self, window, result, level, level_type, mode, safety):
+    def send_can_message(self, window, result, level, level_type, mode, safety, trace=None):
         try:
             result_index = RESULT_CODES.index(result)
             msg_data = [
@@ -114,53 +161,87 @@ class CANWindowMaster:
                 MODES.index(mode.upper()),
                 1 if safety == "ON" else 0
             ]
+            self.commanded[window] = list(msg_data)
+            # Traced commands carry a sequence byte the slave echoes back
+            sequence = self.tracer.expect_response(trace, WINDOW_IDS[window])
+            if sequence is not None:
+                msg_data.append(sequence)
             
             msg = can.Message(
                 arbitration_id=WINDOW_IDS[window],
                 data=msg_data,
                 is_extended_id=False
             )
-            self.bus.send(msg)
-            print(f"Sent: {window} | {result} | {level}% | {level_type} | {mode} | safety_{safety} (ID: {hex(WINDOW_IDS[window])}, Data: {msg_data})")
+            self.transmitter.send(msg)
+            self.tracer.stamp(trace, 'master_send')
+            FRAMES_SENT[WINDOW_IDS[window]].inc()
+            self.awaiting_response[WINDOW_IDS[window]] = time.monotonic()
+            can_log.info("Sent: %s | %s | %s%% | %s | %s | safety_%s (ID: %s)", window, result, level, level_type,
+                         mode, safety, hex(WINDOW_IDS[window]), extra={'can_id': WINDOW_IDS[window], 'data': msg_data})
         except Exception as e:
-            print(f"Error sending CAN message: {e}")
+            SEND_ERRORS.inc()
+            can_log.error("Error sending CAN message: %s", e)
+    
+    def update_refresh(self):
+        """Put every window commanded so far into the cyclic WINDOW_REFRESH frames (see cyclic.py)"""
+        if not self.commanded:
+            return
+        try:
+            self.refresh.update([data for _, data in encode_window_snapshot(self.commanded, fd=False)])
+        except (can.CanError, OSError, ValueError) as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error updating the refresh frames: %s", e)
+    
+    def request_snapshot(self):
+        """Ask the window slave for the state of all four windows (one frame with CAN FD)"""
+        try:
+            data = encode_request(SNAPSHOT_WINDOWS, self.fd)
+            self.transmitter.send(can.Message(arbitration_id=SNAPSHOT_REQUEST_ID, data=data, is_extended_id=False))
+            FRAMES_SENT[SNAPSHOT_REQUEST_ID].inc()
+            can_log.info("Sent snapshot request (ID: %s)", hex(SNAPSHOT_REQUEST_ID), extra={'can_id': SNAPSHOT_REQUEST_ID})
+        except Exception as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error sending snapshot request: %s", e)
     
     def parse_response_frame(self, msg):
         """Parse response CAN message from slave"""
         try:
-            window = next((name for name, can_id in RESPONSE_IDS.items() if can_id == msg.arbitration_id), None)
-            if window and len(msg.data) >= 5:
-                result = RESULT_CODES[msg.data[0]]
-                level = msg.data[1]
-                level_type = LEVEL_TYPES[msg.data[2]] if len(msg.data) > 2 else "AUTO"
-                mode = MODES[msg.data[3]] if len(msg.data) > 3 else "WHONEN"
-                safety = "ON" if msg.data[4] == 1 else "OFF"
-                
-                return {
-                    window: {
-                        "result": result,
-                        "level": level,
-                        "level_type": level_type,
-                        "mode": mode,
-                        "safety": safety
-                    }
-                }
+            if msg.arbitration_id in SNAPSHOT_IDS:
+                entries = decode_window_snapshot(msg.data)
+            else:
+                window = next((name for name, can_id in RESPONSE_IDS.items() if can_id == msg.arbitration_id), None)
+                entries = {window: msg.data} if window and len(msg.data) >= 5 else {}
+            return {window: self.parse_window_entry(data) for window, data in entries.items()} or None
         except (IndexError, ValueError) as e:
-            print(f"Error parsing response: {e}")
+            can_log.warning("Error parsing response: %s", e)
         return None
     
+    def parse_window_entry(self, data):
+        """Result, level, level type, mode and safety bytes of one window"""
+        return {
+            "result": RESULT_CODES[data[0]],
+            "level": data[1],
+            "level_type": LEVEL_TYPES[data[2]],
+            "mode": MODES[data[3]],
+            "safety": "ON" if data[4] == 1 else "OFF"
+        }
+    
     def write_response_to_file(self, status):
         """Write response status to window_response.txt"""
         try:
             with open("window_response.txt", 'a') as f:
                 for window, data in status.items():
                     f.write(f"{window} | {data['result']} | {data['level']} | {data['level_type']} | {data['mode']} | safety_{data['safety']}\n")
-            print("Response status written to window_response.txt")
+            file_log.debug("Response status written to window_response.txt")
         except Exception as e:
-            print(f"Error writing to window_response.txt: {e}")
+            file_log.error("Error writing to window_response.txt: %s", e)
     
     def update_database(self, status):
         """Update the database with window status levels"""
+        with DB_WRITES.time():
+            self._update_database(status)
+    
+    def _update_database(self, status):
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
         try:
@@ -179,32 +260,59 @@ class CANWindowMaster:
                 
                 if self.last_processed_status[window] != level:
                     self.db_cursor.execute(update_query, (level, timestamp, event_id))
-                    print(f"Updated MySQL database: event_id={event_id} ({window}), message={level} at {timestamp}")
+                    db_log.info("Updated MySQL database: event_id=%s (%s), message=%s", event_id, window, level)
                     self.last_processed_status[window] = level
             
             self.db_connection.commit()
             
         except Error as e:
-            print(f"Error updating MySQL database: {e}")
+            db_log.error("Error updating MySQL database: %s", e)
             if not self.db_connection.is_connected():
-                print("Database connection lost; will attempt to reconnect on next update")
+                db_log.warning("Database connection lost; will attempt to reconnect on next update")
     
     def monitor_responses(self):
         """Monitor CAN bus for response messages from slave"""
-        print("Listening for response CAN messages...")
+        can_log.info("Listening for response CAN messages...")
         try:
             while self.running:
                 msg = self.bus.recv(timeout=1.0)
-                if msg and msg.arbitration_id in RESPONSE_IDS.values():
-                    status = self.parse_response_frame(msg)
-                    if status:
-                        print("\nReceived Window Status:")
-                        for window, data in status.items():
-                            print(f"{window}: {data['result']} | {data['level']}% | {data['level_type']} | {data['mode']} | safety_{data['safety']}")
-                        self.write_response_to_file(status)
-                        self.update_database(status)
+                self.check_response_timeouts()
+                if msg and msg.is_error_frame:
+                    # Error classes share the ID space (0x201: counters + TX timeout)
+                    self.transmitter.on_error_frame(msg)
+                elif msg:
+                    self.handle_response(msg)
         except Exception as e:
-            print(f"Response monitoring error: {e}")
+            can_log.error("Response monitoring error: %s", e)
+    
+    def handle_response(self, msg):
+        """Process one frame from the bus; frames of other IDs are ignored"""
+        if msg.arbitration_id not in FRAMES_RECEIVED:
+            return
+        FRAMES_RECEIVED[msg.arbitration_id].inc()
+        self.awaiting_response.pop(msg.arbitration_id, None)
+        if msg.arbitration_id in SNAPSHOT_IDS:
+            trace = None  # snapshots answer no command
+        else:
+            trace = self.tracer.match_response(msg.arbitration_id, msg.data[5] if len(msg.data) > 5 else None)
+        self.tracer.stamp(trace, 'bus_round_trip')
+        status = self.parse_response_frame(msg)
+        if status:
+            for window, data in status.items():
+                can_log.info("Received: %s | %s | %s%% | %s | %s | safety_%s", window, data['result'], data['level'],
+                             data['level_type'], data['mode'], data['safety'], extra={'can_id': msg.arbitration_id})
+            self.write_response_to_file(status)
+            self.tracer.stamp(trace, 'response_file')
+            self.update_database(status)
+            self.tracer.finish(trace, 'db_update')
+    
+    def check_response_timeouts(self):
+        """Count commands the slave has not answered within RESPONSE_TIMEOUT"""
+        now = time.monotonic()
+        for can_id, sent_at in list(self.awaiting_response.items()):
+            if now - sent_at > RESPONSE_TIMEOUT and self.awaiting_response.pop(can_id, None):
+                RESPONSE_TIMEOUTS.labels('window_master', hex(can_id)).inc()
+                can_log.warning("No response for ID %s within %s s", hex(can_id), RESPONSE_TIMEOUT)
     
     def start_response_monitor(self):
         """Start a thread to monitor response messages"""
@@ -212,90 +320,119 @@ class CANWindowMaster:
         self.response_thread.start()
     
     def monitor_file(self):
-        print(f"Monitoring {self.filename} for new window status updates...")
-        print("Add new lines to the file to send CAN messages")
+        file_log.info("Monitoring %s for new window status updates...", self.filename)
         
         try:
             while self.running:
-                current_size = os.path.getsize(self.filename)
-                
-                if current_size > self.last_size:
-                    with open(self.filename, 'r') as f:
-                        f.seek(self.last_size)
-                        new_content = f.read()
-                        self.last_size = current_size
-                        
-                        for line in new_content.split('\n'):
-                            if line.strip() and line.startswith("Window:"):
-                                try:
-                                    # Split and clean all parts
-                                    parts = [p.strip() for p in line.split('|')]
-                                    if len(parts) < 6:
-                                        print(f"Skipping incomplete line: {line}")
-                                        continue
-                                        
-                                    window = parts[0].split(':')[1].strip()
-                                    result = parts[1].split(':')[1].strip()
-                                    level = int(parts[2].split(':')[1].strip().replace('%', ''))
-                                    level_type = parts[3].split(':')[1].strip().upper()
-                                    mode = parts[4].split(':')[1].strip().upper()
-                                    safety = parts[5].split(':')[1].strip().upper()
-                                    
-                                    # Validate window
-                                    if window not in WINDOW_IDS:
-                                        print(f"Invalid window: {window}")
-                                        continue
-                                        
-                                    # Validate result
-                                    if result not in RESULT_CODES:
-                                        print(f"Invalid result: {result}")
-                                        continue
-                                        
-                                    # Validate level
-                                    if not 0 <= level <= 100:
-                                        print(f"Invalid level: {level}")
-                                        continue
-                                        
-                                    # Validate level_type
-                                    if level_type not in LEVEL_TYPES:
-                                        print(f"Invalid level_type: {level_type}")
-                                        continue
-                                        
-                                    # Validate mode (case insensitive)
-                                    if mode.upper() not in [m.upper() for m in MODES]:
-                                        print(f"Invalid mode: {mode}")
-                                        continue
-                                        
-                                    # Validate safety
-                                    if safety not in ["ON", "OFF"]:
-                                        print(f"Invalid safety value: {safety}")
-                                        continue
-                                    
-                                    # Convert mode to standard case
-                                    mode = MODES[[m.upper() for m in MODES].index(mode.upper())]
-                                    
-                                    self.send_can_message(window, result, level, level_type, mode, safety)
-                                except (IndexError, ValueError) as e:
-                                    print(f"Malformed line: {line} - Error: {e}")
-                
+                self.process_available()
                 time.sleep(0.1)
                 
         except KeyboardInterrupt:
             self.shutdown()
     
+    def process_available(self):
+        """Handle the complete lines appended to the file since the last call.
+
+        Safe to call on every file event: a line still being written is left
+        for the next call, and a truncated file is read again from the start.
+        """
+        current_size = os.path.getsize(self.filename)
+        if current_size < self.last_size:
+            self.last_size = 0
+        if current_size == self.last_size:
+            return 0
+        
+        with open(self.filename, 'rb') as f:
+            f.seek(self.last_size)
+            new_content = f.read(current_size - self.last_size)
+        read_ns = time.monotonic_ns()
+        complete = new_content[:new_content.rfind(b'\n') + 1]
+        self.last_size += len(complete)
+        
+        lines = complete.decode(errors='replace').splitlines()
+        if lines:
+            self.on_new_lines(lines, read_ns)
+        return len(lines)
+    
+    def on_new_lines(self, lines, read_ns=None):
+        """Send the CAN commands for new analysis lines"""
+        read_ns = read_ns or time.monotonic_ns()
+        for line in lines:
+            line, trace_tag = split_trace_field(line)
+            if line.strip() and line.startswith("Window:"):
+                try:
+                    # Split and clean all parts
+                    parts = [p.strip() for p in line.split('|')]
+                    if len(parts) < 6:
+                        MALFORMED_LINES.inc()
+                        file_log.warning("Skipping incomplete line: %s", line)
+                        continue
+
+                    window = parts[0].split(':')[1].strip()
+                    result = parts[1].split(':')[1].strip()
+                    level = int(parts[2].split(':')[1].strip().replace('%', ''))
+                    level_type = parts[3].split(':')[1].strip().upper()
+                    mode = parts[4].split(':')[1].strip().upper()
+                    safety = parts[5].split(':')[1].strip().upper()
+
+                    # Validate window
+                    if window not in WINDOW_IDS:
+                        file_log.warning("Invalid window: %s", window)
+                        continue
+
+                    # Validate result
+                    if result not in RESULT_CODES:
+                        file_log.warning("Invalid result: %s", result)
+                        continue
+
+                    # Validate level
+                    if not 0 <= level <= 100:
+                        file_log.warning("Invalid level: %s", level)
+                        continue
+
+                    # Validate level_type
+                    if level_type not in LEVEL_TYPES:
+                        file_log.warning("Invalid level_type: %s", level_type)
+                        continue
+
+                    # Validate mode (case insensitive)
+                    if mode.upper() not in [m.upper() for m in MODES]:
+                        file_log.warning("Invalid mode: %s", mode)
+                        continue
+
+                    # Validate safety
+                    if safety not in ["ON", "OFF"]:
+                        file_log.warning("Invalid safety value: %s", safety)
+                        continue
+
+                    # Convert mode to standard case
+                    mode = MODES[[m.upper() for m in MODES].index(mode.upper())]
+
+                    trace = self.tracer.begin(trace_tag, read_ns, 'master_poll')
+                    self.send_can_message(window, result, level, level_type, mode, safety, trace)
+                except (IndexError, ValueError) as e:
+                    MALFORMED_LINES.inc()
+                    file_log.warning("Malformed line: %s - Error: %s", line, e)
+        self.update_refresh()
+    
     def shutdown(self):
         self.running = False
         if hasattr(self, 'response_thread') and self.response_thread.is_alive():
             self.response_thread.join(timeout=0.5)
-        if self.bus:
+        if self.owns_bus and self.transmitter:
+            self.transmitter.stop()
+        self.refresh.stop()
+        if self.bus and self.owns_bus:
             self.bus.shutdown()
         if self.db_connection and self.db_connection.is_connected():
             self.db_cursor.close()
             self.db_connection.close()
-            print("MySQL connection closed")
-        os.system(f'sudo /sbin/ip link set {self.channel} down')
-        print("Shutdown complete")
+            db_log.info("MySQL connection closed")
+        if self.owns_bus:
+            os.system(f'sudo /sbin/ip link set {self.channel} down')
+        log.info("Shutdown complete")
 
 if __name__ == "__main__":
+    setup_logging('window_master', 'window_master.log')
     master = CANWindowMaster("windows_analysis.txt")
     master.monitor_file()
\ No newline at end of file
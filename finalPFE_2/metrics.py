@@ -0,0 +1,298 @@
+"""
+In-process metrics registry served in the Prometheus text format.
+
+Scripts create their metrics at import time and bind the label values of the
+hot path once, so counting a frame costs a dict lookup plus a locked add
+(well under 1 us on a Pi):
+
+    FRAMES = metrics.counter('pfe_frames', 'Frames per ID', ('service', 'direction', 'id'))
+    SENT = {can_id: FRAMES.labels('light_master', 'tx', hex(can_id)) for can_id in IDS}
+    SENT[can_id].inc()
+
+One HTTP endpoint runs per process (the first start_http_server() call wins)
+and serves every metric of the process on /metrics. Scrapers that ask for
+application/openmetrics-text get the OpenMetrics flavour.
+
+    METRICS_PORT=9101     override the port a script passes in (0 disables)
+    METRICS_ADDR=0.0.0.0  interface to bind
+"""
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; sized for MySQL round trips on the lab network
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+_server = None
+_server_lock = threading.Lock()
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Value:
+    """One counter or gauge series; the lock keeps += correct across threads."""
+    __slots__ = ('value', 'lock', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+        self.function = None
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from `function()` at scrape time instead."""
+        self.function = function
+
+    def get(self):
+        if self.function is None:
+            return self.value
+        try:
+            return self.function()
+        except Exception:
+            return float('nan')
+
+class HistogramValue:
+    """One histogram series; counts[i] holds observations <= buckets[i], last is +Inf."""
+    __slots__ = ('buckets', 'counts', 'sum', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block."""
+        return Timer(self)
+
+class Timer:
+    def __init__(self, target):
+        self.target = target
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+        return False
+
+class Metric:
+    """A metric family: one series per combination of label values."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def new_child(self):
+        return Value()
+
+    def labels(self, *values):
+        """Series for these label values (positional, in labelnames order)."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use .labels()")
+        return self.labels()
+
+    def samples(self, openmetrics):
+        """Yield (name suffix, label text, value) for every series."""
+        for values, child in sorted(self.children.items()):
+            yield '', _format_labels(self.labelnames, values), child.get()
+
+    def render(self, openmetrics=False):
+        family = self.name
+        lines = [f'# HELP {family} {self.documentation}', f'# TYPE {family} {self.kind}']
+        for suffix, labels, value in self.samples(openmetrics):
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def render(self, openmetrics=False):
+        # OpenMetrics names the family without _total, the text format with it
+        family = self.name if openmetrics else self.name + '_total'
+        lines = [f'# HELP {family} {self.documentation}', f'# TYPE {family} counter']
+        for values, child in sorted(self.children.items()):
+            lines.append(f'{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.get())}')
+        return lines
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def samples(self, openmetrics):
+        for values, child in sorted(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', _format_labels(self.labelnames, values, f'le="{_format_value(float(bound))}"'), cumulative
+            yield '_sum', _format_labels(self.labelnames, values), total
+            yield '_count', _format_labels(self.labelnames, values), cumulative
+
+class Registry:
+    """All metrics of the process, plus collectors that render their own lines."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def get_or_create(self, cls, name, documentation, labelnames=(), **kwargs):
+        # Master and slave modules may share a process (bench harness), so a
+        # second definition of the same metric returns the first one
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def add_collector(self, collector):
+        """`collector()` returns text-format lines (HELP/TYPE included)."""
+        with self.lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def render(self, openmetrics=False):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+            collectors = list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(openmetrics))
+        for collector in collectors:
+            lines.extend(line for line in collector().splitlines() if line)
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.get_or_create(Counter, name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.get_or_create(Gauge, name, documentation, labelnames)
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = REGISTRY.render(openmetrics).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, addr=None):
+    """Serve REGISTRY on `port` unless this process already serves it.
+
+    Returns the running server, or None when disabled or the port is taken
+    (metrics are then still counted, just not exposed).
+    """
+    global _server
+    port = int(os.environ.get('METRICS_PORT', port))
+    addr = addr or os.environ.get('METRICS_ADDR', '0.0.0.0')
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((addr, port), MetricsHandler)
+        except OSError as e:
+            print(f"Metrics endpoint not started on {addr}:{port}: {e}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f"Metrics available on http://{addr}:{port}/metrics")
+        return _server
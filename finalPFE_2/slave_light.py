@@ -4,6 +4,15 @@ import logging
 import os
 import time
 import threading
+import metrics
+from async_logging import setup_logging
+from stage_trace import StageTracer
+from light_frames import LIGHTS_CTRL_ID, LIGHTS_STATUS_ID, encode_lights, decode_lights
+from can_fd import open_bus
+from snapshot import SNAPSHOT_REQUEST_ID, LIGHT_SNAPSHOT_ID, SNAPSHOT_LIGHTS, decode_request
+from cyclic import LIGHTS_REFRESH_ID, RefreshMonitor
+from isotp_channel import IsoTpChannel
+from slave_service import SlaveService, LIGHT_SERVICE_IDS, STATE_DUMP_DID, LED_TABLE_DID, service_counters
 
 # Light ID definitions (matches master)
 LIGHT_IDS = {
@@ -77,21 +86,34 @@ SHIFT_REGISTER_PINS = {
     'Clear': 7
 }
 
+METRICS_PORT = 9111
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+SHIFT_REGISTER_REFRESHES = metrics.counter('pfe_shift_register_refreshes', 'Shift register chain rewrites', ('service',))
+EFFECT_THREADS = metrics.gauge('pfe_effect_threads', 'Running effect/animation threads', ('service',))
+
+FRAMES_RECEIVED = {can_id: FRAMES.labels('light_slave', 'rx', hex(can_id))
+                   for can_id in (*LIGHT_IDS, LIGHTS_CTRL_ID, LIGHTS_REFRESH_ID)}
+FRAMES_SENT = {light: FRAMES.labels('light_slave', 'tx', hex(can_id)) for light, can_id in RESPONSE_IDS.items()}
+LIGHTS_FRAMES_SENT = FRAMES.labels('light_slave', 'tx', hex(LIGHTS_STATUS_ID))
+SNAPSHOT_REQUESTS = FRAMES.labels('light_slave', 'rx', hex(SNAPSHOT_REQUEST_ID))
+SNAPSHOT_FRAMES_SENT = FRAMES.labels('light_slave', 'tx', hex(LIGHT_SNAPSHOT_ID))
+SEND_ERRORS = ERRORS.labels('light_slave', 'send')
+REFRESH_TIMEOUTS = ERRORS.labels('light_slave', 'refresh_timeout')
+REFRESHES = SHIFT_REGISTER_REFRESHES.labels('light_slave')
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('light_slave.log'),
-        logging.StreamHandler()
-    ]
-)
+log = setup_logging('light_slave', 'light_slave.log')
+can_log = logging.getLogger('light_slave.can')
+gpio_log = logging.getLogger('light_slave.gpio')
 
 class CANLightSlave:
     def __init__(self):
         self.channel = 'can0'
         self.bustype = 'socketcan'
         self.bus = None
+        self.fd = False
         self.running = True
         self.light_status = {
             "Low Beam": {"status": 0, "mode": "Stand", "should_be_on": False},
@@ -110,23 +132,82 @@ class CANLightSlave:
         self.left_turn_running = False
         self.right_turn_running = False
         self.current_mode = "Stand"
+        self.commanded = {}  # light -> status code of its latest command
+        self.commanded_mode = None
+        self.refresh_monitor = RefreshMonitor('light master', on_timeout=REFRESH_TIMEOUTS.inc)
         
         # Shift register state (80 LEDs, all OFF initially)
         self.leds_status = [0] * 80
+        self.tracer = StageTracer('light_slave')
+        EFFECT_THREADS.labels('light_slave').set_function(self.count_effect_threads)
         
+        metrics.start_http_server(METRICS_PORT)
         self.init_can_bus()
         self.setup_shift_register()
+        self.start_service()
     
     def init_can_bus(self):
         try:
-            os.system(f'sudo /sbin/ip link set {self.channel} up type can bitrate 500000')
-            time.sleep(0.1)
-            self.bus = can.interface.Bus(channel=self.channel, bustype=self.bustype)
-            logging.info("CAN initialized")
+            self.bus, self.fd = open_bus(self.channel, self.bustype)
+            can_log.info("CAN initialized (%s)", "CAN FD" if self.fd else "classic")
         except Exception as e:
-            logging.error(f"CAN init failed: {e}")
+            can_log.error("CAN init failed: %s", e)
             raise
     
+    def start_service(self):
+        """State dumps and LED_GROUPS updates over ISO-TP (see slave_service.py)"""
+        request_id, response_id = LIGHT_SERVICE_IDS
+        self.service_channel = IsoTpChannel(self.bus, response_id, request_id, channel=self.channel,
+                                            interface=self.bustype, fd=self.fd)
+        self.service = SlaveService('light_slave', self.service_channel,
+                                    readers={STATE_DUMP_DID: self.state_dump, LED_TABLE_DID: lambda: LED_GROUPS},
+                                    writers={LED_TABLE_DID: self.apply_led_groups})
+        self.service.start()
+    
+    def state_dump(self):
+        return {
+            "light_status": self.light_status,
+            "current_mode": self.current_mode,
+            "leds_status": ''.join(str(state) for state in self.leds_status),
+            "effect_threads": self.count_effect_threads(),
+            "refresh_lost": self.refresh_monitor.lost,
+            "counters": service_counters('light_slave', FRAMES, ERRORS, SHIFT_REGISTER_REFRESHES),
+        }
+    
+    def apply_led_groups(self, groups):
+        """Replace LED_GROUPS, moving the lights that are on to their new LEDs"""
+        if not isinstance(groups, dict) or set(groups) != set(LED_GROUPS):
+            raise ValueError(f"LED_GROUPS must list exactly {sorted(LED_GROUPS)}")
+        for light, leds in groups.items():
+            if light in ("Left Turn", "Right Turn"):
+                # The flowing effect steps through two LEDs per group
+                if not isinstance(leds, dict) or set(leds) != {"group1", "group2"}:
+                    raise ValueError(f"{light} needs group1 and group2")
+                if any(not isinstance(group, list) or len(group) != 2 for group in leds.values()):
+                    raise ValueError(f"{light} groups need two LEDs each")
+                leds = leds["group1"] + leds["group2"]
+            if not isinstance(leds, list) or not all(isinstance(i, int) and 0 <= i < 80 for i in leds):
+                raise ValueError(f"{light}: LED indices must be 0-79")
+        
+        active = [light for light, state in self.light_status.items() if state["status"]]
+        self.stop_hazard_lights()
+        self.stop_left_turn()
+        self.stop_right_turn()
+        for light in active:
+            self.turn_off_light(light)
+        LED_GROUPS.clear()
+        LED_GROUPS.update(groups)
+        for light in active:
+            if light == "Hazard Lights":
+                self.start_hazard_lights()
+            elif light == "Left Turn":
+                self.start_left_turn()
+            elif light == "Right Turn":
+                self.start_right_turn()
+            else:
+                self.turn_on_light(light)
+        gpio_log.info("LED_GROUPS replaced, %d lights redrawn", len(active))
+    
     def setup_shift_register(self):
         """Initialize GPIO pins for 74HC595 shift register control."""
         GPIO.setmode(GPIO.BOARD)
@@ -140,7 +221,7 @@ class CANLightSlave:
         self.clear_shift_register()
         self.update_shift_register()
         
-        logging.info("Shift register initialized - All LEDs OFF")
+        gpio_log.info("Shift register initialized - All LEDs OFF")
     
     def clear_shift_register(self):
         """Clear all shift register outputs."""
@@ -160,6 +241,7 @@ class CANLightSlave:
         # Latch the data to outputs
         GPIO.output(SHIFT_REGISTER_PINS['Latch'], 0)
         GPIO.output(SHIFT_REGISTER_PINS['Latch'], 1)
+        REFRESHES.inc()
     
     def update_shift_register(self):
         """Update the shift register with current LED states."""
@@ -198,7 +280,8 @@ class CANLightSlave:
                 self.set_led(led_indices, True)
             
             self.current_mode = mode_name
-            logging.info(f"Mode indicator set to {mode_name} (LEDs {[x+1 for x in led_indices] if isinstance(led_indices, list) else led_indices+1})")
+            gpio_log.debug("Mode indicator set to %s (LEDs %s)", mode_name,
+                           [x+1 for x in led_indices] if isinstance(led_indices, list) else led_indices+1)
             
             # Special handling for Low Beam based on mode change
             if self.light_status["Low Beam"]["should_be_on"]:
@@ -212,8 +295,9 @@ class CANLightSlave:
     def control_light_status(self, light, status_code):
         """Control the light based only on status code (ON/OFF/FAILED/INVALID)."""
         if status_code not in [0x01, 0x00, 0xFF, 0xFE]:
-            logging.warning(f"Invalid status code received for {light}: {hex(status_code)}")
+            can_log.warning("Invalid status code received for %s: %s", light, hex(status_code))
             return
+        self.commanded[light] = status_code
         
         # Stop any running effects first
         if light == "Hazard Lights":
@@ -267,13 +351,14 @@ class CANLightSlave:
             return
         
         status_name = STATUS_CODES.get(status_code, f"Unknown: {hex(status_code)}")
-        logging.info(f"Controlled {light}: {status_name}")
+        gpio_log.info("Controlled %s: %s", light, status_name)
     
     def control_mode(self, mode_code):
         """Control the mode indicator LEDs based only on mode code."""
         if mode_code not in [0x01, 0x02, 0x03, 0x04]:
-            logging.warning(f"Invalid mode code received: {hex(mode_code)}")
+            can_log.warning("Invalid mode code received: %s", hex(mode_code))
             return
+        self.commanded_mode = mode_code
         
         mode_name = MODE_CODES.get(mode_code, "Stand")
         self.update_mode_leds(mode_name)
@@ -282,7 +367,7 @@ class CANLightSlave:
         for light in self.light_status:
             self.light_status[light]["mode"] = mode_name
         
-        logging.info(f"Updated mode to: {mode_name}")
+        gpio_log.info("Updated mode to: %s", mode_name)
     
     def turn_on_light(self, light):
         """Turn on a simple light (non-blinking, non-flowing)."""
@@ -305,6 +390,10 @@ class CANLightSlave:
         
         self.set_multiple_leds(led_indices, False)
     
+    def count_effect_threads(self):
+        threads = (self.hazard_thread, self.left_turn_thread, self.right_turn_thread)
+        return sum(1 for thread in threads if thread is not None and thread.is_alive())
+    
     def start_hazard_lights(self):
         """Start the hazard lights blinking effect."""
         self.hazard_running = True
@@ -397,7 +486,7 @@ class CANLightSlave:
             self.set_multiple_leds([group1[1], group2[1]], False)
             time.sleep(0.3)
     
-    def send_light_response(self, light):
+    def send_light_response(self, light, sequence=None):
         """Send response for a specific light"""
         try:
             status_data = self.light_status[light]
@@ -405,6 +494,8 @@ class CANLightSlave:
                 0x01 if status_data["status"] else 0x00,  # Status
                 [k for k, v in MODE_CODES.items() if v == status_data["mode"]][0]  # Mode code
             ]
+            if sequence is not None:
+                msg_data.append(sequence)  # echo the master's trace sequence
             
             msg = can.Message(
                 arbitration_id=RESPONSE_IDS[light],
@@ -413,37 +504,125 @@ class CANLightSlave:
             )
             
             self.bus.send(msg)
-            logging.info(f"Sent response for {light}: Status={msg_data[0]}, Mode={msg_data[1]}")
-            print(f"Sent Response: {light} | {'ON' if msg_data[0] else 'OFF'} | {status_data['mode']}")
+            FRAMES_SENT[light].inc()
+            can_log.info("Sent Response: %s | %s | %s", light, 'ON' if msg_data[0] else 'OFF', status_data['mode'],
+                         extra={'can_id': RESPONSE_IDS[light], 'data': list(msg_data)})
+        except Exception as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error sending %s response: %s", light, e)
+    
+    def encode_light_states(self, lights):
+        mode_codes = {v: k for k, v in MODE_CODES.items()}
+        return encode_lights({light: (0x01 if self.light_status[light]["status"] else 0x00,
+                                      mode_codes[self.light_status[light]["mode"]])
+                              for light in lights})
+    
+    def send_lights_response(self, lights):
+        """Answer a LIGHTS_CTRL frame with the state of the lights it carried"""
+        try:
+            data = self.encode_light_states(lights)
+            self.bus.send(can.Message(arbitration_id=LIGHTS_STATUS_ID, data=data, is_extended_id=False))
+            LIGHTS_FRAMES_SENT.inc()
+            can_log.info("Sent Response: %s", ', '.join(
+                f"{light} | {'ON' if self.light_status[light]['status'] else 'OFF'} | {self.light_status[light]['mode']}"
+                for light in lights), extra={'can_id': LIGHTS_STATUS_ID, 'data': list(data)})
         except Exception as e:
-            logging.error(f"Error sending {light} response: {e}")
+            SEND_ERRORS.inc()
+            can_log.error("Error sending lights response: %s", e)
+    
+    def send_snapshot(self):
+        """Answer a snapshot request with every light; 8 bytes, so classic CAN even on an FD bus"""
+        try:
+            data = self.encode_light_states(self.light_status)
+            self.bus.send(can.Message(arbitration_id=LIGHT_SNAPSHOT_ID, data=data, is_extended_id=False))
+            SNAPSHOT_FRAMES_SENT.inc()
+            can_log.info("Sent snapshot (ID: %s)", hex(LIGHT_SNAPSHOT_ID), extra={'can_id': LIGHT_SNAPSHOT_ID, 'data': list(data)})
+        except Exception as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error sending snapshot: %s", e)
+    
+    def handle_lights_frame(self, msg):
+        """Apply every command of a LIGHTS_CTRL frame, then answer them in one frame"""
+        lights = decode_lights(msg.data)
+        if not lights:
+            can_log.warning("Ignoring LIGHTS_CTRL frame without lights: %s", bytes(msg.data).hex())
+            return
+        trace = self.tracer.begin()
+        self.tracer.record('slave_queue', int((time.time() - msg.timestamp) * 1e9))
+        for light, (status_code, mode_code) in lights.items():
+            can_log.info("Received: %s | %s | %s", light, STATUS_CODES.get(status_code, 'UNKNOWN'),
+                         MODE_CODES.get(mode_code, 'UNKNOWN'), extra={'can_id': msg.arbitration_id})
+            self.control_light_status(light, status_code)
+        # The master never mixes modes in one frame
+        self.control_mode(mode_code)
+        self.tracer.stamp(trace, 'slave_actuate')
+        self.send_lights_response(lights)
+        self.tracer.finish(trace, 'slave_respond')
+    
+    def handle_refresh_frame(self, msg):
+        """Catch up with a LIGHTS_REFRESH frame: apply what differs from the last commands, no answer"""
+        self.refresh_monitor.seen()
+        lights = decode_lights(msg.data)
+        for light, (status_code, mode_code) in lights.items():
+            if self.commanded.get(light) != status_code:
+                can_log.info("Refresh: %s | %s", light, STATUS_CODES.get(status_code, 'UNKNOWN'),
+                             extra={'can_id': msg.arbitration_id})
+                self.control_light_status(light, status_code)
+        # Every light of a refresh carries the mode of the master's latest command
+        if lights and self.commanded_mode != mode_code:
+            self.control_mode(mode_code)
     
     def receive_messages(self):
-        print("Listening for CAN messages and controlling lights...")
+        can_log.info("Listening for CAN messages and controlling lights...")
         try:
             while self.running:
                 msg = self.bus.recv(timeout=1.0)
-                if msg:
+                self.refresh_monitor.check()
+                if msg and msg.arbitration_id == LIGHTS_CTRL_ID:
+                    FRAMES_RECEIVED[LIGHTS_CTRL_ID].inc()
+                    self.handle_lights_frame(msg)
+                elif msg and msg.arbitration_id == LIGHTS_REFRESH_ID:
+                    FRAMES_RECEIVED[LIGHTS_REFRESH_ID].inc()
+                    self.handle_refresh_frame(msg)
+                elif msg and msg.arbitration_id == self.service_channel.rx_id:
+                    self.service_channel.on_frame(msg)
+                elif msg and msg.arbitration_id == SNAPSHOT_REQUEST_ID:
+                    SNAPSHOT_REQUESTS.inc()
+                    if decode_request(msg.data)[0] & SNAPSHOT_LIGHTS:
+                        self.send_snapshot()
+                elif msg:
                     light = LIGHT_IDS.get(msg.arbitration_id)
-                    if light and len(msg.data) >= 2:
+                    if light:
+                        FRAMES_RECEIVED[msg.arbitration_id].inc()
+                    # 0x101 is also the wiper response, which is 8 bytes long
+                    if light and 2 <= len(msg.data) <= 3:
+                        trace = self.tracer.begin()
+                        # msg.timestamp is the kernel receive time (wall clock)
+                        self.tracer.record('slave_queue', int((time.time() - msg.timestamp) * 1e9))
                         status_code = msg.data[0]
                         mode_code = msg.data[1]
+                        sequence = msg.data[2] if len(msg.data) > 2 else None
                         
-                        print(f"Received: {light} | {STATUS_CODES.get(status_code, 'UNKNOWN')} | {MODE_CODES.get(mode_code, 'UNKNOWN')}")
+                        can_log.info("Received: %s | %s | %s", light, STATUS_CODES.get(status_code, 'UNKNOWN'),
+                                     MODE_CODES.get(mode_code, 'UNKNOWN'), extra={'can_id': msg.arbitration_id})
                         
                         # Handle status and mode separately
                         self.control_light_status(light, status_code)
                         self.control_mode(mode_code)
-                        self.send_light_response(light)
+                        self.tracer.stamp(trace, 'slave_actuate')
+                        self.send_light_response(light, sequence)
+                        self.tracer.finish(trace, 'slave_respond')
                 
         except KeyboardInterrupt:
-            logging.info("Received keyboard interrupt")
+            log.info("Received keyboard interrupt")
         finally:
             self.shutdown()
     
     def shutdown(self):
-        logging.info("Shutting down...")
+        log.info("Shutting down...")
         self.running = False
+        self.service.stop()
+        self.service_channel.close()
         
         # Stop all effects
         self.stop_hazard_lights()
@@ -458,7 +637,7 @@ class CANLightSlave:
             self.bus.shutdown()
         os.system(f'sudo /sbin/ip link set {self.channel} down')
         GPIO.cleanup()
-        logging.info("Shutdown complete")
+        log.info("Shutdown complete")
 
 if __name__ == "__main__":
     slave = CANLightSlave()
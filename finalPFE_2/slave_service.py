@@ -0,0 +1,206 @@
+"""
+Request/response service the slaves run on an ISO-TP channel.
+
+Reads whole-state dumps and writes LED tables without a CAN ID or frame
+layout per field. Requests and responses follow UDS framing, with JSON data:
+
+    read   0x22 DID         -> 0x62 DID data
+    write  0x2E DID data    -> 0x6E DID
+    error                   -> 0x7F SID NRC
+
+    STATE_DUMP_DID  0xF100  read: status, LED buffer, error and frame counters
+    LED_TABLE_DID   0xF200  read/write: LED_GROUPS (lights), WINDOW_LEDS (windows)
+
+Every slave has its own pair of ISO-TP IDs (request, response), in the
+diagnostic range above every command and snapshot ID.
+
+    python slave_service.py light dump
+    python slave_service.py window read-leds
+    python slave_service.py light write-leds groups.json
+"""
+import sys
+import json
+import logging
+import argparse
+import threading
+import metrics
+from isotp_channel import IsoTpChannel, IsoTpError
+
+# (request ID, response ID) per slave
+LIGHT_SERVICE_IDS = (0x7A0, 0x7A8)
+WINDOW_SERVICE_IDS = (0x7A1, 0x7A9)
+SERVICE_IDS = {"light": LIGHT_SERVICE_IDS, "window": WINDOW_SERVICE_IDS}
+
+READ_DATA_SID = 0x22
+WRITE_DATA_SID = 0x2E
+POSITIVE_RESPONSE_OFFSET = 0x40
+NEGATIVE_RESPONSE_SID = 0x7F
+
+SERVICE_NOT_SUPPORTED = 0x11
+INCORRECT_LENGTH_OR_FORMAT = 0x13
+CONDITIONS_NOT_CORRECT = 0x22
+REQUEST_OUT_OF_RANGE = 0x31
+NRC_NAMES = {
+    SERVICE_NOT_SUPPORTED: "service not supported",
+    INCORRECT_LENGTH_OR_FORMAT: "incorrect length or format",
+    CONDITIONS_NOT_CORRECT: "conditions not correct",
+    REQUEST_OUT_OF_RANGE: "request out of range",
+}
+
+STATE_DUMP_DID = 0xF100
+LED_TABLE_DID = 0xF200
+
+REQUEST_TIMEOUT = 2.0
+
+REQUESTS = metrics.counter('pfe_service_requests', 'ISO-TP service requests by response code', ('service', 'response'))
+
+log = logging.getLogger('slave_service')
+
+class ServiceError(Exception):
+    """Negative response; writers raise it to pick the response code"""
+    def __init__(self, nrc, message=None):
+        super().__init__(message or NRC_NAMES.get(nrc, hex(nrc)))
+        self.nrc = nrc
+
+def service_counters(service, *families):
+    """{family name: {'direction id' / 'kind': value}} for one service's series"""
+    return {family.name: {' '.join(values[1:]): child.get()
+                          for values, child in sorted(family.children.items()) if values[0] == service}
+            for family in families}
+
+def encode_data(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+class SlaveService:
+    def __init__(self, name, channel, readers, writers):
+        """
+        Args:
+            name: service label for metrics and logs, e.g. light_slave
+            channel: IsoTpChannel listening on the slave's request ID
+            readers: {DID: callable() -> JSON-serialisable value}
+            writers: {DID: callable(value)}; raise ValueError for bad data
+        """
+        self.name = name
+        self.channel = channel
+        self.readers = readers
+        self.writers = writers
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f'{self.name}-service', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.5)
+
+    def run(self):
+        # Own thread: a long answer waits for the master's flow control, which
+        # the slave's receive loop feeds to the channel meanwhile
+        while self.running:
+            request = self.channel.recv(timeout=1.0)
+            if not request:
+                continue
+            response = self.handle(request)
+            REQUESTS.labels(self.name, hex(response[0])).inc()
+            try:
+                self.channel.send(response)
+            except IsoTpError as e:
+                log.warning("%s: response to %s not delivered: %s", self.name, hex(request[0]), e)
+
+    def handle(self, request):
+        """Response bytes for one request"""
+        sid = request[0]
+        if sid not in (READ_DATA_SID, WRITE_DATA_SID):
+            return self.negative(sid, SERVICE_NOT_SUPPORTED)
+        if len(request) < 3 or (sid == READ_DATA_SID and len(request) != 3):
+            return self.negative(sid, INCORRECT_LENGTH_OR_FORMAT)
+        did = int.from_bytes(request[1:3], 'big')
+        positive = bytes([sid + POSITIVE_RESPONSE_OFFSET]) + request[1:3]
+
+        if sid == READ_DATA_SID:
+            reader = self.readers.get(did)
+            if reader is None:
+                return self.negative(sid, REQUEST_OUT_OF_RANGE)
+            log.info("%s: read %s", self.name, hex(did))
+            return positive + encode_data(reader())
+
+        writer = self.writers.get(did)
+        if writer is None:
+            return self.negative(sid, REQUEST_OUT_OF_RANGE)
+        try:
+            value = json.loads(request[3:])
+        except ValueError:
+            return self.negative(sid, INCORRECT_LENGTH_OR_FORMAT)
+        try:
+            writer(value)
+        except ServiceError as e:
+            log.warning("%s: write %s refused: %s", self.name, hex(did), e)
+            return self.negative(sid, e.nrc)
+        except ValueError as e:
+            log.warning("%s: write %s rejected: %s", self.name, hex(did), e)
+            return self.negative(sid, REQUEST_OUT_OF_RANGE)
+        log.info("%s: wrote %s", self.name, hex(did))
+        return positive
+
+    def negative(self, sid, nrc):
+        return bytes([NEGATIVE_RESPONSE_SID, sid, nrc])
+
+# ----------------------------------------------------------------------
+# Client side
+
+def request(channel, message, timeout=REQUEST_TIMEOUT):
+    """Send one request and return the positive response"""
+    channel.send(message)
+    response = channel.recv(timeout=timeout)
+    if response is None:
+        raise IsoTpError(f"No response on {hex(channel.rx_id)} within {timeout} s")
+    if response[0] == NEGATIVE_RESPONSE_SID and len(response) >= 3:
+        raise ServiceError(response[2])
+    return response
+
+def read_data(channel, did, timeout=REQUEST_TIMEOUT):
+    response = request(channel, bytes([READ_DATA_SID]) + did.to_bytes(2, 'big'), timeout)
+    return json.loads(response[3:])
+
+def write_data(channel, did, value, timeout=REQUEST_TIMEOUT):
+    request(channel, bytes([WRITE_DATA_SID]) + did.to_bytes(2, 'big') + encode_data(value), timeout)
+
+def main():
+    from can_fd import open_bus
+
+    parser = argparse.ArgumentParser(description="Dump slave state or push LED tables over ISO-TP")
+    parser.add_argument('slave', choices=sorted(SERVICE_IDS))
+    parser.add_argument('action', choices=('dump', 'read-leds', 'write-leds'))
+    parser.add_argument('table', nargs='?', help="JSON file with the LED table (write-leds)")
+    parser.add_argument('--channel', default='can0')
+    args = parser.parse_args()
+    if args.action == 'write-leds' and not args.table:
+        parser.error("write-leds needs a JSON table file")
+
+    # The master scripts own the link; only open a socket on it
+    bus, fd = open_bus(args.channel, bring_up=False)
+    request_id, response_id = SERVICE_IDS[args.slave]
+    channel = IsoTpChannel(bus, request_id, response_id, channel=args.channel, interface='socketcan', fd=fd)
+    channel.start_reader()
+    try:
+        if args.action == 'dump':
+            print(json.dumps(read_data(channel, STATE_DUMP_DID), indent=2))
+        elif args.action == 'read-leds':
+            print(json.dumps(read_data(channel, LED_TABLE_DID), indent=2))
+        else:
+            with open(args.table) as f:
+                write_data(channel, LED_TABLE_DID, json.load(f))
+            print(f"{args.slave} LED table written")
+    except (IsoTpError, ServiceError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        channel.close()
+        bus.shutdown()
+
+if __name__ == "__main__":
+    main()
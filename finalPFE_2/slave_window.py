@@ -7,6 +7,16 @@ import os
 import time
 from collections import defaultdict
 import threading
+import metrics
+from async_logging import setup_logging
+from stage_trace import StageTracer
+from can_fd import open_bus, fd_message
+from snapshot import (SNAPSHOT_REQUEST_ID, WINDOW_ORDER, SNAPSHOT_WINDOWS, decode_request, encode_window_snapshot,
+                      decode_window_snapshot)
+from cyclic import WINDOW_REFRESH_ID, RefreshMonitor
+from isotp_channel import IsoTpChannel
+from slave_service import (SlaveService, ServiceError, WINDOW_SERVICE_IDS, STATE_DUMP_DID, LED_TABLE_DID,
+                           CONDITIONS_NOT_CORRECT, service_counters)
 
 # CAN IDs for each window type (matches master)
 WINDOW_IDS = {
@@ -55,21 +65,33 @@ RESULT_CODES = ["OP", "CL", "OPG", "CLG", "FOP", "OP_D", "CL_D", "OPG_D", "CLG_D
 LEVEL_TYPES = ["AUTO", "MANUAL"]
 MODES = ["WHONEN", "FAHREN"]
 
+METRICS_PORT = 9112
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+SHIFT_REGISTER_REFRESHES = metrics.counter('pfe_shift_register_refreshes', 'Shift register chain rewrites', ('service',))
+EFFECT_THREADS = metrics.gauge('pfe_effect_threads', 'Running effect/animation threads', ('service',))
+
+FRAMES_RECEIVED = {can_id: FRAMES.labels('window_slave', 'rx', hex(can_id)) for can_id in (*WINDOW_IDS, WINDOW_REFRESH_ID)}
+FRAMES_SENT = {window: FRAMES.labels('window_slave', 'tx', hex(can_id)) for window, can_id in RESPONSE_IDS.items()}
+SEND_ERRORS = ERRORS.labels('window_slave', 'send')
+SNAPSHOT_REQUESTS = FRAMES.labels('window_slave', 'rx', hex(SNAPSHOT_REQUEST_ID))
+MALFORMED_FRAMES = ERRORS.labels('window_slave', 'malformed_frame')
+REFRESH_TIMEOUTS = ERRORS.labels('window_slave', 'refresh_timeout')
+REFRESHES = SHIFT_REGISTER_REFRESHES.labels('window_slave')
+HANDLER_THREADS = EFFECT_THREADS.labels('window_slave')
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('window_slave.log'),
-        logging.StreamHandler()
-    ]
-)
+log = setup_logging('window_slave', 'window_slave.log')
+can_log = logging.getLogger('window_slave.can')
+gpio_log = logging.getLogger('window_slave.gpio')
 
 class CANWindowSlave:
     def __init__(self):
         self.channel = 'can0'
         self.bustype = 'socketcan'
         self.bus = None
+        self.fd = False
         self.running = True
         self.window_status = {
             "DR": {"level": 0, "result": "CL", "level_type": "AUTO", "mode": "WHONEN", "safety": "OFF"},
@@ -81,22 +103,70 @@ class CANWindowSlave:
         self.LEDs_status = [0] * 80  # 40-bit shift register status
         self.lock = threading.Lock()
         self.led_update_lock = threading.Lock()  # New lock for LED updates
+        self.commanded = {}  # window -> entry bytes of its latest command
+        self.refresh_monitor = RefreshMonitor('window master', on_timeout=REFRESH_TIMEOUTS.inc)
+        self.tracer = StageTracer('window_slave')
         
+        metrics.start_http_server(METRICS_PORT)
         self.init_can_bus()
         self.setup_gpio()
         self.clear_register()
         self.shift_out(self.LEDs_status)
+        self.start_service()
     
     def init_can_bus(self):
         try:
-            os.system(f'sudo /sbin/ip link set {self.channel} up type can bitrate 500000')
-            time.sleep(0.1)
-            self.bus = can.interface.Bus(channel=self.channel, bustype=self.bustype)
-            logging.info("CAN initialized")
+            self.bus, self.fd = open_bus(self.channel, self.bustype)
+            can_log.info("CAN initialized (%s)", "CAN FD" if self.fd else "classic")
         except Exception as e:
-            logging.error(f"CAN init failed: {e}")
+            can_log.error("CAN init failed: %s", e)
             raise
     
+    def start_service(self):
+        """State dumps and WINDOW_LEDS updates over ISO-TP (see slave_service.py)"""
+        request_id, response_id = WINDOW_SERVICE_IDS
+        self.service_channel = IsoTpChannel(self.bus, response_id, request_id, channel=self.channel,
+                                            interface=self.bustype, fd=self.fd)
+        self.service = SlaveService('window_slave', self.service_channel,
+                                    readers={STATE_DUMP_DID: self.state_dump, LED_TABLE_DID: lambda: WINDOW_LEDS},
+                                    writers={LED_TABLE_DID: self.apply_window_leds})
+        self.service.start()
+    
+    def state_dump(self):
+        with self.lock:
+            return {
+                "window_status": self.window_status,
+                "current_led_states": dict(self.current_led_states),
+                "LEDs_status": ''.join(str(state) for state in self.LEDs_status),
+                "handler_threads": HANDLER_THREADS.get(),
+                "refresh_lost": self.refresh_monitor.lost,
+                "counters": service_counters('window_slave', FRAMES, ERRORS, SHIFT_REGISTER_REFRESHES),
+            }
+    
+    def apply_window_leds(self, table):
+        """Replace WINDOW_LEDS, moving each window's lit LEDs to the new indices"""
+        if not isinstance(table, dict) or set(table) != set(WINDOW_LEDS):
+            raise ValueError(f"WINDOW_LEDS must list exactly {sorted(WINDOW_LEDS)}")
+        for window, leds in table.items():
+            if not isinstance(leds, list) or len(leds) != 4:
+                raise ValueError(f"{window} needs 4 LEDs, one per level step")
+            if not all(isinstance(i, int) and 0 <= i < 80 and i != SAFETY_LED_INDEX for i in leds):
+                raise ValueError(f"{window}: LED indices must be 0-79 and not the safety LED")
+        # An animation holds on to the old list until it ends
+        if HANDLER_THREADS.get():
+            raise ServiceError(CONDITIONS_NOT_CORRECT, "window animation running")
+        
+        with self.lock:
+            for window, leds in WINDOW_LEDS.items():
+                for i in leds[:self.current_led_states[window]]:
+                    self.LEDs_status[i] = 0
+            for window, leds in table.items():
+                WINDOW_LEDS[window] = leds
+                for i in leds[:self.current_led_states[window]]:
+                    self.LEDs_status[i] = 1
+        self.shift_out(self.LEDs_status)
+        gpio_log.info("WINDOW_LEDS replaced")
+    
     def setup_gpio(self):
         # Setup all GPIO pins using BCM numbering consistently
         GPIO.setmode(GPIO.BCM)
@@ -116,7 +186,7 @@ class CANWindowSlave:
         GPIO.output(GREEN_LED, GPIO.HIGH)  # Start with green LED on by default
         GPIO.output(YELLOW_LED, GPIO.LOW)  # Yellow LED off by default
         
-        logging.info("GPIO initialized")
+        gpio_log.info("GPIO initialized")
     
     def clear_register(self):
         """Clear all LEDs in the shift register"""
@@ -132,6 +202,7 @@ class CANWindowSlave:
                 GPIO.output(Clock, 1)
             GPIO.output(Latch, 0)
             GPIO.output(Latch, 1)
+        REFRESHES.inc()
 
     
     def update_safety_led(self, safety_status):
@@ -139,10 +210,10 @@ class CANWindowSlave:
         with self.lock:
             if safety_status == "ON":
                 self.LEDs_status[SAFETY_LED_INDEX] = 1
-                logging.info(f"Safety ON - turning on LED 2 (index {SAFETY_LED_INDEX})")
+                gpio_log.debug("Safety ON - turning on LED 2 (index %d)", SAFETY_LED_INDEX)
             else:
                 self.LEDs_status[SAFETY_LED_INDEX] = 0
-                logging.info(f"Safety OFF - turning off LED 2 (index {SAFETY_LED_INDEX})")
+                gpio_log.debug("Safety OFF - turning off LED 2 (index %d)", SAFETY_LED_INDEX)
         
         self.shift_out(self.LEDs_status)
     
@@ -155,13 +226,13 @@ class CANWindowSlave:
         
         if result == "FAILED":
             GPIO.output(YELLOW_LED, GPIO.HIGH)
-            logging.info(f"FAILED status detected, turning on yellow LED")
+            gpio_log.debug("FAILED status detected, turning on yellow LED")
         elif safety == "ON":
             GPIO.output(RED_LED, GPIO.HIGH)
-            logging.info(f"Safety ON detected, turning on red LED")
+            gpio_log.debug("Safety ON detected, turning on red LED")
         else:
             GPIO.output(GREEN_LED, GPIO.HIGH)
-            logging.info(f"Normal operation, turning on green LED")
+            gpio_log.debug("Normal operation, turning on green LED")
     
     def get_required_leds(self, level):
         """Determine how many LEDs should be on based on level percentage"""
@@ -184,7 +255,7 @@ class CANWindowSlave:
         current_leds = self.current_led_states[window]
         leds = WINDOW_LEDS[window]
         
-        logging.info(f"Updating {window} from {current_leds} LEDs to {required_leds} LEDs (Level: {new_level}%)")
+        gpio_log.info("Updating %s from %d LEDs to %d LEDs (Level: %s%%)", window, current_leds, required_leds, new_level)
         
         # Animate LED changes with thread protection
         if required_leds > current_leds:
@@ -193,7 +264,7 @@ class CANWindowSlave:
                 with self.lock:
                     self.LEDs_status[leds[i]] = 1
                 self.shift_out(self.LEDs_status)
-                logging.info(f"Turned on {window} LED {i+1} (Index {leds[i]})")
+                gpio_log.debug("Turned on %s LED %d (Index %d)", window, i+1, leds[i])
                 time.sleep(1)
         elif required_leds < current_leds:
             # Turn off LEDs one by one
@@ -201,24 +272,30 @@ class CANWindowSlave:
                 with self.lock:
                     self.LEDs_status[leds[i]] = 0
                 self.shift_out(self.LEDs_status)
-                logging.info(f"Turned off {window} LED {i+1} (Index {leds[i]})")
+                gpio_log.debug("Turned off %s LED %d (Index %d)", window, i+1, leds[i])
                 time.sleep(1)
         
         with self.lock:
             self.current_led_states[window] = required_leds
             self.window_status[window]["level"] = new_level
     
-    def send_window_response(self, window):
+    def window_entry(self, status):
+        """Result, level, level type, mode and safety bytes of one window"""
+        return [
+            RESULT_CODES.index(status["result"]),
+            status["level"],
+            LEVEL_TYPES.index(status["level_type"]),
+            MODES.index(status["mode"]),
+            1 if status["safety"] == "ON" else 0
+        ]
+    
+    def send_window_response(self, window, sequence=None):
         try:
             with self.lock:
                 status = self.window_status[window]
-                msg_data = [
-                    RESULT_CODES.index(status["result"]),
-                    status["level"],
-                    LEVEL_TYPES.index(status["level_type"]),
-                    MODES.index(status["mode"]),
-                    1 if status["safety"] == "ON" else 0
-                ]
+                msg_data = self.window_entry(status)
+                if sequence is not None:
+                    msg_data.append(sequence)  # echo the master's trace sequence
                 
                 msg = can.Message(
                     arbitration_id=RESPONSE_IDS[window],
@@ -227,12 +304,37 @@ class CANWindowSlave:
                 )
                 
                 self.bus.send(msg)
-                print(f"Sent Response: {window} | {status['result']} | {status['level']}% | {status['level_type']} | {status['mode']} | safety_{status['safety']} (ID: {hex(RESPONSE_IDS[window])}, Data: {msg_data})")
-                logging.info(f"Sent response for {window}: {msg_data}")
+                FRAMES_SENT[window].inc()
+                can_log.info("Sent Response: %s | %s | %s%% | %s | %s | safety_%s (ID: %s)", window, status['result'],
+                             status['level'], status['level_type'], status['mode'], status['safety'],
+                             hex(RESPONSE_IDS[window]), extra={'can_id': RESPONSE_IDS[window], 'data': list(msg_data)})
         except Exception as e:
-            logging.error(f"Error sending {window} response: {e}")
+            SEND_ERRORS.inc()
+            can_log.error("Error sending %s response: %s", window, e)
     
-    def handle_window_message(self, window, result, level, level_type, mode, safety):
+    def send_snapshot(self, fd):
+        """Answer a snapshot request: one FD frame for all windows, else one classic frame each"""
+        try:
+            with self.lock:
+                entries = {window: self.window_entry(self.window_status[window]) for window in WINDOW_ORDER}
+            for can_id, data in encode_window_snapshot(entries, fd):
+                msg = fd_message(can_id, data) if fd else can.Message(arbitration_id=can_id, data=data, is_extended_id=False)
+                self.bus.send(msg)
+                FRAMES.labels('window_slave', 'tx', hex(can_id)).inc()
+            can_log.info("Sent snapshot (%s)", "CAN FD" if fd else "classic")
+        except Exception as e:
+            SEND_ERRORS.inc()
+            can_log.error("Error sending snapshot: %s", e)
+    
+    def handle_window_message(self, window, result, level, level_type, mode, safety, sequence=None, trace=None):
+        # One thread per command; the gauge shows how many animations overlap
+        HANDLER_THREADS.inc()
+        try:
+            self._handle_window_message(window, result, level, level_type, mode, safety, sequence, trace)
+        finally:
+            HANDLER_THREADS.dec()
+    
+    def _handle_window_message(self, window, result, level, level_type, mode, safety, sequence, trace):
         # First update the status LEDs based on the result and safety
         self.update_status_leds(result, safety)
         
@@ -241,7 +343,7 @@ class CANWindowSlave:
         
         # Skip LED updates if result is FAILED
         if result == "FAILED":
-            logging.info(f"Received FAILED status for {window}, skipping LED update")
+            gpio_log.info("Received FAILED status for %s, skipping LED update", window)
             with self.lock:
                 # Still update the status fields (except level) for the response
                 self.window_status[window]["result"] = result
@@ -257,45 +359,81 @@ class CANWindowSlave:
                 self.window_status[window]["safety"] = safety
             
             self.update_window_leds(window, level)
+        self.tracer.stamp(trace, 'slave_actuate')
         
         # Always send response even for FAILED status
-        self.send_window_response(window)
+        self.send_window_response(window, sequence)
+        self.tracer.finish(trace, 'slave_respond')
+    
+    def dispatch_command(self, window, data, trace=None):
+        """Start the handler thread for one window entry (result, level, level type, mode, safety[, sequence])"""
+        try:
+            result_index = data[0]
+            level = data[1]
+            level_type = LEVEL_TYPES[data[2]] if len(data) > 2 else "AUTO"
+            mode = MODES[data[3]] if len(data) > 3 else "WHONEN"
+            safety = "ON" if data[4] == 1 else "OFF"
+            sequence = data[5] if len(data) > 5 else None
+            
+            if (0 <= level <= 100 and 
+                0 <= result_index < len(RESULT_CODES)):
+                result = RESULT_CODES[result_index]
+                self.commanded[window] = bytes(data[:5])
+                can_log.info("Received: %s | %s | %s%% | %s | %s | safety_%s", window, result, level, level_type, mode, safety,
+                             extra={'can_id': RESPONSE_IDS[window]})
+                threading.Thread(
+                    target=self.handle_window_message,
+                    args=(window, result, level, level_type, mode, safety, sequence, trace),
+                    daemon=True
+                ).start()
+        except (IndexError, ValueError) as e:
+            MALFORMED_FRAMES.inc()
+            can_log.warning("Error processing message: %s", e)
+    
+    def handle_refresh_frame(self, msg):
+        """Catch up with a WINDOW_REFRESH frame: run the windows whose entry differs from their last command"""
+        self.refresh_monitor.seen()
+        for window, entry in decode_window_snapshot(msg.data).items():
+            if self.commanded.get(window) != bytes(entry):
+                can_log.info("Refresh: %s differs from its last command", window, extra={'can_id': msg.arbitration_id})
+                self.dispatch_command(window, entry)
     
     def receive_messages(self):
-        print("Listening for CAN messages and controlling window LEDs via shift register...")
+        can_log.info("Listening for CAN messages and controlling window LEDs via shift register...")
         try:
             while self.running:
                 msg = self.bus.recv(timeout=1.0)
-                if msg:
+                self.refresh_monitor.check()
+                if msg and msg.arbitration_id == WINDOW_REFRESH_ID:
+                    FRAMES_RECEIVED[WINDOW_REFRESH_ID].inc()
+                    self.handle_refresh_frame(msg)
+                elif msg and msg.arbitration_id == self.service_channel.rx_id:
+                    self.service_channel.on_frame(msg)
+                elif msg and msg.arbitration_id == SNAPSHOT_REQUEST_ID:
+                    SNAPSHOT_REQUESTS.inc()
+                    ecus, requester_fd = decode_request(msg.data)
+                    if ecus & SNAPSHOT_WINDOWS:
+                        self.send_snapshot(requester_fd and self.fd)
+                elif msg:
                     window = WINDOW_IDS.get(msg.arbitration_id)
+                    if window:
+                        FRAMES_RECEIVED[msg.arbitration_id].inc()
                     if window and len(msg.data) >= 5:
-                        try:
-                            result_index = msg.data[0]
-                            level = msg.data[1]
-                            level_type = LEVEL_TYPES[msg.data[2]] if len(msg.data) > 2 else "AUTO"
-                            mode = MODES[msg.data[3]] if len(msg.data) > 3 else "WHONEN"
-                            safety = "ON" if msg.data[4] == 1 else "OFF"
-                            
-                            if (0 <= level <= 100 and 
-                                0 <= result_index < len(RESULT_CODES)):
-                                result = RESULT_CODES[result_index]
-                                print(f"Received: {window} | {result} | {level}% | {level_type} | {mode} | safety_{safety}")
-                                threading.Thread(
-                                    target=self.handle_window_message,
-                                    args=(window, result, level, level_type, mode, safety),
-                                    daemon=True
-                                ).start()
-                        except (IndexError, ValueError) as e:
-                            print(f"Error processing message: {e}")
+                        trace = self.tracer.begin()
+                        # msg.timestamp is the kernel receive time (wall clock)
+                        self.tracer.record('slave_queue', int((time.time() - msg.timestamp) * 1e9))
+                        self.dispatch_command(window, msg.data, trace)
                 
         except KeyboardInterrupt:
-            logging.info("Received keyboard interrupt")
+            log.info("Received keyboard interrupt")
         finally:
             self.shutdown()
     
     def shutdown(self):
-        logging.info("Shutting down...")
+        log.info("Shutting down...")
         self.running = False
+        self.service.stop()
+        self.service_channel.close()
         if self.bus:
             self.bus.shutdown()
         os.system(f'sudo /sbin/ip link set {self.channel} down')
@@ -310,7 +448,7 @@ class CANWindowSlave:
         GPIO.output(YELLOW_LED, GPIO.LOW)
         
         GPIO.cleanup()
-        logging.info("Shutdown complete")
+        log.info("Shutdown complete")
 
 if __name__ == "__main__":
     slave = CANWindowSlave()
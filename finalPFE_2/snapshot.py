@@ -0,0 +1,72 @@
+"""
+Vehicle status snapshots: one request, one answer per ECU.
+
+Polling every unit's response ID costs a frame per unit (4 windows, 7
+lights, the wiper). A snapshot asks all ECUs at once and each answers with
+its whole state; vehicle_snapshot.dbc describes the frames.
+
+SNAPSHOT_REQUEST (0x300) is always a classic frame, so every node hears it:
+
+    byte 0  ECUs to answer: SNAPSHOT_LIGHTS | SNAPSHOT_WINDOWS | SNAPSHOT_WIPER
+    byte 1  bit 0 (REQUEST_FD) set when the requester reads CAN FD frames
+
+Answers:
+
+    lights   LIGHT_SNAPSHOT (0x302), all seven lights encoded with
+             light_frames.encode_lights; 8 bytes, so a classic frame either way
+    windows  with FD on both sides one 20-byte WINDOW_SNAPSHOT (0x301) FD
+             frame, WINDOW_ENTRY bytes per window in WINDOW_ORDER; otherwise
+             one classic WINDOW_SNAPSHOT_CLASSIC (0x303) frame per window,
+             its index in WINDOW_ORDER followed by its WINDOW_ENTRY bytes
+    wiper    its usual 8-byte status frame on 0x101
+
+Window entries are the response bytes the window slave already sends:
+result index, level, level type index, mode index, safety.
+"""
+SNAPSHOT_REQUEST_ID = 0x300
+WINDOW_SNAPSHOT_ID = 0x301
+LIGHT_SNAPSHOT_ID = 0x302
+WINDOW_SNAPSHOT_CLASSIC_ID = 0x303
+
+SNAPSHOT_LIGHTS = 0x01
+SNAPSHOT_WINDOWS = 0x02
+SNAPSHOT_WIPER = 0x04
+SNAPSHOT_ALL = SNAPSHOT_LIGHTS | SNAPSHOT_WINDOWS | SNAPSHOT_WIPER
+REQUEST_FD = 0x01
+
+WINDOW_ORDER = ("DR", "PS", "DRS", "PRS")
+WINDOW_ENTRY = 5
+
+def encode_request(ecus, fd):
+    return bytes([ecus, REQUEST_FD if fd else 0])
+
+def decode_request(data):
+    """(ECU mask, requester reads FD); a 1-byte request is classic only"""
+    if not data:
+        return 0, False
+    return data[0], len(data) > 1 and bool(data[1] & REQUEST_FD)
+
+def encode_window_snapshot(entries, fd):
+    """
+    Window answer payloads
+
+    Args:
+        entries: {window: WINDOW_ENTRY bytes}
+        fd: one FD payload instead of one classic payload per window
+
+    Returns:
+        list: (arbitration ID, payload) in the order they go on the bus
+    """
+    if fd:
+        return [(WINDOW_SNAPSHOT_ID, b''.join(bytes(entries[window]) for window in WINDOW_ORDER))]
+    return [(WINDOW_SNAPSHOT_CLASSIC_ID, bytes([WINDOW_ORDER.index(window)]) + bytes(entries[window]))
+            for window in WINDOW_ORDER if window in entries]
+
+def decode_window_snapshot(data):
+    """{window: WINDOW_ENTRY bytes} from either an FD or a classic payload"""
+    data = bytes(data)
+    if len(data) >= WINDOW_ENTRY * len(WINDOW_ORDER):
+        return {window: data[i * WINDOW_ENTRY:(i + 1) * WINDOW_ENTRY] for i, window in enumerate(WINDOW_ORDER)}
+    if len(data) >= 1 + WINDOW_ENTRY and data[0] < len(WINDOW_ORDER):
+        return {WINDOW_ORDER[data[0]]: data[1:1 + WINDOW_ENTRY]}
+    return {}
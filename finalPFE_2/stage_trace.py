@@ -0,0 +1,296 @@
+"""
+Per-stage latency tracing for the analyzer -> master -> bus -> slave -> DB path.
+
+Each process owns a StageTracer per service. A trace starts where a
+vsomeip log line is picked up by an analyzer, which tags the analysis line
+with `| Trace: <id>@<start ns>@<written ns>`. The master strips that tag and times
+its own hops. On the bus it matches the slave's response by CAN ID and a
+sequence byte carried in a spare data byte. Timestamps are
+time.monotonic_ns(), so hops are only compared within one host. The
+slave, on the other Pi, times its own hops.
+
+Tracing is off unless enabled by argument or environment:
+
+    STAGE_TRACE_DIR=/tmp/stages   write <service>.prom every 5 s (Prometheus text)
+    STAGE_TRACE_PORT=9109         serve every tracer of the process on /metrics
+
+Where metrics.py sits next to this module, the summaries are also served on
+the process's metrics endpoint and STAGE_TRACE_PORT starts that endpoint.
+"""
+import os
+import time
+import atexit
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import metrics
+except ImportError:
+    metrics = None
+
+TRACE_FIELD = 'Trace'
+FLUSH_INTERVAL = 5.0
+QUANTILES = (0.5, 0.9, 0.99)
+
+# HELP/TYPE of the two exported metric families
+SUMMARY_HEADER = [
+    '# HELP pfe_stage_latency_seconds Latency of each hop from analyzer to database',
+    '# TYPE pfe_stage_latency_seconds summary'
+]
+MAX_HEADER = [
+    '# HELP pfe_stage_latency_max_seconds Slowest sample of each hop',
+    '# TYPE pfe_stage_latency_max_seconds gauge'
+]
+
+# Histogram resolution: values below SUB_BUCKETS us are exact, above that
+# every power of two is split into HALF_BUCKETS buckets (~3% error)
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_BUCKETS = SUB_BUCKETS // 2
+
+_tracers = []
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of durations, stored in microseconds."""
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    @staticmethod
+    def bucket_index(value_us):
+        if value_us < SUB_BUCKETS:
+            return value_us
+        shift = value_us.bit_length() - SUB_BUCKET_BITS
+        return SUB_BUCKETS + (shift - 1) * HALF_BUCKETS + ((value_us >> shift) - HALF_BUCKETS)
+
+    @staticmethod
+    def bucket_value(index):
+        """Midpoint of a bucket, in microseconds."""
+        if index < SUB_BUCKETS:
+            return index
+        shift = (index - SUB_BUCKETS) // HALF_BUCKETS + 1
+        sub = (index - SUB_BUCKETS) % HALF_BUCKETS + HALF_BUCKETS
+        return ((sub << shift) + ((sub + 1) << shift) - 1) // 2
+
+    def record(self, value_ns):
+        value_us = max(0, value_ns) // 1000
+        index = self.bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def percentile(self, fraction):
+        """Value in microseconds below which `fraction` of the samples fall."""
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.bucket_value(index), self.max_us)
+        return self.max_us
+
+class Trace:
+    """One command travelling through the stages; stamps are monotonic ns."""
+    __slots__ = ('trace_id', 'origin_ns', 'last_ns', 'sequence')
+
+    def __init__(self, trace_id, origin_ns, last_ns):
+        self.trace_id = trace_id
+        self.origin_ns = origin_ns
+        self.last_ns = last_ns
+        self.sequence = None
+
+def split_trace_field(line):
+    """Strip a trailing `| Trace: ...` field.
+
+    Returns (line, (trace_id, origin_ns, written_ns) or None).
+    """
+    head, sep, tail = line.rpartition('|')
+    if not sep or not tail.strip().startswith(TRACE_FIELD + ':'):
+        return line, None
+    try:
+        trace_id, origin_ns, written_ns = tail.split(':', 1)[1].strip().split('@')
+        return head.rstrip(), (trace_id, int(origin_ns), int(written_ns))
+    except ValueError:
+        return head.rstrip(), None
+
+class StageTracer:
+    """Per-service stage histograms plus the bookkeeping to correlate hops.
+
+    Every method accepts trace=None and returns at once, so call sites do
+    not need to check whether tracing is enabled.
+    """
+
+    def __init__(self, service, enabled=None, output_dir=None, port=None):
+        self.service = service
+        self.output_dir = output_dir or os.environ.get('STAGE_TRACE_DIR')
+        self.port = port or (int(os.environ['STAGE_TRACE_PORT']) if os.environ.get('STAGE_TRACE_PORT') else None)
+        self.enabled = enabled if enabled is not None else bool(self.output_dir or self.port)
+        self.histograms = defaultdict(LatencyHistogram)
+        self.pending = defaultdict(deque)  # CAN ID -> traces awaiting a response
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.next_sequence = 0
+        if self.enabled:
+            _register(self)
+
+    def record(self, stage, duration_ns):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histograms[stage].record(duration_ns)
+
+    def begin(self, tag=None, start_ns=None, stage=None):
+        """Start (or continue, if `tag` came from an upstream process) a trace.
+
+        With a tag, the gap between the upstream write and start_ns is
+        recorded as `stage`.
+        """
+        if not self.enabled:
+            return None
+        now = start_ns or time.monotonic_ns()
+        if tag:
+            trace_id, origin_ns, written_ns = tag
+            if stage:
+                self.record(stage, now - written_ns)
+            return Trace(trace_id, origin_ns, now)
+        with self.lock:
+            self.next_id += 1
+            trace_id = f"{self.service}-{self.next_id}"
+        return Trace(trace_id, now, now)
+
+    def stamp(self, trace, stage):
+        """Record the time since the previous stamp of `trace` as `stage`."""
+        if trace is None:
+            return
+        now = time.monotonic_ns()
+        self.record(stage, now - trace.last_ns)
+        trace.last_ns = now
+
+    def finish(self, trace, stage):
+        """Last hop of a trace; also records the whole path as end_to_end."""
+        if trace is None:
+            return
+        self.stamp(trace, stage)
+        self.record('end_to_end', trace.last_ns - trace.origin_ns)
+
+    def tag(self, trace):
+        """Field appended to an analysis line so the master can continue the trace."""
+        if trace is None:
+            return ''
+        return f" | {TRACE_FIELD}: {trace.trace_id}@{trace.origin_ns}@{time.monotonic_ns()}"
+
+    def tag_lines(self, text, trace):
+        """Append the trace field to every non-empty line of `text`."""
+        if trace is None:
+            return text
+        field = self.tag(trace)
+        return ''.join(line + field + '\n' if line.strip() else line + '\n' for line in text.splitlines())
+
+    def expect_response(self, trace, can_id):
+        """Queue `trace` for the response on `can_id`; return the sequence
+        byte to carry in the frame (None when tracing is off)."""
+        if trace is None:
+            return None
+        with self.lock:
+            trace.sequence = self.next_sequence
+            self.next_sequence = (self.next_sequence + 1) & 0xFF
+            self.pending[can_id].append(trace)
+        return trace.sequence
+
+    def match_response(self, can_id, sequence=None):
+        """Pop the trace a response belongs to: by sequence byte when the
+        slave echoed one, otherwise the oldest one pending on that ID."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            queue = self.pending.get(can_id)
+            if not queue:
+                return None
+            if sequence is not None:
+                for trace in queue:
+                    if trace.sequence == sequence:
+                        queue.remove(trace)
+                        return trace
+                return None
+            return queue.popleft()
+
+    def render_groups(self):
+        """(summary lines, max lines): each metric family must stay contiguous."""
+        summary, maxima = [], []
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                labels = f'service="{self.service}",stage="{stage}"'
+                for q in QUANTILES:
+                    summary.append(f'pfe_stage_latency_seconds{{{labels},quantile="{q}"}} '
+                                   f'{histogram.percentile(q) / 1e6:.6f}')
+                summary.append(f'pfe_stage_latency_seconds_sum{{{labels}}} {histogram.total_us / 1e6:.6f}')
+                summary.append(f'pfe_stage_latency_seconds_count{{{labels}}} {histogram.count}')
+                maxima.append(f'pfe_stage_latency_max_seconds{{{labels}}} {histogram.max_us / 1e6:.6f}')
+        return summary, maxima
+
+    def render(self):
+        """Prometheus text exposition of this tracer's histograms."""
+        summary, maxima = self.render_groups()
+        return SUMMARY_HEADER + summary + MAX_HEADER + maxima
+
+def render_all():
+    summary, maxima = list(SUMMARY_HEADER), list(MAX_HEADER)
+    for tracer in list(_tracers):
+        tracer_summary, tracer_maxima = tracer.render_groups()
+        summary.extend(tracer_summary)
+        maxima.extend(tracer_maxima)
+    return '\n'.join(summary + maxima) + '\n'
+
+def write_files():
+    for tracer in list(_tracers):
+        if not tracer.output_dir:
+            continue
+        os.makedirs(tracer.output_dir, exist_ok=True)
+        path = os.path.join(tracer.output_dir, f"{tracer.service}.prom")
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(tracer.render()) + '\n')
+        os.replace(path + '.tmp', path)  # readers never see a half-written file
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_all().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        write_files()
+
+def _register(tracer):
+    global _exporters_started
+    with _exporters_lock:
+        _tracers.append(tracer)
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if metrics is not None:
+        metrics.REGISTRY.add_collector(render_all)
+        if tracer.port:
+            metrics.start_http_server(tracer.port)
+    elif tracer.port:
+        server = ThreadingHTTPServer(('', tracer.port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=_flush_loop, daemon=True).start()
+    atexit.register(write_files)
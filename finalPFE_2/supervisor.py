@@ -0,0 +1,660 @@
+"""
+Single-process supervisor for the ECU masters.
+
+Instead of one process (or thread) per master, each opening its own CAN
+socket, serial port and MySQL connection and bringing can0 up and down on its
+own, the supervisor owns:
+
+    - one CAN socket; frames are routed to plugins by arbitration ID, with
+      kernel filters so IDs nobody subscribed to never reach Python
+    - one LIN serial port, shared by the LIN plugins through a write lock
+    - one MySQL connection pool
+    - one file watcher for every analysis/input file (inotify through
+      watchdog when installed, else one polling thread)
+
+and hosts light, window, wiper and door as plugins. Each plugin runs on its
+own worker thread fed by an inbox (frames, file changes, ticks for response
+timeouts), so a slow DB write in one does not hold up the others. A plugin
+that raises is stopped and started again with a growing back-off. CPU time
+per plugin (worker thread plus the threads it started) is logged every
+CPU_REPORT_INTERVAL seconds and exported as pfe_plugin_cpu_seconds.
+
+    python supervisor.py                 light window wiper door
+    python supervisor.py light window    only these
+
+    CAN_INTERFACE=virtual                any python-can interface (can0 is then left alone)
+    CAN_FD=1                             open the CAN socket as CAN FD, classic if unavailable (can_fd.py)
+    LIGHT_FRAMES=aggregated              all lights in one frame per command batch (light_frames.py)
+    SNAPSHOT_INTERVAL=10                 ask every hosted ECU for its whole state every 10 s (snapshot.py)
+    CAN_REFRESH_PERIOD=1.0               kernel-timed refresh of the commanded state, 0 to turn off (cyclic.py)
+    CAN_TX_QUEUE=256                     frames the plugins may queue before their sends block (can_tx.py)
+    WIPER_MASTER_DIR, DOOR_MASTER_DIR    where the wiper/door master.py live
+    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+
+The wiper response (0x101) shares its ID with the Low Beam response, so both
+plugins receive it, as they did with two sockets.
+"""
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import importlib.util
+from collections import defaultdict
+import can
+import metrics
+import can_fd
+import snapshot
+from can_tx import CANTransmitter
+from async_logging import setup_logging
+
+try:
+    import watchdog.events as watchdog_events
+    import watchdog.observers as watchdog_observers
+except ImportError:
+    watchdog_events = watchdog_observers = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HMI_DIR = os.path.join(HERE, '..', 'vehicle systems', 'HMI')
+
+METRICS_PORT = 9100
+CAN_INTERFACE = os.environ.get('CAN_INTERFACE', 'socketcan')
+CAN_CHANNEL = os.environ.get('CAN_CHANNEL', 'can0')
+LIN_PORT = os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
+LIN_BAUDRATE = 19200
+
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', '10.20.0.23'),
+    'user': os.environ.get('DB_USER', 'myuser1'),
+    'password': os.environ.get('DB_PASSWORD', 'root'),
+    'database': os.environ.get('DB_NAME', 'khalil')
+}
+
+# Directories of the masters that do not live next to this file
+PLUGIN_DIRS = {
+    'wiper': os.environ.get('WIPER_MASTER_DIR', os.path.join(HMI_DIR, 'wiper', 'CAN', 'finalVersion', 'send2event_id')),
+    'door': os.environ.get('DOOR_MASTER_DIR', os.path.join(HMI_DIR, 'door', 'final'))
+}
+
+FILE_POLL_INTERVAL = 0.1  # seconds between checks of the watched files without watchdog
+TICK_INTERVAL = 0.5       # seconds between response timeout checks
+CPU_REPORT_INTERVAL = 30.0
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 0))  # 0: no periodic snapshots
+RESTART_BACKOFF = (1, 2, 5, 10, 30)  # seconds before the 1st, 2nd, ... restart
+STABLE_AFTER = 60.0       # a plugin up this long starts over at the first back-off step
+
+log = logging.getLogger('supervisor')
+can_log = logging.getLogger('supervisor.can')
+lin_log = logging.getLogger('supervisor.lin')
+file_log = logging.getLogger('supervisor.file')
+
+PLUGIN_CPU = metrics.counter('pfe_plugin_cpu_seconds', 'CPU time used by each hosted plugin', ('plugin',))
+PLUGIN_RESTARTS = metrics.counter('pfe_plugin_restarts', 'Plugin restarts after a crash', ('plugin',))
+PLUGIN_UP = metrics.gauge('pfe_plugin_up', '1 while the plugin is running', ('plugin',))
+QUEUE_DEPTH = metrics.gauge('pfe_queue_depth', 'Items waiting in a background queue', ('service', 'queue'))
+
+def load_module(name, directory, filename='master.py'):
+    """Import `filename` from `directory` as `name` (its siblings become importable)"""
+    if name in sys.modules:
+        return sys.modules[name]
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+    return module
+
+class SharedCANBus:
+    """The one CAN socket of the process: send() queues on one transmitter
+    (lowest ID first, bus-off recovery), received frames are handed to the
+    callbacks subscribed to their ID."""
+
+    def __init__(self, interface=CAN_INTERFACE, channel=CAN_CHANNEL):
+        self.interface = interface
+        self.channel = channel
+        self.bus = None
+        self.fd = False  # True once opened with CAN FD
+        self.subscribers = defaultdict(list)  # CAN ID -> callbacks
+        self.lock = threading.Lock()
+        self.transmitter = None
+        self.running = False
+
+    def open(self):
+        self.bus, self.fd = can_fd.open_bus(self.channel, self.interface)
+        self.transmitter = CANTransmitter(self.bus, 'supervisor',
+                                          self.channel if self.interface == 'socketcan' else None, self.fd)
+        self.transmitter.start()
+        self.update_filters()
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop, name='can-reader', daemon=True)
+        self.reader.start()
+        can_log.info("CAN initialized on %s (%s, %s)", self.channel, self.interface, "CAN FD" if self.fd else "classic")
+
+    def subscribe(self, can_ids, callback):
+        with self.lock:
+            for can_id in can_ids:
+                self.subscribers[can_id].append(callback)
+        self.update_filters()
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            for can_id in list(self.subscribers):
+                callbacks = [c for c in self.subscribers[can_id] if c != callback]
+                if callbacks:
+                    self.subscribers[can_id] = callbacks
+                else:
+                    del self.subscribers[can_id]
+        self.update_filters()
+
+    def update_filters(self):
+        if self.bus is None:
+            return
+        with self.lock:
+            filters = [{'can_id': can_id, 'can_mask': 0x7FF, 'extended': False} for can_id in sorted(self.subscribers)]
+        self.bus.set_filters(filters)
+
+    def send(self, msg, timeout=None):
+        """Queue a frame; blocks while the queue is full, for up to `timeout` seconds"""
+        self.transmitter.send(msg, timeout)
+
+    def send_periodic(self, msgs, period):
+        """Cyclic frames for the plugins (kernel BCM tasks on socketcan, see cyclic.py)"""
+        return self.bus.send_periodic(msgs, period)
+
+    def read_loop(self):
+        while self.running:
+            try:
+                msg = self.bus.recv(timeout=1.0)
+            except can.CanError as e:
+                can_log.error("CAN receive error: %s", e)
+                time.sleep(0.1)
+                continue
+            if msg is None:
+                continue
+            if msg.is_error_frame:
+                self.transmitter.on_error_frame(msg)
+                continue
+            for callback in self.subscribers.get(msg.arbitration_id, ()):
+                callback(msg)
+
+    def close(self):
+        self.running = False
+        if self.bus is None:
+            return
+        self.transmitter.stop()
+        self.reader.join(timeout=1.5)
+        self.bus.shutdown()
+        if self.interface == 'socketcan':
+            os.system(f'sudo /sbin/ip link set {self.channel} down')
+
+class SharedLINPort:
+    """The one LIN UART of the process; whole frames are written under a lock
+    so frames of different plugins never interleave. The lock is re-entrant:
+    a plugin that checks its echo holds it across the frame's writes and reads."""
+
+    def __init__(self, port=LIN_PORT, baudrate=LIN_BAUDRATE):
+        self.port = port
+        self.baudrate = baudrate
+        self.serial = None
+        self.lock = threading.RLock()
+
+    def open(self):
+        import serial
+        self.serial = serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=1
+        )
+        lin_log.info("LIN port %s opened at %d baud", self.port, self.baudrate)
+
+    def write(self, data):
+        with self.lock:
+            return self.serial.write(data)
+
+    def flush(self):
+        self.serial.flush()
+
+    def read(self, size=1):
+        with self.lock:
+            return self.serial.read(size)
+
+    def reset_input_buffer(self):
+        self.serial.reset_input_buffer()
+
+    def close(self):
+        if self.serial and self.serial.is_open:
+            self.serial.close()
+
+class FileWatcher:
+    """Calls back when a watched file changes (size or mtime).
+
+    With watchdog installed the changes come from inotify and nothing runs
+    while the files are idle; otherwise one thread polls every file.
+    """
+
+    def __init__(self, interval=FILE_POLL_INTERVAL):
+        self.interval = interval
+        self.watches = {}  # absolute path -> [last (size, mtime), callbacks]
+        self.lock = threading.Lock()
+        self.running = True
+        self.observer = None
+        self.directories = set()  # directories scheduled on the observer
+
+    def start(self):
+        if watchdog_observers is not None:
+            self.observer = watchdog_observers.Observer()
+            self.observer.start()
+            with self.lock:
+                paths = list(self.watches)
+            for path in paths:
+                self.schedule(path)
+            file_log.info("Watching files with %s", type(self.observer).__name__)
+        else:
+            threading.Thread(target=self.poll_loop, name='file-watcher', daemon=True).start()
+            file_log.info("watchdog not installed, polling files every %s s", self.interval)
+
+    def schedule(self, path):
+        directory = os.path.dirname(path)
+        with self.lock:
+            if directory in self.directories:
+                return
+            self.directories.add(directory)
+        self.observer.schedule(FileEventHandler(self), directory, recursive=False)
+
+    def watch(self, path, callback):
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.watches.setdefault(path, [self.stat(path), []])
+            entry[1].append(callback)
+        if self.observer is not None:
+            self.schedule(path)
+
+    def unwatch(self, callback):
+        with self.lock:
+            for path in list(self.watches):
+                entry = self.watches[path]
+                entry[1] = [c for c in entry[1] if c != callback]
+                if not entry[1]:
+                    del self.watches[path]
+
+    @staticmethod
+    def stat(path):
+        try:
+            st = os.stat(path)
+            return st.st_size, st.st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self, path):
+        with self.lock:
+            entry = self.watches.get(path)
+        if entry is None:
+            return
+        current = self.stat(path)
+        if current != entry[0]:
+            entry[0] = current
+            for callback in list(entry[1]):
+                callback(path)
+
+    def poll_loop(self):
+        while self.running:
+            with self.lock:
+                paths = list(self.watches)
+            for path in paths:
+                self.check(path)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join(timeout=1.0)
+
+if watchdog_observers is not None:
+    class FileEventHandler(watchdog_events.FileSystemEventHandler):
+        def __init__(self, watcher):
+            super().__init__()
+            self.watcher = watcher
+
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            # A rename onto a watched file (editor save) reports it as dest_path
+            for path in (event.src_path, getattr(event, 'dest_path', None)):
+                if path:
+                    self.watcher.check(os.path.abspath(path))
+
+class Plugin:
+    """A master hosted by the supervisor. start() builds it on the shared
+    resources and sets `can_ids` and `files`; the other hooks run on the
+    plugin's worker thread."""
+    name = None
+    uses_lin = False
+    snapshot_ecu = 0  # snapshot.SNAPSHOT_* bit of the ECU this plugin masters
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+        self.master = None  # stays None when start() fails early
+        self.can_ids = ()
+        self.files = ()
+
+    def start(self):
+        pass
+
+    def on_frame(self, msg):
+        pass
+
+    def on_file(self, path):
+        pass
+
+    def tick(self):
+        pass
+
+    def stop(self):
+        pass
+
+class LightPlugin(Plugin):
+    name = 'light'
+    snapshot_ecu = snapshot.SNAPSHOT_LIGHTS
+
+    def start(self):
+        import master_light
+        self.master = master_light.CANLightMaster("Lights_analysis.txt", bus=self.supervisor.can_bus,
+                                                  db_pool=self.supervisor.db_pool)
+        self.can_ids = (*master_light.RESPONSE_IDS.values(), master_light.LIGHTS_STATUS_ID,
+                        snapshot.LIGHT_SNAPSHOT_ID)
+        self.files = (self.master.filename,)
+
+    def on_frame(self, msg):
+        self.master.handle_response(msg)
+
+    def on_file(self, path):
+        self.master.process_available()
+
+    def tick(self):
+        self.master.check_response_timeouts()
+
+    def stop(self):
+        if self.master:
+            self.master.shutdown()
+
+class WindowPlugin(LightPlugin):
+    name = 'window'
+    snapshot_ecu = snapshot.SNAPSHOT_WINDOWS
+
+    def start(self):
+        import master_window
+        self.master = master_window.CANWindowMaster("windows_analysis.txt", bus=self.supervisor.can_bus,
+                                                    db_pool=self.supervisor.db_pool)
+        self.can_ids = (*master_window.RESPONSE_IDS.values(), *master_window.SNAPSHOT_IDS)
+        self.files = (self.master.filename,)
+
+class WiperPlugin(Plugin):
+    name = 'wiper'
+    snapshot_ecu = snapshot.SNAPSHOT_WIPER
+
+    def start(self):
+        wiper_master = load_module('wiper_master', PLUGIN_DIRS['wiper'])
+        self.master = wiper_master.CANWiperMaster(bus=self.supervisor.can_bus, db_pool=self.supervisor.db_pool,
+                                                  base_dir=PLUGIN_DIRS['wiper'])
+        self.can_ids = (self.master.RESPONSE_MSG_ID,)
+        self.files = (self.master.input_file,)
+
+    def on_frame(self, msg):
+        self.master.handle_response(msg)
+
+    def on_file(self, path):
+        self.master.check_file()
+
+    def tick(self):
+        self.master.check_response_timeout()
+
+    def stop(self):
+        if self.master:
+            self.master.shutdown()
+
+class DoorPlugin(Plugin):
+    name = 'door'
+    uses_lin = True
+
+    def start(self):
+        self.master = self.door = load_module('door_master', PLUGIN_DIRS['door'])
+        self.door.init_db(self.supervisor.db_pool)
+        self.door.start_transmitter(self.supervisor.lin_port, self.supervisor.db_pool)
+        self.files = (self.door.DOORS_ANALYSIS_FILE,)
+        # Like tail_file(): only lines appended from now on are sent
+        current = FileWatcher.stat(self.files[0])
+        self.offset = current[0] if current else 0
+
+    def on_file(self, path):
+        try:
+            with open(path, 'r') as f:
+                f.seek(self.offset)
+                lines = f.readlines()
+                self.offset = f.tell()
+        except FileNotFoundError:
+            self.offset = 0
+            return
+        if lines:
+            self.door.process_new_lines(lines)
+
+    def stop(self):
+        if self.master:
+            self.door.transmitter.flush(timeout=1)
+
+PLUGINS = {plugin.name: plugin for plugin in (LightPlugin, WindowPlugin, WiperPlugin, DoorPlugin)}
+
+class PluginRunner:
+    """Runs one plugin on its worker thread and restarts it when it crashes."""
+
+    def __init__(self, supervisor, plugin_class):
+        self.supervisor = supervisor
+        self.plugin_class = plugin_class
+        self.name = plugin_class.name
+        self.plugin = None
+        self.worker = None
+        self.inbox = queue.SimpleQueue()
+        self.file_pending = False
+        self.started_at = None
+        self.crashed_at = None
+        self.failures = 0  # consecutive crashes, selects the back-off step
+        self.threads = []  # threads the plugin started, for CPU accounting
+        self.ready = threading.Event()  # set once start() returned or failed
+        self.cpu_samples = {}  # thread -> last CPU time seen
+        self.cpu_lock = threading.Lock()
+
+        PLUGIN_CPU.labels(self.name).set_function(self.cpu_seconds)
+        PLUGIN_UP.labels(self.name).set_function(lambda: int(self.running()))
+        QUEUE_DEPTH.labels('supervisor', self.name).set_function(lambda: self.inbox.qsize())
+
+    def running(self):
+        return self.worker is not None and self.worker.is_alive() and self.crashed_at is None
+
+    def start(self):
+        self.inbox = queue.SimpleQueue()  # anything queued for the crashed instance is stale
+        self.crashed_at = None
+        self.ready.clear()
+        self.worker = threading.Thread(target=self.run, name=f'plugin-{self.name}', daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.inbox.put(('stop', None))
+        if self.worker:
+            self.worker.join(timeout=2.0)
+
+    def submit_frame(self, msg):
+        self.inbox.put(('frame', msg))
+
+    def submit_file(self, path):
+        # One pending notification is enough: the plugin reads everything new
+        if not self.file_pending:
+            self.file_pending = True
+            self.inbox.put(('file', path))
+
+    def run(self):
+        supervisor = self.supervisor
+        before = set(threading.enumerate())
+        plugin = None
+        try:
+            plugin = self.plugin = self.plugin_class(supervisor)
+            plugin.start()
+            for thread in threading.enumerate():
+                if thread not in before and thread is not self.worker and thread not in self.threads:
+                    self.threads.append(thread)
+            if plugin.can_ids:
+                supervisor.can_bus.subscribe(plugin.can_ids, self.submit_frame)
+            for path in plugin.files:
+                supervisor.watcher.watch(path, self.submit_file)
+            self.started_at = time.monotonic()
+            self.ready.set()
+            log.info("Plugin %s started", self.name)
+
+            next_tick = time.monotonic() + TICK_INTERVAL
+            while True:
+                try:
+                    kind, payload = self.inbox.get(timeout=max(0.0, next_tick - time.monotonic()))
+                except queue.Empty:
+                    kind, payload = 'tick', None
+                if kind == 'stop':
+                    break
+                if kind == 'frame':
+                    plugin.on_frame(payload)
+                elif kind == 'file':
+                    self.file_pending = False
+                    plugin.on_file(payload)
+                if time.monotonic() >= next_tick:
+                    plugin.tick()
+                    next_tick = time.monotonic() + TICK_INTERVAL
+        except Exception:
+            log.exception("Plugin %s crashed", self.name)
+            self.crashed_at = time.monotonic()
+            if self.started_at is not None and self.crashed_at - self.started_at >= STABLE_AFTER:
+                self.failures = 0
+            self.failures += 1
+        finally:
+            supervisor.can_bus.unsubscribe(self.submit_frame)
+            supervisor.watcher.unwatch(self.submit_file)
+            self.file_pending = False
+            self.started_at = None
+            self.ready.set()
+            if plugin is not None:
+                try:
+                    plugin.stop()
+                except Exception as e:
+                    log.error("Plugin %s did not stop cleanly: %s", self.name, e)
+            with self.cpu_lock:
+                self.cpu_samples[self.worker] = time.thread_time()
+
+    def restart_due(self, now):
+        if self.crashed_at is None:
+            return False
+        backoff = RESTART_BACKOFF[min(self.failures, len(RESTART_BACKOFF)) - 1]
+        return now - self.crashed_at >= backoff
+
+    def cpu_seconds(self):
+        """CPU time of the worker threads so far and of the threads the plugin started"""
+        with self.cpu_lock:
+            for thread in [self.worker] + self.threads:
+                # A finished thread's ident may belong to another thread by now
+                if thread is None or not thread.is_alive():
+                    continue
+                try:
+                    self.cpu_samples[thread] = time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+                except OSError:
+                    pass  # exited between the check and the read; keep the last sample
+            return sum(self.cpu_samples.values())
+
+class Supervisor:
+    def __init__(self, plugin_names):
+        self.plugin_classes = [PLUGINS[name] for name in plugin_names]
+        self.can_bus = SharedCANBus()
+        self.lin_port = SharedLINPort() if any(cls.uses_lin for cls in self.plugin_classes) else None
+        self.db_pool = None
+        self.watcher = FileWatcher()
+        self.runners = [PluginRunner(self, cls) for cls in self.plugin_classes]
+        self.running = True
+
+    def init_db_pool(self):
+        from mysql.connector import pooling
+        # One connection per plugin plus one for a plugin that is restarting
+        self.db_pool = pooling.MySQLConnectionPool(pool_name='pfe', pool_size=len(self.runners) + 1, **DB_CONFIG)
+        log.info("MySQL pool of %d connections to %s", len(self.runners) + 1, DB_CONFIG['host'])
+
+    def start(self):
+        metrics.start_http_server(METRICS_PORT)
+        self.can_bus.open()
+        if self.lin_port:
+            self.lin_port.open()
+        self.init_db_pool()
+        self.watcher.start()
+        # One at a time, so the threads a plugin starts are attributed to it
+        for runner in self.runners:
+            runner.start()
+            runner.ready.wait(timeout=10.0)
+
+    def run(self):
+        self.start()
+        next_report = time.monotonic() + CPU_REPORT_INTERVAL
+        next_snapshot = time.monotonic()
+        try:
+            while self.running:
+                now = time.monotonic()
+                for runner in self.runners:
+                    if runner.restart_due(now):
+                        PLUGIN_RESTARTS.labels(runner.name).inc()
+                        log.warning("Restarting plugin %s (crash #%d)", runner.name, runner.failures)
+                        runner.start()
+                if now >= next_report:
+                    self.report_cpu()
+                    next_report = now + CPU_REPORT_INTERVAL
+                if SNAPSHOT_INTERVAL and now >= next_snapshot:
+                    self.request_snapshot()
+                    next_snapshot = now + SNAPSHOT_INTERVAL
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def request_snapshot(self):
+        """One request for the whole state of every ECU a running plugin masters"""
+        ecus = 0
+        for runner in self.runners:
+            if runner.running():
+                ecus |= runner.plugin_class.snapshot_ecu
+        if not ecus:
+            return
+        msg = can.Message(arbitration_id=snapshot.SNAPSHOT_REQUEST_ID,
+                          data=snapshot.encode_request(ecus, self.can_bus.fd), is_extended_id=False)
+        try:
+            self.can_bus.send(msg)
+        except can.CanError as e:
+            can_log.error("Error sending snapshot request: %s", e)
+
+    def report_cpu(self):
+        usage = {runner.name: round(runner.cpu_seconds(), 3) for runner in self.runners}
+        log.info("CPU seconds per plugin: %s (process: %.3f)", usage, time.process_time(), extra={'cpu': usage})
+
+    def shutdown(self):
+        self.running = False
+        for runner in self.runners:
+            runner.stop()
+        self.watcher.stop()
+        self.can_bus.close()
+        if self.lin_port:
+            self.lin_port.close()
+        self.report_cpu()
+        log.info("Shutdown complete")
+
+if __name__ == "__main__":
+    setup_logging('supervisor', 'supervisor.log')
+    names = sys.argv[1:] or list(PLUGINS)
+    unknown = [name for name in names if name not in PLUGINS]
+    if unknown:
+        sys.exit(f"Unknown plugin(s): {', '.join(unknown)}; available: {', '.join(PLUGINS)}")
+    Supervisor(names).run()
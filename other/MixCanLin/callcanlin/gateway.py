@@ -0,0 +1,172 @@
+import time
+import threading
+from collections import OrderedDict
+
+# Minimum spacing between LIN frames: one slot of the LIN schedule.
+# CAN frames are sent back to back.
+LIN_SLOT_TIME = 0.01
+
+# Where each signal goes when input.txt does not pin a protocol: one bus,
+# CAN, so a receiver on each bus never acts on the same ledState twice.
+# `protocol = 'LIN'` sends every signal over LIN instead.
+SIGNAL_ROUTES = {
+    'ledState': ('CAN',),
+    'lightStatus': ('CAN',),
+    'windowLevel': ('CAN',)
+}
+
+# Frame layouts per bus: frame ID -> [(signal, byte position)].
+# ledState stays in byte 0 of CAN 0x100 / LIN 0x01 so the existing
+# receivers keep working; the other signals share the same frames on CAN
+# and a second frame on LIN. LIN frames carry no length field, so the LIN
+# receiver splits the byte stream with LIN_DATA_LENGTHS.
+FRAME_LAYOUTS = {
+    'CAN': {
+        0x100: [('ledState', 0), ('lightStatus', 1), ('windowLevel', 2)]
+    },
+    'LIN': {
+        0x01: [('ledState', 0)],
+        0x02: [('lightStatus', 0), ('windowLevel', 1)]
+    }
+}
+
+# LIN frame ID -> data bytes, shared with receive_lin
+LIN_DATA_LENGTHS = {
+    frame_id: max(position for _, position in layout) + 1
+    for frame_id, layout in FRAME_LAYOUTS['LIN'].items()
+}
+
+def lin_frame_length(frame_id):
+    """Break + sync + PID + data + checksum bytes of a LIN frame, None for unknown IDs"""
+    data_length = LIN_DATA_LENGTHS.get(frame_id)
+    return None if data_length is None else 3 + data_length + 1
+
+def encode_on_off(value):
+    if value not in ['ON', 'OFF']:
+        raise ValueError(f"expected 'ON' or 'OFF', got {value!r}")
+    return 0x01 if value == 'ON' else 0x00
+
+def encode_percent(value):
+    level = int(value)
+    if not 0 <= level <= 100:
+        raise ValueError(f"expected 0-100, got {level}")
+    return level
+
+SIGNAL_ENCODERS = {
+    'ledState': encode_on_off,
+    'lightStatus': encode_on_off,
+    'windowLevel': encode_percent
+}
+
+class BusTransmitter(threading.Thread):
+    """Transmit queue for one bus.
+
+    Frames waiting for the same ID are coalesced (only the latest data is
+    sent) and consecutive frames are spaced by at least `min_interval`.
+    """
+
+    def __init__(self, name, master, min_interval=0.0):
+        super().__init__(daemon=True)
+        self.name = name
+        self.master = master
+        self.min_interval = min_interval
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.running = True
+
+    def submit(self, frame_id, data):
+        with self.condition:
+            self.pending.pop(frame_id, None)
+            self.pending[frame_id] = data
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or not self.running)
+                if not self.pending:
+                    return
+                frame_id, data = self.pending.popitem(last=False)
+            start = time.monotonic()
+            self.master.send_data(frame_id, data)
+            remaining = self.min_interval - (time.monotonic() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+class Gateway:
+    """Routes named signals to one or more buses and packs them into frames."""
+
+    def __init__(self, bus_factories, routes=SIGNAL_ROUTES, layouts=FRAME_LAYOUTS):
+        self.bus_factories = bus_factories
+        self.routes = routes
+        self.layouts = layouts
+        self.transmitters = {}
+        self.signal_values = {}
+        # Reverse index: (bus, signal) -> frame ID carrying it
+        self.signal_frames = {
+            (bus, signal): frame_id
+            for bus, frames in layouts.items()
+            for frame_id, layout in frames.items()
+            for signal, _ in layout
+        }
+
+    def update(self, signals, protocol=None):
+        """Encode the signals and queue the frames that carry them.
+
+        `protocol` restricts routing to a single bus (the old `protocol = ...`
+        line in input.txt); without it the SIGNAL_ROUTES table decides.
+        """
+        dirty = set()
+        for signal, value in signals.items():
+            encoder = SIGNAL_ENCODERS.get(signal)
+            if encoder is None:
+                continue
+            try:
+                encoded = encoder(value)
+            except ValueError as e:
+                print(f"Invalid {signal}: {e}")
+                continue
+            
+            buses = (protocol,) if protocol else self.routes.get(signal, ())
+            for bus in buses:
+                frame_id = self.signal_frames.get((bus, signal))
+                if frame_id is None:
+                    print(f"No {bus} frame carries {signal}")
+                    continue
+                self.signal_values[(bus, signal)] = encoded
+                dirty.add((bus, frame_id))
+        
+        for bus, frame_id in sorted(dirty):
+            transmitter = self._transmitter(bus)
+            if transmitter:
+                transmitter.submit(frame_id, self._pack(bus, frame_id))
+
+    def _pack(self, bus, frame_id):
+        layout = self.layouts[bus][frame_id]
+        data = [0x00] * (max(position for _, position in layout) + 1)
+        for signal, position in layout:
+            data[position] = self.signal_values.get((bus, signal), 0x00)
+        return data
+
+    def _transmitter(self, bus):
+        if bus not in self.transmitters:
+            factory = self.bus_factories.get(bus)
+            if factory is None:
+                print(f"Unknown protocol: {bus}")
+                return None
+            min_interval = LIN_SLOT_TIME if bus == 'LIN' else 0.0
+            transmitter = BusTransmitter(bus, factory(), min_interval)
+            transmitter.start()
+            self.transmitters[bus] = transmitter
+        return self.transmitters[bus]
+
+    def shutdown(self):
+        for transmitter in self.transmitters.values():
+            transmitter.stop()
+            transmitter.join(timeout=1)
+            transmitter.master.shutdown()
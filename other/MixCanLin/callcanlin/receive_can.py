@@ -24,17 +24,37 @@ class CANSlave:
         GPIO.setup(self.LED_PIN, GPIO.OUT)
         GPIO.output(self.LED_PIN, GPIO.LOW)
 
+    def fileno(self):
+        """Socket fd for the receiver's event loop, or None if CAN is not up"""
+        if self.can_bus:
+            return self.can_bus.fileno()
+        return None
+
+    def on_readable(self):
+        """Drain every frame already queued on the socket without blocking"""
+        try:
+            msg = self.can_bus.recv(timeout=0)
+            while msg is not None:
+                self._handle_message(msg)
+                msg = self.can_bus.recv(timeout=0)
+        except Exception as e:
+            print(f"CAN receive error: {e}")
+
     def process_frame(self):
         try:
             if self.can_bus:
                 msg = self.can_bus.recv(timeout=0.1)
-                if msg and msg.arbitration_id == self.CAN_MSG_ID:
-                    state = msg.data[0] if len(msg.data) > 0 else 0x00
-                    GPIO.output(self.LED_PIN, GPIO.HIGH if state == 0x01 else GPIO.LOW)
-                    print(f"Received CAN frame: LED {'ON' if state == 0x01 else 'OFF'}")
+                if msg:
+                    self._handle_message(msg)
         except Exception as e:
             print(f"CAN receive error: {e}")
 
+    def _handle_message(self, msg):
+        if msg.arbitration_id == self.CAN_MSG_ID:
+            state = msg.data[0] if len(msg.data) > 0 else 0x00
+            GPIO.output(self.LED_PIN, GPIO.HIGH if state == 0x01 else GPIO.LOW)
+            print(f"Received CAN frame: LED {'ON' if state == 0x01 else 'OFF'}")
+
     def shutdown(self):
         if self.can_bus:
             self.can_bus.shutdown()
@@ -1,5 +1,6 @@
 import serial
 import RPi.GPIO as GPIO
+from gateway import lin_frame_length
 
 class LINFrame:
     def __init__(self, id, data):
@@ -31,6 +32,8 @@ class LINFrame:
             
         pid = buffer[2]
         id = pid & 0x3F
+        if len(buffer) != lin_frame_length(id):
+            return None
         data = buffer[3:-1]
         checksum = buffer[-1]
         
@@ -68,25 +71,50 @@ class LINSlave:
         GPIO.setup(self.LED_PIN, GPIO.OUT)
         GPIO.output(self.LED_PIN, GPIO.LOW)
 
+    def fileno(self):
+        """Serial fd for the receiver's event loop, or None if LIN is not up"""
+        if self.serial:
+            return self.serial.fileno()
+        return None
+
+    def on_readable(self):
+        """Consume every byte already received without blocking"""
+        waiting = self.serial.in_waiting
+        if waiting:
+            for byte in self.serial.read(waiting):
+                self._handle_byte(byte)
+
     def process_frame(self):
         if self.serial and self.serial.in_waiting:
             byte = self.serial.read(1)
             if byte:
-                self.lin_buffer.append(byte[0])
-                if len(self.lin_buffer) >= 5:
-                    if self.lin_buffer[0] == 0x00 and self.lin_buffer[1] == 0x55:
-                        frame = LINFrame.from_bytes(self.lin_buffer)
-                        if frame and frame.id == self.LIN_MSG_ID:
-                            state = frame.data[0] if len(frame.data) > 0 else 0x00
-                            GPIO.output(self.LED_PIN, GPIO.HIGH if state == 0x01 else GPIO.LOW)
-                            print(f"Received LIN frame: LED {'ON' if state == 0x01 else 'OFF'}")
-                            self.lin_buffer = bytearray()
-                        else:
-                            self.lin_buffer = bytearray()
-                    else:
-                        self.lin_buffer = bytearray()
-                elif len(self.lin_buffer) > 10:
-                    self.lin_buffer = bytearray()
+                self._handle_byte(byte[0])
+
+    def _handle_byte(self, byte):
+        self.lin_buffer.append(byte)
+        # Wait for a break + sync header, dropping bytes until one starts
+        if len(self.lin_buffer) == 1:
+            if byte != 0x00:
+                self.lin_buffer = bytearray()
+            return
+        if len(self.lin_buffer) == 2:
+            if byte != 0x55:
+                self.lin_buffer = bytearray([byte]) if byte == 0x00 else bytearray()
+            return
+        # The PID says how long the frame is (gateway.LIN_DATA_LENGTHS)
+        length = lin_frame_length(self.lin_buffer[2] & 0x3F)
+        if length is None:
+            print(f"Unknown LIN frame ID: {hex(self.lin_buffer[2] & 0x3F)}")
+            self.lin_buffer = bytearray()
+            return
+        if len(self.lin_buffer) < length:
+            return
+        frame = LINFrame.from_bytes(self.lin_buffer)
+        self.lin_buffer = bytearray()
+        if frame and frame.id == self.LIN_MSG_ID:
+            state = frame.data[0] if len(frame.data) > 0 else 0x00
+            GPIO.output(self.LED_PIN, GPIO.HIGH if state == 0x01 else GPIO.LOW)
+            print(f"Received LIN frame: LED {'ON' if state == 0x01 else 'OFF'}")
 
     def shutdown(self):
         if self.serial:
@@ -1,31 +1,49 @@
-import time
+import selectors
 from receive_can import CANSlave
 from receive_lin import LINSlave
 
 class ReceiveMain:
+    """Central receiver: one event loop dispatching CAN and LIN as data arrives.
+
+    Protocol handlers are plugins registered with register(). A handler must
+    provide fileno() (None when its bus is unavailable), on_readable() which
+    consumes whatever is already received without blocking, and shutdown().
+    """
+
     def __init__(self):
-        self.can_slave = CANSlave()
-        self.lin_slave = LINSlave()
+        self.selector = selectors.DefaultSelector()
+        self.handlers = []
         self.running = True
+        self.register(CANSlave())
+        self.register(LINSlave())
+
+    def register(self, handler):
+        self.handlers.append(handler)
+        fd = handler.fileno()
+        if fd is None:
+            print(f"{type(handler).__name__} not available, not listening on it")
+            return
+        self.selector.register(fd, selectors.EVENT_READ, handler)
 
     def monitor(self):
         print("Listening for CAN and LIN frames...")
         try:
             while self.running:
-                self.can_slave.process_frame()
-                self.lin_slave.process_frame()
-                time.sleep(0.01)
-        except Exception as e:
-            print(f"Monitoring error: {e}")
+                # Wakes as soon as either bus has data, no polling sleep
+                for key, _ in self.selector.select(timeout=1.0):
+                    key.data.on_readable()
         except KeyboardInterrupt:
             self.shutdown()
+        except Exception as e:
+            print(f"Monitoring error: {e}")
 
     def shutdown(self):
         self.running = False
-        self.can_slave.shutdown()
-        self.lin_slave.shutdown()
+        self.selector.close()
+        for handler in self.handlers:
+            handler.shutdown()
         print("Receiver shutdown complete")
 
 if __name__ == "__main__":
     receiver = ReceiveMain()
-    receiver.monitor()
\ No newline at end of file
+    receiver.monitor()
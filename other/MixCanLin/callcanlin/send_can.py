@@ -22,16 +22,18 @@ class CANMaster:
             return
         
         data = [0x01] if led_state == 'ON' else [0x00]
-        
+        self.send_data(self.CAN_MSG_ID, data)
+
+    def send_data(self, frame_id, data):
         try:
             if self.can_bus:
                 msg = can.Message(
-                    arbitration_id=self.CAN_MSG_ID,
+                    arbitration_id=frame_id,
                     data=data,
                     is_extended_id=False
                 )
                 self.can_bus.send(msg)
-                print(f"Sent CAN frame: ID={hex(self.CAN_MSG_ID)}, Data={data}")
+                print(f"Sent CAN frame: ID={hex(frame_id)}, Data={data}")
             else:
                 print("CAN bus not initialized")
         except Exception as e:
@@ -57,18 +57,23 @@ class LINMaster:
             return
         
         data = [0x01] if led_state == 'ON' else [0x00]
-        
+        if self.send_data(self.LIN_MSG_ID, data):
+            time.sleep(0.1)
+
+    def send_data(self, frame_id, data):
+        """Write one frame; pacing is left to the caller. Returns True on success."""
         try:
             if self.serial:
-                frame = LINFrame(id=self.LIN_MSG_ID, data=data)
+                frame = LINFrame(id=frame_id, data=data)
                 frame_bytes = frame.to_bytes()
                 self.serial.write(frame_bytes)
                 print(f"Sent LIN frame: {frame_bytes.hex(' ')}")
-                time.sleep(0.1)
+                return True
             else:
                 print("LIN serial not initialized")
         except Exception as e:
             print(f"LIN send error: {e}")
+        return False
 
     def shutdown(self):
         if self.serial:
@@ -2,27 +2,34 @@ import os
 import time
 from send_can import CANMaster
 from send_lin import LINMaster
+from gateway import Gateway
 
 class SendMain:
     def __init__(self):
         self.input_file = "input.txt"
         self.last_modified = 0
-        self.can_master = None
-        self.lin_master = None
+        # Bus masters are created on first use, each with its own transmit queue
+        self.gateway = Gateway({'CAN': CANMaster, 'LIN': LINMaster})
 
     def parse_input(self):
+        """Return ({signal: value}, protocol) from lines like ledState = 'ON'"""
         try:
             with open(self.input_file, 'r') as f:
                 content = f.read()
-                led_state = None
+                signals = {}
                 protocol = None
                 for line in content.split('\n'):
                     line = line.strip()
-                    if line.startswith('ledState'):
-                        led_state = line.split('=')[1].strip().strip("'")
-                    elif line.startswith('protocol'):
-                        protocol = line.split('=')[1].strip().strip("'")
-                return led_state, protocol
+                    if '=' not in line:
+                        continue
+                    name, value = line.split('=', 1)
+                    name = name.strip()
+                    value = value.strip().strip("'")
+                    if name == 'protocol':
+                        protocol = value
+                    else:
+                        signals[name] = value
+                return signals, protocol
         except Exception as e:
             print(f"Error reading input file: {e}")
             return None, None
@@ -43,28 +50,16 @@ class SendMain:
             while True:
                 if self.file_changed():
                     print("\n=== Input Changed ===")
-                    led_state, protocol = self.parse_input()
-                    if led_state and protocol:
-                        print(f"Parsed: ledState={led_state}, protocol={protocol}")
-                        if protocol == 'CAN':
-                            if not self.can_master:
-                                self.can_master = CANMaster()
-                            self.can_master.send_frame(led_state)
-                        elif protocol == 'LIN':
-                            if not self.lin_master:
-                                self.lin_master = LINMaster()
-                            self.lin_master.send_frame(led_state)
-                        else:
-                            print(f"Unknown protocol: {protocol}")
+                    signals, protocol = self.parse_input()
+                    if signals:
+                        print(f"Parsed: {signals}, protocol={protocol or 'routed'}")
+                        self.gateway.update(signals, protocol)
                 time.sleep(0.5)
         except KeyboardInterrupt:
             self.shutdown()
 
     def shutdown(self):
-        if self.can_master:
-            self.can_master.shutdown()
-        if self.lin_master:
-            self.lin_master.shutdown()
+        self.gateway.shutdown()
         print("Sender shutdown complete")
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
 from .master import LINMaster
 from .slave import LINSlave
+from .network import LINNetworkManager
+from .transport import Reassembler, segment
 from .exceptions import *
 
-__all__ = ['LINMaster', 'LINSlave', 'LINError', 'LINChecksumError', 
-           'LINParityError', 'LINSyncError', 'LINFrameError']
\ No newline at end of file
+__all__ = ['LINMaster', 'LINSlave', 'LINNetworkManager', 'Reassembler', 'segment', 'LINError',
+           'LINChecksumError', 'LINParityError', 'LINSyncError', 'LINFrameError', 'LINTransportError']
\ No newline at end of file
@@ -16,4 +16,8 @@ class LINSyncError(LINError):
 
 class LINFrameError(LINError):
     """Frame structure error"""
+    pass
+
+class LINTransportError(LINError):
+    """Transport layer (multi-frame message) error"""
     pass
\ No newline at end of file
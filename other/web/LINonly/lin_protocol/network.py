@@ -0,0 +1,84 @@
+"""
+LIN network management: tracks whether the bus is awake so the master only
+pulses the wakeup line when the slaves are actually asleep.
+
+The bus counts as awake from the first frame after a wakeup until it has
+been idle for BUS_IDLE_TIMEOUT (4 s, the LIN bus inactivity time after
+which slaves drop to sleep on their own). When that timer runs out the
+master sends the go-to-sleep command (master request 0x3C, data 00 FF..FF)
+so every node enters sleep at the same moment, and the next frame wakes
+the bus again.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from .constants import BUS_IDLE_TIMEOUT
+
+# Bus states
+AWAKE = "awake"
+GO_TO_SLEEP = "go-to-sleep"
+SLEEPING = "sleeping"
+
+class LINNetworkManager:
+    def __init__(self, wakeup, go_to_sleep, idle_timeout=BUS_IDLE_TIMEOUT):
+        """
+        Args:
+            wakeup: callable that sends the wakeup signal
+            go_to_sleep: callable that writes the go-to-sleep frame
+            idle_timeout: seconds without traffic before the bus is put to sleep
+        """
+        self.wakeup = wakeup
+        self.go_to_sleep = go_to_sleep
+        self.idle_timeout = idle_timeout
+        self.state = SLEEPING  # nothing is known about the slaves at start-up
+        self.last_activity = 0.0
+        self.wakeups = 0
+        self.running = True
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.sleep_thread = threading.Thread(target=self.sleep_timer, daemon=True)
+        self.sleep_thread.start()
+
+    @contextmanager
+    def transmit(self):
+        """Hold the bus for one frame, waking it first if it is asleep."""
+        with self.lock:
+            if self.state != AWAKE:
+                self.wakeup()
+                self.wakeups += 1
+                self.state = AWAKE
+            try:
+                yield
+            finally:
+                self.last_activity = time.monotonic()
+                self.changed.notify()
+
+    def note_activity(self):
+        """Record traffic seen on the bus (a slave frame keeps it awake too)."""
+        with self.lock:
+            self.state = AWAKE
+            self.last_activity = time.monotonic()
+            self.changed.notify()
+
+    def sleep_timer(self):
+        with self.lock:
+            while self.running:
+                if self.state != AWAKE:
+                    self.changed.wait()
+                    continue
+                remaining = self.last_activity + self.idle_timeout - time.monotonic()
+                if remaining > 0:
+                    self.changed.wait(remaining)
+                    continue
+                self.state = GO_TO_SLEEP
+                try:
+                    self.go_to_sleep()
+                except Exception as e:
+                    print(f"Error sending go-to-sleep frame: {e}")
+                self.state = SLEEPING
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.changed.notify()
+        self.sleep_thread.join(timeout=0.5)
@@ -80,15 +80,15 @@ class LINSlave:
         Raises:
             LINError: If frame validation fails
         """
-        # Wait for break
+        # Wait for break; read() sleeps until a byte arrives (or the port
+        # timeout passes) rather than spinning on in_waiting
         while True:
-            if self.ser.in_waiting:
-                try:
-                    byte = self.ser.read(1)
-                    if byte == bytes([BREAK_BYTE]):
-                        break
-                except:
+            try:
+                byte = self.ser.read(1)
+                if byte == bytes([BREAK_BYTE]):
                     break
+            except:
+                break
         
         # Read sync
         sync = self.ser.read(1)
@@ -1,9 +1,21 @@
+import os
+
 # LIN Protocol Constants
-DEFAULT_SERIAL_PORT = '/dev/serial0'
+DEFAULT_SERIAL_PORT = os.environ.get('LIN_SERIAL_PORT', '/dev/serial0')
 DEFAULT_BAUD_RATE = 19200
 DEFAULT_WAKEUP_PIN = 18
 
 # LIN Frame constants
 SYNC_BYTE = 0x55
 BREAK_BYTE = 0x00
-MAX_FRAME_DATA_LENGTH = 8
\ No newline at end of file
+MAX_FRAME_DATA_LENGTH = 8
+
+# Diagnostic frames, also used by the transport layer
+MASTER_REQUEST_ID = 0x3C
+SLAVE_RESPONSE_ID = 0x3D
+SLAVE_TURNAROUND = 0.005  # time a slave takes to react to a header
+
+# LIN network management
+BUS_IDLE_TIMEOUT = 4.0  # seconds of bus inactivity before slaves sleep
+GO_TO_SLEEP_ID = MASTER_REQUEST_ID
+GO_TO_SLEEP_DATA = bytes([0x00, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
\ No newline at end of file
@@ -3,10 +3,12 @@ import time
 import RPi.GPIO as GPIO
 from .constants import *
 from .exceptions import *
+from .network import LINNetworkManager
+from .transport import Reassembler, segment
 
 class LINMaster:
     def __init__(self, serial_port=DEFAULT_SERIAL_PORT, baud_rate=DEFAULT_BAUD_RATE, 
-                 wakeup_pin=DEFAULT_WAKEUP_PIN):
+                 wakeup_pin=DEFAULT_WAKEUP_PIN, idle_timeout=BUS_IDLE_TIMEOUT):
         """
         Initialize LIN Master controller
         
@@ -14,6 +16,7 @@ class LINMaster:
             serial_port: Serial port device path
             baud_rate: Communication baud rate
             wakeup_pin: GPIO pin for slave wakeup signal
+            idle_timeout: Seconds of bus inactivity before go-to-sleep is sent
         """
         self.ser = serial.Serial(serial_port, baudrate=baud_rate, timeout=0)
         self.baud_rate = baud_rate
@@ -25,6 +28,10 @@ class LINMaster:
         GPIO.setup(self.wakeup_pin, GPIO.OUT)
         GPIO.output(self.wakeup_pin, GPIO.HIGH)
         
+        # Wake the slaves only when the bus has gone to sleep
+        self.network = LINNetworkManager(self._wakeup_slave, self._send_go_to_sleep,
+                                         idle_timeout=idle_timeout)
+        
     def send_break(self):
         """Send LIN break signal (13 bits of dominant + 1 bit recessive)"""
         # Switch to lower baud rate for break
@@ -88,9 +95,12 @@ class LINMaster:
         if len(data) > MAX_FRAME_DATA_LENGTH:
             raise ValueError(f"Data length exceeds maximum of {MAX_FRAME_DATA_LENGTH} bytes")
         
-        # Wake up slave
-        self._wakeup_slave()
+        # Wake up the bus if it is asleep
+        with self.network.transmit():
+            self._write_frame(frame_id, data)
         
+    def _write_frame(self, frame_id, data):
+        """Write break, sync, PID, data and checksum on the wire"""
         # Send break
         self.send_break()
         
@@ -116,6 +126,82 @@ class LINMaster:
         # Inter-byte space
         time.sleep(0.001)
         
+    def poll_frame(self, frame_id, length):
+        """
+        Send the header of a slave-published frame and read its response
+        
+        Args:
+            frame_id: 6-bit LIN frame ID (0-63)
+            length: Number of data bytes the slave answers with
+            
+        Returns:
+            bytes: Data bytes, or None if no valid response arrived within
+            the response slot
+        """
+        pid = self.calculate_pid(frame_id)
+        # Header plus the maximum response space (1.4x nominal)
+        timeout = (34 + 1.4 * 10 * (length + 1)) / self.baud_rate + SLAVE_TURNAROUND
+        with self.network.transmit():
+            self.ser.reset_input_buffer()
+            self.send_break()
+            self.ser.write(bytes([SYNC_BYTE, pid]))
+            self.ser.flush()
+            self.ser.timeout = timeout
+            try:
+                response = self.ser.read(length + 1)
+                if response[:3] == bytes([BREAK_BYTE, SYNC_BYTE, pid]):
+                    # Transceiver echo of our own header
+                    response = response[3:] + self.ser.read(3)
+            finally:
+                self.ser.timeout = 0
+        if len(response) < length + 1 or response[length] != self.calculate_checksum(pid, response[:length]):
+            return None
+        return response[:length]
+        
+    def send_request(self, nad, message):
+        """
+        Send a transport layer message to a slave on the master request frame
+        
+        Args:
+            nad: Node address of the slave
+            message: Message bytes, service ID first (up to 4095 bytes)
+        """
+        for frame in segment(nad, message):
+            self.send_frame(MASTER_REQUEST_ID, frame)
+            
+    def read_response(self, nad):
+        """
+        Poll the slave response frame until a whole transport message is in
+        
+        Args:
+            nad: Node address of the slave
+            
+        Returns:
+            bytes: The message, or None if the slave stopped answering
+            
+        Raises:
+            LINTransportError: If a frame is out of sequence or for another node
+        """
+        # Each frame either completes the message or continues one of at
+        # most 4095 bytes, so this ends once the slave has sent it all
+        receiver = Reassembler(nad)
+        while True:
+            frame = self.poll_frame(SLAVE_RESPONSE_ID, MAX_FRAME_DATA_LENGTH)
+            if frame is None:
+                return None
+            message = receiver.feed(frame)
+            if message is not None:
+                return message
+        
+    def request(self, nad, message):
+        """Send a transport layer request and return the slave's response"""
+        self.send_request(nad, message)
+        return self.read_response(nad)
+        
+    def _send_go_to_sleep(self):
+        """Broadcast the go-to-sleep command once the bus has been idle"""
+        self._write_frame(GO_TO_SLEEP_ID, GO_TO_SLEEP_DATA)
+        
     def _wakeup_slave(self, pulse_duration=0.01):
         """Send wakeup pulse to slave"""
         GPIO.output(self.wakeup_pin, GPIO.LOW)
@@ -124,5 +210,6 @@ class LINMaster:
         
     def close(self):
         """Clean up resources"""
+        self.network.stop()
         self.ser.close()
         GPIO.cleanup()
\ No newline at end of file
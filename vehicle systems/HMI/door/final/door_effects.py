@@ -0,0 +1,77 @@
+import time
+import threading
+
+# Flash pattern used for FlashLight (0x23): 3 x (on 200 ms, off 200 ms)
+FLASH_STEPS = [(True, 0.2), (False, 0.2)] * 3
+
+class EffectScheduler(threading.Thread):
+    """Runs timed output effects (flash, horn) off the UART receive thread.
+
+    Each effect runs on a named channel. Starting an effect on a channel that
+    is already running replaces it immediately, so a newer FlashLight or Horn
+    command always wins and commands never pile up behind each other.
+    `set_outputs(pins, on)` is called from this thread to drive the hardware.
+    """
+
+    def __init__(self, set_outputs):
+        super().__init__(daemon=True)
+        self.set_outputs = set_outputs
+        self.condition = threading.Condition()
+        self.channels = {}
+        self.running = True
+
+    def start_effect(self, channel, pins, steps):
+        """Start (or restart) an effect: steps is a list of (on, duration_s)."""
+        with self.condition:
+            self.channels[channel] = {
+                'pins': pins,
+                'steps': list(steps),
+                'index': 0,
+                'deadline': time.monotonic()
+            }
+            self.condition.notify()
+
+    def flash(self, channel, pins):
+        self.start_effect(channel, pins, FLASH_STEPS)
+
+    def cancel(self, channel):
+        """Stop an effect and switch its outputs off."""
+        with self.condition:
+            effect = self.channels.pop(channel, None)
+        if effect:
+            self.set_outputs(effect['pins'], False)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                due = self._due_steps(time.monotonic())
+                if not due:
+                    deadlines = [e['deadline'] for e in self.channels.values()]
+                    timeout = min(deadlines) - time.monotonic() if deadlines else None
+                    self.condition.wait(timeout)
+                    continue
+            
+            # Drive outputs without holding the lock so new commands are never blocked
+            for pins, on in due:
+                self.set_outputs(pins, on)
+
+    def _due_steps(self, now):
+        due = []
+        for channel, effect in list(self.channels.items()):
+            if effect['deadline'] > now:
+                continue
+            if effect['index'] >= len(effect['steps']):
+                del self.channels[channel]
+                continue
+            on, duration = effect['steps'][effect['index']]
+            effect['index'] += 1
+            effect['deadline'] = now + duration
+            due.append((effect['pins'], on))
+        return due
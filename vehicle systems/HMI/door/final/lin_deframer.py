@@ -0,0 +1,108 @@
+import re
+
+SYNC_BYTE = 0x55
+
+# Matches "Name: 0x01, Publisher, 3 {" entries inside the LDF Frames block
+LDF_FRAMES_BLOCK = re.compile(r"^Frames\s*\{(.*?)^\}", re.MULTILINE | re.DOTALL)
+LDF_FRAME_ENTRY = re.compile(r"(\w+)\s*:\s*(0x[0-9A-Fa-f]+|\d+)\s*,\s*(\w+)\s*,\s*(\d+)\s*\{")
+
+def load_frame_table(ldf_path):
+    """Read {frame_id: data_length} from the Frames section of an LDF file."""
+    with open(ldf_path, 'r') as ldf_file:
+        text = ldf_file.read()
+    
+    block = LDF_FRAMES_BLOCK.search(text)
+    if block is None:
+        raise ValueError(f"No Frames section found in {ldf_path}")
+    
+    table = {}
+    for name, frame_id, publisher, length in LDF_FRAME_ENTRY.findall(block.group(1)):
+        table[int(frame_id, 0)] = int(length)
+    return table
+
+def calculate_checksum(identifier, data_bytes, enhanced_mode=True):
+    checksum = sum(data_bytes)
+    if enhanced_mode:
+        checksum += identifier
+    return (~checksum) & 0xFF
+
+class LINDeframer:
+    """Incremental LIN frame decoder for a byte stream read from the UART.
+
+    Bytes are appended to one bytearray and consumed through a read cursor, so
+    skipping noise or frames never shifts the buffer byte by byte. The consumed
+    prefix is only dropped once it grows past `compact_threshold`, which keeps
+    the cost amortised O(1) per received byte.
+
+    feed() returns complete frames as bytes laid out as
+    [sync, identifier, data..., checksum], the same layout the slaves used before.
+    """
+
+    def __init__(self, frame_table, enhanced_mode=True, compact_threshold=4096):
+        self.frame_table = dict(frame_table)
+        self.enhanced_mode = enhanced_mode
+        self.compact_threshold = compact_threshold
+        self.buffer = bytearray()
+        self.position = 0
+        self.checksum_errors = 0
+        self.discarded_bytes = 0
+
+    def feed(self, data):
+        """Append received bytes and return the list of complete, valid frames."""
+        buffer = self.buffer
+        buffer.extend(data)
+        frames = []
+        position = self.position
+        end = len(buffer)
+        
+        while position < end:
+            # Jump straight to the next sync byte instead of dropping bytes one by one
+            sync = buffer.find(SYNC_BYTE, position)
+            if sync < 0:
+                self.discarded_bytes += end - position
+                position = end
+                break
+            self.discarded_bytes += sync - position
+            position = sync
+            
+            # Check if we have enough data to read the ID
+            if end - position < 2:
+                break
+            
+            identifier = buffer[position + 1]
+            data_length = self.frame_table.get(identifier)
+            if data_length is None:
+                # Not a known frame, the sync was part of noise or data
+                position += 1
+                self.discarded_bytes += 1
+                continue
+            
+            # Sync + ID + data + checksum
+            frame_length = data_length + 3
+            if end - position < frame_length:
+                break  # Wait for more data
+            
+            data_bytes = buffer[position + 2:position + 2 + data_length]
+            checksum = buffer[position + frame_length - 1]
+            if checksum != calculate_checksum(identifier, data_bytes, self.enhanced_mode):
+                # Resync on the next sync byte after this one
+                self.checksum_errors += 1
+                self.discarded_bytes += 1
+                position += 1
+                continue
+            
+            frames.append(bytes(buffer[position:position + frame_length]))
+            position += frame_length
+        
+        self._compact(position)
+        return frames
+
+    def _compact(self, position):
+        if position >= len(self.buffer):
+            self.buffer.clear()
+            self.position = 0
+        elif position >= self.compact_threshold:
+            del self.buffer[:position]
+            self.position = 0
+        else:
+            self.position = position
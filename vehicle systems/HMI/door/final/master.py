@@ -1,9 +1,16 @@
+import os
 import time
+import queue
 import serial
-import subprocess
+import threading
+import itertools
 import mysql.connector
+from collections import OrderedDict
+from contextlib import nullcontext
 from datetime import datetime
 from mysql.connector import Error
+import metrics
+from lin_echo import EchoCheckedWriter
 
 # Database configuration
 DB_CONFIG = {
@@ -27,14 +34,51 @@ ATTRIBUTE_IDS = {
     "Result": 0x30
 }
 
-uart = serial.Serial(
-    port='/dev/serial0',
-    baudrate=19200,
-    parity=serial.PARITY_NONE,
-    stopbits=serial.STOPBITS_ONE,
-    bytesize=serial.EIGHTBITS,
-    timeout=1
-)
+# Frames that each ask for an action rather than report a state: every one is sent
+EVENT_FRAME_IDS = {ATTRIBUTE_IDS["HornBeeping"], ATTRIBUTE_IDS["FlashLight"]}
+
+LIN_BAUDRATE = 19200
+
+# LIN 2.x frame timing: header is 34 bit times, each data/checksum byte is 10,
+# and a frame may take up to 40% longer than nominal (inter-byte space)
+LIN_HEADER_BITS = 34
+LIN_FRAME_TOLERANCE = 1.4
+
+# Frame ID -> protocol_data event_id for the door state frames
+DOOR_FRAME_EVENTS = {
+    0x01: 101,
+    0x02: 102,
+    0x03: 106,
+    0x04: 107
+}
+
+METRICS_PORT = 9104
+DOORS_ANALYSIS_FILE = "/home/pi/vsomeip/PFE-2025/mockupDoors/src/HMI/doors_analysis.txt"
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+DB_WRITE_SECONDS = metrics.histogram('pfe_db_write_seconds', 'Duration of protocol_data updates', ('service',))
+QUEUE_DEPTH = metrics.gauge('pfe_queue_depth', 'Items waiting in a background queue', ('service', 'queue'))
+
+FRAMES_SENT = {frame_id: FRAMES.labels('door_master', 'tx', hex(frame_id)) for frame_id in ATTRIBUTE_IDS.values()}
+SEND_ERRORS = ERRORS.labels('door_master', 'send')
+MALFORMED_LINES = ERRORS.labels('door_master', 'malformed_line')
+ECHO_ERRORS = ERRORS.labels('door_master', 'echo_mismatch')
+DB_WRITES = DB_WRITE_SECONDS.labels('door_master')
+
+uart = None  # opened by start_transmitter() unless a shared port is passed in
+
+def open_uart():
+    global uart
+    uart = serial.Serial(
+        port=os.environ.get('LIN_SERIAL_PORT', '/dev/serial0'),
+        baudrate=LIN_BAUDRATE,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.EIGHTBITS,
+        timeout=1
+    )
+    return uart
 
 previous_key_states = {
     "key_zone": None,
@@ -57,9 +101,9 @@ def create_db_connection():
         print(f"Error connecting to MySQL database: {e}")
         return None
 
-def init_db():
+def init_db(db_pool=None):
     """Initialize the database and create tables if they don't exist"""
-    connection = create_db_connection()
+    connection = db_pool.get_connection() if db_pool else create_db_connection()
     if connection:
         try:
             cursor = connection.cursor()
@@ -73,33 +117,38 @@ def init_db():
                 cursor.close()
                 connection.close()
 
-def update_frame_event(event_id, message):
+def write_frame_event(connection, event_id, message):
     """Update the existing record for this event_id or create if it doesn't exist"""
-    connection = create_db_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            
-            # Get current time with microsecond precision
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            
-            # First try to update existing record with explicit timestamp
-            update_query = "UPDATE protocol_data SET message = %s, timestamp = %s WHERE event_id = %s"
-            cursor.execute(update_query, (message, current_time, event_id))
-            
-            # If no rows were updated, insert a new record
-            if cursor.rowcount == 0:
-                insert_query = "INSERT INTO protocol_data (event_id, message, timestamp) VALUES (%s, %s, %s)"
-                cursor.execute(insert_query, (event_id, message, current_time))
-            
-            connection.commit()
-            print(f"Received frame and database update - event_id: {event_id}, message: {message} at {current_time}")
-        except Error as e:
-            print(f"Error updating database: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+    cursor = connection.cursor()
+    try:
+        # Get current time with microsecond precision
+        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        
+        # First try to update existing record with explicit timestamp
+        update_query = "UPDATE protocol_data SET message = %s, timestamp = %s WHERE event_id = %s"
+        cursor.execute(update_query, (message, current_time, event_id))
+        
+        # If no rows were updated, insert a new record
+        if cursor.rowcount == 0:
+            insert_query = "INSERT INTO protocol_data (event_id, message, timestamp) VALUES (%s, %s, %s)"
+            cursor.execute(insert_query, (event_id, message, current_time))
+        
+        connection.commit()
+        print(f"Received frame and database update - event_id: {event_id}, message: {message} at {current_time}")
+    finally:
+        cursor.close()
+
+def frame_event(frame):
+    """Return the (event_id, message) database update for a sent frame, or None"""
+    frame_id = frame[2]  # Frame ID is the 3rd byte
+    if frame_id in DOOR_FRAME_EVENTS:
+        # Check data bytes (positions 4 and 5 in frame)
+        data1 = frame[4] if len(frame) > 4 else 0
+        data2 = frame[5] if len(frame) > 5 else 0
+        return DOOR_FRAME_EVENTS[frame_id], 1 if (data1 == 1 or data2 == 1) else 0
+    if frame_id == 0x1E:
+        return 30, frame[3] if len(frame) > 3 else 0
+    return None
 
 def calculate_checksum(identifier, data_bytes, enhanced_mode=True):
     checksum = sum(data_bytes)
@@ -112,64 +161,183 @@ def create_lin_frame(identifier, data_bytes, enhanced_mode=True):
     checksum = calculate_checksum(identifier, data_bytes, enhanced_mode)
     return [0x00, sync, identifier] + data_bytes + [checksum]
 
-def send_lin_frame(frame, description=None):
-    try:
-        uart.write(bytes(frame))
-        hex_frame = [hex(byte) for byte in frame]
-        print(f"Sent LIN frame in HEX: {hex_frame}")
-        
-        # Database update logic
-        frame_id = frame[2]  # Frame ID is the 3rd byte
-        time.sleep(0.1)
-        # For frame ID 1 (0x01)
-        if frame_id == 0x01:
-            event_id = 101
-            # Check data bytes (positions 4 and 5 in frame)
-            data1 = frame[4] if len(frame) > 4 else 0
-            data2 = frame[5] if len(frame) > 5 else 0
-            message = 1 if (data1 == 1 or data2 == 1) else 0
-            update_frame_event(event_id, message)
-        
-        # For frame ID 2 (0x02)
-        elif frame_id == 0x02:
-            event_id = 102
-            data1 = frame[4] if len(frame) > 4 else 0
-            data2 = frame[5] if len(frame) > 5 else 0
-            message = 1 if (data1 == 1 or data2 == 1) else 0
-            update_frame_event(event_id, message)
-        
-        # For frame ID 3 (0x03)
-        elif frame_id == 0x03:
-            event_id = 106
-            data1 = frame[4] if len(frame) > 4 else 0
-            data2 = frame[5] if len(frame) > 5 else 0
-            message = 1 if (data1 == 1 or data2 == 1) else 0
-            update_frame_event(event_id, message)
-        
-        # For frame ID 4 (0x04)
-        elif frame_id == 0x04:
-            event_id = 107
-            data1 = frame[4] if len(frame) > 4 else 0
-            data2 = frame[5] if len(frame) > 5 else 0
-            message = 1 if (data1 == 1 or data2 == 1) else 0
-            update_frame_event(event_id, message)
-        
-        # For frame ID 30 (0x1E)
-        elif frame_id == 0x1E:
-            event_id = 30
-            data = frame[3] if len(frame) > 3 else 0
-            update_frame_event(event_id, data)
+def lin_frame_time(frame, baudrate=LIN_BAUDRATE):
+    """Maximum on-wire time of a frame (break/sync/ID + data + checksum) in seconds"""
+    response_bytes = len(frame) - 3
+    bits = LIN_HEADER_BITS + 10 * response_bytes
+    return bits * LIN_FRAME_TOLERANCE / baudrate
+
+class DatabaseSink(threading.Thread):
+    """Background writer for protocol_data updates, reusing one connection"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.events = queue.Queue()
+        self.connection = None
+        self.pool = None  # connections come from here when set
+
+    def submit(self, event_id, message):
+        self.events.put((event_id, message))
+
+    def run(self):
+        while True:
+            event_id, message = self.events.get()
+            # Only the latest value per event_id matters, drop stale updates
+            latest = {event_id: message}
+            while not self.events.empty():
+                event_id, message = self.events.get_nowait()
+                latest[event_id] = message
+            for event_id, message in latest.items():
+                self._write(event_id, message)
+
+    def _write(self, event_id, message):
+        for _ in range(2):
+            if self.connection is None or not self.connection.is_connected():
+                self.connection = self._connect()
+                if self.connection is None:
+                    return
+            try:
+                with DB_WRITES.time():
+                    write_frame_event(self.connection, event_id, message)
+                return
+            except Error as e:
+                print(f"Error updating database: {e}")
+                self.connection = None
+
+    def _connect(self):
+        if self.pool is None:
+            return create_db_connection()
+        try:
+            return self.pool.get_connection()
+        except Error as e:
+            print(f"Error getting a pooled database connection: {e}")
+            return None
+
+class FileLogSink(threading.Thread):
+    """Background appender for sent_frames_log.txt"""
+
+    def __init__(self, path="sent_frames_log.txt"):
+        super().__init__(daemon=True)
+        self.path = path
+        self.entries = queue.Queue()
+
+    def submit(self, text):
+        self.entries.put(text)
+
+    def run(self):
+        while True:
+            lines = [self.entries.get()]
+            while not self.entries.empty():
+                lines.append(self.entries.get_nowait())
+            with open(self.path, "a") as log_file:
+                log_file.writelines(lines)
+
+class LINDoorTransmitter(threading.Thread):
+    """Queues door frames and sends them paced at the LIN frame slot time.
+
+    State frames are coalesced per ID: if a frame for an ID is still waiting
+    when a newer one is queued, only the newer state is sent (at the end of the
+    queue, so the order within a batch is kept). Event frames (EVENT_FRAME_IDS)
+    are never merged; each one is queued in order. Database updates and file logging are
+    handed to background sinks so they never delay the next frame. Each frame's
+    echo is checked and the frame is retransmitted on a mismatch (lin_echo).
+    """
+
+    def __init__(self, serial_port, db_sink, log_sink):
+        super().__init__(daemon=True)
+        self.serial_port = serial_port
+        self.writer = None
+        self.db_sink = db_sink
+        self.log_sink = log_sink
+        self.pending = OrderedDict()  # frame ID, or (frame ID, n) for events -> (frame, description)
+        self.event_sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.busy = False
+
+    def send(self, frame, description=None):
+        with self.condition:
+            frame_id = frame[2]
+            if frame_id in EVENT_FRAME_IDS:
+                self.pending[(frame_id, next(self.event_sequence))] = (frame, description)
+            else:
+                self.pending.pop(frame_id, None)
+                self.pending[frame_id] = (frame, description)
+            self.condition.notify()
+
+    def flush(self, timeout=None):
+        """Block until every queued frame has been written"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                _, (frame, description) = self.pending.popitem(last=False)
+                self.busy = True
+            try:
+                self._transmit(frame, description)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def _transmit(self, frame, description):
+        start = time.monotonic()
+        try:
+            # A shared port is held for the whole frame, retries included
+            with getattr(self.serial_port, 'lock', None) or nullcontext():
+                delivered = self.writer.send(frame[2], bytes(frame[:3]), bytes(frame[3:]))
+        except Exception as e:
+            SEND_ERRORS.inc()
+            print(f"Error sending LIN frame: {e}")
+            return
+        if not delivered:
+            SEND_ERRORS.inc()
+            print(f"LIN bus error: frame {hex(frame[2])} dropped, echo mismatched on every retry "
+                  f"({self.writer.bus_errors[frame[2]]} mismatches on this ID)")
+            return
+        FRAMES_SENT[frame[2]].inc()
+        print(f"Sent LIN frame in HEX: {[hex(byte) for byte in frame]}")
         
+        event = frame_event(frame)
+        if event:
+            self.db_sink.submit(*event)
         if description:
-            log_frame_to_file(description, frame)
-    except Exception as e:
-        print(f"Error sending LIN frame: {e}")
+            self.log_sink.submit(format_frame_log(description, frame))
+        
+        # Hold the bus for the rest of this frame's slot before the next one
+        remaining = lin_frame_time(frame) - (time.monotonic() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+
+db_sink = DatabaseSink()
+log_sink = FileLogSink()
+transmitter = LINDoorTransmitter(None, db_sink, log_sink)
+
+QUEUE_DEPTH.labels('door_master', 'database').set_function(db_sink.events.qsize)
+QUEUE_DEPTH.labels('door_master', 'file_log').set_function(log_sink.entries.qsize)
+QUEUE_DEPTH.labels('door_master', 'lin_tx').set_function(lambda: len(transmitter.pending))
+
+def start_transmitter(serial_port=None, db_pool=None):
+    """Start the background threads; the supervisor passes its shared port and pool"""
+    transmitter.serial_port = serial_port or open_uart()
+    transmitter.writer = EchoCheckedWriter(transmitter.serial_port, LIN_BAUDRATE,
+                                           on_error=lambda frame_id: ECHO_ERRORS.inc())
+    db_sink.pool = db_pool
+    for thread in (db_sink, log_sink, transmitter):
+        if not thread.is_alive():
+            thread.start()
+
+def send_lin_frame(frame, description=None):
+    transmitter.send(frame, description)
+
+def format_frame_log(description, frame):
+    text = description + "\n" if description else ""
+    return text + f"Frame HEX: {' '.join([hex(b) for b in frame])}\n\n"
 
 def log_frame_to_file(description, frame):
-    with open("sent_frames_log.txt", "a") as log_file:
-        if description:
-            log_file.write(description + "\n")
-        log_file.write(f"Frame HEX: {' '.join([hex(b) for b in frame])}\n\n")
+    log_sink.submit(format_frame_log(description, frame))
 
 def state_to_text(state_value, context=""):
     if state_value is None or state_value == "":
@@ -240,6 +408,7 @@ def process_new_lines(lines):
                 }
 
             except Exception as e:
+                MALFORMED_LINES.inc()
                 print(f"Error processing door line: {line}, Error: {e}")
 
         elif "Key |" in line:
@@ -265,6 +434,7 @@ def process_new_lines(lines):
                     print(f"Missing keys in Key line: {missing}")
 
             except Exception as e:
+                MALFORMED_LINES.inc()
                 print(f"Error parsing key attributes: {e}")
 
         elif "RESULT:" in line:
@@ -351,8 +521,7 @@ def process_new_lines(lines):
                 for frame_name, frame in frames_to_send:
                     send_lin_frame(frame)
 
-                with open("sent_frames_log.txt", "a") as log_file:
-                    log_file.write(description + "\n\n")
+                log_sink.submit(description + "\n\n")
 
                 current_batch = {"doors": {}, "keys": {}, "result": None}
 
@@ -374,12 +543,15 @@ def tail_file(file_path):
     except Exception as e:
         print(f"Unexpected error: {e}")
     finally:
-        uart.close()
+        transmitter.flush(timeout=1)
+        if uart:
+            uart.close()
 
 if __name__ == "__main__":
     # Initialize the database first
     init_db()
+    metrics.start_http_server(METRICS_PORT)
+    start_transmitter()
     
     # Start monitoring the file
-    file_path = "/home/pi/vsomeip/PFE-2025/mockupDoors/src/HMI/doors_analysis.txt"
-    tail_file(file_path)
\ No newline at end of file
+    tail_file(DOORS_ANALYSIS_FILE)
\ No newline at end of file
@@ -1,10 +1,14 @@
 import serial
 import RPi.GPIO as GPIO
+import os
 import time
+from lin_deframer import LINDeframer, load_frame_table
+from door_effects import EffectScheduler
+import metrics
 
 # UART configuration
 uart = serial.Serial(
-    port='/dev/serial0',
+    port=os.environ.get('LIN_SERIAL_PORT', '/dev/serial0'),
     baudrate=19200,
     parity=serial.PARITY_NONE,
     stopbits=serial.STOPBITS_ONE,
@@ -12,6 +16,16 @@ uart = serial.Serial(
     timeout=1
 )
 
+METRICS_PORT = 9114
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+DISCARDED_BYTES = metrics.counter('pfe_lin_discarded_bytes', 'UART bytes skipped while resyncing', ('service',))
+ACTIVE_EFFECTS = metrics.gauge('pfe_active_effects', 'Effects running on the effect scheduler', ('service',))
+
+# Frame ID -> data length, taken from the door LDF
+LDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'door_system.ldf')
+
 # LED GPIO pin assignments for each LIN ID
 LED_PINS = {
     0x10: [4],               # ID 0x10 controls 1 LED on GPIO4
@@ -32,46 +46,13 @@ def setup_gpio():
         GPIO.setup(pin, GPIO.OUT)
         GPIO.output(pin, GPIO.LOW)
 
-def parse_lin_frames(buffer):
-    """Extract and validate LIN frames from the buffer."""
-    frames = []
-    while len(buffer) > 0:
-        try:
-            # Look for the sync byte (0x55)
-            if buffer[0] != 0x55:
-                buffer.pop(0)  # Discard invalid data
-                continue
-
-            # Check if we have enough data to read the ID
-            if len(buffer) < 2:
-                break
-
-            identifier = buffer[1]
-
-            # Determine frame length based on ID
-            if identifier in [0x10, 0x11, 0x22, 0x23, 0x30]:
-                frame_length = 4  # Sync + ID + Data (1 byte) + Checksum
-            elif identifier in [0x01, 0x02, 0x03, 0x04]:
-                frame_length = 6  # Sync + ID + Data (3 bytes) + Checksum
-            else:
-                buffer.pop(0)  # Discard unknown frames
-                continue
-
-            # Check if we have enough data for the full frame
-            if len(buffer) < frame_length:
-                break  # Wait for more data
-
-            # Extract the frame
-            frame = buffer[:frame_length]
-            # Validate checksum (optional, implement if needed)
-            frames.append(frame)
-            buffer = buffer[frame_length:]  # Move to the next potential frame
-
-        except IndexError:
-            # If buffer is incomplete, wait for more data
-            break
+def set_leds(pins, on):
+    for pin in pins:
+        GPIO.output(pin, GPIO.HIGH if on else GPIO.LOW)
 
-    return frames, buffer
+# Timed effects (FlashLight) run here instead of sleeping in the receive loop
+effects = EffectScheduler(set_leds)
+ACTIVE_EFFECTS.labels('door_slave').set_function(lambda: len(effects.channels))
 
 def format_frame(frame):
     """Format a frame into a hex string."""
@@ -88,14 +69,8 @@ def control_leds(frame):
         GPIO.output(pin, GPIO.HIGH if data & 0x01 else GPIO.LOW)
         
     elif identifier == 0x23:
-        # ID 0x23 - flash two LEDs
-        for _ in range(3):  # Flash 3 times
-            for pin in LED_PINS[0x23]:
-                GPIO.output(pin, GPIO.HIGH)
-            time.sleep(0.2)
-            for pin in LED_PINS[0x23]:
-                GPIO.output(pin, GPIO.LOW)
-            time.sleep(0.2)
+        # ID 0x23 - flash two LEDs 3 times, a new frame restarts the flash
+        effects.flash(0x23, LED_PINS[0x23])
                 
     elif identifier in [0x01, 0x02, 0x03, 0x04]:
         # IDs 0x01-0x04 - control LEDs directly based on data bytes
@@ -121,23 +96,32 @@ def control_leds(frame):
             GPIO.output(pins[3], GPIO.HIGH if data_bytes[2] == 1 else GPIO.LOW)
   
 def receive_and_process_frames():
-    buffer = bytearray()
+    deframer = LINDeframer(load_frame_table(LDF_PATH))
+    frames_received = {frame_id: FRAMES.labels('door_slave', 'rx', hex(frame_id)) for frame_id in deframer.frame_table}
+    # The deframer keeps its own error counts; read them at scrape time
+    ERRORS.labels('door_slave', 'checksum').set_function(lambda: deframer.checksum_errors)
+    DISCARDED_BYTES.labels('door_slave').set_function(lambda: deframer.discarded_bytes)
+    metrics.start_http_server(METRICS_PORT)
     setup_gpio()
+    effects.start()
     
     try:
         print("Listening for LIN frames and controlling LEDs...")
         while True:
-            if uart.in_waiting:
-                buffer.extend(uart.read(uart.in_waiting))
-                #print(f"Raw data received (hex): {buffer.hex()}")
-                frames, buffer = parse_lin_frames(buffer)
+            # Blocks for the first byte (up to the 1 s timeout), then takes
+            # whatever else has already arrived
+            data = uart.read(uart.in_waiting or 1)
+            if data:
+                frames = deframer.feed(data)
                 for frame in frames:
+                    frames_received[frame[1]].inc()
                     print(format_frame(frame))
                     control_leds(frame)
                     
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
+        effects.stop()
         GPIO.cleanup()
         uart.close()
 
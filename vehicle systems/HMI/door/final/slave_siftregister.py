@@ -1,10 +1,15 @@
 import serial
 import RPi.GPIO as GPIO
+import os
 import time
+import threading
+from lin_deframer import LINDeframer, load_frame_table
+from door_effects import EffectScheduler
+import metrics
 
 # UART configuration
 uart = serial.Serial(
-    port='/dev/serial0',
+    port=os.environ.get('LIN_SERIAL_PORT', '/dev/serial0'),
     baudrate=19200,
     parity=serial.PARITY_NONE,
     stopbits=serial.STOPBITS_ONE,
@@ -12,6 +17,18 @@ uart = serial.Serial(
     timeout=1
 )
 
+METRICS_PORT = 9114
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+DISCARDED_BYTES = metrics.counter('pfe_lin_discarded_bytes', 'UART bytes skipped while resyncing', ('service',))
+ACTIVE_EFFECTS = metrics.gauge('pfe_active_effects', 'Effects running on the effect scheduler', ('service',))
+SHIFT_REGISTER_REFRESHES = metrics.counter('pfe_shift_register_refreshes', 'Shift register chain rewrites', ('service',))
+REFRESHES = SHIFT_REGISTER_REFRESHES.labels('door_slave')
+
+# Frame ID -> data length, taken from the door LDF
+LDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'door_system.ldf')
+
 # Shift register output mapping (GPIO to shift register output)
 GPIO_TO_SHIFT = {
     4: 41,
@@ -55,6 +72,8 @@ SHIFT_REGISTER_PINS = {
 
 # Global state for all 80 possible shift register outputs
 shift_register_state = [0] * 80
+# Outputs are updated from both the receive loop and the effect thread
+shift_register_lock = threading.Lock()
 
 def setup_shift_register():
     """Initialize GPIO and shift register"""
@@ -85,51 +104,26 @@ def update_shift_register():
     
     # Latch the data to outputs
     GPIO.output(SHIFT_REGISTER_PINS['Latch'], 1)
+    REFRESHES.inc()
 
 def set_shift_output(output_num, state):
     """Set a specific shift register output"""
     if 0 <= output_num < 80:
-        shift_register_state[output_num] = 1 if state else 0
+        with shift_register_lock:
+            shift_register_state[output_num] = 1 if state else 0
+            update_shift_register()
+
+def set_shift_outputs(outputs, state):
+    """Set several outputs with a single shift register refresh"""
+    with shift_register_lock:
+        for output_num in outputs:
+            if 0 <= output_num < 80:
+                shift_register_state[output_num] = 1 if state else 0
         update_shift_register()
 
-def parse_lin_frames(buffer):
-    """Extract and validate LIN frames from the buffer."""
-    frames = []
-    while len(buffer) > 0:
-        try:
-            # Look for the sync byte (0x55)
-            if buffer[0] != 0x55:
-                buffer.pop(0)  # Discard invalid data
-                continue
-
-            # Check if we have enough data to read the ID
-            if len(buffer) < 2:
-                break
-
-            identifier = buffer[1]
-
-            # Determine frame length based on ID
-            if identifier in [0x10, 0x11, 0x22, 0x23, 0x30]:
-                frame_length = 4  # Sync + ID + Data (1 byte) + Checksum
-            elif identifier in [0x01, 0x02, 0x03, 0x04]:
-                frame_length = 6  # Sync + ID + Data (3 bytes) + Checksum
-            else:
-                buffer.pop(0)  # Discard unknown frames
-                continue
-
-            # Check if we have enough data for the full frame
-            if len(buffer) < frame_length:
-                break  # Wait for more data
-
-            # Extract the frame
-            frame = buffer[:frame_length]
-            frames.append(frame)
-            buffer = buffer[frame_length:]  # Move to next potential frame
-
-        except IndexError:
-            break
-
-    return frames, buffer
+# Timed effects (FlashLight) run here instead of sleeping in the receive loop
+effects = EffectScheduler(set_shift_outputs)
+ACTIVE_EFFECTS.labels('door_slave').set_function(lambda: len(effects.channels))
 
 def format_frame(frame):
     """Format a frame into a hex string."""
@@ -145,14 +139,8 @@ def control_leds(frame):
         set_shift_output(41, data & 0x01)
         
     elif identifier == 0x23:
-        # ID 0x23 - flash two outputs (42-43)
-        for _ in range(3):
-            set_shift_output(42, 1)
-            set_shift_output(43, 1)
-            time.sleep(0.2)
-            set_shift_output(42, 0)
-            set_shift_output(43, 0)
-            time.sleep(0.2)
+        # ID 0x23 - flash two outputs (42-43) 3 times, a new frame restarts the flash
+        effects.flash(0x23, LED_PINS[0x23])
                 
     elif identifier in [0x01, 0x02, 0x03, 0x04]:
         # IDs 0x01-0x04 - control outputs based on data bytes
@@ -175,26 +163,34 @@ def control_leds(frame):
             set_shift_output(pins[3], data_bytes[2] == 1)
 
 def receive_and_process_frames():
-    buffer = bytearray()
+    deframer = LINDeframer(load_frame_table(LDF_PATH))
+    frames_received = {frame_id: FRAMES.labels('door_slave', 'rx', hex(frame_id)) for frame_id in deframer.frame_table}
+    # The deframer keeps its own error counts; read them at scrape time
+    ERRORS.labels('door_slave', 'checksum').set_function(lambda: deframer.checksum_errors)
+    DISCARDED_BYTES.labels('door_slave').set_function(lambda: deframer.discarded_bytes)
+    metrics.start_http_server(METRICS_PORT)
     setup_shift_register()
+    effects.start()
     
     try:
         print("Listening for LIN frames and controlling shift register outputs...")
         while True:
-            if uart.in_waiting:
-                buffer.extend(uart.read(uart.in_waiting))
-                frames, buffer = parse_lin_frames(buffer)
+            # Blocks for the first byte (up to the 1 s timeout), then takes
+            # whatever else has already arrived
+            data = uart.read(uart.in_waiting or 1)
+            if data:
+                frames = deframer.feed(data)
                 for frame in frames:
+                    frames_received[frame[1]].inc()
                     print(format_frame(frame))
                     control_leds(frame)
                     
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
+        effects.stop()
         # Clear all outputs on exit
-        for i in range(80):
-            shift_register_state[i] = 0
-        update_shift_register()
+        set_shift_outputs(range(80), 0)
         GPIO.cleanup()
         uart.close()
 
@@ -1,10 +1,11 @@
 import serial
 import RPi.GPIO as GPIO
+import os
 import time
 
 # UART configuration
 uart = serial.Serial(
-    port='/dev/serial0',
+    port=os.environ.get('LIN_SERIAL_PORT', '/dev/serial0'),
     baudrate=19200,
     parity=serial.PARITY_NONE,
     stopbits=serial.STOPBITS_ONE,
@@ -127,8 +128,11 @@ def receive_and_process_frames():
     try:
         print("Listening for LIN frames and controlling LEDs...")
         while True:
-            if uart.in_waiting:
-                buffer.extend(uart.read(uart.in_waiting))
+            # Blocks for the first byte (up to the 1 s timeout), then takes
+            # whatever else has already arrived
+            data = uart.read(uart.in_waiting or 1)
+            if data:
+                buffer.extend(data)
                 #print(f"Raw data received (hex): {buffer.hex()}")
                 frames, buffer = parse_lin_frames(buffer)
                 for frame in frames:
@@ -0,0 +1,161 @@
+"""
+LIN transport layer (ISO 17987-2): carries messages longer than one frame
+over the diagnostic frames, master request 0x3C and slave response 0x3D.
+
+Every transport frame has 8 data bytes: the node address (NAD), a protocol
+control byte (PCI) and payload padded with 0xFF.
+
+    single frame       PCI 0x0L          L = 1..6 payload bytes
+    first frame        PCI 0x1H, LEN     12-bit message length H:LEN, 5 bytes
+    consecutive frame  PCI 0x2N          N = sequence number mod 16, 6 bytes
+
+A message of up to 6 bytes goes in one single frame. A longer one (up to
+4095 bytes) is a first frame followed by consecutive frames numbered from 1.
+The master sends requests as master request frames. A slave queues its
+response and sends one transport frame each time the master sends a slave
+response header; with nothing queued it leaves the header unanswered.
+"""
+
+MAX_FRAME_DATA_LENGTH = 8
+MASTER_REQUEST_ID = 0x3C
+SLAVE_RESPONSE_ID = 0x3D
+
+class LINTransportError(Exception):
+    """Transport layer (multi-frame message) error"""
+    pass
+
+BROADCAST_NAD = 0x7F
+PADDING = 0xFF
+
+# PCI types (upper nibble)
+SINGLE_FRAME = 0x00
+FIRST_FRAME = 0x10
+CONSECUTIVE_FRAME = 0x20
+
+SINGLE_FRAME_DATA = 6
+FIRST_FRAME_DATA = 5
+CONSECUTIVE_FRAME_DATA = 6
+MAX_MESSAGE_LENGTH = 4095
+
+# Negative response: 0x7F, the rejected service ID, then the reason
+NEGATIVE_RESPONSE_SID = 0x7F
+SERVICE_NOT_SUPPORTED = 0x11
+REQUEST_OUT_OF_RANGE = 0x31
+
+def _pad(data):
+    return bytes(data) + bytes([PADDING] * (MAX_FRAME_DATA_LENGTH - len(data)))
+
+def segment(nad, message):
+    """
+    Split a message into transport frames
+
+    Args:
+        nad: node address of the slave the message is for or from
+        message: message bytes (service ID first), 1..4095 bytes
+
+    Returns:
+        list: 8-byte frame payloads, in the order they go on the bus
+    """
+    message = bytes(message)
+    if not 0 < len(message) <= MAX_MESSAGE_LENGTH:
+        raise ValueError(f"Message length must be 1..{MAX_MESSAGE_LENGTH} bytes")
+    if len(message) <= SINGLE_FRAME_DATA:
+        return [_pad(bytes([nad, SINGLE_FRAME | len(message)]) + message)]
+
+    frames = [bytes([nad, FIRST_FRAME | (len(message) >> 8), len(message) & 0xFF]) +
+              message[:FIRST_FRAME_DATA]]
+    sequence = 1
+    for start in range(FIRST_FRAME_DATA, len(message), CONSECUTIVE_FRAME_DATA):
+        chunk = message[start:start + CONSECUTIVE_FRAME_DATA]
+        frames.append(_pad(bytes([nad, CONSECUTIVE_FRAME | (sequence & 0x0F)]) + chunk))
+        sequence += 1
+    return frames
+
+def frame_count(length):
+    """Number of transport frames a message of `length` bytes takes"""
+    if length <= SINGLE_FRAME_DATA:
+        return 1
+    return 1 + -(-(length - FIRST_FRAME_DATA) // CONSECUTIVE_FRAME_DATA)
+
+def negative_response(nad, service_id, reason):
+    """Single frame rejecting a request"""
+    return segment(nad, bytes([NEGATIVE_RESPONSE_SID, service_id, reason]))
+
+class Reassembler:
+    def __init__(self, nad=None):
+        """
+        Rebuild messages from transport frames
+
+        Args:
+            nad: only accept frames for this node address (None: any)
+        """
+        self.nad = nad
+        self.reset()
+
+    def reset(self):
+        self.message = bytearray()
+        self.length = 0
+        self.sequence = 0
+
+    @property
+    def in_progress(self):
+        """True between a first frame and the last consecutive frame"""
+        return self.length > 0
+
+    def feed(self, frame):
+        """
+        Add one received transport frame
+
+        Args:
+            frame: the frame's 8 data bytes
+
+        Returns:
+            bytes: the complete message once its last frame arrived, None before
+
+        Raises:
+            LINTransportError: wrong NAD, PCI or sequence number; the partial
+                message is dropped
+        """
+        if len(frame) != MAX_FRAME_DATA_LENGTH:
+            self.reset()
+            raise LINTransportError(f"Transport frame must have {MAX_FRAME_DATA_LENGTH} bytes, got {len(frame)}")
+        nad, pci = frame[0], frame[1]
+        if self.nad is not None and nad not in (self.nad, BROADCAST_NAD):
+            self.reset()
+            raise LINTransportError(f"Frame for NAD {hex(nad)}, expected {hex(self.nad)}")
+
+        kind = pci & 0xF0
+        if kind == SINGLE_FRAME:
+            self.reset()
+            length = pci & 0x0F
+            if not 0 < length <= SINGLE_FRAME_DATA:
+                raise LINTransportError(f"Invalid single frame length {length}")
+            return bytes(frame[2:2 + length])
+
+        if kind == FIRST_FRAME:
+            self.reset()
+            length = ((pci & 0x0F) << 8) | frame[2]
+            if length <= SINGLE_FRAME_DATA:
+                raise LINTransportError(f"First frame for a {length}-byte message")
+            self.length = length
+            self.message.extend(frame[3:])
+            self.sequence = 1
+            return None
+
+        if kind == CONSECUTIVE_FRAME:
+            if not self.in_progress:
+                raise LINTransportError("Consecutive frame without a first frame")
+            if pci & 0x0F != self.sequence & 0x0F:
+                expected = self.sequence & 0x0F
+                self.reset()
+                raise LINTransportError(f"Consecutive frame {pci & 0x0F} out of sequence, expected {expected}")
+            self.message.extend(frame[2:2 + min(CONSECUTIVE_FRAME_DATA, self.length - len(self.message))])
+            self.sequence += 1
+            if len(self.message) < self.length:
+                return None
+            message = bytes(self.message)
+            self.reset()
+            return message
+
+        self.reset()
+        raise LINTransportError(f"Unknown PCI {hex(pci)}")
@@ -254,49 +254,67 @@ class CANLightMaster:
         
         try:
             while self.running:
-                current_size = os.path.getsize(self.filename)
-                
-                if current_size > self.last_size:
-                    with open(self.filename, 'r') as f:
-                        f.seek(self.last_size)
-                        new_content = f.read()
-                        self.last_size = current_size
-                        
-                        for line in new_content.split('\n'):
-                            if line.strip() and line.startswith("Light:"):
-                                try:
-                                    parts = [p.strip() for p in line.split('|')]
-                                    if len(parts) < 3:
-                                        print(f"Skipping incomplete line: {line}")
-                                        continue
-                                        
-                                    light = parts[0].split(':')[1].strip()
-                                    status = parts[1].split(':')[1].strip().upper()
-                                    mode = parts[2].split(':')[1].strip().upper()
-                                    
-                                    if (light in LIGHT_IDS and 
-                                        status in STATUS_CODES and 
-                                        mode in MODE_CODES):
-                                        
-                                        if (self.last_processed_status[light] != status or 
-                                            self.last_processed_mode[light] != mode):
-                                            
-                                            self.send_can_message(light, status, mode)
-                                            self.last_processed_status[light] = status
-                                            self.last_processed_mode[light] = mode
-                                            print(f"Processed status/mode change for {light}: {status}/{mode}")
-                                        else:
-                                            print(f"No change in {light} status/mode, skipping")
-                                    else:
-                                        print(f"Ignoring unknown light/status/mode: {line}")
-                                except (IndexError, ValueError) as e:
-                                    print(f"Malformed line: {line} - Error: {e}")
-                
+                self.process_available()
                 time.sleep(0.1)
                 
         except KeyboardInterrupt:
             self.shutdown()
     
+    def process_available(self):
+        """Handle the complete lines appended to the file since the last call.
+
+        Safe to call on every file event: a line still being written is left
+        for the next call, and a truncated file is read again from the start.
+        """
+        current_size = os.path.getsize(self.filename)
+        if current_size < self.last_size:
+            self.last_size = 0
+        if current_size == self.last_size:
+            return 0
+        
+        with open(self.filename, 'rb') as f:
+            f.seek(self.last_size)
+            new_content = f.read(current_size - self.last_size)
+        complete = new_content[:new_content.rfind(b'\n') + 1]
+        self.last_size += len(complete)
+        
+        lines = complete.decode(errors='replace').splitlines()
+        if lines:
+            self.on_new_lines(lines)
+        return len(lines)
+    
+    def on_new_lines(self, lines):
+        """Send the CAN commands for new analysis lines"""
+        for line in lines:
+            if line.strip() and line.startswith("Light:"):
+                try:
+                    parts = [p.strip() for p in line.split('|')]
+                    if len(parts) < 3:
+                        print(f"Skipping incomplete line: {line}")
+                        continue
+
+                    light = parts[0].split(':')[1].strip()
+                    status = parts[1].split(':')[1].strip().upper()
+                    mode = parts[2].split(':')[1].strip().upper()
+
+                    if (light in LIGHT_IDS and 
+                        status in STATUS_CODES and 
+                        mode in MODE_CODES):
+
+                        if (self.last_processed_status[light] != status or 
+                            self.last_processed_mode[light] != mode):
+
+                            self.send_can_message(light, status, mode)
+                            self.last_processed_status[light] = status
+                            self.last_processed_mode[light] = mode
+                            print(f"Processed status/mode change for {light}: {status}/{mode}")
+                        else:
+                            print(f"No change in {light} status/mode, skipping")
+                    else:
+                        print(f"Ignoring unknown light/status/mode: {line}")
+                except (IndexError, ValueError) as e:
+                    print(f"Malformed line: {line} - Error: {e}")
+    
     def shutdown(self):
         self.running = False
         if hasattr(self, 'response_thread') and self.response_thread.is_alive():
@@ -217,72 +217,90 @@ class CANWindowMaster:
         
         try:
             while self.running:
-                current_size = os.path.getsize(self.filename)
-                
-                if current_size > self.last_size:
-                    with open(self.filename, 'r') as f:
-                        f.seek(self.last_size)
-                        new_content = f.read()
-                        self.last_size = current_size
-                        
-                        for line in new_content.split('\n'):
-                            if line.strip() and line.startswith("Window:"):
-                                try:
-                                    # Split and clean all parts
-                                    parts = [p.strip() for p in line.split('|')]
-                                    if len(parts) < 6:
-                                        print(f"Skipping incomplete line: {line}")
-                                        continue
-                                        
-                                    window = parts[0].split(':')[1].strip()
-                                    result = parts[1].split(':')[1].strip()
-                                    level = int(parts[2].split(':')[1].strip().replace('%', ''))
-                                    level_type = parts[3].split(':')[1].strip().upper()
-                                    mode = parts[4].split(':')[1].strip().upper()
-                                    safety = parts[5].split(':')[1].strip().upper()
-                                    
-                                    # Validate window
-                                    if window not in WINDOW_IDS:
-                                        print(f"Invalid window: {window}")
-                                        continue
-                                        
-                                    # Validate result
-                                    if result not in RESULT_CODES:
-                                        print(f"Invalid result: {result}")
-                                        continue
-                                        
-                                    # Validate level
-                                    if not 0 <= level <= 100:
-                                        print(f"Invalid level: {level}")
-                                        continue
-                                        
-                                    # Validate level_type
-                                    if level_type not in LEVEL_TYPES:
-                                        print(f"Invalid level_type: {level_type}")
-                                        continue
-                                        
-                                    # Validate mode (case insensitive)
-                                    if mode.upper() not in [m.upper() for m in MODES]:
-                                        print(f"Invalid mode: {mode}")
-                                        continue
-                                        
-                                    # Validate safety
-                                    if safety not in ["ON", "OFF"]:
-                                        print(f"Invalid safety value: {safety}")
-                                        continue
-                                    
-                                    # Convert mode to standard case
-                                    mode = MODES[[m.upper() for m in MODES].index(mode.upper())]
-                                    
-                                    self.send_can_message(window, result, level, level_type, mode, safety)
-                                except (IndexError, ValueError) as e:
-                                    print(f"Malformed line: {line} - Error: {e}")
-                
+                self.process_available()
                 time.sleep(0.1)
                 
         except KeyboardInterrupt:
             self.shutdown()
     
+    def process_available(self):
+        """Handle the complete lines appended to the file since the last call.
+
+        Safe to call on every file event: a line still being written is left
+        for the next call, and a truncated file is read again from the start.
+        """
+        current_size = os.path.getsize(self.filename)
+        if current_size < self.last_size:
+            self.last_size = 0
+        if current_size == self.last_size:
+            return 0
+        
+        with open(self.filename, 'rb') as f:
+            f.seek(self.last_size)
+            new_content = f.read(current_size - self.last_size)
+        complete = new_content[:new_content.rfind(b'\n') + 1]
+        self.last_size += len(complete)
+        
+        lines = complete.decode(errors='replace').splitlines()
+        if lines:
+            self.on_new_lines(lines)
+        return len(lines)
+    
+    def on_new_lines(self, lines):
+        """Send the CAN commands for new analysis lines"""
+        for line in lines:
+            if line.strip() and line.startswith("Window:"):
+                try:
+                    # Split and clean all parts
+                    parts = [p.strip() for p in line.split('|')]
+                    if len(parts) < 6:
+                        print(f"Skipping incomplete line: {line}")
+                        continue
+
+                    window = parts[0].split(':')[1].strip()
+                    result = parts[1].split(':')[1].strip()
+                    level = int(parts[2].split(':')[1].strip().replace('%', ''))
+                    level_type = parts[3].split(':')[1].strip().upper()
+                    mode = parts[4].split(':')[1].strip().upper()
+                    safety = parts[5].split(':')[1].strip().upper()
+
+                    # Validate window
+                    if window not in WINDOW_IDS:
+                        print(f"Invalid window: {window}")
+                        continue
+
+                    # Validate result
+                    if result not in RESULT_CODES:
+                        print(f"Invalid result: {result}")
+                        continue
+
+                    # Validate level
+                    if not 0 <= level <= 100:
+                        print(f"Invalid level: {level}")
+                        continue
+
+                    # Validate level_type
+                    if level_type not in LEVEL_TYPES:
+                        print(f"Invalid level_type: {level_type}")
+                        continue
+
+                    # Validate mode (case insensitive)
+                    if mode.upper() not in [m.upper() for m in MODES]:
+                        print(f"Invalid mode: {mode}")
+                        continue
+
+                    # Validate safety
+                    if safety not in ["ON", "OFF"]:
+                        print(f"Invalid safety value: {safety}")
+                        continue
+
+                    # Convert mode to standard case
+                    mode = MODES[[m.upper() for m in MODES].index(mode.upper())]
+
+                    self.send_can_message(window, result, level, level_type, mode, safety)
+                except (IndexError, ValueError) as e:
+                    print(f"Malformed line: {line} - Error: {e}")
+    
     def shutdown(self):
         self.running = False
         if hasattr(self, 'response_thread') and self.response_thread.is_alive():
@@ -15,13 +15,22 @@ WINDOW_IDS = {
     "PRS": 0x13
 }
 
-# Response IDs (same as window IDs for two-way communication)
+# Status frames published by the slave, one per window
 RESPONSE_IDS = {
-    0x10: "DR",
-    0x11: "PS",
-    0x12: "DRS",
-    0x13: "PRS"
+    0x20: "DR",
+    0x21: "PS",
+    0x22: "DRS",
+    0x23: "PRS"
 }
+STATUS_RESPONSE_LENGTH = 5
+
+# Schedule table: (status frame polled, delay before the next entry)
+SCHEDULE = [
+    (0x20, 0.05),
+    (0x21, 0.05),
+    (0x22, 0.05),
+    (0x23, 0.05)
+]
 
 # Result codes mapping
 RESULT_CODES = ["OP", "CL", "OPG", "CLG", "FOP", "OP_D", "CL_D", "OPG_D", "CLG_D", "FOP_D", 
@@ -45,6 +54,9 @@ BAUD_RATE = 19200
 WAKEUP_PIN = 4
 SYNC_BYTE = 0x55
 BREAK_BYTE = 0x00
+SLAVE_TURNAROUND = 0.005  # time a slave script takes to react to a header
+# Header plus the maximum LIN response space (1.4x nominal) for a status frame
+RESPONSE_TIMEOUT = (34 + 1.4 * 10 * (STATUS_RESPONSE_LENGTH + 1)) / BAUD_RATE + SLAVE_TURNAROUND
 
 class LINWindowMaster:
     def __init__(self, filename):
@@ -52,15 +64,17 @@ class LINWindowMaster:
         self.last_size = os.path.getsize(filename)
         self.running = True
         self.last_processed_status = {window: None for window in WINDOW_IDS}
+        self.last_responses = {}
+        self.bus_lock = threading.Lock()  # one frame on the wire at a time
         
         # Initialize GPIO and serial
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(WAKEUP_PIN, GPIO.OUT)
         GPIO.output(WAKEUP_PIN, GPIO.HIGH)
         
-        self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=0.1)
+        self.ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=RESPONSE_TIMEOUT)
         self.init_db_connection()
-        self.start_response_monitor()
+        self.start_schedule()
     
     def init_db_connection(self):
         try:
@@ -132,13 +146,6 @@ class LINWindowMaster:
     def send_window_command(self, window, result, level, level_type, mode, safety):
         """Send a LIN frame to control a window"""
         try:
-            self.wakeup_slave()
-            self.send_break()
-            
-            self.ser.write(bytes([SYNC_BYTE]))
-            pid = self.calculate_pid(WINDOW_IDS[window])
-            self.ser.write(bytes([pid]))
-            
             result_index = RESULT_CODES.index(result)
             msg_data = bytes([
                 result_index,
@@ -148,38 +155,54 @@ class LINWindowMaster:
                 1 if safety == "ON" else 0
             ])
             
-            self.ser.write(msg_data)
-            checksum = self.calculate_checksum(pid, msg_data)
-            self.ser.write(bytes([checksum]))
-            self.ser.flush()
+            with self.bus_lock:
+                self.wakeup_slave()
+                self.send_break()
+                
+                self.ser.write(bytes([SYNC_BYTE]))
+                pid = self.calculate_pid(WINDOW_IDS[window])
+                self.ser.write(bytes([pid]))
+                
+                self.ser.write(msg_data)
+                checksum = self.calculate_checksum(pid, msg_data)
+                self.ser.write(bytes([checksum]))
+                self.ser.flush()
             
             print(f"Sent LIN frame: {window} | {result} | {level}% | {level_type} | {mode} | safety_{safety}")
             
         except Exception as e:
             print(f"Error sending LIN message: {e}")
     
-    def parse_response_frame(self, buffer):
-        """Parse response frame from slave"""
-        try:
-            # Frame structure: [BREAK, SYNC, PID, DATA(5), CHECKSUM]
-            if len(buffer) < 9:
-                return None
-            
-            # Verify break and sync bytes
-            if buffer[0] != BREAK_BYTE or buffer[1] != SYNC_BYTE:
-                return None
-            
-            pid = buffer[2]
-            data = buffer[3:8]
-            received_checksum = buffer[8]
-            
-            # Verify checksum
-            calc_checksum = self.calculate_checksum(pid, data)
-            if received_checksum != calc_checksum:
-                print(f"Checksum mismatch: received {hex(received_checksum)}, calculated {hex(calc_checksum)}")
-                return None
+    def poll_response(self, frame_id, length):
+        """Send the header for a slave-published frame and read its response.
+        
+        Returns the data bytes, or None if the slave did not answer within
+        the response slot or the checksum is wrong.
+        """
+        pid = self.calculate_pid(frame_id)
+        with self.bus_lock:
+            self.ser.reset_input_buffer()
+            self.send_break()
+            self.ser.write(bytes([SYNC_BYTE, pid]))
+            self.ser.flush()
             
-            frame_id = pid & 0x3F
+            response = self.ser.read(length + 1)
+            if response[:3] == bytes([BREAK_BYTE, SYNC_BYTE, pid]):
+                # Transceiver echo of our own header
+                response = response[3:] + self.ser.read(3)
+        if len(response) < length + 1:
+            return None
+        
+        data, checksum = response[:length], response[length]
+        calc_checksum = self.calculate_checksum(pid, data)
+        if checksum != calc_checksum:
+            print(f"Checksum mismatch: received {hex(checksum)}, calculated {hex(calc_checksum)}")
+            return None
+        return data
+    
+    def parse_response_frame(self, frame_id, data):
+        """Parse a window status response (5 data bytes) from slave"""
+        try:
             window = RESPONSE_IDS.get(frame_id)
             
             if not window:
@@ -246,42 +269,37 @@ class LINWindowMaster:
             if not self.db_connection.is_connected():
                 print("Database connection lost; will attempt to reconnect on next update")
     
-    def monitor_responses(self):
-        """Monitor for response frames from slave"""
-        print("Listening for response LIN messages...")
-        buffer = bytearray()
+    def run_schedule(self):
+        """Poll the slave's status frames from the schedule table"""
+        print("Polling window status frames...")
         
         try:
             while self.running:
-                if self.ser.in_waiting:
-                    byte = self.ser.read(1)
-                    if byte:
-                        buffer += byte
+                for frame_id, delay in SCHEDULE:
+                    if not self.running:
+                        break
+                    data = self.poll_response(frame_id, STATUS_RESPONSE_LENGTH)
                     
-                    # Process complete frames in buffer
-                    while len(buffer) >= 9:
-                        status = self.parse_response_frame(buffer[:9])
+                    # Report a window when its published status changes
+                    if data is not None and self.last_responses.get(frame_id) != data:
+                        self.last_responses[frame_id] = data
+                        status = self.parse_response_frame(frame_id, data)
                         if status:
                             print("\nReceived Window Status:")
                             for window, data in status.items():
                                 print(f"{window}: {data['result']} | {data['level']}% | {data['level_type']} | {data['mode']} | safety_{data['safety']}")
                             self.write_response_to_file(status)
                             self.update_database(status)
-                        
-                        # Remove processed bytes from buffer
-                        buffer = buffer[9:]
-                
-                time.sleep(0.001)
+                    
+                    time.sleep(delay)
                 
         except Exception as e:
-            print(f"Response monitoring error: {e}")
-        finally:
-            self.ser.close()
+            print(f"Schedule error: {e}")
     
-    def start_response_monitor(self):
-        """Start a thread to monitor response messages"""
-        self.response_thread = threading.Thread(target=self.monitor_responses, daemon=True)
-        self.response_thread.start()
+    def start_schedule(self):
+        """Start a thread that runs the schedule table"""
+        self.schedule_thread = threading.Thread(target=self.run_schedule, daemon=True)
+        self.schedule_thread.start()
     
     def monitor_file(self):
         print(f"Monitoring {self.filename} for new window status updates...")
@@ -349,8 +367,8 @@ class LINWindowMaster:
     
     def shutdown(self):
         self.running = False
-        if hasattr(self, 'response_thread') and self.response_thread.is_alive():
-            self.response_thread.join(timeout=0.5)
+        if hasattr(self, 'schedule_thread') and self.schedule_thread.is_alive():
+            self.schedule_thread.join(timeout=0.5)
         if self.ser and self.ser.is_open:
             self.ser.close()
         if hasattr(self, 'db_connection') and self.db_connection.is_connected():
@@ -13,12 +13,12 @@ WINDOW_IDS = {
     "PRS": 0x13
 }
 
-# Response IDs (same as window IDs for two-way communication)
+# Status frames this slave publishes; the master polls them with a header
 RESPONSE_IDS = {
-    "DR": 0x10,
-    "PS": 0x11,
-    "DRS": 0x12,
-    "PRS": 0x13
+    "DR": 0x20,
+    "PS": 0x21,
+    "DRS": 0x22,
+    "PRS": 0x23
 }
 
 # GPIO pins for each window's LEDs
@@ -70,6 +70,7 @@ class LINWindowSlave:
         }
         self.current_led_states = defaultdict(int)
         self.lock = threading.Lock()
+        self.response_slots = {}  # frame ID -> data sent when the master polls it
         
         # Initialize GPIO and serial
         self.setup_gpio()
@@ -115,41 +116,30 @@ class LINWindowSlave:
                 checksum -= 0xFF
         return (0xFF - checksum) & 0xFF
     
-    def send_break(self):
-        self.ser.baudrate = BAUD_RATE // 4
-        self.ser.write(bytes([BREAK_BYTE]))
-        self.ser.flush()
-        time.sleep(13 * (1.0 / (BAUD_RATE // 4)))
-        self.ser.baudrate = BAUD_RATE
+    def publish_response(self, window, status):
+        """Publish a window's status (5 bytes) in its response slot"""
+        msg_data = bytes([
+            RESULT_CODES.index(status["result"]),
+            status["level"],
+            LEVEL_TYPES.index(status["level_type"]),
+            MODES.index(status["mode"]),
+            1 if status["safety"] == "ON" else 0
+        ])
+        self.response_slots[RESPONSE_IDS[window]] = msg_data
+        logging.info(f"Published response for {window}: {status}")
     
-    def send_lin_response(self, window, status):
-        """Send a complete LIN response frame"""
+    def send_slot_response(self, frame_id, pid):
+        """Answer a master header with data and checksum only (the master owns break, sync and PID)"""
+        with self.lock:
+            data = self.response_slots.get(frame_id)
+        if data is None:
+            return False
         try:
-            self.send_break()
-            self.ser.write(bytes([SYNC_BYTE]))
-            
-            pid = self.calculate_pid(RESPONSE_IDS[window])
-            self.ser.write(bytes([pid]))
-            
-            # Prepare response data (5 bytes)
-            msg_data = bytes([
-                RESULT_CODES.index(status["result"]),
-                status["level"],
-                LEVEL_TYPES.index(status["level_type"]),
-                MODES.index(status["mode"]),
-                1 if status["safety"] == "ON" else 0
-            ])
-            
-            self.ser.write(msg_data)
-            
-            # Calculate and send checksum
-            checksum = self.calculate_checksum(pid, msg_data)
-            self.ser.write(bytes([checksum]))
+            self.ser.write(data + bytes([self.calculate_checksum(pid, data)]))
             self.ser.flush()
-            
-            logging.info(f"Sent response for {window}: {status}")
         except Exception as e:
             logging.error(f"Error sending LIN response: {e}")
+        return True
     
     def update_status_leds(self, result, safety):
         """Update the status LEDs based on the result code and safety status"""
@@ -230,9 +220,9 @@ class LINWindowSlave:
             
             self.update_window_leds(window, level)
         
-        # Always send response even for FAILED status
+        # Always publish a response even for FAILED status
         with self.lock:
-            self.send_lin_response(window, self.window_status[window])
+            self.publish_response(window, self.window_status[window])
     
     def process_frame(self, buffer):
         """Process a complete LIN frame from the buffer"""
@@ -302,18 +292,30 @@ class LINWindowSlave:
         
         try:
             while self.running:
-                if self.ser.in_waiting:
-                    byte = self.ser.read(1)
-                    if byte:
-                        buffer += byte
-                    
-                    # Check if we have a complete frame (break + sync + pid + 5 data + checksum)
-                    if len(buffer) >= 9:
-                        if self.process_frame(buffer):
-                            buffer = buffer[9:]  # Remove processed frame from buffer
-                        else:
-                            buffer = bytearray()  # Invalid frame, clear buffer
-                time.sleep(0.001)
+                # Blocks in select() until a byte arrives or the port timeout
+                # expires, so an idle bus costs no CPU
+                byte = self.ser.read(1)
+                if not byte:
+                    continue
+                buffer += byte
+                
+                # Resynchronise on break + sync
+                if buffer and (buffer[0] != BREAK_BYTE or (len(buffer) >= 2 and buffer[1] != SYNC_BYTE)):
+                    buffer = buffer[1:]
+                    continue
+                
+                # A header for one of our status frames: answer in its response slot
+                if len(buffer) == 3 and (buffer[2] & 0x3F) in RESPONSE_IDS.values():
+                    self.send_slot_response(buffer[2] & 0x3F, buffer[2])
+                    buffer = bytearray()
+                    continue
+                
+                # Check if we have a complete frame (break + sync + pid + 5 data + checksum)
+                if len(buffer) >= 9:
+                    if self.process_frame(buffer):
+                        buffer = buffer[9:]  # Remove processed frame from buffer
+                    else:
+                        buffer = bytearray()  # Invalid frame, clear buffer
                 
         except KeyboardInterrupt:
             logging.info("Received keyboard interrupt")
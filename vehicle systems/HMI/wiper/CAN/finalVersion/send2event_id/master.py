@@ -9,13 +9,29 @@ from datetime import datetime
 import mysql.connector
 from mysql.connector import Error
 import json
+import metrics
+
+METRICS_PORT = 9103
+RESPONSE_TIMEOUT = 2.0  # seconds the slave has to answer a command
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+RESPONSE_TIMEOUTS = metrics.counter('pfe_response_timeouts', 'Commands not answered in time', ('service', 'id'))
+DB_WRITE_SECONDS = metrics.histogram('pfe_db_write_seconds', 'Duration of protocol_data updates', ('service',))
+
+SEND_ERRORS = ERRORS.labels('wiper_master', 'send')
+DB_WRITES = DB_WRITE_SECONDS.labels('wiper_master')
 
 class CANWiperMaster:
-    def __init__(self):
+    def __init__(self, bus=None, db_pool=None, base_dir=''):
         self.channel = 'can0'
         self.bustype = 'socketcan'
-        self.bus = None
-        self.wiper = WiperSystem("input.json", "wiper_output.txt")
+        self.bus = bus
+        self.owns_bus = bus is None  # False when hosted by the supervisor
+        self.db_pool = db_pool
+        self.input_file = os.path.join(base_dir, "input.json")
+        self.output_file = os.path.join(base_dir, "wiper_output.txt")
+        self.wiper = WiperSystem(self.input_file, self.output_file)
         self.CAN_MSG_ID = 0x100
         self.RESPONSE_MSG_ID = 0x101
         self.last_modified = 0
@@ -23,10 +39,16 @@ class CANWiperMaster:
         self.db_connection = None
         self.db_cursor = None
         self.current_wiper_operation = 0  # To track WiperRequestOperation status
+        self.command_sent_at = None  # monotonic time of the unanswered command
+        self.frames_sent = FRAMES.labels('wiper_master', 'tx', hex(self.CAN_MSG_ID))
+        self.frames_received = FRAMES.labels('wiper_master', 'rx', hex(self.RESPONSE_MSG_ID))
 
-        self.init_can_bus()
+        metrics.start_http_server(METRICS_PORT)
+        if self.owns_bus:
+            self.init_can_bus()
         self.init_database()
-        self.start_response_monitor()
+        if self.owns_bus:
+            self.start_response_monitor()
 
     def init_can_bus(self):
         try:
@@ -40,12 +62,15 @@ class CANWiperMaster:
 
     def init_database(self):
         try:
-            self.db_connection = mysql.connector.connect(
-                host="10.20.0.119",
-                user="monuserr",
-                password="khalil",
-                database="khalil"
-            )
+            if self.db_pool:
+                self.db_connection = self.db_pool.get_connection()
+            else:
+                self.db_connection = mysql.connector.connect(
+                    host="10.20.0.119",
+                    user="monuserr",
+                    password="khalil",
+                    database="khalil"
+                )
             self.db_cursor = self.db_connection.cursor()
             print("Database connection established")
 
@@ -105,7 +130,7 @@ class CANWiperMaster:
     def send_signals(self):
         try:
             self.wiper.process_operation()
-            with open("wiper_output.txt", 'r') as f:
+            with open(self.output_file, 'r') as f:
                 content = f.read()
                 print("\nGenerated Output:")
                 print(content.strip())
@@ -131,8 +156,11 @@ class CANWiperMaster:
                 is_extended_id=False
             )
             self.bus.send(msg)
+            self.frames_sent.inc()
+            self.command_sent_at = time.monotonic()
             print(f"Sent CAN: {data.hex()}")
         except Exception as e:
+            SEND_ERRORS.inc()
             print(f"CAN send error: {e}")
 
     def parse_response_frame(self, data):
@@ -161,8 +189,9 @@ class CANWiperMaster:
             """
             values = (message, timestamp, event_id)
 
-            self.db_cursor.execute(query, values)
-            self.db_connection.commit()
+            with DB_WRITES.time():
+                self.db_cursor.execute(query, values)
+                self.db_connection.commit()
             print(f"Updated WiperStatus={wiper_status} (message={message}) in database at {timestamp}")
         except Error as e:
             print(f"Error storing WiperStatus in database: {e}")
@@ -185,8 +214,9 @@ class CANWiperMaster:
             """
             values = (operation, timestamp, event_id)
 
-            self.db_cursor.execute(query, values)
-            self.db_connection.commit()
+            with DB_WRITES.time():
+                self.db_cursor.execute(query, values)
+                self.db_connection.commit()
             print(f"Updated WiperOperation={operation} in database at {timestamp}")
         except Error as e:
             print(f"Error storing WiperOperation in database: {e}")
@@ -196,25 +226,43 @@ class CANWiperMaster:
         try:
             while self.running:
                 msg = self.bus.recv(timeout=1.0)
-                if msg and msg.arbitration_id == self.RESPONSE_MSG_ID:
-                    signals = self.parse_response_frame(msg.data)
-                    print("\nReceived Response Signals:")
-                    for key, value in signals.items():
-                        print(f"{key}: {value}")
-                    
-                    # Store both WiperStatus and current operation
-                    self.store_wiper_status(signals['WiperStatus'])
-                    self.store_wiper_operation(self.current_wiper_operation)
+                self.check_response_timeout()
+                if msg:
+                    self.handle_response(msg)
         except Exception as e:
             print(f"Response monitoring error: {e}")
 
+    def handle_response(self, msg):
+        """Process one frame from the bus; frames of other IDs are ignored"""
+        # 0x101 is also the Low Beam response, which is only 2-3 bytes long
+        if msg.arbitration_id != self.RESPONSE_MSG_ID or len(msg.data) < 8:
+            return
+        self.frames_received.inc()
+        self.command_sent_at = None
+        signals = self.parse_response_frame(msg.data)
+        print("\nReceived Response Signals:")
+        for key, value in signals.items():
+            print(f"{key}: {value}")
+        
+        # Store both WiperStatus and current operation
+        self.store_wiper_status(signals['WiperStatus'])
+        self.store_wiper_operation(self.current_wiper_operation)
+
+    def check_response_timeout(self):
+        """Count a command the slave has not answered within RESPONSE_TIMEOUT"""
+        sent_at = self.command_sent_at
+        if sent_at is not None and time.monotonic() - sent_at > RESPONSE_TIMEOUT:
+            self.command_sent_at = None
+            RESPONSE_TIMEOUTS.labels('wiper_master', hex(self.CAN_MSG_ID)).inc()
+            print(f"No response for ID {hex(self.CAN_MSG_ID)} within {RESPONSE_TIMEOUT} s")
+
     def start_response_monitor(self):
         self.response_thread = threading.Thread(target=self.monitor_responses, daemon=True)
         self.response_thread.start()
 
     def file_changed(self):
         try:
-            mod_time = os.path.getmtime("input.json")
+            mod_time = os.path.getmtime(self.input_file)
             if mod_time != self.last_modified:
                 self.last_modified = mod_time
                 return True
@@ -226,25 +274,30 @@ class CANWiperMaster:
         print("Monitoring input.json...")
         try:
             while self.running:
-                if self.file_changed():
-                    print("\n=== Input Changed ===")
-                    self.send_signals()
+                self.check_file()
                 time.sleep(0.3)
         except KeyboardInterrupt:
             self.shutdown()
 
+    def check_file(self):
+        """Send the wiper command again if input.json was modified"""
+        if self.file_changed():
+            print("\n=== Input Changed ===")
+            self.send_signals()
+
     def shutdown(self):
         self.running = False
-        if self.response_thread.is_alive():
+        if hasattr(self, 'response_thread') and self.response_thread.is_alive():
             self.response_thread.join(timeout=0.5)
-        if self.bus:
+        if self.bus and self.owns_bus:
             self.bus.shutdown()
         if self.db_connection:
             if self.db_cursor:
                 self.db_cursor.close()
             self.db_connection.close()
             print("Database connection closed")
-        os.system(f'sudo /sbin/ip link set {self.channel} down')
+        if self.owns_bus:
+            os.system(f'sudo /sbin/ip link set {self.channel} down')
         print("Shutdown complete")
 
 if __name__ == "__main__":
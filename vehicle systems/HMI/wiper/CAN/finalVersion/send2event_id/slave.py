@@ -6,11 +6,26 @@ import time
 import threading
 import logging
 import re
+import metrics
 
 # GPIO setup
 FRONT_LEDS = [2, 3, 23]  # Right to left
 BACK_LEDS = [6, 13, 19]   # Right to left
 
+METRICS_PORT = 9113
+
+# Vehicle snapshot request (finalPFE_2/snapshot.py): byte 0 selects the ECUs
+SNAPSHOT_REQUEST_ID = 0x300
+SNAPSHOT_WIPER = 0x04
+
+FRAMES = metrics.counter('pfe_frames', 'Frames by direction and ID', ('service', 'direction', 'id'))
+ERRORS = metrics.counter('pfe_errors', 'Errors by kind (send, malformed input, checksum)', ('service', 'kind'))
+EFFECT_THREADS = metrics.gauge('pfe_effect_threads', 'Running effect/animation threads', ('service',))
+
+FRAMES_RECEIVED = FRAMES.labels('wiper_slave', 'rx', hex(0x100))
+FRAMES_SENT = FRAMES.labels('wiper_slave', 'tx', hex(0x101))
+SEND_ERRORS = ERRORS.labels('wiper_slave', 'send')
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -23,6 +38,8 @@ logging.basicConfig(
 
 class CANWiperSlave:
     def __init__(self):
+        metrics.start_http_server(METRICS_PORT)
+        
         # Initialize CAN
         try:
             os.system('sudo /sbin/ip link set can0 up type can bitrate 500000')
@@ -41,6 +58,8 @@ class CANWiperSlave:
         # Thread control
         self.stop_event = threading.Event()
         self.active_threads = []
+        EFFECT_THREADS.labels('wiper_slave').set_function(
+            lambda: sum(1 for thread in self.active_threads if thread.is_alive()))
         self.operation_lock = threading.Lock()
         self.running = True
         self.back_wiper_active = False
@@ -225,6 +244,7 @@ class CANWiperSlave:
                 is_extended_id=False
             )
             self.can_bus.send(msg)
+            FRAMES_SENT.inc()
             logging.info(f"Sent response CAN: {data.hex()}")
             # Display sent signals
             signals = {
@@ -241,6 +261,7 @@ class CANWiperSlave:
             for key, value in signals.items():
                 print(f"{key}: {value}")
         except Exception as e:
+            SEND_ERRORS.inc()
             logging.error(f"CAN response send error: {e}")
 
     def process_can_signals(self, signals):
@@ -322,8 +343,13 @@ class CANWiperSlave:
             while self.running:
                 msg = self.can_bus.recv(timeout=1.0)
                 if msg and msg.arbitration_id == 0x100:
+                    FRAMES_RECEIVED.inc()
                     signals = self.parse_can_frame(msg.data)
                     self.process_can_signals(signals)
+                elif msg and msg.arbitration_id == SNAPSHOT_REQUEST_ID:
+                    # The status frame is 8 bytes, so the answer is classic CAN either way
+                    if msg.data and msg.data[0] & SNAPSHOT_WIPER:
+                        self.send_response()
         except Exception as e:
             logging.error(f"CAN monitoring error: {e}")
 
@@ -6,7 +6,68 @@ import time
 import os
 import sys
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+
+# Door position -> suffix used for the flat state fields and rule signals
+DOOR_SLOTS = {
+    "Front Right Door": 'right_front',
+    "Rear Right Door": 'right_rear',
+    "Front Left Door": 'left_front',
+    "Rear Left Door": 'left_rear'
+}
+
+# Door position -> (state field, open/close field, rule signal)
+DOOR_FIELDS = {
+    pos: (f'door_state_{slot}', f'door_open_close_{slot}', f'door_status_{slot}')
+    for pos, slot in DOOR_SLOTS.items()
+}
+
+_STATE_FIELDS = (
+    'version', 'key_status', 'car_status', 'auto_unlock_status', 'auto_lock_status',
+    'ST_FlashLight', 'ST_HornBeeping', 'open_doors'
+) + tuple(field for fields in DOOR_FIELDS.values() for field in fields[:2])
+
+class DoorLockState(namedtuple('DoorLockState', _STATE_FIELDS)):
+    """Flat, immutable snapshot of the lock system state.
+
+    Every update returns a new record with an incremented version, so keeping
+    the previous state is just keeping a reference (no deep copies).
+    """
+    __slots__ = ()
+    _index = {name: i for i, name in enumerate(_STATE_FIELDS)}
+
+    def evolve(self, **changes):
+        """Return a new snapshot with the given fields changed and version + 1"""
+        values = list(self)
+        index = self._index
+        for name, value in changes.items():
+            values[index[name]] = value
+        values[0] += 1
+        return tuple.__new__(DoorLockState, values)
+
+    def __getitem__(self, key):
+        # Keeps the old dict-style access (state['key_status']) working
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def as_dict(self):
+        """Nested dict in the historical report format"""
+        return {
+            'key_status': self.key_status,
+            'car_status': self.car_status,
+            'doors': {
+                pos: {'state': getattr(self, state_field), 'open_close': getattr(self, open_field)}
+                for pos, (state_field, open_field, _) in DOOR_FIELDS.items()
+            },
+            'auto_unlock_status': self.auto_unlock_status,
+            'auto_lock_status': self.auto_lock_status,
+            'ST_FlashLight': self.ST_FlashLight,
+            'ST_HornBeeping': self.ST_HornBeeping
+        }
+
+    def __repr__(self):
+        return str(self.as_dict())
 
 class CarLockSystem:
     # Car status constants
@@ -26,29 +87,33 @@ class CarLockSystem:
     DOOR_CLOSED = "close"
     
     def __init__(self):
-        self.current_state = {
+        initial = {
+            'version': 0,
             'key_status': 0,  # 0=not in zone, 1=in zone
             'car_status': self.LOCKED,
-            'doors': {
-                self.FRONT_RIGHT: {'state': self.DOOR_LOCKED, 'open_close': ''},
-                self.REAR_RIGHT: {'state': self.DOOR_LOCKED, 'open_close': ''},
-                self.FRONT_LEFT: {'state': self.DOOR_LOCKED, 'open_close': ''},
-                self.REAR_LEFT: {'state': self.DOOR_LOCKED, 'open_close': ''}
-            },
             'auto_unlock_status': 1,  # Assume enabled by default
             'auto_lock_status': 1,    # Assume enabled by default
             'ST_FlashLight': 0,
-            'ST_HornBeeping': 0
+            'ST_HornBeeping': 0,
+            'open_doors': 0
         }
-        self.previous_state = self.current_state.copy()
+        for state_field, open_field, _ in DOOR_FIELDS.values():
+            initial[state_field] = self.DOOR_LOCKED
+            initial[open_field] = ''
+        self.current_state = DoorLockState(**initial)
+        self.previous_state = self.current_state
         self.requirements = self._initialize_requirements()
+        self.rules_by_signal = self._compile_rules()
 
     def _initialize_requirements(self):
+        door_signals = tuple(signal for _, _, signal in DOOR_FIELDS.values())
         return {
             'req1': {
                 'description': "The car should automatically unlock when the key comes within a predefined radius (e.g., 2 meters) of the vehicle.",
                 'input': {'key_zone_status': 1, 'auto_unlock_status': 1, 'previous_car_status': self.LOCKED},
-                'output': {'car_status': self.UNLOCKED, 'ST_FlashLight': 1, 'ST_HornBeeping': 1}
+                'output': {'car_status': self.UNLOCKED, 'ST_FlashLight': 1, 'ST_HornBeeping': 1},
+                'trigger': ('key_zone_status',),
+                'check': self._check_req1
             },
             'req2': {
                 'description': "The car should automatically lock when all doors are closed and the key is at least 3 meters away.",
@@ -57,12 +122,16 @@ class CarLockSystem:
                     'door_status_right_front': 0, 'door_status_right_rear': 0,
                     'key_zone_status': 0, 'auto_lock_status': 1, 'previous_car_status': self.UNLOCKED
                 },
-                'output': {'car_status': self.LOCKED, 'ST_FlashLight': 1, 'ST_HornBeeping': 1}
+                'output': {'car_status': self.LOCKED, 'ST_FlashLight': 1, 'ST_HornBeeping': 1},
+                'trigger': ('key_zone_status',),
+                'check': self._check_req2
             },
             'req9a': {
                 'description': "If any door is opened from the inside, the car should remain unlocked while the door is open.",
                 'input': {'any_door_open': True, 'key_zone_status': 'any'},
-                'output': {'car_status': self.UNLOCKED}
+                'output': {'car_status': self.UNLOCKED},
+                'trigger': door_signals,
+                'check': self._check_req9a
             },
             'req9b': {
                 'description': "Doors should open when interior/exterior handle is pulled while car is unlocked.",
@@ -76,71 +145,72 @@ class CarLockSystem:
             }
         }
 
+    def _compile_rules(self):
+        """Index the checkable requirements by the input signal that triggers them"""
+        index = defaultdict(list)
+        for req_id, req_data in self.requirements.items():
+            check = req_data.get('check')
+            if check is None:
+                continue
+            for signal in req_data['trigger']:
+                index[signal].append((req_id, check))
+        return dict(index)
+
     def update_state(self, change_type, value):
-        """Update the system state based on the change"""
-        self.previous_state = self._deep_copy_state(self.current_state)
+        """Update the system state based on the change and return the changed signal"""
+        state = self.current_state
+        self.previous_state = state
         
         if change_type == 'key_status':
-            self.current_state['key_status'] = value
+            self.current_state = state.evolve(key_status=value)
+            return 'key_zone_status'
         elif change_type == 'door_status':
             position, door_state, open_close = value
-            self.current_state['doors'][position]['state'] = door_state
-            self.current_state['doors'][position]['open_close'] = open_close
+            state_field, open_field, signal = DOOR_FIELDS[position]
+            was_open = getattr(state, open_field) == self.DOOR_OPEN
+            is_open = open_close == self.DOOR_OPEN
+            changes = {
+                state_field: door_state,
+                open_field: open_close,
+                'open_doors': state.open_doors + is_open - was_open
+            }
             
             # Update car status based on door state
             if door_state == self.DOOR_UNLOCKED:
-                self.current_state['car_status'] = self.UNLOCKED
+                changes['car_status'] = self.UNLOCKED
+            self.current_state = state.evolve(**changes)
+            return signal
+        return None
 
-    def _deep_copy_state(self, state):
-        """Create a deep copy of the state dictionary"""
-        return {
-            'key_status': state['key_status'],
-            'car_status': state['car_status'],
-            'doors': {
-                pos: {'state': val['state'], 'open_close': val['open_close']}
-                for pos, val in state['doors'].items()
-            },
-            'auto_unlock_status': state['auto_unlock_status'],
-            'auto_lock_status': state['auto_lock_status'],
-            'ST_FlashLight': state['ST_FlashLight'],
-            'ST_HornBeeping': state['ST_HornBeeping']
-        }
+    def _check_req1(self, current, previous):
+        # Auto unlock when key comes near
+        return (current.key_status == 1 and previous.key_status == 0 and
+                current.auto_unlock_status == 1 and
+                previous.car_status == self.LOCKED)
+
+    def _check_req2(self, current, previous):
+        # Auto lock when key leaves and all doors closed
+        return (current.key_status == 0 and previous.key_status == 1 and
+                current.open_doors == 0 and
+                current.auto_lock_status == 1 and
+                previous.car_status == self.UNLOCKED)
 
-    def check_requirements(self, change_type):
-        """Check if any requirements are triggered by the state change"""
-        triggered = []
+    def _check_req9a(self, current, previous):
+        # Doors open keeps car unlocked
+        return current.open_doors > 0 and current.car_status != self.UNLOCKED
+
+    def check_requirements(self, signal):
+        """Evaluate only the requirements that depend on the changed signal"""
         current = self.current_state
         previous = self.previous_state
-        
-        # Check req1: Auto unlock when key comes near
-        if (change_type == 'key_status' and current['key_status'] == 1 and 
-            previous['key_status'] == 0 and
-            current['auto_unlock_status'] == 1 and
-            previous['car_status'] == self.LOCKED):
-            triggered.append('req1')
-        
-        # Check req2: Auto lock when key leaves and all doors closed
-        all_doors_closed = all(
-            door['open_close'] != self.DOOR_OPEN 
-            for door in current['doors'].values()
-        )
-        if (change_type == 'key_status' and current['key_status'] == 0 and 
-            previous['key_status'] == 1 and
-            all_doors_closed and
-            current['auto_lock_status'] == 1 and
-            previous['car_status'] == self.UNLOCKED):
-            triggered.append('req2')
-        
-        # Check req9a: Doors open keeps car unlocked
-        any_door_open = any(
-            door['open_close'] == self.DOOR_OPEN 
-            for door in current['doors'].values()
-        )
-        if (change_type == 'door_status' and any_door_open and 
-            current['car_status'] != self.UNLOCKED):
-            triggered.append('req9a')
-        
-        return triggered
+        return [
+            req_id for req_id, check in self.rules_by_signal.get(signal, ())
+            if check(current, previous)
+        ]
+
+DOOR_LINE_PATTERN = re.compile(
+    r".*(Front|Rear) (Right|Left) Door \| State: (Locked|Unlocked), Open_Close: (.*)"
+)
 
 def parse_log_line(line):
     """Parse a single line from the log file"""
@@ -150,10 +220,7 @@ def parse_log_line(line):
         return ('key_status', key_status)
     
     # Door status
-    door_match = re.match(
-        r".*(Front|Rear) (Right|Left) Door \| State: (Locked|Unlocked), Open_Close: (.*)", 
-        line
-    )
+    door_match = DOOR_LINE_PATTERN.match(line)
     if door_match:
         position = f"{door_match.group(1)} {door_match.group(2)} Door"
         state = door_match.group(3)
@@ -189,14 +256,15 @@ def analyze_log_file(filename, output_file=sys.stdout):
             parsed = parse_log_line(line)
             if parsed:
                 change_type, value = parsed
-                system.update_state(change_type, value)
-                triggered = system.check_requirements(change_type)
+                signal = system.update_state(change_type, value)
+                triggered = system.check_requirements(signal)
                 
+                # States are immutable snapshots, keeping a reference is enough
                 for req_id in triggered:
                     results[req_id].append({
                         'line': line,
-                        'state': system.current_state.copy(),
-                        'previous_state': system.previous_state.copy()
+                        'state': system.current_state,
+                        'previous_state': system.previous_state
                     })
     
     # Print results
@@ -212,8 +280,8 @@ def analyze_log_file(filename, output_file=sys.stdout):
             example = results[req_id][0]
             print(f"\nExample occurrence:", file=output_file)
             print(f"Log line: {example['line']}", file=output_file)
-            print(f"Previous state: {example['previous_state']}", file=output_file)
-            print(f"New state: {example['state']}", file=output_file)
+            print(f"Previous state: {example['previous_state'].as_dict()}", file=output_file)
+            print(f"New state: {example['state'].as_dict()}", file=output_file)
         
         print("-" * 80, file=output_file)
     
@@ -256,7 +324,43 @@ def monitor_log_file(filename):
         except KeyboardInterrupt:
             print("\nMonitoring stopped.")
 
+def generate_door_log(filename, events=10**6, seed=0):
+    """Write a synthetic door log with the given number of key/door events"""
+    import random
+    rng = random.Random(seed)
+    positions = list(DOOR_SLOTS)
+    with open(filename, 'w', encoding='utf-8') as file:
+        for i in range(events):
+            if rng.random() < 0.3:
+                file.write(f"{i} | Key | Key: {rng.randint(0, 1)}\n")
+            else:
+                position = rng.choice(positions)
+                state = rng.choice((CarLockSystem.DOOR_LOCKED, CarLockSystem.DOOR_UNLOCKED))
+                open_close = rng.choice(("Open", "Close"))
+                file.write(f"{i} | {position} | State: {state}, Open_Close: {open_close}\n")
+
+def benchmark(events=10**6, log_file="doors_benchmark_log.txt"):
+    """Time analyze_log_file() over a generated log of `events` door events"""
+    print(f"Generating {events} door events in {log_file}...")
+    generate_door_log(log_file, events)
+    try:
+        with open(os.devnull, 'w', encoding='utf-8') as devnull:
+            start = time.perf_counter()
+            results = analyze_log_file(log_file, devnull)
+            elapsed = time.perf_counter() - start
+    finally:
+        os.remove(log_file)
+    
+    print(f"Analyzed {events} events in {elapsed:.2f} s "
+          f"({events / elapsed:,.0f} events/s, {elapsed / events * 1e6:.2f} us/event)")
+    for req_id, occurrences in results.items():
+        print(f"  {req_id}: {len(occurrences)} occurrences")
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 10**6)
+        sys.exit(0)
+    
     log_file = "doors_log.txt"
     
     # Initialize output file
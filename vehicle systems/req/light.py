@@ -1,7 +1,9 @@
+import io
 import re
 import time
 import os
 import sys
+from stage_trace import StageTracer
 
 class VehicleLightingSystem:
     # Constants for modes
@@ -331,6 +333,7 @@ def monitor_log_file(filename):
     print("- Hazard Lights: ON in Fahren/Wohnen, OFF in Parking/Standby")
     print("- Turn Signals: ON in Wohnen/Fahren, OFF in Parking/Standby")
     print("\nPress Ctrl+C to stop monitoring...\n")
+    tracer = StageTracer('light_analyzer')
     
     with open("analysis_results.txt", "a") as output_file:
         output_file.write(f"\n\n=== New Monitoring Session === {time.ctime()}\n")
@@ -340,13 +343,19 @@ def monitor_log_file(filename):
             while True:
                 new_entries, last_position = parse_lights_log(filename, last_position)
                 if any(new_entries.values()):
+                    trace = tracer.begin()
+                    # How long the log line waited for this 1 s poll
+                    tracer.record('analyzer_poll', time.time_ns() - os.stat(filename).st_mtime_ns)
                     # Print detailed output to console
                     print("\nNew entries detected:")
                     analyze_lights(new_entries)
                     
                     # Write simple output to file (without transition messages)
+                    results = io.StringIO()
+                    analyze_lights(new_entries, output_file=results, simple_file_output=True)
+                    tracer.stamp(trace, 'analyzer_process')
                     with open("analysis_results.txt", "a") as f:
-                        analyze_lights(new_entries, output_file=f, simple_file_output=True)
+                        f.write(tracer.tag_lines(results.getvalue(), trace))
                     
                 time.sleep(1)
         except KeyboardInterrupt:
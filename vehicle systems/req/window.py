@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import re
 import time
 import os
 import sys
 from datetime import datetime
+from stage_trace import StageTracer
 
 class VehicleWindowSystem:
     # Constants for modes
@@ -188,6 +190,7 @@ def analyze_windows(log_entries, output_file=sys.stdout):
 def monitor_window_log_file(filename):
     print(f"\nStarting real-time monitoring of: {filename}")
     print("\nPress Ctrl+C to stop monitoring...\n")
+    tracer = StageTracer('window_analyzer')
     
     with open("windows_analysis.txt", "a", encoding='utf-8') as output_file:
         last_position = 0 if not os.path.exists(filename) else os.path.getsize(filename)
@@ -195,11 +198,17 @@ def monitor_window_log_file(filename):
             while True:
                 new_entries, last_position = parse_windows_log(filename, last_position)
                 if any(new_entries.values()):
+                    trace = tracer.begin()
+                    # How long the log line waited for this 1 s poll
+                    tracer.record('analyzer_poll', time.time_ns() - os.stat(filename).st_mtime_ns)
                     print("\n" + "="*60)
                     print("NEW WINDOW STATUS UPDATE".center(60))
                     print("="*60)
                     
-                    analyze_windows(new_entries, output_file)
+                    results = io.StringIO()
+                    analyze_windows(new_entries, results)
+                    tracer.stamp(trace, 'analyzer_process')
+                    output_file.write(tracer.tag_lines(results.getvalue(), trace))
                     output_file.flush()
                 time.sleep(1)
         except KeyboardInterrupt:
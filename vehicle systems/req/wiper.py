@@ -2,6 +2,20 @@ import time
 import os
 import json
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Column order used by the batch / stream evaluation API
+INPUT_FIELDS = ('ignition', 'wiperRequestOperation', 'rainIntensity', 'ReverseGear')
+OUTPUT_FIELDS = ('Wiper_Function_Enabled', 'wiperMode', 'wiperSpeed',
+                 'wiperCycleCount', 'WiperIntermittent', 'wipingCycle')
+
+# Rain intensity threshold between speed 1 and speed 2 in automatic mode
+RAIN_SPEED2_THRESHOLD = 20
+INTERMITTENT_WIPING_CYCLE = 1700
+
 class WiperSystem:
     def __init__(self, input_file_path="input.json", output_file_path="wiper_output.txt"):
         self.input_file_path = input_file_path
@@ -219,6 +233,96 @@ class WiperSystem:
         else:
             print("No valid wiper operation requested")
 
+    @staticmethod
+    def evaluate_sample(ignition, wiper_request, rain_intensity, reverse_gear):
+        """Return the expected outputs for one input sample, without any file I/O."""
+        outputs = dict.fromkeys(OUTPUT_FIELDS, 0)
+        if not _ignition_on(ignition):
+            return outputs
+
+        outputs['Wiper_Function_Enabled'] = 1
+        if wiper_request == 4 and reverse_gear == 1:
+            outputs.update(wiperMode=2, wiperSpeed=1, WiperIntermittent=1,
+                           wipingCycle=INTERMITTENT_WIPING_CYCLE)
+        elif wiper_request == 1:
+            outputs.update(wiperMode=1, wiperSpeed=1, wiperCycleCount=1)
+        elif wiper_request == 2:
+            outputs.update(wiperMode=2, wiperSpeed=1)
+        elif wiper_request == 3:
+            outputs.update(wiperMode=2, wiperSpeed=2)
+        elif wiper_request == 4:
+            speed = 1 if rain_intensity < RAIN_SPEED2_THRESHOLD else 2
+            outputs.update(wiperMode=4, wiperSpeed=speed)
+        return outputs
+
+    @staticmethod
+    def evaluate_batch(samples):
+        """Evaluate a whole recorded input stream in one vectorised pass.
+
+        `samples` is either a NumPy structured array with the INPUT_FIELDS
+        columns, a dict of column sequences, or a sequence of four columns
+        in INPUT_FIELDS order. Returns a dict of output columns (NumPy arrays).
+        """
+        if np is None:
+            raise RuntimeError("evaluate_batch requires numpy (pip install numpy)")
+
+        ignition, request, rain, reverse = _split_columns(samples)
+        enabled = _ignition_on_array(ignition)
+        request = np.asarray(request, dtype=np.int64)
+        rain = np.asarray(rain, dtype=np.int64)
+        reverse = np.asarray(reverse, dtype=np.int64)
+
+        # Same priority order as process_operation(): intermittent wins over automatic
+        intermittent = enabled & (request == 4) & (reverse == 1)
+        touch = enabled & (request == 1)
+        speed1 = enabled & (request == 2)
+        speed2 = enabled & (request == 3)
+        automatic = enabled & (request == 4) & ~intermittent
+        conditions = [intermittent, touch, speed1, speed2, automatic]
+
+        mode = np.select(conditions, [2, 1, 2, 2, 4], default=0)
+        auto_speed = np.where(rain < RAIN_SPEED2_THRESHOLD, 1, 2)
+        speed = np.select(conditions, [1, 1, 1, 2, auto_speed], default=0)
+
+        return {
+            'Wiper_Function_Enabled': enabled.astype(np.int8),
+            'wiperMode': mode.astype(np.int8),
+            'wiperSpeed': speed.astype(np.int8),
+            'wiperCycleCount': touch.astype(np.int8),
+            'WiperIntermittent': intermittent.astype(np.int8),
+            'wipingCycle': np.where(intermittent, INTERMITTENT_WIPING_CYCLE, 0).astype(np.int16),
+        }
+
+    @classmethod
+    def evaluate_stream(cls, samples, chunk_size=64, max_delay=0.005):
+        """Evaluate a live stream of (ignition, request, rain, reverse) tuples.
+
+        Samples are buffered into chunks and evaluated with evaluate_batch()
+        when numpy is available, otherwise one by one. Yields one output
+        dict per input sample, in order.
+
+        A chunk is evaluated when it holds chunk_size samples, or as soon as
+        a sample took longer than max_delay seconds to arrive: a live feed
+        gets each output when its sample comes in, while a backlog (a file,
+        a burst) is still batched. Pass a large chunk_size, e.g. 4096, for
+        offline data.
+        """
+        if np is None:
+            for sample in samples:
+                yield cls.evaluate_sample(*sample)
+            return
+
+        chunk = []
+        waiting_since = time.perf_counter()
+        for sample in samples:
+            chunk.append(sample)
+            if len(chunk) >= chunk_size or time.perf_counter() - waiting_since > max_delay:
+                yield from _iter_rows(cls.evaluate_batch(list(zip(*chunk))))
+                chunk = []
+            waiting_since = time.perf_counter()
+        if chunk:
+            yield from _iter_rows(cls.evaluate_batch(list(zip(*chunk))))
+
     def monitor_input_file(self):
         """Continuously monitor the input file for changes."""
         try:
@@ -230,6 +334,40 @@ class WiperSystem:
         except KeyboardInterrupt:
             print("\nMonitoring stopped by user.")
 
+def _ignition_on(value):
+    """Accept 'ON'/'OFF' strings as read from input.json, or 1/0."""
+    if isinstance(value, str):
+        return value.upper() == 'ON'
+    return bool(value)
+
+def _ignition_on_array(values):
+    """Vectorised _ignition_on(); mixed columns are mapped element by element."""
+    array = np.asarray(values)
+    if array.dtype.kind in ('U', 'S') and not isinstance(values, np.ndarray) \
+            and not all(isinstance(value, (str, bytes)) for value in values):
+        # numpy turns ['ON', 1] into ['ON', '1']; keep the 1 a number
+        array = np.asarray(values, dtype=object)
+    if array.dtype.kind == 'O':
+        return np.fromiter(map(_ignition_on, array), bool, len(array))
+    if array.dtype.kind in ('U', 'S'):
+        return np.char.upper(array.astype(str)) == 'ON'
+    return array.astype(bool)
+
+def _split_columns(samples):
+    """Return the four input columns from a structured array, dict or column list."""
+    names = getattr(getattr(samples, 'dtype', None), 'names', None)
+    if names or isinstance(samples, dict):
+        return tuple(samples[field] for field in INPUT_FIELDS)
+    if len(samples) != len(INPUT_FIELDS):
+        raise ValueError(f"Expected {len(INPUT_FIELDS)} columns {INPUT_FIELDS}, got {len(samples)}")
+    return tuple(samples)
+
+def _iter_rows(columns):
+    """Turn a dict of output columns back into one dict per sample."""
+    lists = {name: columns[name].tolist() for name in OUTPUT_FIELDS}
+    for values in zip(*(lists[name] for name in OUTPUT_FIELDS)):
+        yield dict(zip(OUTPUT_FIELDS, values))
+
 if __name__ == "__main__":
     wiper = WiperSystem("input.json", "wiper_output.txt")
     wiper.monitor_input_file()
\ No newline at end of file